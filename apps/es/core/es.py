@@ -322,7 +322,7 @@ def delete_uploaded_expense_file(claimer_rc: User,
         trn.modify(expense_item_rcs)
         trn.delete(file_rc)
         if is_need_to_rollback_file_seq:
-            es_seq.rollbackSeq(es_seq.SequenceType.SEQ_TYPE_EXPENSE_FILE, office_rc.id, file_rc.seq, transaction=trn)
+            es_seq.rollbackSeq(es_seq.SequenceType.SEQ_TYPE_EXPENSE_FILE, office_rc.id, file_rc.seq, trn=trn)
         save_result = trn.save()
         if not save_result.value:
             raise IkValidateException(save_result.dataStr)
@@ -52,7 +52,7 @@ def generate_rpt(operator: User, template_file: Path, sch_items: dict) -> Path:
 
     if isNullBlank(office):
         raise IkValidateException("Please select an office.")
-    office_rc = Office.objects.filter(id=office).first()
+    office_rc = Office.objects.filter(id=office).select_related('ccy').first()
     # check permission
     # TODO: 2024-12-26, is_office_admin
     if isNotNullBlank(incurrence_date_from) and isNotNullBlank(incurrence_date_to) and incurrence_date_from > incurrence_date_to:
@@ -78,6 +78,8 @@ def generate_rpt(operator: User, template_file: Path, sch_items: dict) -> Path:
         queryset = queryset.filter(incur_dt__gte=incurrence_date_from)  # d.incur_dt>=%s
     if isNotNullBlank(incurrence_date_to):
         queryset = queryset.filter(incur_dt__lte=incurrence_date_to)    # d.incur_dt<=%s
+    # the cash advancements' SNs of the expenses' prior balances: {expense ID: [CA SN]}
+    expense_ca_sns = __get_prior_balance_sns(PriorBalance.objects.filter(expense_id__in=queryset.values('hdr_id')), 'expense_id', 'ca__sn')
 
     queryset = queryset.annotate(
         amt_calculated=Case(
@@ -99,13 +101,9 @@ def generate_rpt(operator: User, template_file: Path, sch_items: dict) -> Path:
     )
 
     queryset = queryset.order_by('incur_dt', 'dsc', 'cat')
-    for rc in queryset:
-        related_ca = PriorBalance.objects.filter(expense_id=rc['hdr__id']).select_related('ca')
-        ca_sns = related_ca.order_by('ca__sn').values_list('ca__sn', flat=True)
-        rc['ref_ca_no'] = ','.join(ca_sns)
-
     expense_table = list(queryset)
     for i in expense_table:
+        i['ref_ca_no'] = ','.join(expense_ca_sns.get(i['hdr__id'], []))
         i['incur_dt'] = __to_datetime(i['incur_dt'])
 
     # Part 1: e-Cheque for Expense
@@ -122,18 +120,18 @@ def generate_rpt(operator: User, template_file: Path, sch_items: dict) -> Path:
     if isNotNullBlank(incurrence_date_to):
         expense_queryset = expense_queryset.filter(incur_dt__lte=incurrence_date_to)
 
-    expense_list, repeat_flag = [], []
-    for es_rc in expense_queryset:
-        sn = es_rc.hdr.sn
+    expense_list, repeat_flag = [], set()
+    for es_rc in expense_queryset.values('hdr__sn', 'hdr__payment_record_file__file_original_nm', 'incur_dt'):
+        sn = es_rc['hdr__sn']
         if sn not in repeat_flag:
             expense_list.append({
-                'sn': es_rc.hdr.sn,
-                'echeque_file_nm': es_rc.hdr.payment_record_file.file_original_nm if es_rc.hdr.payment_record_file else None,
+                'sn': sn,
+                'echeque_file_nm': es_rc['hdr__payment_record_file__file_original_nm'],
                 'type': 'Expense',
                 'ref_expense_no': None,
-                'incur_dt': __to_datetime(es_rc.incur_dt),
+                'incur_dt': __to_datetime(es_rc['incur_dt']),
             })
-            repeat_flag.append(sn)
+            repeat_flag.add(sn)
 
     # Part 2: e-Cheque for Cash Advancement
     cash_queryset = CashAdvancement.objects
@@ -153,17 +151,16 @@ def generate_rpt(operator: User, template_file: Path, sch_items: dict) -> Path:
         cash_queryset = cash_queryset.filter(payment_activity__operate_dt__lte=incurrence_date_to)
 
     cash_list = []
-    for ca_rc in cash_queryset.select_related('payment_activity', 'payment_record_file').order_by('sn'):
-        related_expenses = PriorBalance.objects.filter(ca=ca_rc).select_related('expense')
-
-        expense_sns = related_expenses.order_by('expense__sn').values_list('expense__sn', flat=True)
-        ref_expense_no = ','.join(expense_sns)
-
+    ca_rcs = list(cash_queryset.select_related('payment_activity', 'payment_record_file').order_by('sn'))
+    # the expenses' SNs of the cash advancements' prior balances: {CA ID: [expense SN]}
+    ca_expense_sns = {} if len(ca_rcs) == 0 else \
+        __get_prior_balance_sns(PriorBalance.objects.filter(ca_id__in=[ca_rc.id for ca_rc in ca_rcs]), 'ca_id', 'expense__sn')
+    for ca_rc in ca_rcs:
         cash_list.append({
             'sn': ca_rc.sn,
             'echeque_file_nm': ca_rc.payment_record_file.file_original_nm if ca_rc.payment_record_file else None,
             'type': 'Cash Advancement',
-            'ref_expense_no': ref_expense_no,
+            'ref_expense_no': ','.join(ca_expense_sns.get(ca_rc.id, [])),
             'incur_dt': __to_datetime(ca_rc.payment_activity.operate_dt),
         })
 
@@ -210,6 +207,24 @@ def generate_rpt(operator: User, template_file: Path, sch_items: dict) -> Path:
     return outputFile, incurrence_date_from, incurrence_date_to
 
 
+def __get_prior_balance_sns(prior_balance_queryset, key_field: str, sn_field: str) -> dict:
+    """Get the related SNs of the prior balances in one query.
+
+    Args:
+        prior_balance_queryset (QuerySet): PriorBalance queryset.
+        key_field (str): Group by field. E.g. expense_id
+        sn_field (str): SN field. E.g. ca__sn
+
+    Returns:
+        dict: {key: [sn]}. The SNs are sorted.
+
+    """
+    sns = {}
+    for key, sn in prior_balance_queryset.order_by(key_field, sn_field).values_list(key_field, sn_field):
+        sns.setdefault(key, []).append(sn)
+    return sns
+
+
 def __to_datetime(value):
     if value is None:
         return None
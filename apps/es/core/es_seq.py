@@ -1,13 +1,31 @@
 """ES sequence management
 
+Sequences are allocated in the database with one "UPDATE ... RETURNING" statement on the Sequence row, so the
+allocation is safe across processes and hosts: the row is locked by the update until the current transaction ends.
+If getNextSeq is called in a transaction, the next caller of the same sequence waits until the transaction ends, and
+the number is undone if the transaction rolls back.
+
+High-volume callers can reserve a block of numbers per process (getNextSeq(..., blockSize=N)). A block is reserved
+in autocommit mode only, so it's never undone by a rolled back transaction. In a transaction, the numbers in the current
+block are used first, then a single number is allocated in the transaction.
+
+Gaps:
+    1. rollbackSeq undoes the last allocated number only: the sequence is decreased if it's still equal to the
+       rolled back number (compare and set in the database), or it's the last number taken from this process's block.
+       Otherwise the number is a gap.
+    2. The unused numbers of a block are gaps when the process exits.
 """
 import logging
+import os
+from datetime import datetime
 from enum import Enum, unique
 from threading import Lock
 
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
 from django.db.models import Q
+from django.utils import timezone
 
-import core.user.user_manager as UserManager
 from core.core.exception import IkException, IkValidateException
 from core.db.transaction import IkTransaction
 
@@ -35,16 +53,70 @@ class SequenceType(Enum):
 # MAX to 8
 __MAX_SEQ = 100000000
 __MAX_DRAFT_SEQ = __MAX_SEQ / 10000
-__seqLock = Lock()
+__seqBlocks = {}  # (sequence type, office ID) -> _SeqBlock
+__seqBlocksLock = Lock()
 
 
-def getNextSeq(sequenceType: SequenceType, officeID: int, maxReset: bool = False, maxValue: int = None) -> int:
+class _SeqBlock():
+    """Numbers reserved by a process: nextSeq, nextSeq + 1, ..., lastSeq.
+    """
+    __slots__ = ('pid', 'nextSeq', 'lastSeq')
+
+    def __init__(self, pid: int, nextSeq: int, lastSeq: int) -> None:
+        self.pid = pid
+        self.nextSeq = nextSeq
+        self.lastSeq = lastSeq
+
+    def isAvailable(self) -> bool:
+        # a forked process doesn't use its parent's block
+        return self.pid == os.getpid() and self.nextSeq <= self.lastSeq
+
+
+def __now() -> datetime:
+    return timezone.now() if settings.USE_TZ else datetime.now()
+
+
+def __updateSeq(sequenceType: SequenceType, officeID: int, setSql: str, setParams: list, whereSql: str = '', whereParams: list = None) -> int:
+    """Update the sequence row in one statement. Return the new sequence, or None if no row is updated.
+    """
+    sql = 'UPDATE %s SET seq = %s, %s = %s + 1, %s = %%s WHERE tp = %%s AND office_id = %%s%s RETURNING seq' % (
+        connection.ops.quote_name(esModels.Sequence._meta.db_table), setSql, esModels.Sequence.DB_COLUMN_VERSION_NO,
+        esModels.Sequence.DB_COLUMN_VERSION_NO, esModels.Sequence.DB_COLUMN_MODIFY_DATE, whereSql)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, setParams + [__now(), sequenceType.value, officeID] + (whereParams or []))
+        row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def __allocateSeqs(sequenceType: SequenceType, officeID: int, count: int = 1, maxReset: bool = False, maxValue: int = None) -> int:
+    """Add [count] to the sequence and return the new sequence, it's the last allocated number.
+    """
+    if maxReset is True:
+        setSql, params = 'CASE WHEN seq + 1 >= %s THEN 1 ELSE seq + 1 END', [maxValue]
+    else:
+        setSql, params = 'seq + %s', [count]
+    for _ in range(2):
+        seq = __updateSeq(sequenceType, officeID, setSql, params)
+        if seq is not None:
+            return seq
+        # the first number. If another process inserts the row at the same time, update it again.
+        try:
+            with transaction.atomic():
+                esModels.Sequence.objects.create(tp=sequenceType.value, office_id=officeID, seq=count)
+            return count
+        except IntegrityError as e:
+            logger.debug('Sequence [%s] for office [%s] is created by another process: %s' % (sequenceType.value, officeID, e))
+    raise IkException('Update sequence [%s] for office [%s] failed.' % (sequenceType.value, officeID))
+
+
+def getNextSeq(sequenceType: SequenceType, officeID: int, maxReset: bool = False, maxValue: int = None, blockSize: int = 1) -> int:
     """Get next sequence by sequence type and office ID
 
     Args:
         sequenceType (SequenceType): Sequence type.
         officeID (int): Office's ID.
         maxReset (bool): reset value
+        blockSize (int): Reserve [blockSize] numbers in this process if it's greater than 1. It cannot be used with maxReset.
 
     Returns:
         Next sequence ID if found, None otherwise.
@@ -53,26 +125,30 @@ def getNextSeq(sequenceType: SequenceType, officeID: int, maxReset: bool = False
         IkException: If update the sequence failed.
 
     """
-    __seqLock.acquire()
-    try:
-        seq = 1
-        rc = esModels.Sequence.objects.filter(tp=sequenceType.value).filter(office_id=officeID).first()
-        if rc is None:
-            rc = esModels.Sequence(tp=sequenceType.value, office_id=officeID, seq=seq)
-        else:
-            seq = rc.seq + 1
-            if maxReset is True and seq >= maxValue:
-                seq = 1
-            rc.seq = seq
-            rc.ik_set_status_modified()
-        trn = IkTransaction(userID=UserManager.SYSTEM_USER_ID)
-        trn.add(rc)
-        b = trn.save()
-        if not b.value:
-            raise IkException(b.dataStr)
+    if blockSize is None or blockSize <= 1:
+        return __allocateSeqs(sequenceType, officeID, maxReset=maxReset, maxValue=None if maxValue is None else int(maxValue))
+    if maxReset is True:
+        raise IkException('Sequence block cannot be reset: %s' % sequenceType.value)
+    key = (sequenceType.value, officeID)
+    with __seqBlocksLock:
+        block = __seqBlocks.get(key, None)
+        if block is None or not block.isAvailable():
+            if connection.in_atomic_block:
+                # the block should not be undone by the caller's transaction
+                return __allocateSeqs(sequenceType, officeID)
+            lastSeq = __allocateSeqs(sequenceType, officeID, count=blockSize)
+            block = _SeqBlock(os.getpid(), lastSeq - blockSize + 1, lastSeq)
+            __seqBlocks[key] = block
+        seq = block.nextSeq
+        block.nextSeq += 1
         return seq
-    finally:
-        __seqLock.release()
+
+
+def clearSeqBlocks() -> None:
+    """Discard the blocks reserved by this process. Their unused numbers are gaps.
+    """
+    with __seqBlocksLock:
+        __seqBlocks.clear()
 
 
 def getCurrentSeq(sequenceType: SequenceType, officeID: int) -> int:
@@ -145,13 +221,16 @@ def SN2Number(sn: str) -> int:
 
 
 # Use this method to replace getRollbackSeq
-def rollbackSeq(sequenceType: SequenceType, officeObject: any, rollbackSeq: int, transaction: IkTransaction = None, exact: bool = True) -> int:
+def rollbackSeq(sequenceType: SequenceType, officeObject: any, rollbackSeq: int, trn: IkTransaction = None, exact: bool = True) -> int:
     """Get the current sequence and rollback the sequence (-1)
 
+    Only the last allocated number can be rolled back (reference to the module document). If a transaction is
+    specified, the sequence is updated when the transaction is saved.
+
     Args:
         sequenceType (SequenceType): Sequence type.
         officeObject (int|str): Office's ID or office's code.
-        transaction (IkTransaction, optional): Update transaction.
+        trn (IkTransaction, optional): Update transaction.
         exact (bool): Raise exception if rollback failed when exact is True. Otherwise return the current sequence.
 
     Returns:
@@ -160,10 +239,6 @@ def rollbackSeq(sequenceType: SequenceType, officeObject: any, rollbackSeq: int,
 
     Raises:
         IkException: If data error or system error.
-
-    Todo:
-        * need to test this method in a transaction
-        * add lock work with getNextSeq(..) when parameter transaction is not None
     """
     officeID = None
     if officeObject is None:
@@ -181,31 +256,49 @@ def rollbackSeq(sequenceType: SequenceType, officeObject: any, rollbackSeq: int,
         raise IkValidateException("Parameter office should be office's ID or office's code. Please check: %s" % officeObject)
     if type(rollbackSeq) != int:
         raise IkValidateException('Rollback sequence should be an integer value: %s' % rollbackSeq)
-    __seqLock.acquire()
-    try:
-        rc = esModels.Sequence.objects.filter(Q(tp=sequenceType.value) & Q(office_id=officeID)).first()
-        seq = 0
-        if rc is not None:
-            seq = rc.seq
-            if seq != rollbackSeq:
-                if exact:
-                    raise IkValidateException('Concurrent error. Please try again.')
-                return seq
-            elif seq == 0:
-                logger.error("Rollback DB sequence [%s] is 0." % rc.tp)
-            else:
-                rc.seq = seq - 1
-                trn = IkTransaction(userID=UserManager.SYSTEM_USER_ID) if transaction is None else transaction
-                trn.modify(rc)
-                if transaction is None:
-                    b = trn.save()
-                    if not b.value:
-                        logging.error('Rollback sequence failed. The last sequence is %s for [%s] for office [%s].' % (seq, sequenceType.value, officeObject))
-                        raise IkException('Update sequence failed: %s' % b.dataStr)
-                return rc.seq
+    if trn is None:
+        with __seqBlocksLock:
+            block = __seqBlocks.get((sequenceType.value, officeID), None)
+            if block is not None and block.pid == os.getpid() and block.nextSeq - 1 == rollbackSeq and rollbackSeq > 0:
+                block.nextSeq -= 1  # the last number taken from this process's block
+                return rollbackSeq - 1
+        if rollbackSeq > 0:
+            for _ in range(2):
+                seq = __updateSeq(sequenceType, officeID, 'seq - 1', [], ' AND seq = %s', [rollbackSeq])
+                if seq is not None:
+                    return seq
+                # compare and set failed. Try again if another caller has changed the sequence back to the rolled back number.
+                seq = getCurrentSeq(sequenceType, officeID)
+                if seq != rollbackSeq:
+                    break
+        else:
+            seq = getCurrentSeq(sequenceType, officeID)
+        if seq is None:
+            return 0
+        elif seq == 0 and rollbackSeq == 0:
+            logger.error("Rollback DB sequence [%s] is 0." % sequenceType.value)
+            return 0
+        # the sequence is changed by another caller, so the rolled back number is a gap
+        if exact:
+            raise IkValidateException('Concurrent error. Please try again.')
         return seq
-    finally:
-        __seqLock.release()
+    rc = esModels.Sequence.objects.filter(Q(tp=sequenceType.value) & Q(office_id=officeID)).first()
+    seq = 0
+    if rc is not None:
+        seq = rc.seq
+        if seq != rollbackSeq:
+            # the sequence is changed by another caller, so the rolled back number is a gap
+            if exact:
+                raise IkValidateException('Concurrent error. Please try again.')
+            return seq
+        elif seq == 0:
+            logger.error("Rollback DB sequence [%s] is 0." % rc.tp)
+        else:
+            # the version number is checked when the caller's transaction is saved
+            rc.seq = seq - 1
+            trn.modify(rc)
+            return rc.seq
+    return seq
 
 
 def getDraftSN(office: int | esModels.Office) -> str:
@@ -0,0 +1,75 @@
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.utils.spreadsheet import SpreadsheetWriter
+
+from ..core import es_report
+from ..core.status import Status
+from ..models import (Activity, CashAdvancement, Expense, ExpenseCategory,
+                      ExpenseDetail, File, Payee, PaymentMethod, PriorBalance)
+from .test_es_base import ESTestCase
+
+TEMPLATE_FILE = Path(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'resources', 'templates', 'ES101', 'ES101-v1.xlsx'))
+EXPENSE_AMOUNT = 1000
+CA_AMOUNT = 10
+
+
+class TestES101Report(ESTestCase):
+    def setUp(self):
+        super().setUp()
+        with connection.cursor() as cursor:
+            # the claimers can access their expenses and cash advancements (es_v_user_expense and es_v_user_cash_advancement in init.sql)
+            cursor.execute("CREATE VIEW es_v_user_expense AS SELECT claimer_id AS usr_id, id AS expense_id, 'admin' AS acl FROM es_expense")
+            cursor.execute("CREATE VIEW es_v_user_cash_advancement AS SELECT claimer_id AS usr_id, id AS ca_id, 'admin' AS acl FROM es_cashadvancement")
+        office_rc = self.office_a
+        claimer_rc = self.regular_user1
+        payee_rc = Payee.objects.create(office=office_rc, payee='Payee A')
+        payment_tp_rc = PaymentMethod.objects.create(tp=PaymentMethod.E_CHEQUE)
+        cat_rc = ExpenseCategory.objects.create(cat='travel')
+        incur_dt = datetime(2025, 1, 1, 10, 0, 0)
+        File.objects.bulk_create([File(tp='payment', office=office_rc, seq=i, file_nm='f%s' % i, file_tp='pdf', file_original_nm='cheque%s.pdf' % i,
+                                       file_size=1, file_path='es/payment') for i in range(EXPENSE_AMOUNT + CA_AMOUNT)])
+        file_ids = list(File.objects.filter(tp='payment').order_by('seq').values_list('id', flat=True))
+        activity_rc = Activity.objects.create(tp='2', transaction_id=0, operate_dt=incur_dt, sts=Status.SETTLED.value)
+        CashAdvancement.objects.bulk_create([
+            CashAdvancement(office=office_rc, sn='CA%04d' % i, sts=Status.SETTLED.value, ccy=self.currency_usd, dsc='-', claimer=claimer_rc, claim_amt=100,
+                            claim_dt=incur_dt, payee=payee_rc, payment_activity=activity_rc, payment_tp=payment_tp_rc,
+                            payment_record_file_id=file_ids[EXPENSE_AMOUNT + i]) for i in range(CA_AMOUNT)])
+        Expense.objects.bulk_create([
+            Expense(office=office_rc, sn='E%04d' % i, sts=Status.SETTLED.value, payee=payee_rc, claimer=claimer_rc, payment_tp=payment_tp_rc,
+                    payment_record_file_id=file_ids[i]) for i in range(EXPENSE_AMOUNT)])
+        expense_ids = list(Expense.objects.order_by('sn').values_list('id', flat=True))
+        ca_ids = list(CashAdvancement.objects.order_by('sn').values_list('id', flat=True))
+        ExpenseDetail.objects.bulk_create([
+            ExpenseDetail(hdr_id=expense_id, seq=1, incur_dt=incur_dt + timedelta(seconds=i), dsc='Detail %s' % i, cat=cat_rc, ccy=self.currency_usd,
+                          amt=10) for i, expense_id in enumerate(expense_ids)])
+        PriorBalance.objects.bulk_create([PriorBalance(ca_id=ca_ids[i % CA_AMOUNT], expense_id=expense_id, balance_amt=1)
+                                          for i, expense_id in enumerate(expense_ids)])
+        self.sch_items = {'schOffice': office_rc.id, 'schDateFrom': None, 'schDateTo': None, 'schPayMed': None}
+
+    def test_generate_rpt_query_count(self):
+        """The report queries don't depend on the number of expenses and cash advancements."""
+        with patch.object(es_report, 'SpreadsheetWriter', wraps=SpreadsheetWriter) as writer, CaptureQueriesContext(connection) as queries:
+            output_file, date_from, date_to = es_report.generate_rpt(self.regular_user1, TEMPLATE_FILE, self.sch_items)
+        try:
+            self.assertLessEqual(len(queries.captured_queries), 10)
+            self.assertTrue(output_file.is_file())
+            self.assertEqual(('2025-01-01', '2025-01-01'), (date_from, date_to))
+
+            data = writer.call_args.kwargs['parameters']
+            expense_table = data['expenseTable']
+            self.assertEqual(EXPENSE_AMOUNT, len(expense_table))
+            self.assertEqual(['E0000', 'CA0000'], [expense_table[0][11], expense_table[0][13]])
+            self.assertEqual(['E0011', 'CA0001'], [expense_table[11][11], expense_table[11][13]])
+            e_cheque_table = data['echequeFileListTable']
+            self.assertEqual(EXPENSE_AMOUNT + CA_AMOUNT, len(e_cheque_table))
+            ca_row = [row for row in e_cheque_table if row[1] == 'CA0001'][0]
+            self.assertEqual(['cheque%s.pdf' % (EXPENSE_AMOUNT + 1), 'Cash Advancement'], ca_row[2:4])
+            self.assertEqual(','.join('E%04d' % i for i in range(1, EXPENSE_AMOUNT, CA_AMOUNT)), ca_row[4])
+        finally:
+            output_file.unlink(missing_ok=True)
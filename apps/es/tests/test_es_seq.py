@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+from contextlib import closing
+from pathlib import Path
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+
+# The worker processes import this module before django.setup(), so the models and es_seq are imported in the functions.
+
+WORKERS = 4
+SEQS_PER_WORKER = 30
+BLOCK_SIZE = 8
+
+
+def _allocateSeqs(databaseName: str, officeID: int, queue) -> None:
+    '''
+        Worker process: allocate SEQS_PER_WORKER expense SNs one by one, and SEQS_PER_WORKER PO SNs from blocks.
+    '''
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_backend.settings')
+    django.setup()
+    from django.db import connections
+    connections['default'].settings_dict['NAME'] = databaseName
+    from es.core import es_seq
+    try:
+        singles = [es_seq.getNextSeq(es_seq.SequenceType.SEQ_TYPE_EXPENSE_SN, officeID) for _ in range(SEQS_PER_WORKER)]
+        blocks = [es_seq.getNextSeq(es_seq.SequenceType.SEQ_TYPE_PO_SN, officeID, blockSize=BLOCK_SIZE) for _ in range(SEQS_PER_WORKER)]
+        queue.put((singles, blocks))
+    except Exception as e:
+        queue.put(e)
+    finally:
+        connections.close_all()
+
+
+class SequenceTestCase(TransactionTestCase):
+    def setUp(self):
+        from core.models import Currency, Office
+        from es.core import es_seq
+        ccy = Currency.objects.create(seq=1, code='USD', name='US Dollar')
+        self.office = Office.objects.create(name='Office A', code='001', addr='123 Main St', city='Hong Kong', country='China', ccy=ccy)
+        es_seq.clearSeqBlocks()
+
+    def tearDown(self):
+        from es.core import es_seq
+        es_seq.clearSeqBlocks()
+
+    def test_next_and_rollback(self):
+        from core.core.exception import IkValidateException
+        from es.core import es_seq
+        tp = es_seq.SequenceType.SEQ_TYPE_EXPENSE_SN
+        self.assertEqual([1, 2, 3], [es_seq.getNextSeq(tp, self.office.id) for _ in range(3)])
+        self.assertEqual(2, es_seq.rollbackSeq(tp, self.office.code, 3))
+        self.assertEqual(3, es_seq.getNextSeq(tp, self.office.id))
+
+        # 2 is not the last number: it's a gap
+        with self.assertRaises(IkValidateException):
+            es_seq.rollbackSeq(tp, self.office.id, 2)
+        self.assertEqual(3, es_seq.rollbackSeq(tp, self.office, 2, exact=False))
+        self.assertEqual(3, es_seq.getCurrentSeq(tp, self.office.id))
+        self.assertEqual(0, es_seq.rollbackSeq(es_seq.SequenceType.SEQ_TYPE_PO_SN, self.office.id, 1))
+
+        # reset
+        tp = es_seq.SequenceType.SEQ_TYPE_EXPENSE_DRAFT_SN
+        self.assertEqual([1, 2, 1], [es_seq.getNextSeq(tp, self.office.id, True, 3) for _ in range(3)])
+
+    def test_rollback_retry(self):
+        from es.core import es_seq
+        tp = es_seq.SequenceType.SEQ_TYPE_EXPENSE_SN
+        self.assertEqual([1, 2, 3], [es_seq.getNextSeq(tp, self.office.id) for _ in range(3)])
+        updateSeq = getattr(es_seq, '__updateSeq')
+        calls = []
+
+        def _updateSeq(*args):
+            # the first compare and set fails, e.g. another caller took 4 and rolled it back in the meantime
+            calls.append(args)
+            return None if len(calls) == 1 else updateSeq(*args)
+        with mock.patch.object(es_seq, '__updateSeq', side_effect=_updateSeq):
+            self.assertEqual(2, es_seq.rollbackSeq(tp, self.office.id, 3))
+        self.assertEqual(2, len(calls))
+        self.assertEqual(2, es_seq.getCurrentSeq(tp, self.office.id))
+
+        # the sequence is still the rolled back number after the retry
+        with mock.patch.object(es_seq, '__updateSeq', return_value=None):
+            self.assertEqual(2, es_seq.rollbackSeq(tp, self.office.id, 2, exact=False))
+
+    def test_transaction_rollback(self):
+        from es.core import es_seq
+        tp = es_seq.SequenceType.SEQ_TYPE_EXPENSE_SN
+        es_seq.getNextSeq(tp, self.office.id)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.assertEqual(2, es_seq.getNextSeq(tp, self.office.id))
+                raise ValueError()
+        self.assertEqual(1, es_seq.getCurrentSeq(tp, self.office.id))
+
+    def test_blocks(self):
+        from es.core import es_seq
+        tp = es_seq.SequenceType.SEQ_TYPE_PO_SN
+        self.assertEqual([1, 2], [es_seq.getNextSeq(tp, self.office.id, blockSize=5) for _ in range(2)])
+        self.assertEqual(5, es_seq.getCurrentSeq(tp, self.office.id))
+        self.assertEqual(1, es_seq.rollbackSeq(tp, self.office.id, 2))
+        self.assertEqual([2, 3, 4, 5, 6], [es_seq.getNextSeq(tp, self.office.id, blockSize=5) for _ in range(5)])
+        self.assertEqual(10, es_seq.getCurrentSeq(tp, self.office.id))
+        self.assertEqual(11, es_seq.getNextSeq(tp, self.office.id))
+
+        # the block is not reserved in a transaction
+        es_seq.clearSeqBlocks()
+        with transaction.atomic():
+            self.assertEqual(12, es_seq.getNextSeq(tp, self.office.id, blockSize=5))
+        self.assertEqual(12, es_seq.getCurrentSeq(tp, self.office.id))
+
+    def test_multiple_processes(self):
+        from es.core import es_seq
+        from es.models import Sequence
+        with tempfile.TemporaryDirectory() as folder:
+            if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+                # the worker processes cannot open the in-memory test database, copy it to a file
+                databaseName = str(Path(folder, 'test_es_seq.sqlite3'))
+                connection.ensure_connection()
+                target = sqlite3.connect(databaseName)
+                connection.connection.backup(target)
+                target.close()
+            else:
+                databaseName = connection.settings_dict['NAME']
+
+            context = multiprocessing.get_context('spawn')
+            queue = context.Queue()
+            processes = [context.Process(target=_allocateSeqs, args=(databaseName, self.office.id, queue)) for _ in range(WORKERS)]
+            for p in processes:
+                p.start()
+            results = [queue.get(timeout=120) for _ in processes]
+            for p in processes:
+                p.join()
+
+            for r in results:
+                if isinstance(r, Exception):
+                    raise r
+            singles = [seq for r in results for seq in r[0]]
+            blocks = [seq for r in results for seq in r[1]]
+            total = WORKERS * SEQS_PER_WORKER
+            self.assertEqual(list(range(1, total + 1)), sorted(singles))
+            self.assertEqual(total, len(set(blocks)))
+            reservedSeqs = WORKERS * -(-SEQS_PER_WORKER // BLOCK_SIZE) * BLOCK_SIZE
+            self.assertLessEqual(max(blocks), reservedSeqs)
+
+            if databaseName == connection.settings_dict['NAME']:
+                seqs = {tp: es_seq.getCurrentSeq(tp, self.office.id) for tp in (es_seq.SequenceType.SEQ_TYPE_EXPENSE_SN, es_seq.SequenceType.SEQ_TYPE_PO_SN)}
+            else:
+                with closing(sqlite3.connect(databaseName)) as conn:
+                    seqs = {es_seq.SequenceType(tp): seq for tp, seq in conn.execute('SELECT tp, seq FROM %s' % Sequence._meta.db_table)}
+            self.assertEqual(total, seqs[es_seq.SequenceType.SEQ_TYPE_EXPENSE_SN])
+            self.assertEqual(reservedSeqs, seqs[es_seq.SequenceType.SEQ_TYPE_PO_SN])
@@ -0,0 +1,184 @@
+'''
+    Micro benchmarks for the framework hot paths.
+
+    Run a benchmark module from the django_backend folder. E.g.
+        python -m core.benchmark.screen_dfn
+'''
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from pathlib import Path
+
+from core.log.profiler import percentile
+
+
+def setupDjango() -> None:
+    '''
+        Initialize django for the stand alone benchmark scripts.
+    '''
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_backend.settings')
+    import django
+    django.setup()
+
+
+def createTestDatabase() -> str:
+    '''
+        Create an empty test database (same as django test runner), so the benchmarks don't change the real database.
+        Return the original database name. Call destroyTestDatabase(oldName) at the end.
+    '''
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    oldName = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    return oldName
+
+
+def destroyTestDatabase(oldName: str) -> None:
+    from django.db import connection
+    connection.creation.destroy_test_db(oldName, verbosity=0)
+
+
+class BenchmarkResult:
+    def __init__(self, name: str, rounds: int, durations: list, peakBytes: int, retainedBlocks: int, gcCollections: int,
+                 queries: int = None) -> None:
+        self.name = name
+        self.rounds = rounds
+        self.durations = durations  # milliseconds
+        self.peakBytes = peakBytes
+        self.retainedBlocks = retainedBlocks
+        self.gcCollections = gcCollections
+        self.queries = queries  # database queries per call. None means not counted.
+
+    @property
+    def p50(self) -> float:
+        return statistics.median(self.durations)
+
+    @property
+    def p95(self) -> float:
+        return percentile(sorted(self.durations), 95) if len(self.durations) > 0 else 0.0
+
+    @property
+    def mean(self) -> float:
+        return statistics.fmean(self.durations)
+
+    def toJson(self) -> dict:
+        return {'name': self.name,
+                'rounds': self.rounds,
+                'p50': self.p50,
+                'p95': self.p95,
+                'mean': self.mean,
+                'peakBytes': self.peakBytes,
+                'retainedBlocks': self.retainedBlocks,
+                'gcCollections': self.gcCollections,
+                'queries': self.queries
+                }
+
+    def __str__(self) -> str:
+        return '%-40s p50=%9.3fms p95=%9.3fms peak=%9.1fKB retained blocks=%7d gen0 gc=%5d%s' % (
+            self.name, self.p50, self.p95, self.peakBytes / 1024, self.retainedBlocks, self.gcCollections,
+            '' if self.queries is None else ' queries=%4d' % self.queries)
+
+
+def measure(name: str, fn, rounds: int = 200, warmup: int = 10, countQueries: bool = False) -> BenchmarkResult:
+    '''
+        Call fn() [rounds] times.
+
+        The durations are measured without tracemalloc. The memory is measured in one more call:
+            peakBytes: peak traced memory during the call. It includes the garbage created by the call.
+            retainedBlocks: memory blocks still referenced by the return value after the call.
+        gcCollections: generation 0 garbage collections during the timed rounds.
+        countQueries: count the database queries (default connection) in one more call.
+    '''
+    for _i in range(warmup):
+        fn()
+    queries = None
+    if countQueries:
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as capturedQueries:
+            fn()
+        queries = len(capturedQueries.captured_queries)
+    gen0Collections = gc.get_stats()[0]['collections']
+    durations = []
+    for _i in range(rounds):
+        startTime = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - startTime) * 1000)
+    gcCollections = gc.get_stats()[0]['collections'] - gen0Collections
+
+    tracemalloc.start()
+    try:
+        snapshot1 = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        currentBytes = tracemalloc.get_traced_memory()[0]
+        r = fn()
+        peakBytes = tracemalloc.get_traced_memory()[1] - currentBytes
+        snapshot2 = tracemalloc.take_snapshot()
+        retainedBlocks = sum(stat.count_diff for stat in snapshot2.compare_to(snapshot1, 'filename') if stat.count_diff > 0)
+        del r
+    finally:
+        tracemalloc.stop()
+    return BenchmarkResult(name, rounds, durations, peakBytes, retainedBlocks, gcCollections, queries=queries)
+
+
+def _getGitCommit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def writeResults(outputFile: str, benchmarkName: str, results: list, parameters: dict = None) -> dict:
+    '''
+        Write the results and the environment (commit, database, python version) to a json file.
+    '''
+    from django.db import connection
+    import django
+    data = {'benchmark': benchmarkName,
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': _getGitCommit(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'parameters': parameters or {},
+            'results': [r.toJson() for r in results]}
+    outputFile = Path(outputFile)
+    outputFile.parent.mkdir(parents=True, exist_ok=True)
+    with open(outputFile, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    print('Results are written to %s' % outputFile)
+    return data
+
+
+def readResults(file: str) -> dict:
+    with open(file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compareResults(oldData: dict, results: list, threshold: float = 1.2) -> list:
+    '''
+        Compare the results with the old results (readResults). Return the names of the regressions: p50 is [threshold]
+        times slower, or there are more queries.
+    '''
+    oldResults = {r['name']: r for r in oldData['results']}
+    regressions = []
+    print('Compare with %s (commit %s):' % (oldData.get('time', None), oldData.get('commit', None)))
+    for r in results:
+        old = oldResults.get(r.name, None)
+        if old is None:
+            print('%-40s new' % r.name)
+            continue
+        ratio = r.p50 / old['p50'] if old['p50'] > 0 else 1
+        isRegression = ratio >= threshold or (r.queries is not None and old.get('queries', None) is not None and r.queries > old['queries'])
+        if isRegression:
+            regressions.append(r.name)
+        print('%-40s p50 %9.3fms -> %9.3fms (%5.2fx) queries %s -> %s%s' % (
+            r.name, old['p50'], r.p50, ratio, old.get('queries', None), r.queries, '  REGRESSION' if isRegression else ''))
+    return regressions
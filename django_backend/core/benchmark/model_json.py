@@ -0,0 +1,80 @@
+'''
+    Model json benchmark: IkJsonResponse json data of a queryset with foreign key values.
+
+        legacy: convert the model instances one by one and read the foreign key values by getattr (1 query per foreign key per row).
+                Reference to core/tests/legacy_model_json.py.
+        serializer: core.core.json_serializer (values_list + joins, or select_related).
+
+    It creates a test database and fills ik_usr_grp with (users * groups) rows.
+
+    Usage (in django_backend folder):
+        python -m core.benchmark.model_json [--users 100] [--groups 100] [--rounds 5]
+'''
+import argparse
+
+from core.benchmark import createTestDatabase, destroyTestDatabase, measure, setupDjango
+
+ADDITIONAL_FIELDS = ['usr.usr_nm', 'grp.grp_nm']
+
+
+def createUserGroups(users: int, groups: int) -> None:
+    from core.models import Group, User, UserGroup
+    User.objects.bulk_create([User(usr_nm='BenchmarkUser%s' % i, psw='-') for i in range(users)])
+    Group.objects.bulk_create([Group(grp_nm='BenchmarkGroup%s' % i) for i in range(groups)])
+    usrIDs = list(User.objects.filter(usr_nm__startswith='BenchmarkUser').values_list('id', flat=True))
+    grpIDs = list(Group.objects.filter(grp_nm__startswith='BenchmarkGroup').values_list('id', flat=True))
+    UserGroup.objects.bulk_create([UserGroup(usr_id=usrID, grp_id=grpID) for usrID in usrIDs for grpID in grpIDs], batch_size=5000)
+
+
+def run(users: int = 100, groups: int = 100, rounds: int = 5) -> list:
+    import json
+
+    from django.core.serializers.json import DjangoJSONEncoder
+    from django.db import connection
+
+    from core.core.http import IkSccJsonResponse
+    from core.models import UserGroup
+    from core.tests.legacy_model_json import legacyModel2Json
+
+    createUserGroups(users, groups)
+    queryset = UserGroup.objects.order_by('id')
+
+    def legacy():
+        return [legacyModel2Json(r, ADDITIONAL_FIELDS) for r in queryset.all()]
+
+    def serializer():
+        return IkSccJsonResponse(data=queryset.all()).getJsonData(ADDITIONAL_FIELDS)
+
+    def modelList():
+        return IkSccJsonResponse(data=list(queryset.all())).getJsonData(ADDITIONAL_FIELDS)
+
+    expected = json.dumps(legacy(), cls=DjangoJSONEncoder)
+    assert expected == json.dumps(serializer(), cls=DjangoJSONEncoder)
+    assert expected == json.dumps(modelList(), cls=DjangoJSONEncoder)
+
+    print('%s rows, additional fields %s' % (queryset.count(), ADDITIONAL_FIELDS))
+    for name, fn in (('legacy', legacy), ('serializer queryset', serializer), ('serializer model list', modelList)):
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, params, many, context: queries.append(sql) or execute(sql, params, many, context)):
+            fn()
+        print('%-40s queries=%s' % (name, len(queries)))
+    results = [measure('legacy', legacy, rounds=rounds, warmup=1),
+               measure('serializer queryset', serializer, rounds=rounds, warmup=1),
+               measure('serializer model list', modelList, rounds=rounds, warmup=1)]
+    for r in results:
+        print(r)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Model json benchmark.')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--groups', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    setupDjango()
+    oldName = createTestDatabase()
+    try:
+        run(args.users, args.groups, args.rounds)
+    finally:
+        destroyTestDatabase(oldName)
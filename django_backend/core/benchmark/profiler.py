@@ -0,0 +1,39 @@
+'''
+    Profiler span overhead: disabled, not sampled and sampled.
+
+    python -m core.benchmark.profiler
+'''
+import argparse
+import tempfile
+from pathlib import Path
+
+from core.benchmark import measure, setupDjango
+
+
+def run(spans: int = 10000, rounds: int = 50) -> list:
+    from core.log import profiler
+
+    def spanLoop():
+        with profiler.trace('benchmark'):
+            for _i in range(spans):
+                with profiler.span('span', index=_i):
+                    pass
+
+    results = []
+    with tempfile.TemporaryDirectory() as outputFolder:
+        for name, enabled, sampleRate in (('disabled', False, 1), ('enabled, not sampled', True, 0), ('enabled, sampled', True, 1)):
+            profiler.configure(enabled=enabled, sampleRate=sampleRate, outputFile=Path(outputFolder, 'runtime.jsonl'))
+            results.append(measure('%s spans (%s)' % (spans, name), spanLoop, rounds=rounds))
+        profiler.configure(enabled=False)
+    for r in results:
+        print('%s   %.3fus/span' % (r, r.p50 * 1000 / spans))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profiler span overhead benchmark.')
+    parser.add_argument('--spans', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+    setupDjango()
+    run(args.spans, args.rounds)
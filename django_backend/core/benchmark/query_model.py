@@ -0,0 +1,120 @@
+'''
+    queryModel benchmark: load the screen recordset rows by sql.
+
+        legacy: modelClass.objects.raw(sql) -> serializers.serialize('json') -> json.loads -> setattr.
+        cursor: build the model instances from the cursor rows, the columns are mapped to the fields once per query.
+        chunks: iterateModel, fetch and build the rows chunk by chunk.
+
+    It creates a test database and fills ik_team with [rows] rows.
+
+    Usage (in django_backend folder):
+        python -m core.benchmark.query_model [--rows 50000] [--rounds 5]
+'''
+import argparse
+
+from core.benchmark import createTestDatabase, destroyTestDatabase, measure, setupDjango
+
+MODEL_NAME = 'core.models.Team'
+
+
+def legacyQueryModel(modelNames, queryFields=None, distinct=False, queryWhere=None, orderBy=None, limit=None) -> list:
+    '''
+        The queryModel before the cursor rows are converted directly. It's used to compare the results and the performance.
+    '''
+    import json
+
+    from django.core import serializers
+
+    import core.utils.model_utils as model_utils
+    modelClass = model_utils.getModelClass(modelNames)
+    sql = 'SELECT '
+    if type(distinct) == bool and distinct:
+        sql += 'DISTINCT '
+    if queryFields is None or queryFields == '':
+        sql += '* '
+    else:
+        if 'id' not in queryFields:
+            sql += '0 AS id,'
+        sql += queryFields + ' '
+    sql += 'FROM %s ' % modelClass._meta.db_table
+    if queryWhere:
+        sql += 'WHERE %s ' % queryWhere
+    if orderBy:
+        sql += 'ORDER BY %s ' % orderBy
+    if limit:
+        sql += 'LIMIT %s ' % limit
+    ds = modelClass.objects.raw(sql)
+    dataStr = serializers.serialize('json', ds, fields=queryFields)
+    rcs = []
+    for j in json.loads(dataStr):
+        r = modelClass()
+        if 'pk' in j and hasattr(r, 'id'):
+            id = j['pk']
+            if id:
+                setattr(r, 'id', id)
+        fields = j['fields']
+        for fieldName, fieldValue in fields.items():
+            try:
+                setattr(r, fieldName, fieldValue)
+            except Exception:
+                setattr(r, fieldName + "_id", fieldValue)
+        r.ik_set_status_retrieve()
+        rcs.append(r)
+    return rcs
+
+
+def modelValues(r) -> dict:
+    '''
+        Return the instance attributes (without django _state) to compare the results.
+    '''
+    return {key: value for key, value in r.__dict__.items() if key != '_state'}
+
+
+def createTeams(rows: int) -> None:
+    from core.models import Company, Currency, Office, Team, User
+    user = User.objects.create(usr_nm='BenchmarkUser', psw='-')
+    ccy = Currency.objects.create(seq=1, code='BMC', name='Benchmark Currency')
+    office = Office.objects.create(name='Benchmark Office', code='BMO', addr='-', city='-', country='-', ccy=ccy)
+    company = Company.objects.create(sn='BMC', full_nm='Benchmark Company', short_nm='BMC', location=office, ctg='A', cre_usr=user)
+    Team.objects.bulk_create([Team(nm='BenchmarkTeam%s' % i, seq='%s.25' % i, company=company, enable=i % 2 == 0, cre_usr=user,
+                                   dsc=None if i % 3 == 0 else 'Team %s' % i) for i in range(rows)], batch_size=5000)
+
+
+def run(rows: int = 50000, rounds: int = 5) -> list:
+    import core.utils.model_utils as model_utils
+    createTeams(rows)
+
+    def legacy():
+        return legacyQueryModel(MODEL_NAME, orderBy='id')
+
+    def cursor():
+        return model_utils.queryModel(MODEL_NAME, orderBy='id')
+
+    def chunks():
+        total = 0
+        for chunk in model_utils.iterateModel(MODEL_NAME, orderBy='id', chunkSize=2000):
+            total += len(chunk)
+        return total
+
+    expected = [modelValues(r) for r in legacy()]
+    assert expected == [modelValues(r) for r in cursor()]
+    print('%s rows of %s' % (len(expected), MODEL_NAME))
+    results = [measure('legacy (raw + serialize + json.loads)', legacy, rounds=rounds, warmup=1),
+               measure('cursor rows', cursor, rounds=rounds, warmup=1),
+               measure('cursor rows in chunks of 2000', chunks, rounds=rounds, warmup=1)]
+    for r in results:
+        print(r)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='queryModel benchmark.')
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    setupDjango()
+    oldName = createTestDatabase()
+    try:
+        run(args.rows, args.rounds)
+    finally:
+        destroyTestDatabase(oldName)
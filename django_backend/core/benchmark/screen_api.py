@@ -0,0 +1,209 @@
+'''
+    End to end screen API benchmark.
+
+    It creates a test database (sqlite, or PostgreSQL if it's configured in config.ini), seeds the groups and menus, and
+    calls the screen API views through the session middlewares as the web server does:
+
+        init:        GET  initScreen
+        screen:      GET  getScreen (search, server paging table and detail field groups)
+        page:        POST getGrpRcs with a page number (server side paging table)
+        combobox:    GET  getScreen of a screen which has comboboxes only
+        save:        POST save: the table data is changed and saved by IkTransaction
+        json:        build IkSccJsonResponse for [jsonRows] model records
+
+    p50/p95 (ms), queries per call and peak memory of each phase are printed, and written to a json file which can be
+    compared with the result of another commit:
+
+        python -m core.benchmark.screen_api [--rows 10000] [--rounds 50] [--output var/benchmark/screen_api.json]
+        python -m core.benchmark.screen_api --compare var/benchmark/screen_api.json
+'''
+import argparse
+import json
+
+from core.benchmark import compareResults, createTestDatabase, destroyTestDatabase, measure, readResults, setupDjango, writeResults
+
+BENCHMARK_USER_NAME = 'BenchmarkUser'
+MAIN_SCREEN_NAME = 'BenchmarkScreenApi'
+COMBOBOX_SCREEN_NAME = 'BenchmarkComboboxApi'
+PAGE_SIZE = 20
+SAVE_ROWS = 20
+INSERT_BATCH_SIZE = 5000
+
+
+def buildMainScreenDefinition() -> dict:
+    import core.ui.ui as ikui
+    return {'templateVersion': 1, 'viewID': MAIN_SCREEN_NAME, 'viewTitle': 'Benchmark Screen API', 'viewDesc': None,
+            'layoutType': None, 'layoutParams': None, 'appName': 'core', 'viewName': MAIN_SCREEN_NAME, 'editable': True,
+            'recordsetTable': [('grpRcs', '*', 'core.models.Group', None, 'id', None, None),
+                               ('menuRcs', '*', 'core.models.Menu', 'enable = true', 'menu_nm', None, None)],
+            'fieldGroupTable': [('schFg', ikui.SCREEN_FIELD_TYPE_SEARCH, 'Search', None, None, None, None, None, None, None,
+                                 None, None, None, None, None, None, None, None),
+                                ('grpFg', ikui.SCREEN_FIELD_TYPE_TABLE, 'Groups', 'grpRcs', True, True, True, None, None, None,
+                                 ikui.SCREEN_FIELD_GROUP_PAGE_TYPE_SERVER, PAGE_SIZE, None, None, None, None, None, None),
+                                ('dtlFg', ikui.SCREEN_FIELD_TYPE_FIELDS, 'Detail', None, None, None, None, None, None, None,
+                                 None, None, None, None, None, None, None, None)],
+            'fieldTable': [('schFg', 'schGrpNm', 'Group Name', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_TEXT_BOX, None, None, None, None, None),
+                           ('grpFg', 'grp_nm', 'Group Name', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_TEXT_BOX, None, 'grp_nm', None, None, None),
+                           ('grpFg', 'rmk', 'Remarks', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_TEXT_BOX, None, 'rmk', None, None, None),
+                           ('dtlFg', 'menuId', 'Menu', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_COMBO_BOX,
+                            'recordset: menuRcs\nvalues: {"value": "id", "display": "menu_nm"}', 'menu_id', None, None, None),
+                           ('dtlFg', 'dsc', 'Description', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_TEXT_AREA, None, 'dsc', None, None, None)],
+            'subScreenTable': [], 'fieldGroupLinkTable': [], 'headerFooterTable': []}
+
+
+def buildComboboxScreenDefinition(totalComboboxes: int = 8) -> dict:
+    import core.ui.ui as ikui
+    fieldTable = []
+    for i in range(totalComboboxes):
+        rsName, display = ('menuRcs', 'menu_nm') if i % 2 == 0 else ('grpRcs', 'grp_nm')
+        fieldTable.append(('cmbFg', 'cmb%s' % i, 'Combobox %s' % i, None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_COMBO_BOX,
+                           'recordset: %s\nvalues: {"value": "id", "display": "%s"}' % (rsName, display), 'field%s' % i, None, None, None))
+    return {'templateVersion': 1, 'viewID': COMBOBOX_SCREEN_NAME, 'viewTitle': 'Benchmark Combobox API', 'viewDesc': None,
+            'layoutType': None, 'layoutParams': None, 'appName': 'core', 'viewName': COMBOBOX_SCREEN_NAME, 'editable': True,
+            'recordsetTable': [('menuRcs', '*', 'core.models.Menu', 'enable = true', 'menu_nm', None, None),
+                               ('grpRcs', '*', 'core.models.Group', 'id <= 100', 'grp_nm', None, None)],
+            'fieldGroupTable': [('cmbFg', ikui.SCREEN_FIELD_TYPE_FIELDS, 'Comboboxes', None, None, None, None, None, None, None,
+                                 None, None, None, None, None, None, None, None)],
+            'fieldTable': fieldTable, 'subScreenTable': [], 'fieldGroupLinkTable': [], 'headerFooterTable': []}
+
+
+def seedDatabase(rows: int, menus: int = 100) -> None:
+    '''
+        [rows] groups (the paging table), [menus] menus (the comboboxes), a user and the benchmark screen menus.
+    '''
+    from core.models import Group, Menu, User
+    User.objects.create(usr_nm=BENCHMARK_USER_NAME, psw='-')
+    for start in range(0, rows, INSERT_BATCH_SIZE):
+        Group.objects.bulk_create([Group(grp_nm='Benchmark Group %06d' % i, rmk='Remarks %s' % (i % 10))
+                                   for i in range(start, min(start + INSERT_BATCH_SIZE, rows))])
+    Menu.objects.bulk_create([Menu(menu_nm='BenchmarkMenu%s' % i, menu_caption='Menu %s' % i, enable=i % 10 != 0) for i in range(menus)])
+    for screenName in (MAIN_SCREEN_NAME, COMBOBOX_SCREEN_NAME):
+        Menu.objects.create(menu_nm=screenName, menu_caption=screenName, screen_nm=screenName, enable=True, is_free_access=True)
+
+
+def getViewClasses() -> tuple:
+    '''
+        The view classes are created after django setup. Return (main screen view class, combobox screen view class).
+    '''
+    from core.db.transaction import IkTransaction
+    from core.models import Group
+    from core.view.screen_view import ScreenAPIView
+
+    class BenchmarkScreenApi(ScreenAPIView):
+        def getGrpRcs(self):
+            return self.getPagingResponse('grpFg', table_data=Group.objects.order_by('id'))
+
+        def save(self):
+            trn = IkTransaction(self)
+            trn.add(self.getRequestData().get('grpFg'))
+            return trn.save()
+
+    class BenchmarkComboboxApi(ScreenAPIView):
+        pass
+
+    return BenchmarkScreenApi, BenchmarkComboboxApi
+
+
+class ScreenApiClient():
+    '''
+        Call a screen API view with the session middlewares. The session is kept between the calls.
+    '''
+
+    def __init__(self, viewClass, user) -> None:
+        from django.contrib.sessions.middleware import SessionMiddleware
+
+        from core.session.middleware import SessionSanitizerMiddleware
+        self.view = viewClass.as_view()
+        self.user = user
+        self.sessionKey = None
+        self.suuid = None
+        self.__handler = SessionMiddleware(SessionSanitizerMiddleware(self.__callView))
+
+    def __callView(self, request):
+        return self.view(request, action=request.ikAction)
+
+    def call(self, action: str, data: dict = None, method: str = 'get') -> dict:
+        from django.conf import settings
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        factory = APIRequestFactory()
+        url = '/api/%s/%s' % (self.view.view_class.__name__.lower(), action)
+        if self.suuid is not None:
+            url += '?SUUID=%s' % self.suuid
+        if method == 'get':
+            request = factory.get(url, HTTP_HOST='testserver')
+        else:
+            request = factory.post(url, data=json.dumps(data or {}), content_type='application/json', HTTP_HOST='testserver')
+        force_authenticate(request, user=self.user)
+        request.ikAction = action
+        if self.sessionKey is not None:
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = self.sessionKey
+        response = self.__handler(request)
+        if settings.SESSION_COOKIE_NAME in response.cookies:
+            self.sessionKey = response.cookies[settings.SESSION_COOKIE_NAME].value
+        r = json.loads(response.content)
+        if r.get('code') != 1:
+            raise Exception('Call %s failed: %s' % (action, r.get('messages')))
+        return r.get('data')
+
+
+def run(rows: int = 10000, rounds: int = 50, jsonRows: int = 500) -> list:
+    from core.core.http import IkSccJsonResponse
+    from core.models import Group, User
+    from core.benchmark.screen_dfn import primeScreenCache
+
+    seedDatabase(rows)
+    primeScreenCache(buildMainScreenDefinition())
+    primeScreenCache(buildComboboxScreenDefinition())
+    user = User.objects.get(usr_nm=BENCHMARK_USER_NAME)
+    mainViewClass, comboboxViewClass = getViewClasses()
+    client = ScreenApiClient(mainViewClass, user)
+    comboboxClient = ScreenApiClient(comboboxViewClass, user)
+    client.suuid = client.call('initScreen')['SUUID']
+
+    pageNums = iter(range(1, 10 ** 9))
+    saveCount = iter(range(1, 10 ** 9))
+    saveGroups = list(Group.objects.order_by('id').values_list('id', 'grp_nm')[:SAVE_ROWS])
+    jsonRcs = list(Group.objects.order_by('id')[:jsonRows])
+
+    def page():
+        pageNum = next(pageNums) % (rows // PAGE_SIZE) + 1
+        return client.call('getGrpRcs', {'PAGEABLE_grpFg_pageNum': pageNum}, method='post')
+
+    def save():
+        remarks = 'Saved %s' % next(saveCount)
+        rcs = [['~', str(id), grpNm, remarks] for id, grpNm in saveGroups]
+        return client.call('save', {'grpFg': {'attr': ['__STT_', '__KEY_', 'grp_nm', 'rmk'], 'data': rcs}}, method='post')
+
+    phases = (('init', lambda: client.call('initScreen')),
+              ('screen', lambda: client.call('getScreen')),
+              ('page', page),
+              ('combobox', lambda: comboboxClient.call('getScreen')),
+              ('save', save),
+              ('json', lambda: IkSccJsonResponse(data=jsonRcs)))
+    print('%s groups, page size %s, %s rows saved per call, %s rows per json response' % (rows, PAGE_SIZE, SAVE_ROWS, jsonRows))
+    results = [measure(name, fn, rounds=rounds, warmup=3, countQueries=True) for name, fn in phases]
+    for r in results:
+        print(r)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End to end screen API benchmark.')
+    parser.add_argument('--rows', type=int, default=10000, help='Table rows.')
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--jsonRows', type=int, default=500)
+    parser.add_argument('--output', default=None, help='Write the results to a json file.')
+    parser.add_argument('--compare', default=None, help='Compare with the results in a json file.')
+    args = parser.parse_args()
+    setupDjango()
+    oldName = createTestDatabase()
+    try:
+        results = run(args.rows, args.rounds, args.jsonRows)
+    finally:
+        from core.sys.access_log import flushAccessLog
+        flushAccessLog()  # before the test database is dropped
+        destroyTestDatabase(oldName)
+    if args.output is not None:
+        writeResults(args.output, 'screen_api', results, parameters={'rows': args.rows, 'rounds': args.rounds, 'jsonRows': args.jsonRows})
+    if args.compare is not None:
+        compareResults(readResults(args.compare), results)
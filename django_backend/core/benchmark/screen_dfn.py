@@ -0,0 +1,114 @@
+'''
+    Screen definition benchmark: IkUI.getScreen() latency and allocations.
+
+        before: get the definition from cache, deep copy it and build the screen for each request.
+        after:  share the compiled screen and return a per-request overlay.
+
+    Usage (in django_backend folder):
+        python -m core.benchmark.screen_dfn [--fieldGroups 12] [--fields 40] [--rounds 200]
+        python -m core.benchmark.screen_dfn --screen ScreenDfn    # use a screen in database
+'''
+import argparse
+import copy
+
+from core.benchmark import measure, setupDjango
+
+BENCHMARK_SCREEN_NAME = 'BenchmarkLargeScreen'
+
+
+def buildScreenDefinition(totalFieldGroups: int = 12, totalFields: int = 40) -> dict:
+    '''
+        Build a large screen definition in the same format as IkUI._getScreenDefinitionFromDB().
+        Each group has a search field group, a result table with a detail field group and a toolbar.
+    '''
+    import core.ui.ui as ikui
+    dfn = {'templateVersion': 1,
+           'viewID': BENCHMARK_SCREEN_NAME,
+           'viewTitle': 'Benchmark Large Screen',
+           'viewDesc': None,
+           'layoutType': 'grid',
+           'layoutParams': None,
+           'appName': 'core',
+           'viewName': BENCHMARK_SCREEN_NAME,
+           'editable': True,
+           'autoRefresh': None}
+    recordsetTable, fieldGroupTable, fieldTable, fgLinkTable = [], [], [], []
+    for i in range(totalFieldGroups):
+        groupType = (ikui.SCREEN_FIELD_TYPE_SEARCH, ikui.SCREEN_FIELD_TYPE_RESULT_TABLE, ikui.SCREEN_FIELD_TYPE_FIELDS,
+                     ikui.SCREEN_FIELD_TYPE_ICON_BAR)[i % 4]
+        fgName = 'fg%s' % i
+        rsName = 'rcs%s' % i
+        recordsetTable.append((rsName, '*', 'core.models.Menu', None, 'id', None, None))
+        fieldGroupTable.append((fgName, groupType, 'Field Group %s' % i, rsName, None, True, True, None,
+                                'single' if groupType == ikui.SCREEN_FIELD_TYPE_RESULT_TABLE else None, 4, None, None,
+                                None, None, None, None, 'hideCaption: true', None))
+        if groupType == ikui.SCREEN_FIELD_TYPE_FIELDS:
+            fgLinkTable.append((fgName, 'fg%s' % (i - 1), 'id', 'id', None))
+        for j in range(totalFields):
+            if groupType == ikui.SCREEN_FIELD_TYPE_ICON_BAR:
+                fieldTable.append((fgName, 'btn%s' % j, 'Button %s' % j, None, True, True, None, None,
+                                   ikui.SCREEN_FIELD_WIDGET_ICON_AND_TEXT, 'icon: images/save_button.gif', None,
+                                   'save%s(fg%s)' % (j, i - 1), None, None))
+            elif j % 4 == 0:
+                fieldTable.append((fgName, 'cmb%s' % j, 'Combo %s' % j, 'tooltip', True, True, None, None,
+                                   ikui.SCREEN_FIELD_WIDGET_COMBO_BOX, 'recordset: %s\nvalues: {"value": "id", "display": "menu_nm"}\nonChange: change%s' % (rsName, j),
+                                   'field%s' % j, None, 'width: 120px;text-align: left', None))
+            else:
+                fieldTable.append((fgName, 'field%s' % j, 'Field %s' % j, None, True, j % 3 != 0, None, None,
+                                   ikui.SCREEN_FIELD_WIDGET_TEXT_BOX if j % 2 == 0 else ikui.SCREEN_FIELD_WIDGET_LABEL, None,
+                                   'field%s' % j, None, 'width: 80px', None))
+    dfn['recordsetTable'] = recordsetTable
+    dfn['fieldGroupTable'] = fieldGroupTable
+    dfn['fieldTable'] = fieldTable
+    dfn['subScreenTable'] = []
+    dfn['fieldGroupLinkTable'] = fgLinkTable
+    dfn['headerFooterTable'] = []
+    return dfn
+
+
+def primeScreenCache(dfn: dict) -> None:
+    '''
+        Put the screen definition and the field group types/widgets to cache, so no database access is required.
+    '''
+    from django.core.cache import cache
+
+    import core.ui.ui as ikui
+    import core.ui.ui_cache as ikuiCache
+    cache.set('fgTypes', list(ikui.SCREEN_FIELD_NORMAL_GROUP_TYPES))
+    cache.set('fieldWidgets', list(ikui.SCREEN_FIELD_NORMAL_WIDGETS))
+    ikuiCache.setPageDefinitionCache(dfn['viewID'], dfn)
+
+
+def run(screenName: str = None, totalFieldGroups: int = 12, totalFields: int = 40, rounds: int = 200) -> list:
+    import core.ui.ui as ikui
+    import core.ui.ui_cache as ikuiCache
+    if screenName is None:
+        dfn = buildScreenDefinition(totalFieldGroups, totalFields)
+        primeScreenCache(dfn)
+        screenName = dfn['viewID']
+
+    def before():
+        return ikui.IkUI._compileScreen(screenName, copy.deepcopy(ikuiCache.getPageDefinitionFromCache(screenName)))
+
+    def after():
+        return ikui.IkUI.getScreen(screenName)
+
+    screen = after()
+    print('Screen [%s]: %s field groups, %s fields' % (screenName, len(screen.fieldGroups), sum(len(fg.fields) for fg in screen.fieldGroups)))
+    results = [measure('getScreen (before: deepcopy + build)', before, rounds=rounds),
+               measure('getScreen (after: compiled + overlay)', after, rounds=rounds)]
+    for r in results:
+        print(r)
+    print('Speed up (p50): %.1fx' % (results[0].p50 / results[1].p50))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Screen definition benchmark.')
+    parser.add_argument('--screen', default=None, help='Screen SN in database. Default to a generated large screen.')
+    parser.add_argument('--fieldGroups', type=int, default=12)
+    parser.add_argument('--fields', type=int, default=40)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+    setupDjango()
+    run(args.screen, args.fieldGroups, args.fields, args.rounds)
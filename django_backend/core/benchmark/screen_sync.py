@@ -0,0 +1,150 @@
+'''
+    Screen definition sync benchmark: ikuidb.syncScreenDefinitions() at startup.
+
+        full:        sync without the manifest file. All spreadsheet files are parsed and all screens are checked and exported to csv (same as before).
+        incremental: sync with the manifest file, nothing changed.
+        one changed: sync with the manifest file, one spreadsheet file is changed.
+
+    The screens are copied from core/resources/screen/Currency.xlsx to a temporary app folder, and imported to an empty test database.
+    The csv files are exported in the current thread, so they are included in the durations.
+
+    Usage (in django_backend folder):
+        python -m core.benchmark.screen_sync [--screens 200] [--rounds 3]
+'''
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from core.benchmark import createTestDatabase, destroyTestDatabase, measure, setupDjango
+
+BENCHMARK_APP_NAME = 'screensyncbench'
+SOURCE_SCREEN_FILE = Path(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'resources', 'screen', 'Currency.xlsx'))
+
+
+class _CurrentThread():
+    def __init__(self, target, args=(), kwargs=None) -> None:
+        self.target = target
+        self.args = args
+        self.kwargs = {} if kwargs is None else kwargs
+
+    def start(self) -> None:
+        self.target(*self.args, **self.kwargs)
+
+
+def createScreenFiles(appFolder: str, totalScreens: int, screenNamePrefix: str = 'SyncBench') -> list:
+    '''
+        Create [totalScreens] screen spreadsheet files in [appFolder]/resources/screen. Return the files.
+    '''
+    import openpyxl
+
+    import core.ui.ui as ikui
+    screenFolder = Path(os.path.join(appFolder, ikui.SCREEN_RESOURCE_FOLDER_PATH))
+    screenFolder.mkdir(parents=True, exist_ok=True)
+    appName = os.path.basename(appFolder)
+    files = []
+    for i in range(totalScreens):
+        wb = openpyxl.load_workbook(SOURCE_SCREEN_FILE)
+        ws = wb['View Dfn']
+        screenSN = '%s%03d' % (screenNamePrefix, i)
+        for row in ws.iter_rows(min_row=1, max_row=20, max_col=3):
+            if row[0].value == 'viewID':
+                row[2].value = screenSN
+            elif row[0].value == 'appName':
+                row[2].value = appName
+            elif row[0].value == 'rev':
+                row[2].value = 1
+        f = screenFolder.joinpath('%s.xlsx' % screenSN)
+        wb.save(f)
+        files.append(f)
+    return files
+
+
+def createScreenTypes() -> None:
+    '''
+        Create the screen field group types and the widgets (core/resources/database/init.sql) in the test database.
+    '''
+    import core.ui.ui as ikui
+    from core.models import ScreenFgType, ScreenFieldWidget
+    for typeName in ikui.SCREEN_FIELD_NORMAL_GROUP_TYPES:
+        ScreenFgType.objects.get_or_create(type_nm=typeName)
+    for widgetName in ikui.SCREEN_FIELD_NORMAL_WIDGETS:
+        ScreenFieldWidget.objects.get_or_create(widget_nm=widgetName)
+
+
+def updateScreenFileRevision(f: Path, rev: int) -> None:
+    import openpyxl
+    wb = openpyxl.load_workbook(f)
+    for row in wb['View Dfn'].iter_rows(min_row=1, max_row=20, max_col=3):
+        if row[0].value == 'rev':
+            row[2].value = rev
+    wb.save(f)
+
+
+def syncEnvironment(workFolder: str, appNames: list):
+    '''
+        Patch syncScreenDefinitions to use the apps in [workFolder] and export the csv files in the current thread.
+    '''
+    import core.ui.ui_db as ikuidb
+    return [mock.patch.object(ikuidb, 'getAppNames', return_value=appNames),
+            mock.patch.object(ikuidb, '_getSyncManifestFile', return_value=Path(os.path.join(workFolder, 'screen-sync-manifest.json'))),
+            mock.patch.object(ikuidb, 'threading', SimpleNamespace(Thread=_CurrentThread))]
+
+
+def run(totalScreens: int = 200, rounds: int = 3) -> list:
+    import core.ui.ui_db as ikuidb
+    workFolder = tempfile.mkdtemp(prefix='ikyo-screen-sync-')
+    cwd = os.getcwd()
+    patches = syncEnvironment(workFolder, [BENCHMARK_APP_NAME])
+    try:
+        files = createScreenFiles(os.path.join(workFolder, BENCHMARK_APP_NAME), totalScreens)
+        os.chdir(workFolder)
+        for p in patches:
+            p.start()
+        manifestFile = ikuidb._getSyncManifestFile()
+        createScreenTypes()
+
+        startTime = time.perf_counter()
+        ikuidb.syncScreenDefinitions()
+        print('%s screens, first sync (import to database): %.1fs' % (totalScreens, time.perf_counter() - startTime))
+
+        def full():
+            if os.path.isfile(manifestFile):
+                os.remove(manifestFile)
+            ikuidb.syncScreenDefinitions()
+
+        revs = {'rev': 1}
+
+        def oneChanged():
+            revs['rev'] += 1
+            updateScreenFileRevision(files[0], revs['rev'])
+            ikuidb.syncScreenDefinitions()
+
+        results = [measure('sync %s screens (full)' % totalScreens, full, rounds=rounds, warmup=0),
+                   measure('sync %s screens (incremental)' % totalScreens, ikuidb.syncScreenDefinitions, rounds=rounds, warmup=1),
+                   measure('sync %s screens (one changed)' % totalScreens, oneChanged, rounds=rounds, warmup=0)]
+        for r in results:
+            print(r)
+        return results
+    finally:
+        for p in patches:
+            p.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workFolder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--screens', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    setupDjango()
+    oldName = createTestDatabase()
+    try:
+        run(totalScreens=args.screens, rounds=args.rounds)
+    finally:
+        destroyTestDatabase(oldName)
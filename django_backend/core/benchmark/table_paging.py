@@ -0,0 +1,80 @@
+'''
+    Table pagination benchmark: OFFSET pagination vs keyset pagination, page 1 vs a deep page.
+
+        offset: Paginator(queryset).get_page(n) and "sql LIMIT n OFFSET m" (ScreenAPIView._getPaginatorTableData).
+        keyset: KeysetPaginator with the cursor of the previous page (the user clicks "next page").
+
+    It creates a test database and fills ik_access_log with (page size * deep page) rows.
+
+    Usage (in django_backend folder):
+        python -m core.benchmark.table_paging [--pageSize 10] [--page 10000] [--rounds 20]
+'''
+import argparse
+
+from core.benchmark import createTestDatabase, destroyTestDatabase, measure, setupDjango
+
+INSERT_BATCH_SIZE = 5000
+
+
+def createAccessLogs(total: int) -> None:
+    from core.models import AccessLog
+    for start in range(0, total, INSERT_BATCH_SIZE):
+        AccessLog.objects.bulk_create([AccessLog(page_nm='Page%s' % (i % 50), action_nm='getScreen', usr_id=i % 20)
+                                       for i in range(start, min(start + INSERT_BATCH_SIZE, total))])
+
+
+def run(pageSize: int = 10, deepPage: int = 10000, rounds: int = 20) -> list:
+    from django.core.paginator import Paginator
+    from django.db import connection
+
+    import core.utils.db as dbUtils
+    from core.db.keyset_paginator import KeysetPaginator
+    from core.models import AccessLog
+
+    createAccessLogs(pageSize * deepPage)
+    queryset = AccessLog.objects.order_by('-id')
+    sql = 'SELECT id, page_nm, action_nm, usr_id FROM ik_access_log ORDER BY id DESC'
+    paginator = KeysetPaginator(pageSize)
+
+    def offsetQuerySetPage(pageNum):
+        return list(Paginator(queryset, pageSize).get_page(pageNum).object_list)
+
+    def offsetSqlPage(pageNum):
+        with connection.cursor() as cursor:
+            cursor.execute('%s LIMIT %s OFFSET %s' % (sql, pageSize, pageSize * (pageNum - 1)))
+            return dbUtils.dictfetchall(cursor)
+
+    # the cursor of the previous page, e.g. the client is on page 9,999 and clicks "next page"
+    _rcs, deepQuerySetCursor = paginator.getQuerySetPage(queryset, deepPage - 1)
+    _rows, deepSqlCursor = paginator.getSqlPage(sql, deepPage - 1)
+    expectedIDs = [rc.id for rc in offsetQuerySetPage(deepPage)]
+    assert expectedIDs == [rc.id for rc in paginator.getQuerySetPage(queryset, deepPage, deepQuerySetCursor)[0]]
+    assert expectedIDs == [r['id'] for r in paginator.getSqlPage(sql, deepPage, deepSqlCursor)[0]]
+
+    print('%s rows, page size %s' % (AccessLog.objects.count(), pageSize))
+    results = [measure('queryset offset page 1', lambda: offsetQuerySetPage(1), rounds=rounds, warmup=2),
+               measure('queryset offset page %s' % deepPage, lambda: offsetQuerySetPage(deepPage), rounds=rounds, warmup=2),
+               measure('queryset keyset page 1', lambda: paginator.getQuerySetPage(queryset, 1), rounds=rounds, warmup=2),
+               measure('queryset keyset page %s' % deepPage, lambda: paginator.getQuerySetPage(queryset, deepPage, deepQuerySetCursor),
+                       rounds=rounds, warmup=2),
+               measure('sql offset page 1', lambda: offsetSqlPage(1), rounds=rounds, warmup=2),
+               measure('sql offset page %s' % deepPage, lambda: offsetSqlPage(deepPage), rounds=rounds, warmup=2),
+               measure('sql keyset page 1', lambda: paginator.getSqlPage(sql, 1), rounds=rounds, warmup=2),
+               measure('sql keyset page %s' % deepPage, lambda: paginator.getSqlPage(sql, deepPage, deepSqlCursor), rounds=rounds, warmup=2)]
+    for r in results:
+        print(r)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Table pagination benchmark.')
+    parser.add_argument('--pageSize', type=int, default=10)
+    parser.add_argument('--page', type=int, default=10000, help='The deep page number.')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    setupDjango()
+    oldName = createTestDatabase()
+    try:
+        run(args.pageSize, args.page, args.rounds)
+    finally:
+        destroyTestDatabase(oldName)
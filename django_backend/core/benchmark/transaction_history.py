@@ -0,0 +1,62 @@
+'''
+    IkTransaction.save throughput with model history off, sync and deferred.
+
+    Each round updates [rows] records in one IkTransaction. The benchmark runs in a new test database.
+
+    Usage (in django_backend folder):
+        python -m core.benchmark.transaction_history [--rows 100] [--rounds 30]
+'''
+import argparse
+from unittest import mock
+
+from core.benchmark import createTestDatabase, destroyTestDatabase, measure, setupDjango
+
+
+def run(rows: int = 100, rounds: int = 30) -> list:
+    import core.db.model as ikDbModel
+    from core.db.transaction import IkTransaction
+    from core.models import Group
+
+    Group.objects.bulk_create([Group(grp_nm='Benchmark %s' % i) for i in range(rows)])
+    counter = [0]
+
+    def save():
+        counter[0] += 1
+        groups = list(Group.objects.order_by('id'))
+        for grp in groups:
+            grp.rmk = 'round %s' % counter[0]
+            grp.ik_set_status_modified()
+        trn = IkTransaction(userID=-1)
+        trn.add(groups)
+        b = trn.save()
+        if not b.value:
+            raise Exception(b.data)
+
+    results = []
+    with mock.patch.object(ikDbModel, 'ENABLE_MODEL_HISTORY', False), mock.patch.object(ikDbModel, '_isModelHistoryEnabled', return_value=False):
+        results.append(measure('history off', save, rounds=rounds, warmup=2))
+    with mock.patch.object(ikDbModel, 'ENABLE_MODEL_HISTORY', True), mock.patch.object(ikDbModel, '_isModelHistoryEnabled', return_value=True):
+        with mock.patch.object(ikDbModel, 'MODEL_HISTORY_MODE', ikDbModel.MODEL_HISTORY_MODE_SYNC):
+            results.append(measure('history sync', save, rounds=rounds, warmup=2))
+        with mock.patch.object(ikDbModel, 'MODEL_HISTORY_MODE', ikDbModel.MODEL_HISTORY_MODE_DEFERRED):
+            results.append(measure('history deferred', save, rounds=rounds, warmup=2))
+        pendingCount = ikDbModel._modelHistoryWriter.pendingCount
+        flushResult = measure('history deferred flush', lambda: ikDbModel.flushModelHistory(), rounds=1, warmup=0)
+    for r in results:
+        print('%s  %8.0f rows/s' % (r, rows / r.p50 * 1000))
+    print('%s  %s pending histories, %s written by the writer thread' % (flushResult, pendingCount,
+                                                                         ikDbModel._modelHistoryWriter.flushedCount - pendingCount))
+    return results + [flushResult]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='IkTransaction.save benchmark with model history.')
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=30)
+    args = parser.parse_args()
+    setupDjango()
+    oldDatabaseName = createTestDatabase()
+    try:
+        run(args.rows, args.rounds)
+    finally:
+        destroyTestDatabase(oldDatabaseName)
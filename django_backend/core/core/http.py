@@ -1,5 +1,4 @@
 import datetime
-import decimal
 import inspect
 import json
 import logging
@@ -13,21 +12,25 @@ import django.core.files.uploadedfile as djangoUploadedfile
 from django.core.exceptions import FieldDoesNotExist
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db.models.query import QuerySet
+from django.db.models.query import ModelIterable, QuerySet
 from django.http import HttpRequest, HttpResponse
 from django.http.response import JsonResponse, StreamingHttpResponse
 from django.templatetags.static import static
 
 import core.db.model as ikDbModels
 import core.utils.model_utils as model_utils
+from core.log import profiler
 from core.utils import date_utils
 from core.utils.lang_utils import isNotNullBlank, isNullBlank
 
 from .code import IkCode, MessageType
 from .exception import IkMessageException, IkValidateException
+from .json_serializer import getModelJsonSerializer, object2Str
 
 logger = logging.getLogger('ikyo')
 
+PREFETCH_CHUNK_SIZE = 500  # max ids in one "id__in" query when loading the table records in GetRequestData
+
 
 def is_support_session(request) -> bool:
     '''
@@ -155,7 +158,8 @@ class IkJsonResponse(JsonResponse):
                 messageType = MessageType.INFO
             self.addMessage(messageType, message)
         self.__staticResources = []
-        super().__init__(self.__toJson(), encoder, safe, json_dumps_params, *kwargs)
+        with profiler.span('serialize'):
+            super().__init__(self.__toJson(), encoder, safe, json_dumps_params, *kwargs)
 
     def addMessage(self, messageType: MessageType, message: str) -> None:
         self.__messages.append({'type': messageType.value if type(messageType) ==
@@ -214,10 +218,14 @@ class IkJsonResponse(JsonResponse):
             elif isinstance(data2, ikDbModels.DummyModel):
                 data2 = data2.getJson()
             elif type(data2) == list:
-                data3 = []
-                for item in data2:
-                    data3.append(self.__getJsonData(item, modelAdditionalFields))
-                data2 = data3
+                if len(data2) > 1 and isinstance(data2[0], models.Model) and all(type(item) is type(data2[0]) for item in data2):
+                    # load the foreign keys of all the records together
+                    data2 = getModelJsonSerializer(type(data2[0]), modelAdditionalFields).serializeModels(data2)
+                else:
+                    data3 = []
+                    for item in data2:
+                        data3.append(self.__getJsonData(item, modelAdditionalFields))
+                    data2 = data3
             elif type(data2) == dict:
                 data3 = {}
                 for key, value in data2.items():
@@ -228,64 +236,14 @@ class IkJsonResponse(JsonResponse):
         return data2
 
     def __model2Json(self, r: models.Model, modelAdditionalFields: list[str] = None) -> dict:
-        # YL.ikyo, 2023-03-29 bugfix, can't serialize when view get screen(return data is a querySet or model) - start
-        for field in r._meta.get_fields():
-            try:
-                if isinstance(field, models.Field) and not isinstance(field, models.ForeignKey):
-                    key = field.name
-                    r.__dict__[field.name] = self.__object2Str(r.__dict__[field.name])
-            except Exception as e:
-                # this is not a model field or field is not a normal field. ignore it
-                logger.error(str(e))
-        # YL.ikyo, 2023-03-29 - end
-        d = r.toJson()
-        # add property values
-        propertValues = model_utils.getModelPropertyValues(r)
-        for prpKey, prpValue in propertValues.items():
-            d.update({prpKey: self.__object2Str(prpValue)})
-        if r._meta.pk is not None and r._meta.pk.name is not None:
-            primaryKey = r._meta.pk.name
-            d['__PK_'] = primaryKey
-        if modelAdditionalFields is not None and len(modelAdditionalFields) > 0:
-            for name in modelAdditionalFields:
-                if name not in d.keys():
-                    if ikDbModels.FOREIGN_KEY_VALUE_FLAG in name:
-                        attributes = name.split('.')
-                        value = r
-                        for attr in attributes:
-                            if value:
-                                try:
-                                    value = getattr(value, attr)
-                                except Exception as e:
-                                    value = None
-                                    if type(e).__name__ != 'RelatedObjectDoesNotExist':
-                                        logger.error("Model [%s] does't have attr [%s]. Values=[%s]" % (type(r).__name__, attr, str(r)))
-                            else:
-                                value = None
-                                break
-                        d[name] = self.__object2Str(value)
-                    elif name.startswith(ikDbModels.MODEL_PROPERTY_ATTRIBUTE_NAME_PREFIX):
-                        try:
-                            value = getattr(r, name, None)
-                            d[name] = self.__object2Str(value)
-                        except Exception as e:
-                            logger.error('Get Model[%s] attribute [%s] failed.' % (type(r).__name__, name), exc_info=True)
-                    else:
-                        logger.warn('Ignore get Model[%s] attribute [%s] failed.' % (type(r).__name__, name))
-        return d
+        return getModelJsonSerializer(type(r), modelAdditionalFields).serializeModel(r)
 
     def __object2Str(self, value: object) -> str:
-        if isinstance(value, datetime.datetime):
-            return value.strftime("%Y-%m-%d %H:%M:%S")
-        elif isinstance(value, datetime.date):
-            return value.strftime("%Y-%m-%d")
-        elif isinstance(value, datetime.time):
-            return value.strftime("%H:%M:%S")
-        elif isinstance(value, decimal.Decimal):
-            return str(value)
-        return value
+        return object2Str(value)
 
     def __getDataSetValues(self, dataset: QuerySet, modelAdditionalFields: list[str] = None) -> list:
+        if dataset._iterable_class is ModelIterable:
+            return getModelJsonSerializer(dataset.model, modelAdditionalFields).serializeQuerySet(dataset)
         rs = []
         for r in dataset:
             if type(r) == dict:  # model.values(a,b)
@@ -551,6 +509,17 @@ def GetRequestData(request, parameterModelMap={}, screen=None, initDataFromDatab
                     modelClass = model_utils.get_model_class_1(screen.appName, modelClassName)
                     primaryKey = modelClass._meta.pk.name
                     dbFieldNamesAttrs = attr[2:]
+                    # load all the original records in the table with one query
+                    prefetchIds = []
+                    for r in tableData:
+                        if isNullBlank(r[1]):
+                            continue
+                        if r[0] == RECORD_SET.STATUS_NEW.value or r[0] == RECORD_SET.STATUS_UPDATE.value:
+                            if initDataFromDatabase and int(r[1]) > 0:
+                                prefetchIds.append(int(r[1]))
+                        else:
+                            prefetchIds.append(int(r[1]))
+                    prefetchedRecords = __GetRequestData_prefetchRecords(modelClass, primaryKey, prefetchIds)
                     for r in tableData:
                         isNew = r[0] == RECORD_SET.STATUS_NEW.value
                         isDelete = r[0] == RECORD_SET.STATUS_DELETE.value
@@ -559,8 +528,7 @@ def GetRequestData(request, parameterModelMap={}, screen=None, initDataFromDatab
                         if isDelete:
                             modelInstance = modelClass()
                             if isNotNullBlank(primaryKey) and isNotNullBlank(id):
-                                filterDict = {primaryKey: id}
-                                modelInstance = modelClass.objects.filter(**filterDict).first()
+                                modelInstance = __GetRequestData_getPrefetchedRecord(modelClass, primaryKey, id, prefetchedRecords)
                             if modelInstance is None:
                                 raise IkValidateException('This record has been deleted. ID=%s' % id)
                             modelInstance.ik_set_status_delete()
@@ -571,7 +539,7 @@ def GetRequestData(request, parameterModelMap={}, screen=None, initDataFromDatab
                             for i in range(len(dbFieldNamesAttrs)):
                                 rowValuesDict[dbFieldNamesAttrs[i]] = rowValues[i]
                             rowValuesDict[primaryKey] = id
-                            r = __GetRequestData_oneRecord(screen, parameterModelMap, key, rowValuesDict, initDataFromDatabase, True)
+                            r = __GetRequestData_oneRecord(screen, parameterModelMap, key, rowValuesDict, initDataFromDatabase, True, prefetchedRecords)
                             if r is None:
                                 raise IkValidateException('This record has been deleted. ID=%s' % id)
                             modelRecords.append(r)
@@ -579,8 +547,7 @@ def GetRequestData(request, parameterModelMap={}, screen=None, initDataFromDatab
                             # no update
                             modelInstance = modelClass()
                             if isNotNullBlank(primaryKey) and isNotNullBlank(id):
-                                filterDict = {primaryKey: id}
-                                modelInstance = modelClass.objects.filter(**filterDict).first()
+                                modelInstance = __GetRequestData_getPrefetchedRecord(modelClass, primaryKey, id, prefetchedRecords)
                             modelRecords.append(modelInstance)
                             # update the no database fields (E.g. select field)
                             rowValues = r[2:]
@@ -637,7 +604,35 @@ def GetRequestData(request, parameterModelMap={}, screen=None, initDataFromDatab
     return data
 
 
-def __GetRequestData_oneRecord(screen, parameterModelMap, name, values, initDataFromDatabase, isTable):
+def __GetRequestData_prefetchRecords(modelClass, primaryKeyName: str, ids: list) -> dict:
+    '''
+        Load the records by primary keys. One query per PREFETCH_CHUNK_SIZE ids.
+
+        Return {id: model instance}. The deleted records are not in the result.
+    '''
+    records = {}
+    ids = list(dict.fromkeys(ids))
+    for i in range(0, len(ids), PREFETCH_CHUNK_SIZE):
+        filterDict = {'%s__in' % primaryKeyName: ids[i:i + PREFETCH_CHUNK_SIZE]}
+        for rc in modelClass.objects.filter(**filterDict):
+            records[getattr(rc, primaryKeyName)] = rc
+    return records
+
+
+def __GetRequestData_getPrefetchedRecord(modelClass, primaryKeyName: str, id: int, prefetchedRecords: dict) -> models.Model:
+    '''
+        Get the record from the prefetched records. Each record can be used once only, if the same id is in the request
+        more than once, then read a new instance from database.
+    '''
+    if prefetchedRecords is not None:
+        modelInstance = prefetchedRecords.pop(id, None)
+        if modelInstance is not None:
+            return modelInstance
+    filterDict = {primaryKeyName: id}
+    return modelClass.objects.filter(**filterDict).first()
+
+
+def __GetRequestData_oneRecord(screen, parameterModelMap, name, values, initDataFromDatabase, isTable, prefetchedRecords: dict = None):
     modelClassName = parameterModelMap[name]
     if modelClassName is None:
         return None
@@ -658,8 +653,7 @@ def __GetRequestData_oneRecord(screen, parameterModelMap, name, values, initData
     if initDataFromDatabase and primaryKeyName in values.keys() and not isNullBlank(values[primaryKeyName]) \
             and int(values[primaryKeyName]) > 0:
         id = int(values[primaryKeyName])
-        filterDict = {primaryKeyName: id}
-        modelInstance = modelClass.objects.filter(**filterDict).first()
+        modelInstance = __GetRequestData_getPrefetchedRecord(modelClass, primaryKeyName, id, prefetchedRecords)
         if modelInstance is None:
             raise IkValidateException('This record has been deleted. ID=%s' % id)
         isNewModelRecord = False
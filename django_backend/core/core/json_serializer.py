@@ -0,0 +1,232 @@
+'''
+    Model to json serializer for IkJsonResponse.
+
+    A serializer is built once per (model class, additional fields) and cached. It knows the model's columns, properties,
+    foreign key paths (e.g. "usr.usr_nm") and the select_related it needs, so serializing a queryset doesn't query the
+    foreign keys one by one.
+
+    The output is the same as the model instance json (Model.toJson() + properties + "__PK_" + additional fields):
+        1. QuerySet: read the rows by values_list() if the model json only has the model's columns (no properties, no annotations,
+           no deferred fields, no prefetch_related and no customized toJson/__init__/from_db). Foreign key paths are joined
+           in the same query.
+        2. Others: convert the model instances. Foreign key paths are loaded by select_related (QuerySet) or
+           prefetch_related_objects (model list).
+'''
+import datetime
+import decimal
+import logging
+import uuid
+from threading import Lock
+
+from django.db import models
+from django.db.models import prefetch_related_objects
+from django.db.models.query import ModelIterable, QuerySet
+from django.db.models.signals import post_init
+
+import core.db.model as ikDbModels
+
+logger = logging.getLogger('ikyo')
+
+
+def object2Str(value: object) -> str:
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    elif isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+    elif isinstance(value, datetime.time):
+        return value.strftime("%H:%M:%S")
+    elif isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+class ModelJsonSerializer():
+    def __init__(self, modelClass, additionalFields: tuple = None) -> None:
+        '''
+            modelClass (core.db.model.Model class): model class.
+            additionalFields (tuple): foreign key values (e.g. "usr.usr_nm") and attributes (e.g. "_isValid"). Reference to
+                core.db.model.FOREIGN_KEY_VALUE_FLAG and core.db.model.MODEL_PROPERTY_ATTRIBUTE_NAME_PREFIX
+        '''
+        opts = modelClass._meta
+        self.modelClass = modelClass
+        self.additionalFields = () if additionalFields is None else tuple(additionalFields)
+        # the fields converted by object2Str (not foreign keys)
+        self.__convertFieldNames = [f.name for f in opts.get_fields() if isinstance(f, models.Field) and not isinstance(f, models.ForeignKey)]
+        self.__propertyNames = [name for name, value in vars(modelClass).items() if isinstance(value, property)]
+        self.__pkName = None if opts.pk is None else opts.pk.name
+        self.__attNames = [f.attname for f in opts.concrete_fields]
+
+        # foreign key paths: {additional field name: values lookup}, e.g. {'usr.usr_nm': 'usr__usr_nm'}
+        self.__foreignKeyLookups = {}
+        selectRelated = set()
+        self.__hasAttributeFields = False
+        for name in self.additionalFields:
+            if ikDbModels.FOREIGN_KEY_VALUE_FLAG in name:
+                relatedPath, lookup = self.__getForeignKeyLookup(name)
+                if lookup is not None:
+                    self.__foreignKeyLookups[name] = lookup
+                if relatedPath is not None:
+                    selectRelated.add(relatedPath)
+            elif name.startswith(ikDbModels.MODEL_PROPERTY_ATTRIBUTE_NAME_PREFIX):
+                self.__hasAttributeFields = True
+        self.selectRelated = sorted(selectRelated)
+
+        self.__isValuesSupported = issubclass(modelClass, ikDbModels.Model) \
+            and modelClass.toJson is ikDbModels.Model.toJson \
+            and modelClass.__init__ is ikDbModels.Model.__init__ \
+            and modelClass.from_db.__func__ is ikDbModels.Model.from_db.__func__ \
+            and len(self.__propertyNames) == 0 \
+            and not self.__hasAttributeFields \
+            and all(name in self.__attNames for name in self.__convertFieldNames) \
+            and all(name in self.__foreignKeyLookups or name in self.__attNames for name in self.additionalFields)
+        self.__convertFieldIndexes = set(self.__attNames.index(name) for name in self.__convertFieldNames if name in self.__attNames)
+        self.__retrieveStatus = ikDbModels.ModelRecordStatus.RETRIEVE.value
+
+    def __getForeignKeyLookup(self, name: str) -> tuple:
+        '''
+            Return (select related path, values lookup). E.g. "expense.payee.payee" -> ("expense__payee", "expense__payee__payee").
+            The lookup is None if the last attribute is not a normal field.
+        '''
+        attributes = name.split('.')
+        modelClass = self.modelClass
+        for i, attr in enumerate(attributes):
+            try:
+                field = modelClass._meta.get_field(attr)
+            except Exception:
+                field = None
+            if field is None or not field.concrete:
+                return ('__'.join(attributes[:i]) if i > 0 else None), None
+            if i < len(attributes) - 1:
+                if not (field.many_to_one or field.one_to_one):
+                    return ('__'.join(attributes[:i]) if i > 0 else None), None
+                modelClass = field.related_model
+            elif field.is_relation:
+                return '__'.join(attributes[:i + 1]), None
+        return '__'.join(attributes[:-1]), '__'.join(attributes)
+
+    def isValuesSupported(self, queryset: QuerySet) -> bool:
+        '''
+            Return True if the queryset's model json can be read by values_list().
+        '''
+        query = queryset.query
+        return self.__isValuesSupported \
+            and queryset.model is self.modelClass \
+            and queryset._iterable_class is ModelIterable \
+            and queryset._result_cache is None \
+            and len(queryset._prefetch_related_lookups) == 0 \
+            and not query.annotations \
+            and not query.extra \
+            and not query.combinator \
+            and query.deferred_loading == (frozenset(), True) \
+            and not post_init.has_listeners(self.modelClass)
+
+    def serializeQuerySet(self, queryset: QuerySet) -> list:
+        if self.isValuesSupported(queryset):
+            return self.__serializeValues(queryset)
+        if len(self.selectRelated) > 0 and queryset._iterable_class is ModelIterable:
+            if queryset._result_cache is None:
+                queryset = queryset.select_related(*self.selectRelated)
+            else:
+                self.__prefetchForeignKeys(queryset._result_cache)
+        return [self.serializeModel(r) if isinstance(r, models.Model) else object2Str(r) for r in queryset]
+
+    def serializeModels(self, rcs: list) -> list:
+        '''
+            rcs: [self.modelClass]
+        '''
+        if len(self.selectRelated) > 0 and len(rcs) > 1:
+            self.__prefetchForeignKeys(rcs)
+        return [self.serializeModel(r) for r in rcs]
+
+    def __prefetchForeignKeys(self, rcs: list) -> None:
+        noPrefetchCacheRcs = [r for r in rcs if isinstance(r, models.Model) and '_prefetched_objects_cache' not in r.__dict__]
+        prefetch_related_objects([r for r in rcs if isinstance(r, models.Model)], *self.selectRelated)
+        # prefetch_related_objects adds an empty "_prefetched_objects_cache" to the records, it's not a part of the model json
+        for r in noPrefetchCacheRcs:
+            if not r.__dict__.get('_prefetched_objects_cache', True):
+                del r.__dict__['_prefetched_objects_cache']
+
+    def __serializeValues(self, queryset: QuerySet) -> list:
+        foreignKeyNames, foreignKeyLookups = [], []
+        for name in self.additionalFields:
+            if name in self.__foreignKeyLookups and name not in foreignKeyNames:
+                foreignKeyNames.append(name)
+                foreignKeyLookups.append(self.__foreignKeyLookups[name])
+        attNames = self.__attNames
+        convertFieldIndexes = self.__convertFieldIndexes
+        columnIndexes = range(len(attNames))
+        rs = []
+        for row in queryset.values_list(*attNames, *foreignKeyLookups):
+            d = {}
+            for i in columnIndexes:
+                value = row[i]
+                if i in convertFieldIndexes:
+                    value = object2Str(value)
+                if isinstance(value, uuid.UUID):
+                    value = str(value)
+                d[attNames[i]] = value
+            d[ikDbModels.MODEL_RECORD_DATA_STATUS_KEY_NAME] = self.__retrieveStatus
+            if self.__pkName is not None:
+                d['__PK_'] = self.__pkName
+            for i, name in enumerate(foreignKeyNames):
+                d[name] = object2Str(row[len(attNames) + i])
+            rs.append(d)
+        return rs
+
+    def serializeModel(self, r: models.Model) -> dict:
+        values = r.__dict__
+        for name in self.__convertFieldNames:
+            try:
+                values[name] = object2Str(values[name])
+            except Exception as e:
+                # this is not a model field or field is not a normal field. ignore it
+                logger.error(str(e))
+        d = r.toJson()
+        # add property values
+        for name in self.__propertyNames:
+            d[name] = object2Str(getattr(r, name))
+        if self.__pkName is not None:
+            d['__PK_'] = self.__pkName
+        for name in self.additionalFields:
+            if name not in d:
+                if ikDbModels.FOREIGN_KEY_VALUE_FLAG in name:
+                    d[name] = object2Str(self.__getForeignKeyValue(r, name))
+                elif name.startswith(ikDbModels.MODEL_PROPERTY_ATTRIBUTE_NAME_PREFIX):
+                    try:
+                        d[name] = object2Str(getattr(r, name, None))
+                    except Exception:
+                        logger.error('Get Model[%s] attribute [%s] failed.' % (type(r).__name__, name), exc_info=True)
+                else:
+                    logger.warning('Ignore get Model[%s] attribute [%s] failed.' % (type(r).__name__, name))
+        return d
+
+    def __getForeignKeyValue(self, r: models.Model, name: str) -> object:
+        value = r
+        for attr in name.split('.'):
+            if value:
+                try:
+                    value = getattr(value, attr)
+                except Exception as e:
+                    value = None
+                    if type(e).__name__ != 'RelatedObjectDoesNotExist':
+                        logger.error("Model [%s] does't have attr [%s]. Values=[%s]" % (type(r).__name__, attr, str(r)))
+            else:
+                value = None
+                break
+        return value
+
+
+__serializers = {}  # {(model class, additional fields): ModelJsonSerializer}
+__serializersLock = Lock()
+
+
+def getModelJsonSerializer(modelClass, additionalFields: list = None) -> ModelJsonSerializer:
+    key = (modelClass, () if additionalFields is None else tuple(additionalFields))
+    serializer = __serializers.get(key, None)
+    if serializer is None:
+        with __serializersLock:
+            serializer = __serializers.get(key, None)
+            if serializer is None:
+                serializer = ModelJsonSerializer(modelClass, key[1])
+                __serializers[key] = serializer
+    return serializer
@@ -1,21 +1,27 @@
+import base64
 import logging
 import os
-import smtplib
+import re
+import socket
 import threading
-import time
-from datetime import datetime
-from email.mime.application import MIMEApplication
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formataddr
 from threading import Lock
 
-from django.db import DatabaseError, transaction
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 
 import core.core.fs as ikfs
 import core.utils.django_utils as du
 from core.core.exception import IkException, IkValidateException
 from core.core.lang import Boolean2
+from core.core.smtp_pool import SMTP_POOL
 from core.models import Mail, MailAddr, MailAttch
 from core.sys.system_setting import SystemSetting
 from core.utils import str_utils, template_utils
@@ -120,6 +126,92 @@ def standardEmailAddress(emailAddress) -> EmailAddress:
 EMAIL_ADDRESS_FILTER = []
 
 
+def getAttachmentPath(file_path: str) -> str:
+    '''
+        file_path: an absolute path, or a path relative to the root folder.
+    '''
+    if ":" not in file_path and not file_path.startswith("/"):
+        return os.path.join(ikfs.getRootFolder(), file_path)
+    return file_path
+
+
+def getAttachmentSizeLimit() -> int | None:
+    '''
+        Max total attachment size of a mail in MB (system setting EMAIL_ATTACH_TOTAL_SIZE_LIMIT). None means no limit.
+    '''
+    limit = SystemSetting.get("EMAIL_ATTACH_TOTAL_SIZE_LIMIT")
+    return None if isNullBlank(limit) else int(limit)
+
+
+def checkAttachments(attachments: list[MailAttch]) -> str | None:
+    '''
+        Check the attachments before the SMTP transaction starts, they are read when the mail is sent.
+        Return the error message if an attachment file doesn't exist or the total size is more than the limit
+        (reference to getAttachmentSizeLimit), otherwise return None.
+    '''
+    if isNullBlank(attachments):
+        return None
+    total_size = 0
+    for attachment in attachments:
+        file_path = getAttachmentPath(attachment.file)
+        if not os.path.isfile(file_path):
+            return "Attachment [%s] does not exist." % attachment.file
+        total_size += os.path.getsize(file_path)
+    limit = getAttachmentSizeLimit()
+    if limit is not None and total_size > limit * 1024 * 1024:
+        return "The total attachment size can only be less than %s MB, total has %.2f MB." % (limit, total_size / (1024 * 1024))
+    return None
+
+
+class _MailMessage():
+    '''
+        A mail message which reads the attachments when it's sent.
+
+        The MIME message is generated with a placeholder for each attachment. When the message is iterated, the text is returned
+        and the attachment files are read and base64 encoded in chunks. So the memory doesn't depend on the attachment size.
+        It can be iterated more than once, reference to core.core.smtp_pool.SmtpConnectionPool.sendmail.
+    '''
+    # 57 bytes per base64 line (76 characters)
+    CHUNK_SIZE = 57 * 1024
+
+    def __init__(self, msg: MIMEMultipart) -> None:
+        self.msg = msg
+        self.__files = {}  # {placeholder: file path}
+
+    def attachFile(self, file_path: str) -> None:
+        placeholder = 'IKYO-ATTACHMENT-%s' % uuid.uuid4().hex
+        part = MIMEBase('application', 'octet-stream')
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(file_path))
+        part.set_payload(placeholder)
+        self.msg.attach(part)
+        self.__files[placeholder] = file_path
+
+    def as_string(self) -> str:
+        '''
+            The whole message, e.g. for a small mail or the tests.
+        '''
+        return b''.join(self).decode('utf-8')
+
+    def __iter__(self):
+        text = self.msg.as_string()
+        if len(self.__files) == 0:
+            yield text.encode('utf-8')
+            return
+        for i, item in enumerate(re.split('(%s)' % '|'.join(self.__files.keys()), text)):
+            if i % 2 == 0:  # text
+                if i > 0:
+                    item = item[1:]  # the base64 lines end with a new line
+                yield item.encode('utf-8')
+            else:
+                with open(self.__files[item], 'rb') as f:
+                    while True:
+                        data = f.read(self.CHUNK_SIZE)
+                        if not data:
+                            break
+                        yield base64.encodebytes(data)
+
+
 class _Mailer():
     def __init__(self) -> None:
         self.smtp_host = SystemSetting.get(name='SMTP Host', default=IkConfig.get("Email", "mail.smtp"))
@@ -141,17 +233,22 @@ class _Mailer():
         return EmailAddress(email=self.sender_address, name=self.sender_name)
 
     def _send(self, subject: str, content: str, to: list[EmailAddress], cc: list[EmailAddress], bcc: list[EmailAddress] = [], content_type='plain', attachments: list[MailAttch] = None,
-              smtp_account: str | None = None, smtp_password: str | None = None, sender_address: str | None = None, sender_name: str | None = None) -> tuple:
+              smtp_account: str | None = None, smtp_password: str | None = None, sender_address: str | None = None, sender_name: str | None = None,
+              timing: dict = None) -> tuple:
         '''
             contentType=plain / html. Default is plain
             to/cc/bcc/attachments: list
+            timing: dict, the send durations in milliseconds. Reference to core.core.smtp_pool.SmtpConnectionPool.sendmail
         '''
         if content_type not in ('plain', 'html'):
             raise IkException('Parameter [content_type] should be "plain" or "html".')
         if to is None or len(to) == 0:
             raise IkException('Parameter [to] is mandatory.')
+        attachment_error = checkAttachments(attachments)
+        if attachment_error is not None:
+            logger.error('Send email error:%s' % attachment_error)
+            return False, attachment_error
 
-        server = None
         try:
             # Get mail from address
             real_smtp_account = smtp_account or self.smtp_account
@@ -208,14 +305,11 @@ class _Mailer():
                 txt = MIMEText(content, 'plain', 'utf-8')
                 msg.attach(txt)
 
-            # attachments
+            # attachments: the files are read when the message is sent
+            message = _MailMessage(msg)
             if isNotNullBlank(attachments) and len(attachments) > 0:
                 for attachment in attachments:
-                    file_path = attachment.file
-                    file_name = os.path.basename(file_path)
-                    part = MIMEApplication(open(file_path, 'rb').read())
-                    part.add_header('Content-Disposition', 'attachment', filename=file_name)
-                    msg.attach(part)
+                    message.attachFile(getAttachmentPath(attachment.file))
             # attachments - end
 
             # message receivers
@@ -230,30 +324,13 @@ class _Mailer():
             if isNotNullBlank(bcc_list) and len(bcc_list) > 0:
                 to_list = to_list + bcc_list
 
-            # send
-            timeout = 30  # seconds
-            connect_exception = None
-            for i in range(2):
-                try:
-                    server = smtplib.SMTP_SSL(self.smtp_host, self.smtp_port, timeout=timeout) if self.smtp_use_ssl else smtplib.SMTP(
-                        self.smtp_host, self.smtp_port, timeout=timeout)
-                    connect_exception = None
-                except Exception as e:
-                    connect_exception = e
-                    time.sleep(3)
-            if connect_exception is not None:
-                raise connect_exception
-            # server.ehlo()
-            # server.starttls()
-            server.login(real_smtp_account, real_smtp_password)
-            server.sendmail(msg['From'], to_list, msg.as_string())
+            # send by a pooled connection, the connection has logged in
+            SMTP_POOL.sendmail(self.smtp_host, self.smtp_port, self.smtp_use_ssl, real_smtp_account, real_smtp_password,
+                               msg['From'], to_list, message, timing=timing)
             return True, "sent"
         except Exception as e:
             logger.error('Send email error:%s' % str(e))
             return False, str(e)
-        finally:
-            if server is not None:
-                server.close()
 
 
 Mailer = None
@@ -268,91 +345,182 @@ class __MailManager:
 
     Only allow to create one instance.
 
+    The queue mails are claimed in batches by one "UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED LIMIT n)"
+    statement: the claimed mails are set to in_progress with a claim ID, so several processes can send the queue in
+    parallel and a mail is sent by one process only. A mail claimed by a dead process is claimed again after
+    [mail.sender.claimTimeout] seconds.
+
+    If a mail is sent failed, it's retried after [mail.sender.retryInterval] seconds, and the interval is doubled for each
+    attempt ([mail.sender.maxRetryInterval] at most). The attempts are saved in the mail, and the mail status is set to
+    error after SEND_FAILED_RETRY_TIMES attempts.
+
+    If there is no mail to send, the queue is checked again after 1 second, and the interval is doubled each time until
+    [mail.sender.maxIdleInterval] seconds. A new queue mail saved by this process wakes up the sender at once.
     """
     SEND_FAILED_RETRY_TIMES = 5
-
-    def __init__(self) -> None:
-        self.__senderThread = threading.Thread(target=self.__sendMailFromDB, args=())
-        self.__senderThread.start()
+    # the number of threads to send the queue mails
+    SENDER_WORKERS = max(1, int(IkConfig.get("Email", "mail.sender.workers", 4)))
+    # seconds
+    CLAIM_TIMEOUT = float(IkConfig.get("Email", "mail.sender.claimTimeout", 600))
+    RETRY_INTERVAL = float(IkConfig.get("Email", "mail.sender.retryInterval", 30))
+    MAX_RETRY_INTERVAL = float(IkConfig.get("Email", "mail.sender.maxRetryInterval", 3600))
+    MIN_IDLE_INTERVAL = 1
+    MAX_IDLE_INTERVAL = max(MIN_IDLE_INTERVAL, float(IkConfig.get("Email", "mail.sender.maxIdleInterval", 30)))
+
+    def __init__(self, startSender: bool = True) -> None:
+        '''
+            startSender (bool): start the thread to send the queue mails.
+        '''
         self.__queueLock = Lock()
-        self.attempts_counter = {}
+        self.__claimer = '%s:%s' % (socket.gethostname(), os.getpid())
+        self.__sendingMailIDs = set()  # the mails submitted to the sender workers
+        self.__sendingLock = Lock()
+        self.__wakeEvent = threading.Event()  # a mail is sent or queued
+        self.__senderWorkers = ThreadPoolExecutor(max_workers=self.SENDER_WORKERS, thread_name_prefix='ikMailSender')
+        self.__senderThread = threading.Thread(target=self.__sendMailFromDB, args=())
+        if startSender:
+            self.__senderThread.start()
 
     # send email
 
     def __sendEmail(self, mail: Mail, to_addresses: list[EmailAddress], cc_addresses: list[EmailAddress], bcc_addresses: list[EmailAddress] = None, attachments: list[MailAttch] = None,
-                    smtp_account: str | None = None, smtp_password: str | None = None, sender_address: str | None = None, sender_name: str | None = None,) -> tuple:
+                    smtp_account: str | None = None, smtp_password: str | None = None, sender_address: str | None = None, sender_name: str | None = None,
+                    timing: dict = None) -> tuple:
         if isNullBlank(to_addresses):
             return False, "No receiver found."
 
         is_success, message = _Mailer()._send(subject=mail.subject, content=mail.content, to=to_addresses, cc=cc_addresses, bcc=bcc_addresses,
                                               content_type=mail.type if mail.type == "html" else "plain", attachments=attachments,
-                                              smtp_account=smtp_account, smtp_password=smtp_password, sender_address=sender_address, sender_name=sender_name)
+                                              smtp_account=smtp_account, smtp_password=smtp_password, sender_address=sender_address, sender_name=sender_name,
+                                              timing=timing)
         return is_success, message
 
+    def __wakeSender(self) -> None:
+        self.__wakeEvent.set()
+
     # check email database
     def __sendMailFromDB(self) -> None:
-        """Method to continuously check the database and send pending emails."""
+        """Method to continuously claim the queue mails and dispatch them to the sender workers."""
+        idle_interval = self.MIN_IDLE_INTERVAL
         while True:
-            # get all pending status email
-            pending_mails = Mail.objects.filter(sts__in=[Mail.STATUS_PENDING, Mail.STATUS_IN_PROGRESS]).order_by("id")
-
-            if isNullBlank(pending_mails) or len(pending_mails) == 0:
-                # if no pending status email, sleep 1m
-                # logger.info("No pending emails to send. Sleeping for 1 second.")
-                time.sleep(1)
-                continue
+            # claim 2 mails per worker at most, so the new mails are sent in time.
+            with self.__sendingLock:
+                limit = self.SENDER_WORKERS * 2 - len(self.__sendingMailIDs)
+            claimed_mails = []
+            if limit > 0:
+                try:
+                    claimed_mails = self.__claimMails(limit)
+                except Exception as e:
+                    logger.error("Claim queue emails failed: %s" % str(e))
+                finally:
+                    close_old_connections()
+            for claimed_mail in claimed_mails:
+                with self.__sendingLock:
+                    self.__sendingMailIDs.add(claimed_mail[1].id)
+                self.__senderWorkers.submit(self.__sendClaimedMail, *claimed_mail)
+
+            # check again after a worker has sent a mail, or a new mail is queued. Back off if the queue is empty.
+            with self.__sendingLock:
+                is_sending = len(self.__sendingMailIDs) > 0
+            if len(claimed_mails) > 0 or is_sending:
+                idle_interval = self.MIN_IDLE_INTERVAL
+                wait_seconds = self.MIN_IDLE_INTERVAL
+            else:
+                wait_seconds = idle_interval
+                idle_interval = min(idle_interval * 2, self.MAX_IDLE_INTERVAL)
+            if self.__wakeEvent.wait(wait_seconds):
+                idle_interval = self.MIN_IDLE_INTERVAL
+            self.__wakeEvent.clear()
+
+    def __claimMails(self, limit: int) -> list[tuple]:
+        """Claim [limit] queue mails at most. The receivers and attachments are loaded with one query each.
+
+        Returns:
+            [(claim ID, mail, to addresses, cc addresses, bcc addresses, attachments)]
+        """
+        now = timezone.now()
+        claim_id = ('%s:%s' % (uuid.uuid4().hex, self.__claimer))[:100]  # Mail.claimed_by max length
+        claimable = (Q(sts=Mail.STATUS_PENDING) & (Q(next_attempt_ts__isnull=True) | Q(next_attempt_ts__lte=now))) \
+            | (Q(sts=Mail.STATUS_IN_PROGRESS) & (Q(claim_ts__isnull=True) | Q(claim_ts__lt=now - timedelta(seconds=self.CLAIM_TIMEOUT))))
+        with transaction.atomic():
+            claim_ids = Mail.objects.select_for_update(skip_locked=True).filter(claimable).order_by('id').values('id')[:limit]
+            total = Mail.objects.filter(id__in=claim_ids).update(sts=Mail.STATUS_IN_PROGRESS, claimed_by=claim_id, claim_ts=now,
+                                                                 version_no=F('version_no') + 1)
+        if total == 0:
+            return []
+        mails = list(Mail.objects.filter(claimed_by=claim_id).order_by('id'))
+        mail_ids = [mail.id for mail in mails]
+        addresses = {}  # {mail ID: {type: [EmailAddress]}}
+        for mail_addr in MailAddr.objects.filter(mail_id__in=mail_ids).order_by('mail_id', 'seq'):
+            addresses.setdefault(mail_addr.mail_id, {}).setdefault(mail_addr.type, []).append(EmailAddress(email=mail_addr.address, name=mail_addr.name))
+        attachments = {}  # {mail ID: [MailAttch]}
+        for mail_attch in MailAttch.objects.filter(mail_id__in=mail_ids).order_by('mail_id', 'seq'):
+            attachments.setdefault(mail_attch.mail_id, []).append(mail_attch)
+        claimed_mails = []
+        for mail in mails:
+            mail_addresses = addresses.get(mail.id, {})
+            claimed_mails.append((claim_id, mail, mail_addresses.get(MailAddr.TYPE_TO, []), mail_addresses.get(MailAddr.TYPE_CC, []),
+                                  mail_addresses.get(MailAddr.TYPE_BCC, []), attachments.get(mail.id, [])))
+        logger.debug("Claimed %s queue emails: %s" % (len(mail_ids), mail_ids))
+        return claimed_mails
+
+    def __updateClaimedMail(self, claim_id: str, mail: Mail, **values) -> bool:
+        # the mail is not updated if it has been claimed by another sender (claim timeout)
+        return Mail.objects.filter(id=mail.id, claimed_by=claim_id).update(claimed_by=None, claim_ts=None, version_no=F('version_no') + 1, **values) == 1
+
+    def __sendClaimedMail(self, claim_id: str, mail: Mail, to_addresses: list[EmailAddress], cc_addresses: list[EmailAddress],
+                          bcc_addresses: list[EmailAddress], attachments: list[MailAttch]) -> None:
+        """Sender worker: send a claimed email."""
+        try:
+            if len(to_addresses) == 0:
+                logger.debug("Mail ID [%s] no receiver." % mail.id)
+                self.__updateClaimedMail(claim_id, mail, sts=Mail.STATUS_ERROR, error="No receiver found.")
+                return
+            attachment_error = checkAttachments(attachments)
+            if attachment_error is not None:
+                # don't retry
+                logger.error("Mail ID [%s] %s" % (mail.id, attachment_error))
+                self.__updateClaimedMail(claim_id, mail, sts=Mail.STATUS_ERROR, error=attachment_error)
+                return
+
+            send_ts = datetime.now()
+            timing = {}
+            is_success, message = self.__sendEmail(mail=mail, to_addresses=to_addresses, cc_addresses=cc_addresses, bcc_addresses=bcc_addresses,
+                                                   attachments=attachments, timing=timing)
+            end_time = datetime.now()
+
+            # update mail status
+            if is_success:
+                duration = round((end_time - send_ts).total_seconds() * 1000)
+                self.__updateClaimedMail(claim_id, mail, sts=Mail.STATUS_COMPLETE, send_ts=send_ts, duration=duration, error=None, next_attempt_ts=None)
+                logger.info(f"Email ID [{mail.id}] sent successfully takes {duration} ms "
+                            f"(wait connection {timing.get('wait')} ms, connect {timing.get('connect')} ms, send {timing.get('send')} ms).")
+            else:
+                attempts = mail.attempts + 1
+                logger.warning(f"Email ID [{mail.id}] sent {attempts} times failed: {message}")
+                if attempts < self.SEND_FAILED_RETRY_TIMES:
+                    retry_interval = min(self.RETRY_INTERVAL * 2 ** (attempts - 1), self.MAX_RETRY_INTERVAL)
+                    self.__updateClaimedMail(claim_id, mail, sts=Mail.STATUS_PENDING, attempts=attempts, error=message,
+                                             next_attempt_ts=timezone.now() + timedelta(seconds=retry_interval))
+                else:
+                    self.__updateClaimedMail(claim_id, mail, sts=Mail.STATUS_ERROR, attempts=attempts, error=message, send_ts=None, next_attempt_ts=None)
+        except Exception as e:
+            logger.error("Send email ID [%s] failed: %s" % (mail.id, str(e)), exc_info=True)
+        finally:
+            close_old_connections()
+            with self.__sendingLock:
+                self.__sendingMailIDs.discard(mail.id)
+            self.__wakeEvent.set()
 
-            for mail in pending_mails:
-                with transaction.atomic():
-                    mail = Mail.objects.select_for_update().get(id=mail.id)
-                    if mail.sts not in [Mail.STATUS_PENDING, Mail.STATUS_IN_PROGRESS]:
-                        continue
-
-                    # get receivers
-                    to_addresses = []
-                    cc_addresses = []
-                    bcc_addresses = []
-                    for mail_addr in MailAddr.objects.filter(mail=mail, type=MailAddr.TYPE_TO).order_by("seq"):
-                        to_addresses.append(EmailAddress(email=mail_addr.address, name=mail_addr.name))
-                    for mail_addr in MailAddr.objects.filter(mail=mail, type=MailAddr.TYPE_CC).order_by("seq"):
-                        cc_addresses.append(EmailAddress(email=mail_addr.address, name=mail_addr.name))
-                    for mail_addr in MailAddr.objects.filter(mail=mail, type=MailAddr.TYPE_BCC).order_by("seq"):
-                        bcc_addresses.append(EmailAddress(email=mail_addr.address, name=mail_addr.name))
-
-                    if isNullBlank(to_addresses) or len(to_addresses) == 0:
-                        logger.debug("Mail ID [%s] no receiver." % mail.id)
-                        return
-
-                    # get Attachments
-                    mail_attchs = MailAttch.objects.filter(mail=mail).order_by("seq")
-
-                    # send email start
-                    mail.send_ts = datetime.now()
-                    # save status to in_progress
-                    mail.sts = Mail.STATUS_IN_PROGRESS
-                    mail.duration = None
-                    mail.save()
-                    is_success, message = self.__sendEmail(mail=mail, to_addresses=to_addresses, cc_addresses=cc_addresses, bcc_addresses=bcc_addresses, attachments=mail_attchs)
-                    end_time = datetime.now()
-
-                    # update mail status
-                    if is_success:
-                        mail.sts = Mail.STATUS_COMPLETE
-                        mail.duration = round((end_time - mail.send_ts).total_seconds() * 1000)
-                        mail.save()
-                        logger.info(f"Email ID [{mail.id}] sent successfully takes {mail.duration} ms.")
-                        self.attempts_counter.pop(mail.id, None)
-                    else:
-                        logger.warning(f"Email ID [{mail.id}] sent {self.attempts_counter.get(mail.id, 1)} times failed: {message}")
-                        if self.attempts_counter.get(mail.id, 1) < self.SEND_FAILED_RETRY_TIMES:
-                            # if send failed, attempts counter = 1
-                            self.attempts_counter.update({mail.id: self.attempts_counter.get(mail.id, 1) + 1})
-                        else:
-                            mail.send_ts = None
-                            mail.sts = Mail.STATUS_ERROR
-                            mail.error = message
-                            mail.save()
-                            self.attempts_counter.pop(mail.id, None)
+    def sendQueueMails(self, limit: int = None) -> int:
+        '''
+            Claim the queue mails ([limit] mails at most, default to 2 mails per sender worker) and send them in the
+            current thread. Return the number of the claimed mails. E.g. for a command or the tests.
+        '''
+        claimed_mails = self.__claimMails(self.SENDER_WORKERS * 2 if limit is None else limit)
+        for claimed_mail in claimed_mails:
+            self.__sendClaimedMail(*claimed_mail)
+        return len(claimed_mails)
 
     # API 1: send email & save result
     def send(self, sender, subject, to, cc=None, bcc=None, content=None, template_file=None, template_parameter=None, description=None, attachments=None,
@@ -768,6 +936,8 @@ class __MailManager:
                     dsc=description
                 )
                 mail_record.save()
+                # the mail is queued, don't wait for the sender's idle interval
+                transaction.on_commit(self.__wakeSender)
 
                 # create MailAddr to records
                 for idx, email_addr in enumerate(to_dict_list):
@@ -805,14 +975,8 @@ class __MailManager:
                     mail_attchs = []
                     if not isinstance(attachments, list):
                         attachments = [attachments]
-                    import core.core.fs as ikfs
                     for idx, file_path in enumerate(attachments):
-                        ab_file_path = file_path  # 1. attachments is abstract path
-                        # 2. attachments is relative path
-                        if ":" not in file_path and not file_path.startswith("/"):
-                            ab_file_path = os.path.join(ikfs.getRootFolder(), file_path)
-
-                        file_size = os.path.getsize(ab_file_path)
+                        file_size = os.path.getsize(getAttachmentPath(file_path))
                         mail_attchs.append(MailAttch.objects.create(
                             mail=mail_record,
                             file=file_path,
@@ -833,7 +997,7 @@ class __MailManager:
             self.__queueLock.release()
 
     def __newMailAndAttchs(self, sender, subject, content, type, sts, queue, dsc=None, attachments=None) -> tuple:
-        attch_limit_size = None if isNullBlank(SystemSetting.get("EMAIL_ATTACH_TOTAL_SIZE_LIMIT")) else int(SystemSetting.get("EMAIL_ATTACH_TOTAL_SIZE_LIMIT"))
+        attch_limit_size = getAttachmentSizeLimit()
         mail_record = Mail(
             sender=sender,
             request_ts=datetime.now(),
@@ -852,12 +1016,7 @@ class __MailManager:
                 attachments = [attachments]
             total_file_size = 0
             for idx, file_path in enumerate(attachments):
-                ab_file_path = file_path  # 1. attachments is abstract path
-                # 2. attachments is relative path
-                if ":" not in file_path and not file_path.startswith("/"):
-                    ab_file_path = os.path.join(ikfs.getRootFolder(), file_path)
-
-                file_size = os.path.getsize(ab_file_path)
+                file_size = os.path.getsize(getAttachmentPath(file_path))
                 total_file_size += file_size
                 mail_attchs.append(MailAttch(
                     mail=mail_record,
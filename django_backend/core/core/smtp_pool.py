@@ -0,0 +1,287 @@
+'''
+    SMTP connection pool.
+
+    The connections are pooled by (SMTP host, port, SSL, account, password hash). The password is not kept in the pool. A connection
+    logs in once and it's reused by the next mails:
+        1. An idle connection is closed after [idleTimeout] seconds.
+        2. An idle connection is checked by NOOP before it's reused if it's idle more than [checkInterval] seconds. A broken connection
+           is closed and a new connection is opened.
+        3. A pool key has [maxSize] connections at most. The caller waits for a free connection if all of them are in use.
+
+    The message can be an iterable of bytes chunks, e.g. core.core.mailer._MailMessage. The chunks are written to the socket one by one
+    (DATA command), so a large message is not loaded into memory.
+
+    A reused connection can be closed by the server while it's idle. The mail is sent again by a new connection only if the connection
+    is closed before the server accepts the DATA command. After that the server may have received the mail, so it's not sent again.
+
+    The default pool (SMTP_POOL) reads the settings from [Email] section in config.ini.
+'''
+import atexit
+import hashlib
+import logging
+import os
+import re
+import smtplib
+import threading
+import time
+
+from core.utils.lang_utils import isNotNullBlank
+from iktools import IkConfig
+
+logger = logging.getLogger('ikyo')
+
+
+class _SmtpConnection():
+    def __init__(self, key: tuple, server: smtplib.SMTP) -> None:
+        self.key = key
+        self.server = server
+        self.lastUsedTime = time.monotonic()
+        self.isReused = False
+        self.isDataStarted = False  # the server accepted the DATA command of the current mail
+
+
+class SmtpConnectionPool():
+    def __init__(self, maxSize: int = 4, idleTimeout: float = 60, checkInterval: float = 5, timeout: float = 30,
+                 connectRetryTimes: int = 1, connectRetryDelay: float = 3) -> None:
+        '''
+            maxSize (int): max connections of a pool key (SMTP host, port, SSL, account and password hash).
+            idleTimeout (float): close the connection if it's idle more than [idleTimeout] seconds.
+            checkInterval (float): check the connection by NOOP before reuse it if it's idle more than [checkInterval] seconds.
+            timeout (float): SMTP socket timeout in seconds.
+            connectRetryTimes (int): retry times if connect to the SMTP server failed.
+            connectRetryDelay (float): seconds to wait before retry to connect.
+        '''
+        self.maxSize = max(1, maxSize)
+        self.idleTimeout = idleTimeout
+        self.checkInterval = checkInterval
+        self.timeout = timeout
+        self.connectRetryTimes = connectRetryTimes
+        self.connectRetryDelay = connectRetryDelay
+        self.__idleConnections = {}  # {key: [_SmtpConnection]}, the last one is the latest used connection
+        self.__openCounts = {}  # {key: opened connections (idle and in use)}
+        self.__condition = threading.Condition()
+        self.__keySalt = os.urandom(16)
+        self.__counters = {'created': 0, 'reused': 0, 'closed': 0, 'broken': 0, 'sent': 0, 'failed': 0}
+
+    def sendmail(self, host: str, port: int, useSSL: bool, account: str, password: str, fromAddr: str, toAddrs: list, message,
+                 timing: dict = None) -> dict:
+        '''
+            Send the mail by a pooled connection. Return the refused recipients (smtplib.SMTP.sendmail).
+
+            message (str | bytes | iterable): the message, or an iterable of bytes chunks. Each chunk should start at the beginning of
+                a line. The iterable is iterated again if the mail is sent again by a new connection.
+
+            A reused connection maybe closed by the server. If it's closed before the server accepts the DATA command, the mail is
+            sent again by a new connection.
+
+            timing (dict): set the durations in milliseconds: "wait" (get a free connection and the health check),
+                "connect" (connect and login, 0 if the connection is reused), "send" and "total". And "reused" (bool).
+        '''
+        startTime = time.perf_counter()
+        if timing is None:
+            timing = {}
+        key = (host, port, useSSL, account, self.__hashPassword(password))
+        if isinstance(message, str):
+            message = message.encode('ascii')  # smtplib.SMTP.sendmail
+        if isinstance(message, bytes):
+            message = [message]
+        for i in range(2):
+            conn = self.__acquire(key, password, timing)
+            sendStartTime = time.perf_counter()
+            try:
+                refused = self.__sendStream(conn, fromAddr, toAddrs, message)
+            except smtplib.SMTPServerDisconnected:
+                self.__release(conn, isBroken=True)
+                if i == 0 and conn.isReused and not conn.isDataStarted:
+                    logger.debug('SMTP connection to %s:%s is closed by the server, send the mail by a new connection.' % (host, port))
+                    continue
+                self.__count('failed')
+                raise
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+                # the server rejected the mail, smtplib has reset the session, so the connection can be reused
+                self.__release(conn)
+                self.__count('failed')
+                raise
+            except Exception:
+                self.__release(conn, isBroken=True)
+                self.__count('failed')
+                raise
+            timing['send'] = round((time.perf_counter() - sendStartTime) * 1000, 3)
+            timing['total'] = round((time.perf_counter() - startTime) * 1000, 3)
+            self.__release(conn)
+            self.__count('sent')
+            return refused
+
+    def closeIdleConnections(self, closeAll: bool = False) -> int:
+        '''
+            Close the connections idle more than [idleTimeout] seconds. Close all idle connections if [closeAll] is True.
+            Return the number of closed connections.
+        '''
+        now = time.monotonic()
+        expiredConnections = []
+        with self.__condition:
+            for key, connections in self.__idleConnections.items():
+                expired = [conn for conn in connections if closeAll or now - conn.lastUsedTime > self.idleTimeout]
+                if len(expired) > 0:
+                    connections[:] = [conn for conn in connections if conn not in expired]
+                    self.__openCounts[key] -= len(expired)
+                    expiredConnections.extend(expired)
+            if len(expiredConnections) > 0:
+                self.__condition.notify_all()
+        for conn in expiredConnections:
+            self.__close(conn)
+        return len(expiredConnections)
+
+    def getCounters(self) -> dict:
+        '''
+            Return {"created", "reused", "closed", "broken", "sent", "failed", "open", "idle"}.
+        '''
+        with self.__condition:
+            counters = dict(self.__counters)
+            counters['open'] = sum(self.__openCounts.values())
+            counters['idle'] = sum(len(connections) for connections in self.__idleConnections.values())
+        return counters
+
+    def __hashPassword(self, password: str) -> str:
+        return None if password is None else hashlib.sha256(self.__keySalt + password.encode('utf-8')).hexdigest()
+
+    def __acquire(self, key: tuple, password: str, timing: dict) -> _SmtpConnection:
+        startTime = time.perf_counter()
+        self.closeIdleConnections()
+        conn = None
+        with self.__condition:
+            while True:
+                connections = self.__idleConnections.get(key, None)
+                if connections:
+                    conn = connections.pop()
+                    break
+                if self.__openCounts.get(key, 0) < self.maxSize:
+                    self.__openCounts[key] = self.__openCounts.get(key, 0) + 1
+                    break
+                self.__condition.wait()
+        if conn is not None:
+            if time.monotonic() - conn.lastUsedTime <= self.checkInterval or self.__isAlive(conn):
+                conn.isReused = True
+                self.__count('reused')
+                timing['wait'] = round((time.perf_counter() - startTime) * 1000, 3)
+                timing['connect'] = 0
+                timing['reused'] = True
+                return conn
+            # the connection is broken, open a new connection in its place
+            self.__close(conn, isBroken=True)
+
+        timing['wait'] = round((time.perf_counter() - startTime) * 1000, 3)
+        connectStartTime = time.perf_counter()
+        try:
+            conn = _SmtpConnection(key, self.__connect(key, password))
+        except Exception:
+            with self.__condition:
+                self.__openCounts[key] -= 1
+                self.__condition.notify()
+            raise
+        self.__count('created')
+        timing['connect'] = round((time.perf_counter() - connectStartTime) * 1000, 3)
+        timing['reused'] = False
+        return conn
+
+    def __release(self, conn: _SmtpConnection, isBroken: bool = False) -> None:
+        with self.__condition:
+            if isBroken:
+                self.__openCounts[conn.key] -= 1
+            else:
+                conn.lastUsedTime = time.monotonic()
+                self.__idleConnections.setdefault(conn.key, []).append(conn)
+            self.__condition.notify()
+        if isBroken:
+            self.__close(conn, isBroken=True)
+
+    def __connect(self, key: tuple, password: str) -> smtplib.SMTP:
+        host, port, useSSL, account, _ = key
+        for i in range(self.connectRetryTimes + 1):
+            try:
+                server = smtplib.SMTP_SSL(host, port, timeout=self.timeout) if useSSL else smtplib.SMTP(host, port, timeout=self.timeout)
+                break
+            except Exception:
+                if i == self.connectRetryTimes:
+                    raise
+                time.sleep(self.connectRetryDelay)
+        try:
+            if isNotNullBlank(account):
+                server.login(account, password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def __sendStream(self, conn: _SmtpConnection, fromAddr: str, toAddrs: list, message) -> dict:
+        '''
+            smtplib.SMTP.sendmail for a message of bytes chunks: the chunks are written to the socket after the DATA command.
+        '''
+        server = conn.server
+        conn.isDataStarted = False
+        server.ehlo_or_helo_if_needed()
+        code, resp = server.mail(fromAddr)
+        if code != 250:
+            self.__reset(server)
+            raise smtplib.SMTPSenderRefused(code, resp, fromAddr)
+        if isinstance(toAddrs, str):
+            toAddrs = [toAddrs]
+        refused = {}
+        for toAddr in toAddrs:
+            code, resp = server.rcpt(toAddr)
+            if code not in (250, 251):
+                refused[toAddr] = (code, resp)
+        if len(refused) == len(toAddrs):
+            self.__reset(server)
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, resp = server.docmd('data')
+        if code != 354:
+            self.__reset(server)
+            raise smtplib.SMTPDataError(code, resp)
+        conn.isDataStarted = True
+        isLineEnd = True
+        for chunk in message:
+            if len(chunk) == 0:
+                continue
+            # CRLF line ends, and the leading dot of a line is doubled (smtplib.quotedata)
+            chunk = re.sub(rb'(?m)^\.', b'..', re.sub(rb'(?:\r\n|\n|\r(?!\n))', b'\r\n', chunk))
+            server.send(chunk)
+            isLineEnd = chunk.endswith(b'\r\n')
+        server.send(b'.\r\n' if isLineEnd else b'\r\n.\r\n')
+        code, resp = server.getreply()
+        if code != 250:
+            self.__reset(server)
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    def __reset(self, server: smtplib.SMTP) -> None:
+        try:
+            server.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    def __isAlive(self, conn: _SmtpConnection) -> bool:
+        try:
+            return conn.server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def __close(self, conn: _SmtpConnection, isBroken: bool = False) -> None:
+        self.__count('broken' if isBroken else 'closed')
+        try:
+            if isBroken:
+                conn.server.close()
+            else:
+                conn.server.quit()
+        except Exception:
+            conn.server.close()
+
+    def __count(self, name: str) -> None:
+        with self.__condition:
+            self.__counters[name] += 1
+
+
+SMTP_POOL = SmtpConnectionPool(maxSize=int(IkConfig.get('Email', 'mail.smtp.pool.size', 4)),
+                               idleTimeout=float(IkConfig.get('Email', 'mail.smtp.pool.idleTimeout', 60)),
+                               checkInterval=float(IkConfig.get('Email', 'mail.smtp.pool.checkInterval', 5)))
+atexit.register(SMTP_POOL.closeIdleConnections, closeAll=True)
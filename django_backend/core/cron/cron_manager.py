@@ -19,23 +19,183 @@ APS Scheduler
         timezone (datetime.tzinfo|str) - time zone to use for the date/time calculations (defaults to scheduler timezone)
         jitter (int|None) - delay the job execution by jitter seconds at most
 
+Multiple processes (web workers or hosts):
+    Every process starts a scheduler, but only the process which holds the scheduler lease (ik_cron_lease) loads and
+    runs the jobs, so each job fires once across all the processes. The lease holder renews the lease every
+    [cronRefreshInterval] seconds. If it stops or dies, another process takes over the lease after [cronLeaseTimeout]
+    seconds, and the fire times in between are missed. A job is not run if the lease has expired locally (e.g. the
+    renewal failed), so the server clocks should be synchronized and the lease timeout should be much longer than the
+    clock difference.
+
+    The lease holder checks the jobs version (count, max ID, sum of version_no and max mod_dt of ik_cron_job) every
+    [cronRefreshInterval] seconds, and reloads the jobs only if it's changed. Call refresh() to reload them now.
+
+Run history (ik_cron_job_run):
+    Each run is saved with the scheduled time, start and end time, duration, outcome and host/pid by a background
+    writer. The outcomes are success, error, skipped (the job's max_instances runs are still running, empty means 1)
+    and missed (not started in the misfire grace time, e.g. the scheduler was too busy). The lease holder deletes the
+    runs older than [cronRunHistoryDays] days, and keeps [cronRunHistoryMaxRows] runs per job at most, once an hour.
+    get_run_stats() returns the duration percentiles per job.
+
 '''
 
+import os
 import time
+import uuid
+import socket
 import logging
+import traceback
 from typing import Optional
 from importlib import import_module
-from datetime import datetime
-from threading import Lock, Thread
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.job import Job
-from ..models import CronJob
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+from iktools import IkConfig
+from ..db.bulk_writer import BulkWriter
+from ..log.profiler import percentile
+from ..models import CronJob, CronJobRun, CronLease
 
 logger = logging.getLogger(__name__)
-REFRESH_JOB_INTERVAL = 10
+REFRESH_JOB_INTERVAL = float(IkConfig.get('System', 'cronRefreshInterval', 10))
+'''
+    Check the jobs version and renew the scheduler lease interval in second(s). Default is 10 seconds.
+'''
+LEASE_TIMEOUT = float(IkConfig.get('System', 'cronLeaseTimeout', 30))
+'''
+    Scheduler lease timeout in second(s). It should be longer than the refresh interval. Default is 30 seconds.
+'''
+SCHEDULER_LEASE_NAME = 'scheduler'
+RUN_HISTORY_DAYS = float(IkConfig.get('System', 'cronRunHistoryDays', 30))
+'''
+    Delete the run history older than it. Default is 30 days.
+'''
+RUN_HISTORY_MAX_ROWS = int(IkConfig.get('System', 'cronRunHistoryMaxRows', 10000))
 '''
-    Refresh database tasks interval in second(s). Default is 10 seconds.
+    Max run history records per job. Default is 10000.
 '''
+RUN_HISTORY_CLEAN_INTERVAL = 3600
+'''
+    Clean the run history interval in second(s).
+'''
+__runHistoryWriter = BulkWriter('Cron Run History Writer', CronJobRun, batchSize=100, flushInterval=1.0, maxPendingSize=10000)
+
+
+def _now() -> datetime:
+    return timezone.now() if settings.USE_TZ else datetime.now()
+
+
+def acquire_lease(lease_name: str, owner: str, timeout: float) -> bool:
+    '''
+        Acquire or renew a lease in one statement. Return True if [owner] holds the lease for [timeout] seconds.
+    '''
+    now = _now()
+    expire_dt = now + timedelta(seconds=timeout)
+    if CronLease.objects.filter(Q(owner=owner) | Q(expire_dt__lt=now), lease_nm=lease_name).update(
+            owner=owner, expire_dt=expire_dt) == 1:
+        return True
+    if CronLease.objects.filter(lease_nm=lease_name).exists():
+        return False
+    try:
+        with transaction.atomic():
+            CronLease.objects.create(lease_nm=lease_name, owner=owner, expire_dt=expire_dt)
+        return True
+    except IntegrityError:
+        return False  # created by another process
+
+
+def release_lease(lease_name: str, owner: str) -> bool:
+    '''
+        Release the lease if [owner] holds it, so another process can take it over now.
+    '''
+    return CronLease.objects.filter(lease_nm=lease_name, owner=owner).update(expire_dt=_now() - timedelta(seconds=1)) == 1
+
+
+def _to_db_datetime(dt: datetime) -> datetime:
+    '''
+        APScheduler's datetime has time zone. It's converted to the local time if the database doesn't use time zone.
+    '''
+    if dt is None or settings.USE_TZ:
+        return dt
+    return dt.astimezone().replace(tzinfo=None)
+
+
+def add_run_history(cron_job_id: int, task: str, outcome: str, scheduled_dt: datetime = None, start_dt: datetime = None,
+                    end_dt: datetime = None, duration: float = None, error: str = None) -> None:
+    '''
+        Add a run history record. It's written by a background writer. duration: milliseconds.
+    '''
+    rc = CronJobRun(cron_job_id=cron_job_id, task=task, outcome=outcome, scheduled_dt=_to_db_datetime(scheduled_dt),
+                    start_dt=start_dt, end_dt=end_dt, duration=duration, error=error, host=socket.gethostname(), pid=os.getpid())
+    if not __runHistoryWriter.add(rc):
+        logger.warning('Cron run history buffer is full. ID=%s, Task=%s, outcome=%s is dropped.' % (cron_job_id, task, outcome))
+
+
+def flush_run_history() -> int:
+    '''
+        Write the buffered run history now. Return the total written records.
+    '''
+    return __runHistoryWriter.flush()
+
+
+def clean_run_history(days: float = None, max_rows: int = None) -> int:
+    '''
+        Delete the run history older than [days] days, and keep [max_rows] records per job at most. Return the total deleted records.
+    '''
+    days = RUN_HISTORY_DAYS if days is None else days
+    max_rows = RUN_HISTORY_MAX_ROWS if max_rows is None else max_rows
+    total = CronJobRun.objects.filter(scheduled_dt__lt=_now() - timedelta(days=days)).delete()[0]
+    for cron_job_id in CronJobRun.objects.values_list('cron_job_id', flat=True).distinct():
+        ids = list(CronJobRun.objects.filter(cron_job_id=cron_job_id).order_by('-id').values_list('id', flat=True)[max_rows:max_rows + 1])
+        if len(ids) > 0:
+            total += CronJobRun.objects.filter(cron_job_id=cron_job_id, id__lte=ids[0]).delete()[0]
+    return total
+
+
+def get_run_stats(cron_job_id: int = None, since: datetime = None) -> list:
+    '''
+        Return the run statistics per job, order by job ID:
+            [{'cron_job_id', 'task', 'count', 'success', 'error', 'skipped', 'missed', 'p50', 'p95', 'max'}]
+        count: total runs include the skipped and missed runs. p50, p95 and max: duration of the started runs in milliseconds.
+    '''
+    rcs = CronJobRun.objects.order_by('cron_job_id', 'duration')
+    if cron_job_id is not None:
+        rcs = rcs.filter(cron_job_id=cron_job_id)
+    if since is not None:
+        rcs = rcs.filter(scheduled_dt__gte=since)
+    stats = {}
+    for job_id, task, outcome, duration in rcs.values_list('cron_job_id', 'task', 'outcome', 'duration').iterator(chunk_size=10000):
+        r = stats.get(job_id, None)
+        if r is None:
+            r = {'cron_job_id': job_id, 'task': task, 'count': 0, CronJobRun.OUTCOME_SUCCESS: 0, CronJobRun.OUTCOME_ERROR: 0,
+                 CronJobRun.OUTCOME_SKIPPED: 0, CronJobRun.OUTCOME_MISSED: 0, 'durations': []}
+            stats[job_id] = r
+        r['count'] += 1
+        r[outcome] = r.get(outcome, 0) + 1
+        if duration is not None:
+            r['durations'].append(duration)  # sorted
+    results = []
+    for r in stats.values():
+        durations = r.pop('durations')
+        r['p50'] = percentile(durations, 50) if len(durations) > 0 else None
+        r['p95'] = percentile(durations, 95) if len(durations) > 0 else None
+        r['max'] = durations[-1] if len(durations) > 0 else None
+        results.append(r)
+    return results
+
+
+def get_jobs_version() -> tuple:
+    '''
+        One aggregate query. It's changed if a job is added, deleted or updated by IkTransaction.
+    '''
+    r = CronJob.objects.aggregate(count=Count('id'), max_id=Max('id'), version_no=Sum('version_no'), mod_dt=Max('mod_dt'))
+    return (r['count'], r['max_id'], r['version_no'], r['mod_dt'])
+
 
 class JobData:
     def __init__(self, cron_job: CronJob, job: Job) -> None:
@@ -62,30 +222,62 @@ class __CronManager:
         self.__schedLock = Lock()
         self.__is_running = False
         self.__currentJobs = {}
-        self.__refreshInterval = REFRESH_JOB_INTERVAL
         '''
             {cron_job.id, JobData}
         '''
+        self.__refreshInterval = REFRESH_JOB_INTERVAL
+        self.__leaseTimeout = LEASE_TIMEOUT
+        self.__owner = '%s:%s:%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.__leaseExpireTime = 0  # time.monotonic()
+        self.__jobsVersion = None
+        self.__lastCleanTime = None
+        self.__refreshEvent = Event()
         # refresh the tasks in the backuground
         def refresh_in_background():
             while True:
                 if self.is_running():
-                    self.__refresh()
-                time.sleep(self.__refreshInterval)
+                    close_old_connections()
+                    try:
+                        self.__refresh()
+                    finally:
+                        close_old_connections()
+                self.__refreshEvent.wait(self.__refreshInterval)
+                self.__refreshEvent.clear()
         t = Thread(target=refresh_in_background, args=(), name='Cron Manager Refresh Thread', daemon=True)
         t.start()
 
     def is_running(self) -> bool:
         return self.__is_running
 
+    def is_leader(self) -> bool:
+        '''
+            return True if this process holds the scheduler lease, and runs the jobs.
+        '''
+        return self.__is_running and time.monotonic() < self.__leaseExpireTime
+
+    @property
+    def owner(self) -> str:
+        '''
+            The lease owner name: host:pid:random
+        '''
+        return self.__owner
+
+    def refresh(self) -> None:
+        '''
+            Check the lease and the jobs now (in the background thread).
+        '''
+        self.__refreshEvent.set()
+
     def start(self):
         with self.__schedLock:
             if not self.__is_running:
                 logger.info('Starting cron schedule ...')
                 self.__sched = BackgroundScheduler()
+                self.__sched.add_listener(self.__on_job_event, EVENT_JOB_EXECUTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
                 self.__is_running = True
                 self.__sched.start()
                 logger.info('Starting cron schedule done')
+        self.refresh()
     
     def stop(self):
         with self.__schedLock:
@@ -93,6 +285,14 @@ class __CronManager:
                 logger.info('Stopping cron schedule ...')
                 self.__sched.shutdown(wait=True)
                 self.__is_running = False
+                self.__currentJobs = {}
+                self.__jobsVersion = None
+                if self.__leaseExpireTime > 0:
+                    self.__leaseExpireTime = 0
+                    try:
+                        release_lease(SCHEDULER_LEASE_NAME, self.__owner)
+                    except Exception as e:
+                        logger.error('Release cron scheduler lease failed: %s' % str(e))
                 logger.info('Stopping cron schedule done')
 
     @property
@@ -110,10 +310,70 @@ class __CronManager:
             raise Exception('Interval cannot less than 0.')
         self.__refreshInterval = interval
 
+    @property
+    def lease_timeout(self) -> float:
+        '''
+            return (float): seconds
+        '''
+        return self.__leaseTimeout
+
+    def set_lease_timeout(self, timeout) -> None:
+        '''
+            timeout (float): seconds. It should be longer than the refresh interval.
+        '''
+        if timeout <= 0:
+            raise Exception('Lease timeout should be greater than 0.')
+        self.__leaseTimeout = timeout
+
+    def __renew_lease(self) -> bool:
+        try:
+            startTime = time.monotonic()
+            if acquire_lease(SCHEDULER_LEASE_NAME, self.__owner, self.__leaseTimeout):
+                if self.__leaseExpireTime == 0:
+                    logger.info('Cron scheduler lease is acquired by %s.' % self.__owner)
+                self.__leaseExpireTime = startTime + self.__leaseTimeout
+                return True
+        except Exception as e:
+            logger.error('Renew cron scheduler lease failed: %s' % str(e))
+        if self.__leaseExpireTime > 0:
+            logger.info('Cron scheduler lease is lost by %s.' % self.__owner)
+            self.__leaseExpireTime = 0
+        return False
+
+    def __clean_run_history(self) -> None:
+        if self.__lastCleanTime is not None and time.monotonic() - self.__lastCleanTime < RUN_HISTORY_CLEAN_INTERVAL:
+            return
+        self.__lastCleanTime = time.monotonic()
+        try:
+            total = clean_run_history()
+            if total > 0:
+                logger.info('Deleted %s cron run history records.' % total)
+        except Exception as e:
+            logger.error('Clean cron run history failed: %s' % str(e))
+
+    def __remove_all_jobs(self) -> None:
+        for job_data in self.__currentJobs.values():
+            self.__sched.remove_job(job_data.job.id)
+        self.__currentJobs = {}
+        self.__jobsVersion = None
+
     def __refresh(self) -> bool:
         logger.debug('Refreshing jobs ...')
         with self.__schedLock:
+            if not self.__is_running:
+                return False
             try:
+                if not self.__renew_lease():
+                    if len(self.__currentJobs) > 0:
+                        logger.info('Remove %s jobs, another process runs them.' % len(self.__currentJobs))
+                        self.__remove_all_jobs()
+                    return True
+                # the version is read before the jobs, so the jobs changed during loading are reloaded next time
+                jobs_version = get_jobs_version()
+                if jobs_version == self.__jobsVersion:
+                    logger.debug('Jobs are not changed.')
+                    self.__clean_run_history()
+                    return True
                 # get jobs from database
                 logger.debug('Get jobs from database ...')
                 cron_jobs = CronJob.objects.filter().order_by('id')
@@ -148,6 +408,8 @@ class __CronManager:
                         del self.__currentJobs[job_id]
                         del_job_count += 1
                 logger.debug('Total %s jobs found. new=%s, updated=%s, failed=%s, disabled=%s, deleted=%s.' % (len(cron_jobs), newJobs, updatedJobs, errorJobs, disableJobs, del_job_count))
+                self.__jobsVersion = jobs_version
+                self.__clean_run_history()
                 #self.start()
                 return True
             except Exception as e:
@@ -206,7 +468,7 @@ class __CronManager:
                     args = self.__get_job_paramters(argStr)
 
                 logger.info(LG + 'Add job ...')
-                job = self.__sched.add_job(jobFn, 'cron',
+                job = self.__sched.add_job(self.__run_job, 'cron',
                             second = cron_job.second,
                             minute = cron_job.minute,
                             hour = cron_job.hour,
@@ -218,7 +480,8 @@ class __CronManager:
                             start_date = cron_job.start_date,
                             end_date = cron_job.end_date,
                             jitter = cron_job.jitter,
-                            args = args)
+                            max_instances = cron_job.max_instances if cron_job.max_instances is not None and cron_job.max_instances > 0 else 1,
+                            args = [cron_job.id, cron_job.task, jobFn, args])
                 self.__currentJobs[cron_job.id] = JobData(cron_job, job)
                 logger.info(LG + 'Added')
                 if returnValue is None:
@@ -230,6 +493,46 @@ class __CronManager:
         return returnValue
 
 
+    def __run_job(self, cron_job_id: int, task: str, jobFn, args: list) -> dict:
+        '''
+            return the run result for __on_job_event, or None if the job is not run by this process.
+        '''
+        if not self.is_leader():
+            # the lease is expired or released, another process may run the job
+            logger.warning('ID=%s, Task=%s is skipped: the cron scheduler lease is expired.' % (cron_job_id, task))
+            return None
+        result = {'cron_job_id': cron_job_id, 'task': task, 'outcome': CronJobRun.OUTCOME_SUCCESS, 'start_dt': _now(), 'error': None}
+        startTime = time.perf_counter()
+        try:
+            jobFn(*args)
+        except Exception as e:
+            logger.error('ID=%s, Task=%s Error=%s' % (cron_job_id, task, str(e)), exc_info=True)
+            result['outcome'] = CronJobRun.OUTCOME_ERROR
+            result['error'] = traceback.format_exc()
+        result['duration'] = round((time.perf_counter() - startTime) * 1000, 3)
+        result['end_dt'] = _now()
+        return result
+
+    def __on_job_event(self, event) -> None:
+        try:
+            if event.code == EVENT_JOB_EXECUTED:
+                if event.retval is not None:
+                    add_run_history(scheduled_dt=event.scheduled_run_time, **event.retval)
+                return
+            job = self.__sched.get_job(event.job_id)
+            if job is None:
+                return
+            cron_job_id, task = job.args[0], job.args[1]
+            if event.code == EVENT_JOB_MISSED:
+                logger.warning('ID=%s, Task=%s missed the fire time %s.' % (cron_job_id, task, event.scheduled_run_time))
+                add_run_history(cron_job_id, task, CronJobRun.OUTCOME_MISSED, scheduled_dt=event.scheduled_run_time)
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                for scheduled_run_time in event.scheduled_run_times:
+                    logger.warning('ID=%s, Task=%s is skipped at %s: the last run is still running.' % (cron_job_id, task, scheduled_run_time))
+                    add_run_history(cron_job_id, task, CronJobRun.OUTCOME_SKIPPED, scheduled_dt=scheduled_run_time)
+        except Exception as e:
+            logger.error('Add cron run history failed: %s' % str(e), exc_info=True)
+
     def __is_job_updated(self, old_cron_job: CronJob, new_cron_job: CronJob) -> bool:
         '''
             old_cron_job (CronJob)
@@ -248,7 +551,8 @@ class __CronManager:
                 or self.__is_not_the_same(old_cron_job.end_date, new_cron_job.end_date) \
                 or self.__is_not_the_same(old_cron_job.jitter, new_cron_job.jitter) \
                 or self.__is_not_the_same(old_cron_job.task, new_cron_job.task) \
-                or self.__is_not_the_same(old_cron_job.args, new_cron_job.args)
+                or self.__is_not_the_same(old_cron_job.args, new_cron_job.args) \
+                or self.__is_not_the_same(old_cron_job.max_instances, new_cron_job.max_instances)
 
     def __is_not_the_same(self, a, b) -> bool:
         if a is not None and type(a) == str and a.strip() == '':
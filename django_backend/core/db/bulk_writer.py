@@ -0,0 +1,165 @@
+import atexit
+import logging
+import time
+from threading import Event, Lock, Thread
+
+from django.db import close_old_connections
+
+logger = logging.getLogger('ikyo')
+
+
+class BulkWriter():
+    '''
+        Collect model records in memory and insert them with bulk_create in a background thread.
+
+        The records are written when there are [batchSize] pending records, every [flushInterval] seconds and when
+        the process exits. The background thread is started by the first add() call.
+
+        Overflow policy: if [maxPendingSize] is set and the pending records reach it, the new records are dropped and
+        counted in droppedCount. The caller is never blocked.
+
+        If a batch fails to write, its records are written one by one, so only the bad records are dropped (failedCount).
+
+        Usage:
+            writer = BulkWriter('Model History Writer', ModelHistory)
+            writer.add(ModelHistory(...))
+    '''
+
+    def __init__(self, name: str, modelClass, batchSize: int = 500, flushInterval: float = 1.0, maxPendingSize: int = None) -> None:
+        '''
+            name (str): writer name. It's the background thread name.
+            modelClass (Model class): the records' model class.
+            batchSize (int): max records in one bulk_create.
+            flushInterval (float): seconds.
+            maxPendingSize (int): max records in memory. None means no limit.
+        '''
+        self.name = name
+        self.modelClass = modelClass
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.maxPendingSize = maxPendingSize
+        self.__pendingRcs = []
+        self.__lock = Lock()
+        self.__flushLock = Lock()
+        self.__event = Event()
+        self.__thread = None
+        self.__stopped = False
+        self.__flushedCount = 0
+        self.__failedCount = 0
+        self.__droppedCount = 0
+
+    @property
+    def pendingCount(self) -> int:
+        return len(self.__pendingRcs)
+
+    @property
+    def flushedCount(self) -> int:
+        '''
+            Total records have been written.
+        '''
+        return self.__flushedCount
+
+    @property
+    def failedCount(self) -> int:
+        '''
+            Total records failed to write. The failed records are logged and dropped.
+        '''
+        return self.__failedCount
+
+    @property
+    def droppedCount(self) -> int:
+        '''
+            Total records dropped because the pending records reached maxPendingSize.
+        '''
+        return self.__droppedCount
+
+    def getCounters(self) -> dict:
+        return {'pending': self.pendingCount, 'flushed': self.__flushedCount, 'failed': self.__failedCount, 'dropped': self.__droppedCount}
+
+    def add(self, rc) -> bool:
+        '''
+            Return False if the record is dropped.
+        '''
+        return self.addAll([rc]) == 1
+
+    def addAll(self, rcs: list) -> int:
+        '''
+            Return the total accepted records.
+        '''
+        if len(rcs) == 0:
+            return 0
+        with self.__lock:
+            if self.maxPendingSize is not None and len(self.__pendingRcs) + len(rcs) > self.maxPendingSize:
+                acceptedCount = max(self.maxPendingSize - len(self.__pendingRcs), 0)
+                self.__droppedCount += len(rcs) - acceptedCount
+                rcs = rcs[:acceptedCount]
+            self.__pendingRcs.extend(rcs)
+            pendingCount = len(self.__pendingRcs)
+            if self.__thread is None and not self.__stopped:
+                self.__thread = Thread(target=self.__run, args=(), name=self.name, daemon=True)
+                self.__thread.start()
+                atexit.register(self.stop)
+        if self.__stopped:
+            self.flush()  # the process is exiting, write it now
+        elif pendingCount >= self.batchSize:
+            self.__event.set()
+        return len(rcs)
+
+    def flush(self) -> int:
+        '''
+            Write all the pending records in the current thread. Return the total written records.
+        '''
+        total = 0
+        with self.__flushLock:
+            while True:
+                with self.__lock:
+                    rcs = self.__pendingRcs[:self.batchSize]
+                    del self.__pendingRcs[:len(rcs)]
+                if len(rcs) == 0:
+                    break
+                try:
+                    startTime = time.perf_counter()
+                    self.modelClass.objects.bulk_create(rcs)
+                    total += len(rcs)
+                    self.__flushedCount += len(rcs)
+                    logger.debug('%s: wrote %s records in %.3fs.' % (self.name, len(rcs), time.perf_counter() - startTime))
+                except Exception as e:
+                    logger.error('%s: write %s records failed, write them one by one: %s' % (self.name, len(rcs), str(e)))
+                    total += self.__writeOneByOne(rcs)
+        return total
+
+    def __writeOneByOne(self, rcs: list) -> int:
+        total = 0
+        for rc in rcs:
+            try:
+                self.modelClass.objects.bulk_create([rc])
+                total += 1
+                self.__flushedCount += 1
+            except Exception as e:
+                self.__failedCount += 1
+                logger.error('%s: write record failed: %s' % (self.name, str(e)), exc_info=True)
+        return total
+
+    def stop(self) -> None:
+        '''
+            Stop the background thread and write all the pending records.
+        '''
+        self.__stopped = True
+        self.__event.set()
+        thread, self.__thread = self.__thread, None
+        if thread is not None and thread.is_alive():
+            thread.join(timeout=max(self.flushInterval * 5, 10))
+        self.flush()
+        if thread is not None:
+            logger.info('%s stopped: %s' % (self.name, self.getCounters()))
+
+    def __run(self) -> None:
+        while not self.__stopped:
+            self.__event.wait(self.flushInterval)
+            self.__event.clear()
+            if len(self.__pendingRcs) > 0:
+                close_old_connections()
+                try:
+                    self.flush()
+                finally:
+                    close_old_connections()
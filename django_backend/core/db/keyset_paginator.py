@@ -0,0 +1,284 @@
+'''
+    Keyset (seek) pagination for server side paging tables.
+
+    OFFSET pagination reads and skips all the rows before the page, so the deep pages are slow. Keyset pagination remembers
+    the sort key values of the first and last rows of the current page in a cursor, then gets the next page by
+    "WHERE (sort keys) > (last row's sort keys) ORDER BY sort keys LIMIT page size". The sort keys always end with "id", so
+    the order is unique.
+
+    The cursor is an opaque signed token. The client sends back the cursor of the current page with the page number it wants:
+        next page, previous page, current page and the first page: use the cursor (index seek).
+        other pages (e.g. jump to page 100 or the last page): use OFFSET, and return a new cursor.
+
+    The sort key columns should not be NULL. Use OFFSET if the cursor has NULL values.
+
+    Usage:
+        paginator = KeysetPaginator(pageSize=20, sortKeys='-claim_dt')
+        rcs, cursor = paginator.getQuerySetPage(queryset, pageNum, cursor)
+        rows, cursor = paginator.getSqlPage(sql, pageNum, cursor)
+'''
+import datetime
+import decimal
+import logging
+import re
+import uuid
+from functools import lru_cache
+
+import sqlparse
+from django.core import signing
+from django.db import connection
+from django.db.models import Q, QuerySet
+
+import core.utils.db as dbUtils
+from core.core.exception import IkValidateException
+from core.utils.lang_utils import isNullBlank
+
+logger = logging.getLogger('ikyo')
+
+PAGE_MODE_OFFSET = 'offset'
+PAGE_MODE_KEYSET = 'keyset'
+
+KEYSET_KEY_FIELD = 'id'
+
+_CURSOR_SALT = 'ikyo.keyset_paginator'
+_SQL_IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# seek directions
+_SEEK_AFTER = 'after'
+_SEEK_BEFORE = 'before'
+_SEEK_FROM = 'from'
+
+
+def parseSortKeys(sortKeys) -> list:
+    '''
+        sortKeys: "-claim_dt, id", "claim_dt desc, id" or ['-claim_dt', 'id'].
+
+        Return [(name, desc)]. "id" is appended if it's not in the sort keys.
+    '''
+    if isNullBlank(sortKeys):
+        sortKeys = []
+    elif type(sortKeys) == str:
+        sortKeys = sortKeys.split(',')
+    keys = []
+    for sortKey in sortKeys:
+        sortKey = str(sortKey).strip()
+        if sortKey == '':
+            continue
+        desc = False
+        if sortKey.startswith('-'):
+            desc = True
+            sortKey = sortKey[1:].strip()
+        else:
+            items = sortKey.split()
+            if len(items) == 2 and items[1].upper() in ('ASC', 'DESC'):
+                desc = items[1].upper() == 'DESC'
+                sortKey = items[0]
+            elif len(items) != 1:
+                raise IkValidateException('Unsupported keyset pagination sort key: %s' % sortKey)
+        sortKey = sortKey.split('.')[-1].strip('"`')  # t.col -> col
+        if not _SQL_IDENTIFIER_PATTERN.match(sortKey):
+            raise IkValidateException('Unsupported keyset pagination sort key: %s' % sortKey)
+        keys.append((sortKey, desc))
+    if KEYSET_KEY_FIELD not in [name for name, _desc in keys]:
+        keys.append((KEYSET_KEY_FIELD, False))
+    return keys
+
+
+@lru_cache(maxsize=256)
+def splitSqlOrderBy(sql: str) -> tuple:
+    '''
+        Return (sql without ORDER BY, ORDER BY columns). E.g. "SELECT * FROM t ORDER BY a DESC" -> ("SELECT * FROM t", "a DESC")
+        The result is cached, the table SQL is the same in most of the requests.
+    '''
+    statement = sqlparse.parse(sql.strip().rstrip(';'))[0]
+    for index, token in enumerate(statement.tokens):
+        if token.is_keyword and token.normalized == 'LIMIT':
+            raise IkValidateException('Keyset pagination SQL cannot have a LIMIT clause.')
+        if token.is_keyword and token.normalized == 'ORDER BY':
+            orderBy = ''.join(str(t) for t in statement.tokens[index + 1:])
+            if 'LIMIT' in orderBy.upper().split():
+                raise IkValidateException('Keyset pagination SQL cannot have a LIMIT clause.')
+            return ''.join(str(t) for t in statement.tokens[:index]).strip(), orderBy.strip()
+    return str(statement).strip(), None
+
+
+def _encodeValue(value):
+    if isinstance(value, datetime.datetime):
+        return ['dt', value.isoformat()]
+    elif isinstance(value, datetime.date):
+        return ['d', value.isoformat()]
+    elif isinstance(value, datetime.time):
+        return ['t', value.isoformat()]
+    elif isinstance(value, decimal.Decimal):
+        return ['n', str(value)]
+    elif isinstance(value, uuid.UUID):
+        return ['u', str(value)]
+    return value
+
+
+def _decodeValue(value):
+    if type(value) == list:
+        valueType, value = value
+        if valueType == 'dt':
+            return datetime.datetime.fromisoformat(value)
+        elif valueType == 'd':
+            return datetime.date.fromisoformat(value)
+        elif valueType == 't':
+            return datetime.time.fromisoformat(value)
+        elif valueType == 'n':
+            return decimal.Decimal(value)
+        elif valueType == 'u':
+            return uuid.UUID(value)
+        raise ValueError('Unknown cursor value type: %s' % valueType)
+    return value
+
+
+class KeysetPaginator():
+    def __init__(self, pageSize: int, sortKeys=None) -> None:
+        '''
+            pageSize (int): page size.
+            sortKeys (str or list): e.g. "-claim_dt". Default to the queryset's order by or the SQL's ORDER BY.
+        '''
+        if pageSize is None or int(pageSize) <= 0:
+            raise IkValidateException('Keyset pagination page size should be greater than 0.')
+        self.pageSize = int(pageSize)
+        self.sortKeys = None if isNullBlank(sortKeys) else parseSortKeys(sortKeys)
+
+    def getQuerySetPage(self, queryset: QuerySet, pageNum: int, cursor: str = None) -> tuple:
+        '''
+            Return ([record], cursor). The records are models or dicts (queryset.values()).
+        '''
+        sortKeys = self.sortKeys
+        if sortKeys is None:
+            sortKeys = parseSortKeys(queryset.query.order_by or queryset.model._meta.ordering)
+        orderBy = self.__getOrderBy(sortKeys)
+        seek = self.__getSeek(pageNum, cursor, sortKeys)
+        if seek is None:
+            rcs = list(queryset.order_by(*orderBy)[(pageNum - 1) * self.pageSize:pageNum * self.pageSize])
+        else:
+            seekDirection, values = seek
+            if seekDirection == _SEEK_BEFORE:
+                # get the first row of the previous page, then read the page in the normal order
+                reversedOrderBy = self.__getOrderBy(sortKeys, reverse=True)
+                boundaryRcs = list(queryset.filter(self.__getSeekQ(sortKeys, values, reverse=True)).order_by(*reversedOrderBy)
+                                   .values(*[name for name, _desc in sortKeys])[:self.pageSize])
+                if len(boundaryRcs) == 0:
+                    seekDirection, values = None, None
+                else:
+                    seekDirection, values = _SEEK_FROM, [boundaryRcs[-1][name] for name, _desc in sortKeys]
+            if seekDirection is not None:
+                queryset = queryset.filter(self.__getSeekQ(sortKeys, values, inclusive=seekDirection == _SEEK_FROM))
+            rcs = list(queryset.order_by(*orderBy)[:self.pageSize])
+        return rcs, self.__getCursor(pageNum, sortKeys, rcs)
+
+    def getSqlPage(self, sql: str, pageNum: int, cursor: str = None) -> tuple:
+        '''
+            The SQL should return the sort key columns and "id". Don't add LIMIT/OFFSET to the SQL.
+
+            Return ([dict], cursor).
+        '''
+        sql, sqlOrderBy = splitSqlOrderBy(sql)
+        sortKeys = self.sortKeys
+        if sortKeys is None:
+            sortKeys = parseSortKeys(sqlOrderBy)
+        sql = 'SELECT * FROM (%s) ik_keyset_t' % sql.replace('%', '%%')
+        params = []
+        seek = self.__getSeek(pageNum, cursor, sortKeys)
+        if seek is None or seek[0] is None:
+            sql += ' ORDER BY %s LIMIT %s OFFSET %s' % (self.__getSqlOrderBy(sortKeys), self.pageSize, (pageNum - 1) * self.pageSize)
+        else:
+            seekDirection, values = seek
+            reverse = seekDirection == _SEEK_BEFORE
+            where, params = self.__getSeekSql(sortKeys, values, reverse=reverse, inclusive=seekDirection == _SEEK_FROM)
+            sql += ' WHERE %s ORDER BY %s LIMIT %s' % (where, self.__getSqlOrderBy(sortKeys, reverse=reverse), self.pageSize)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = dbUtils.dictfetchall(cursor)
+        if seek is not None and seek[0] == _SEEK_BEFORE:
+            rows.reverse()
+        return rows, self.__getCursor(pageNum, sortKeys, rows)
+
+    def __getSeek(self, pageNum: int, cursor: str, sortKeys: list) -> tuple:
+        '''
+            Return (seek direction, sort key values). (None, None) means the first page. None means use OFFSET.
+        '''
+        if pageNum == 1:
+            return None, None
+        cursorData = self.__loadCursor(cursor)
+        if cursorData is None or cursorData['s'] != self.pageSize or cursorData['k'] != self.__getSortKeysSignature(sortKeys):
+            return None
+        cursorPageNum = cursorData['p']
+        if pageNum == cursorPageNum + 1:
+            seek = _SEEK_AFTER, cursorData['l']
+        elif pageNum == cursorPageNum:
+            seek = _SEEK_FROM, cursorData['f']
+        elif pageNum == cursorPageNum - 1:
+            seek = _SEEK_BEFORE, cursorData['f']
+        else:
+            return None
+        if seek[1] is None or None in seek[1]:
+            return None
+        return seek
+
+    def __loadCursor(self, cursor: str) -> dict:
+        if isNullBlank(cursor):
+            return None
+        try:
+            cursorData = signing.loads(cursor, salt=_CURSOR_SALT)
+            for key in ('f', 'l'):
+                if cursorData[key] is not None:
+                    cursorData[key] = [_decodeValue(v) for v in cursorData[key]]
+            return cursorData
+        except Exception as e:
+            logger.warning('Invalid keyset pagination cursor: %s' % str(e))
+            return None
+
+    def __getCursor(self, pageNum: int, sortKeys: list, rcs: list) -> str:
+        cursorData = {'p': pageNum,
+                      's': self.pageSize,
+                      'k': self.__getSortKeysSignature(sortKeys),
+                      'f': None if len(rcs) == 0 else [_encodeValue(v) for v in self.__getSortKeyValues(sortKeys, rcs[0])],
+                      'l': None if len(rcs) == 0 else [_encodeValue(v) for v in self.__getSortKeyValues(sortKeys, rcs[-1])]}
+        return signing.dumps(cursorData, salt=_CURSOR_SALT)
+
+    def __getSortKeysSignature(self, sortKeys: list) -> str:
+        return ','.join(('-' if desc else '') + name for name, desc in sortKeys)
+
+    def __getSortKeyValues(self, sortKeys: list, rc) -> list:
+        if type(rc) == dict:
+            return [rc[name] for name, _desc in sortKeys]
+        return [getattr(rc, rc._meta.get_field(name).attname) for name, _desc in sortKeys]
+
+    def __getOrderBy(self, sortKeys: list, reverse: bool = False) -> list:
+        return [('-' if desc != reverse else '') + name for name, desc in sortKeys]
+
+    def __getSeekQ(self, sortKeys: list, values: list, reverse: bool = False, inclusive: bool = False) -> Q:
+        '''
+            (a, b) > (x, y): a > x OR (a = x AND b > y)
+        '''
+        q = Q(**{name: value for (name, _desc), value in zip(sortKeys, values)}) if inclusive else None
+        for i in range(len(sortKeys) - 1, -1, -1):
+            name, desc = sortKeys[i]
+            itemQ = Q(**{name: value for (name, _desc), value in zip(sortKeys[:i], values[:i])})
+            itemQ &= Q(**{'%s__%s' % (name, 'lt' if desc != reverse else 'gt'): values[i]})
+            q = itemQ if q is None else q | itemQ
+        return q
+
+    def __getSqlOrderBy(self, sortKeys: list, reverse: bool = False) -> str:
+        return ', '.join('%s %s' % (connection.ops.quote_name(name), 'DESC' if desc != reverse else 'ASC') for name, desc in sortKeys)
+
+    def __getSeekSql(self, sortKeys: list, values: list, reverse: bool = False, inclusive: bool = False) -> tuple:
+        conditions, params = [], []
+        for i in range(len(sortKeys)):
+            items = []
+            for (name, _desc), value in zip(sortKeys[:i], values[:i]):
+                items.append('%s = %%s' % connection.ops.quote_name(name))
+                params.append(value)
+            name, desc = sortKeys[i]
+            items.append('%s %s %%s' % (connection.ops.quote_name(name), '<' if desc != reverse else '>'))
+            params.append(values[i])
+            conditions.append('(%s)' % ' AND '.join(items))
+        if inclusive:
+            conditions.append('(%s)' % ' AND '.join('%s = %%s' % connection.ops.quote_name(name) for name, _desc in sortKeys))
+            params.extend(values)
+        return '(%s)' % ' OR '.join(conditions), params
@@ -11,17 +11,16 @@ from enum import Enum
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.core.serializers import serialize
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models, transaction
 from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from django.forms.models import model_to_dict
 
 import core.utils.db as dbUtils
 import core.utils.django_utils as ikDjangoUtils
 from core.const import TABLE_NAME_PREFIX
 from core.core.exception import IkException, IkValidateException
+from core.db.bulk_writer import BulkWriter
 from core.utils.lang_utils import isNotNullBlank
 from django_backend.settings import DATABASES
 from iktools import IkConfig
@@ -117,6 +116,14 @@ class Model(models.Model):
         self.__ik_status = ModelRecordStatus.NEW if len(
             args) == 0 else ModelRecordStatus.RETRIEVE
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if ENABLE_MODEL_HISTORY:
+            # field values in database, the model history uses it to get the changed fields. The "__ik_" attributes are not in toJson().
+            instance._Model__ik_db_values = dict(zip(field_names, values))
+        return instance
+
     def ik_get_status(self) -> ModelRecordStatus:
         return self.__ik_status
 
@@ -425,6 +432,11 @@ def pre_save_handler(sender, **kwargs):
     logger.debug("{},{}".format(sender, **kwargs))
 
 
+CONCURRENCY_CHECK_BATCH_SIZE = 500
+"""Max records in one version no query. Reference to IDModel.concurrencyCheckInBatch.
+"""
+
+
 class IDModel(Model):
     '''
         The models has id field
@@ -486,9 +498,6 @@ class IDModel(Model):
         rc = self
         if self.ik_is_status_modified() and beforeUpdate or not beforeUpdate:
             # Concurrency check: version_no
-            recordName = rc.getModelDisplayName()
-            if recordName is None:
-                recordName = str(rc.id)
             sql = 'SELECT version_no FROM ' + rc.__class__._meta.db_table + \
                 ' WHERE id=' + dbUtils.toSqlField(rc.id)
             conn = transaction.get_connection()
@@ -496,17 +505,51 @@ class IDModel(Model):
             with conn.cursor() as cursor:
                 cursor.execute(sql)
                 rs = cursor.fetchall()
-            if dbUtils.isEmpty(rs):
-                raise IkValidateException('Concurrency Validate Error: Record [%s] has been deleted, please check %s.' % (
-                    recordName, rc._meta.verbose_name))
-            dbVersionNo = rs[0][0]
-            if (rc.version_no - 1 if beforeUpdate else rc.version_no) < dbVersionNo:
-                modifyUser = None
-                raise IkValidateException('Concurrency Validate Error: Record [%s] has been updated by %s, please check %s.' % (recordName,
-                                                                                                                                'others' if modifyUser is None else modifyUser, rc._meta.verbose_name))
-            elif (rc.version_no - 1) > dbVersionNo:
-                raise IkValidateException("Concurrency Validate Error: Record [%s]'s concurrency flat is incorrect, please check %s." % (
-                    recordName, rc._meta.verbose_name))
+            rc.__validateVersionNo(None if dbUtils.isEmpty(rs) else rs[0][0], beforeUpdate)
+
+    @staticmethod
+    def concurrencyCheckInBatch(rcs: list, beforeUpdate=True) -> None:
+        '''
+            Same as concurrencyCheck, but read the version numbers of all the records with one
+            "SELECT id, version_no ... WHERE id IN (...)" per CONCURRENCY_CHECK_BATCH_SIZE records.
+            The records should be the same model.
+
+            raise IkValidateException if failed. The first failed record is reported.
+        '''
+        rcs = [rc for rc in rcs if rc.ik_is_status_modified() and beforeUpdate or not beforeUpdate]
+        if len(rcs) == 0:
+            return
+        dbVersionNos = {}
+        conn = transaction.get_connection()
+        for i in range(0, len(rcs), CONCURRENCY_CHECK_BATCH_SIZE):
+            ids = [rc.id for rc in rcs[i:i + CONCURRENCY_CHECK_BATCH_SIZE]]
+            sql = 'SELECT id, version_no FROM ' + rcs[0].__class__._meta.db_table + \
+                ' WHERE id IN (' + ','.join(['%s'] * len(ids)) + ')'
+            with conn.cursor() as cursor:
+                cursor.execute(sql, ids)
+                for id, versionNo in cursor.fetchall():
+                    dbVersionNos[id] = versionNo
+        for rc in rcs:
+            rc.__validateVersionNo(dbVersionNos.get(rc.id, None), beforeUpdate)
+
+    def __validateVersionNo(self, dbVersionNo, beforeUpdate) -> None:
+        '''
+            dbVersionNo: the record's version no in database. None means the record has been deleted.
+        '''
+        rc = self
+        recordName = rc.getModelDisplayName()
+        if recordName is None:
+            recordName = str(rc.id)
+        if dbVersionNo is None:
+            raise IkValidateException('Concurrency Validate Error: Record [%s] has been deleted, please check %s.' % (
+                recordName, rc._meta.verbose_name))
+        if (rc.version_no - 1 if beforeUpdate else rc.version_no) < dbVersionNo:
+            modifyUser = None
+            raise IkValidateException('Concurrency Validate Error: Record [%s] has been updated by %s, please check %s.' % (recordName,
+                                                                                                                            'others' if modifyUser is None else modifyUser, rc._meta.verbose_name))
+        elif (rc.version_no - 1) > dbVersionNo:
+            raise IkValidateException("Concurrency Validate Error: Record [%s]'s concurrency flat is incorrect, please check %s." % (
+                recordName, rc._meta.verbose_name))
 
     class Meta:
         abstract = True
@@ -694,58 +737,79 @@ def ignoreDjangoModelsFilter(sender, instance, **kwargs):
 addModelHistoryFilter(ignoreModelHistoryFilter)
 addModelHistoryFilter(ignoreDjangoModelsFilter)
 
-# Save the old data before saving models
+__isRunDjangoServer = None
 
 
-@receiver(pre_save)
-def preSaveModelSignalHandler(sender, instance, **kwargs):
-    """Signal handler when saving models.
+def _isModelHistoryEnabled() -> bool:
+    global __isRunDjangoServer
+    if ENABLE_MODEL_HISTORY is not True:
+        return False
+    if __isRunDjangoServer is None:
+        __isRunDjangoServer = ikDjangoUtils.isRunDjangoServer()  # it reads the call stack, check once only
+    return __isRunDjangoServer
+
+
+def isModelHistoryEnabled(modelClass) -> bool:
+    """Return True if the model's save/delete signals add model histories (modelHistoryEnable, modelHistoryNames and
+        modelHistoryNamesExclude). The model history filters are checked for each record when the signals are sent.
+
+        The signals are not sent by QuerySet.update() and bulk_create(), use IkTransaction to keep the model histories.
     """
-    if ENABLE_MODEL_HISTORY is not True or not ikDjangoUtils.isRunDjangoServer():
-        return
+    if not _isModelHistoryEnabled():
+        return False
+    modelFullName = f"{modelClass.__module__}.{modelClass.__name__}"
+    if len(MODEL_HISTORY_MODEL_NAMES_EXCLUDE) > 0 and modelFullName in MODEL_HISTORY_MODEL_NAMES_EXCLUDE:
+        return False
+    return len(MODEL_HISTORY_MODEL_NAMES) == 0 or modelFullName in MODEL_HISTORY_MODEL_NAMES
+
+
+def __isModelHistoryAccepted(sender, instance, **kwargs) -> bool:
     modelFullName = f"{sender.__module__}.{sender.__name__}"
     if MODEL_HISTORY_MODEL_NAMES_EXCLUDE is not None and len(MODEL_HISTORY_MODEL_NAMES_EXCLUDE) > 0 and modelFullName in MODEL_HISTORY_MODEL_NAMES_EXCLUDE:
-        return
+        return False
     elif MODEL_HISTORY_MODEL_NAMES is not None and len(MODEL_HISTORY_MODEL_NAMES) > 0 and modelFullName not in MODEL_HISTORY_MODEL_NAMES:
-        return
+        return False
     elif __MODEL_HISTORY_FILTERS is not None and type(__MODEL_HISTORY_FILTERS) == list and len(__MODEL_HISTORY_FILTERS) > 0:
         for filter in __MODEL_HISTORY_FILTERS:
             try:
                 if filter is not None:
                     if not filter(sender, instance, **kwargs):
-                        return
+                        return False
             except Exception as e:
                 logger.error("Process filter [%s] failed: %s" % (
                     str(filter), str(e)), e, exc_info=True)
-    try:
-        instance._old_data = instance.__class__.objects.get(pk=instance.pk)
-    except Exception as e:
-        # logger.debug("Add history old data failed: %s" % (str(e)), e, exc_info=True)
-        pass
+    return True
 
 
-# Process model insert and update events.
-@receiver(post_save)
-def postSaveModelSignalHandler(sender, instance, created, **kwargs):
-    """Signal handler when saving models.
+def __getModelHistoryValues(instance) -> dict:
+    """Get the model field values. E.g. {'id': 1, 'usr': 2 (foreign key id), 'usr_nm': 'abc'}
     """
-    if ENABLE_MODEL_HISTORY is not True or not ikDjangoUtils.isRunDjangoServer():
-        return
-    modelFullName = f"{sender.__module__}.{sender.__name__}"
-    if MODEL_HISTORY_MODEL_NAMES_EXCLUDE is not None and len(MODEL_HISTORY_MODEL_NAMES_EXCLUDE) > 0 and modelFullName in MODEL_HISTORY_MODEL_NAMES_EXCLUDE:
-        return
-    elif MODEL_HISTORY_MODEL_NAMES is not None and len(MODEL_HISTORY_MODEL_NAMES) > 0 and modelFullName not in MODEL_HISTORY_MODEL_NAMES:
-        return
-    elif __MODEL_HISTORY_FILTERS is not None and type(__MODEL_HISTORY_FILTERS) == list and len(__MODEL_HISTORY_FILTERS) > 0:
-        for filter in __MODEL_HISTORY_FILTERS:
-            try:
-                if filter is not None:
-                    if not filter(sender, instance, **kwargs):
-                        return
-            except Exception as e:
-                logger.error("Process filter [%s] failed: %s" % (
-                    str(filter), str(e)), e, exc_info=True)
+    return {f.name: getattr(instance, f.attname) for f in instance._meta.concrete_fields}
+
+
+def __getModelHistoryOldValues(instance) -> dict:
+    """Get the field values when the record was read from database. Read from database if the record was not
+        read by django (E.g. MyModel(id=1, ...).save()).
+    """
+    dbValues = getattr(instance, '_Model__ik_db_values', None)
+    if dbValues is not None and dbValues.get(instance._meta.pk.attname, None) == instance.pk:
+        fields = instance._meta.concrete_fields
+        if all(f.attname in dbValues for f in fields):
+            return {f.name: dbValues[f.attname] for f in fields}
+    if instance.pk is None:
+        return None
+    oldData = instance.__class__._base_manager.filter(pk=instance.pk).first()
+    return None if oldData is None else __getModelHistoryValues(oldData)
+
+
+def __toModelHistoryJson(instance, values: dict) -> str:
+    """Same format as django.core.serializers.serialize('json', [instance]).
+    """
+    fields = {name: value for name, value in values.items() if name != instance._meta.pk.name}
+    return json.dumps([{'model': instance._meta.label_lower, 'pk': instance.pk, 'fields': fields}], cls=DjangoJSONEncoder, ensure_ascii=False)
+
 
+def __newModelHistory(action, instance, oldData: str, newData: str, diff: str = None) -> ModelHistory:
     from core.core.request_middleware import getCurrentUser
     from core.models import User
     userRc = getCurrentUser()
@@ -754,96 +818,110 @@ def postSaveModelSignalHandler(sender, instance, created, **kwargs):
     if isinstance(userRc, User):
         userID = userRc.id
         userName = userRc.usr_nm
+    return ModelHistory(action=action, operator_id=userID, operator_name=userName, content_type=ContentType.objects.get_for_model(instance),
+                        model_name=f"{instance.__class__.__module__}.{instance.__class__.__name__}", db_table=instance._meta.db_table,
+                        object_id=instance.pk, old_data=oldData, new_data=newData, diff=diff)
 
-    if created:  # insert
-        try:
-            contentType = ContentType.objects.get_for_model(instance)
-            newDataJson = serialize('json', [instance])
-            dbTable = instance._meta.db_table
-            ModelHistory.objects.create(action=ModelHistory.INSERT_FLAG, operator_id=userID, operator_name=userName, content_type=contentType,
-                                        model_name=modelFullName, db_table=dbTable, object_id=instance.pk, old_data=None, new_data=newDataJson)
-        except Exception as e:
-            logger.error("Add insert history failed: %s" %
-                         (str(e)), e, exc_info=True)
-    else:  # update
-        try:
-            oldData = instance._old_data
-            newData = instance
-
-            oldDataJson = serialize('json', [oldData])
-            newDataJson = serialize('json', [newData])
-
-            dict1 = model_to_dict(oldData)
-            dict2 = model_to_dict(newData)
-
-            from core.models import TimestampMixin
-
-            def compare_dicts(dict1, dict2):
-                differences = {}
-                for key in dict1.keys():
-                    if key == TimestampMixin.DB_COLUMN_MODIFY_USER_ID or key == TimestampMixin.DB_COLUMN_CREATE_USER_ID \
-                            or key == TimestampMixin.DB_COLUMN_MODIFY_DATE or key == TimestampMixin.DB_COLUMN_MODIFY_USER_ID\
-                            or key == IDModel.DB_COLUMN_VERSION_NO:
-                        continue
-                    if dict1[key] != dict2[key]:
-                        differences[key] = {
-                            'old': dict1[key], 'new': dict2[key]}
-                return differences
-
-            dff = compare_dicts(dict1, dict2)
-            diff_json_str = json.dumps(
-                dff, cls=DjangoJSONEncoder, ensure_ascii=False) if len(dff) > 0 else None
-
-            contentType = ContentType.objects.get_for_model(instance)
-            dbTable = instance._meta.db_table
-
-            ModelHistory.objects.create(action=ModelHistory.UPDATE_FLAG, content_type=contentType, operator_id=userID, operator_name=userName,
-                                        model_name=modelFullName, db_table=dbTable, object_id=instance.pk, old_data=oldDataJson, new_data=newDataJson, diff=diff_json_str)
-        except Exception as e:
-            logger.error("Add update history failed: %s" %
-                         (str(e)), e, exc_info=True)
 
+def __saveModelHistory(rc: ModelHistory) -> None:
+    """sync: save in the caller's transaction.
+        deferred: add to the model history writer after the caller's transaction committed.
+    """
+    if MODEL_HISTORY_MODE == MODEL_HISTORY_MODE_SYNC:
+        rc.save()
+    else:
+        transaction.on_commit(lambda: _modelHistoryWriter.add(rc))
 
-# Process model delete events.
-@receiver(post_delete)
-def postDeleteModelSignalHandler(sender, instance, **kwargs):
-    """Signal handler when deleting models.
+
+MODEL_HISTORY_MODE_SYNC = 'sync'
+MODEL_HISTORY_MODE_DEFERRED = 'deferred'
+
+MODEL_HISTORY_MODE = str(IkConfig.get('System', 'modelHistoryMode', MODEL_HISTORY_MODE_SYNC)).lower().strip()
+""" Model history durability mode. Values: sync or deferred. Default to sync.
+
+    sync: insert the history in the caller's transaction. One insert per record.
+    deferred: queue the history when the caller's transaction committed. A background thread inserts the
+              queued histories with bulk_create every [modelHistoryFlushInterval] seconds or every
+              [modelHistoryBatchSize] records, and when the process exits. The queued histories are lost if the process
+              is killed, so use it only when the history can be lost.
+"""
+if MODEL_HISTORY_MODE not in (MODEL_HISTORY_MODE_SYNC, MODEL_HISTORY_MODE_DEFERRED):
+    logger.error('Unsupported modelHistoryMode [%s], use [%s] instead.' % (MODEL_HISTORY_MODE, MODEL_HISTORY_MODE_SYNC))
+    MODEL_HISTORY_MODE = MODEL_HISTORY_MODE_SYNC
+
+_modelHistoryWriter = BulkWriter('Model History Writer', ModelHistory,
+                                 batchSize=int(IkConfig.get('System', 'modelHistoryBatchSize', 500)),
+                                 flushInterval=float(IkConfig.get('System', 'modelHistoryFlushInterval', 1)))
+"""Model history writer for deferred mode.
+"""
+
+MODEL_HISTORY_DIFF_EXCLUDE_FIELDS = ('cre_usr', 'cre_usr_id', 'mod_usr', 'mod_usr_id', 'mod_dt', IDModel.DB_COLUMN_VERSION_NO)
+
+
+def flushModelHistory() -> int:
+    """Write the queued model histories (deferred mode). Return the total written records.
     """
-    if ENABLE_MODEL_HISTORY is not True or not ikDjangoUtils.isRunDjangoServer():
-        return
-    modelFullName = f"{sender.__module__}.{sender.__name__}"
-    if MODEL_HISTORY_MODEL_NAMES_EXCLUDE is not None and len(MODEL_HISTORY_MODEL_NAMES_EXCLUDE) > 0 and modelFullName in MODEL_HISTORY_MODEL_NAMES_EXCLUDE:
-        return
-    elif MODEL_HISTORY_MODEL_NAMES is not None and len(MODEL_HISTORY_MODEL_NAMES) > 0 and modelFullName not in MODEL_HISTORY_MODEL_NAMES:
+    return _modelHistoryWriter.flush()
+
+
+# Save the old data before saving models
+@receiver(pre_save)
+def preSaveModelSignalHandler(sender, instance, **kwargs):
+    """Signal handler when saving models.
+        Keep the old field values in memory. Don't need to read from database if the record was read by django.
+    """
+    if not _isModelHistoryEnabled() or not __isModelHistoryAccepted(sender, instance, **kwargs):
         return
-    elif __MODEL_HISTORY_FILTERS is not None and type(__MODEL_HISTORY_FILTERS) == list and len(__MODEL_HISTORY_FILTERS) > 0:
-        for filter in __MODEL_HISTORY_FILTERS:
-            try:
-                if filter is not None:
-                    if not filter(sender, instance, **kwargs):
-                        return
-            except Exception as e:
-                logger.error("Process filter [%s] failed: %s" % (
-                    str(filter), str(e)), e, exc_info=True)
+    try:
+        instance._Model__ik_old_values = None if instance._state.adding and instance.pk is None else __getModelHistoryOldValues(instance)
+    except Exception as e:
+        logger.debug("Add history old data failed: %s" % (str(e)), e, exc_info=True)
+        instance._Model__ik_old_values = None
 
-    from core.core.request_middleware import getCurrentUser
-    from core.models import User
-    userRc = getCurrentUser()
-    userID = None
-    userName = None
-    if isinstance(userRc, User):
-        userID = userRc.id
-        userName = userRc.usr_nm
 
+# Process model insert and update events.
+@receiver(post_save)
+def postSaveModelSignalHandler(sender, instance, created, **kwargs):
+    """Signal handler when saving models.
+        Insert: save all the fields. Update: save the changed fields only.
+    """
+    if not _isModelHistoryEnabled() or not __isModelHistoryAccepted(sender, instance, **kwargs):
+        return
     try:
-        oldData = instance
-        oldDataJson = serialize('json', [oldData])
+        newValues = __getModelHistoryValues(instance)
+        oldValues = getattr(instance, '_Model__ik_old_values', None)
+        if created or oldValues is None:  # insert
+            rc = __newModelHistory(ModelHistory.INSERT_FLAG, instance, None, __toModelHistoryJson(instance, newValues))
+        else:  # update
+            oldChangedValues, newChangedValues, diff = {}, {}, {}
+            for name, newValue in newValues.items():
+                oldValue = oldValues.get(name, None)
+                if oldValue != newValue:
+                    oldChangedValues[name] = oldValue
+                    newChangedValues[name] = newValue
+                    if name not in MODEL_HISTORY_DIFF_EXCLUDE_FIELDS:
+                        diff[name] = {'old': oldValue, 'new': newValue}
+            diffJsonStr = json.dumps(diff, cls=DjangoJSONEncoder, ensure_ascii=False) if len(diff) > 0 else None
+            rc = __newModelHistory(ModelHistory.UPDATE_FLAG, instance, __toModelHistoryJson(instance, oldChangedValues),
+                                   __toModelHistoryJson(instance, newChangedValues), diffJsonStr)
+        __saveModelHistory(rc)
+        # the current values are the old values for the next saving
+        instance._Model__ik_db_values = {f.attname: newValues[f.name] for f in instance._meta.concrete_fields}
+        instance._Model__ik_old_values = None
+    except Exception as e:
+        logger.error("Add %s history failed: %s" % ('insert' if created else 'update', str(e)), e, exc_info=True)
 
-        content_type = ContentType.objects.get_for_model(instance)
-        dbTable = instance._meta.db_table
 
-        ModelHistory.objects.create(action=ModelHistory.DELETE_FLAG, content_type=content_type, operator_id=userID, operator_name=userName,
-                                    model_name=modelFullName, db_table=dbTable, object_id=instance.pk, old_data=oldDataJson, new_data=None)
+# Process model delete events.
+@receiver(post_delete)
+def postDeleteModelSignalHandler(sender, instance, **kwargs):
+    """Signal handler when deleting models.
+    """
+    if not _isModelHistoryEnabled() or not __isModelHistoryAccepted(sender, instance, **kwargs):
+        return
+    try:
+        rc = __newModelHistory(ModelHistory.DELETE_FLAG, instance, __toModelHistoryJson(instance, __getModelHistoryValues(instance)), None)
+        __saveModelHistory(rc)
     except Exception as e:
         logger.error("Add delete history failed: %s" %
                      (str(e)), e, exc_info=True)
@@ -0,0 +1,104 @@
+'''
+    Model data versions.
+
+    A model's version is read from its table by one aggregate query: (row count, max primary key, sum of version_no). It's kept
+    in the database, so all processes get the same version. The version is changed if a record is inserted or deleted, or it's
+    updated by IkTransaction or Model.save() (both increase version_no, reference to core/db/model.py: IDModel.save). Increase
+    version_no if the table is updated by QuerySet.update() or SQL, e.g. update(..., version_no=F('version_no') + 1).
+    The models without version_no don't have a version.
+
+    The aggregate query reads the whole table, so each process reuses the versions read in the last [modelVersionCheckInterval]
+    seconds (config.ini [System], default to 10). It's a trade-off: a change made by another process is found after that at the
+    latest, and a cached model costs one query per interval per process. changeModelVersions drops the versions kept by this
+    process (e.g. IkTransaction calls it after commit), so a change made by this process is found right away.
+'''
+import time
+from threading import Lock
+
+from django.db import connections, models, router
+
+from iktools import IkConfig
+
+from .model import IDModel
+
+# 0 means read the versions from the database every time.
+CHECK_INTERVAL = max(0, float(IkConfig.getSystem('modelVersionCheckInterval', 10)))
+
+__versions = {}  # {model label: (version, read time)}
+__versionsLock = Lock()
+
+
+def getModelLabel(modelClass) -> str:
+    '''
+        E.g. core.currency
+    '''
+    return modelClass._meta.label_lower
+
+
+def __hasVersionNo(modelClass) -> bool:
+    return any(field.column == IDModel.DB_COLUMN_VERSION_NO for field in modelClass._meta.concrete_fields)
+
+
+def __readVersions(modelClasses: list) -> dict:
+    '''
+        One query per database. Return {model label: version}.
+    '''
+    modelClassesByDb = {}
+    for modelClass in modelClasses:
+        modelClassesByDb.setdefault(router.db_for_read(modelClass), []).append(modelClass)
+    versions = {}
+    for dbAlias, dbModelClasses in modelClassesByDb.items():
+        connection = connections[dbAlias]
+        qn = connection.ops.quote_name
+        sql = ' UNION ALL '.join('SELECT %s, COUNT(*), MAX(%s), SUM(%s) FROM %s' % (
+            i, qn(modelClass._meta.pk.column), qn(IDModel.DB_COLUMN_VERSION_NO), qn(modelClass._meta.db_table))
+            for i, modelClass in enumerate(dbModelClasses))
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            for r in cursor.fetchall():
+                versions[getModelLabel(dbModelClasses[r[0]])] = tuple(r[1:])
+    return versions
+
+
+def getModelVersions(modelClasses: list) -> dict:
+    '''
+        Return {model label: version}. The version is None if the model doesn't have version_no.
+    '''
+    now = time.monotonic()
+    versions = {}
+    expiredModelClasses = []
+    with __versionsLock:
+        for modelClass in dict.fromkeys(modelClasses):
+            label = getModelLabel(modelClass)
+            if not __hasVersionNo(modelClass):
+                versions[label] = None
+                continue
+            version = __versions.get(label, None)
+            if version is not None and now - version[1] < CHECK_INTERVAL:
+                versions[label] = version[0]
+            else:
+                versions[label] = None
+                expiredModelClasses.append(modelClass)
+    if len(expiredModelClasses) > 0:
+        readVersions = __readVersions(expiredModelClasses)
+        with __versionsLock:
+            for label, version in readVersions.items():
+                __versions[label] = (version, now)
+        versions.update(readVersions)
+    return versions
+
+
+def getModelVersion(modelClass) -> tuple:
+    return getModelVersions([modelClass])[getModelLabel(modelClass)]
+
+
+def changeModelVersions(modelClasses: list) -> None:
+    '''
+        The models' data is changed. Read their versions from the database next time in this process. It should be called
+        after the data is committed.
+    '''
+    labels = set(getModelLabel(modelClass) for modelClass in modelClasses
+                 if isinstance(modelClass, type) and issubclass(modelClass, models.Model))
+    with __versionsLock:
+        for label in labels:
+            __versions.pop(label, None)
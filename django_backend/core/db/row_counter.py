@@ -0,0 +1,129 @@
+'''
+    Row counts for server side paging tables.
+
+    Counting all rows of a very large table (e.g. ik_access_log) costs more than getting a page, so the count mode can be
+    set for each table:
+        exact:    SELECT COUNT(*). Default.
+        capped:   count up to [cap] + 1 rows. The total is exact if it's not greater than [cap], otherwise the total is
+                  [cap] + 1, it means "more than [cap] rows".
+        estimate: the planner's row estimate (PostgreSQL): pg_class.reltuples for a whole table, or the EXPLAIN row estimate
+                  for a filtered query. Count exactly if the estimate is less than [cap] (small counts are fast and the
+                  estimates of small results are not accurate), or the database is not PostgreSQL (e.g. sqlite).
+
+    Usage:
+        counter = RowCounter(mode='capped', cap=10000)
+        total, isExact = counter.countQuerySet(queryset)
+        total, isExact = counter.countSql(sql)
+'''
+import json
+import logging
+
+import sqlparse
+from django.db import connection, connections, transaction
+from django.db.models import QuerySet
+
+from core.core.exception import IkValidateException
+from core.utils.lang_utils import isNullBlank
+
+logger = logging.getLogger('ikyo')
+
+COUNT_MODE_EXACT = 'exact'
+COUNT_MODE_CAPPED = 'capped'
+COUNT_MODE_ESTIMATE = 'estimate'
+COUNT_MODES = (COUNT_MODE_EXACT, COUNT_MODE_CAPPED, COUNT_MODE_ESTIMATE)
+
+DEFAULT_COUNT_CAP = 10000
+
+
+def stripSqlOrderBy(sql: str) -> str:
+    '''
+        Delete the ORDER BY clause and everything after it (e.g. LIMIT). The order is not required to count the rows.
+    '''
+    statement = sqlparse.parse(sql.strip().rstrip(';'))[0]
+    for index, token in enumerate(statement.tokens):
+        if token.is_keyword and token.normalized == 'ORDER BY':
+            return ''.join(str(t) for t in statement.tokens[:index]).strip()
+    return str(statement).strip()
+
+
+def _isPostgreSQL(conn) -> bool:
+    return conn.vendor == 'postgresql'
+
+
+class RowCounter():
+    def __init__(self, mode: str = None, cap: int = None) -> None:
+        '''
+            mode (str, optional): exact, capped or estimate. Default to exact.
+            cap (int, optional): the max rows to count in capped mode, and the min estimate to use in estimate mode. Default to 10000.
+        '''
+        self.mode = COUNT_MODE_EXACT if isNullBlank(mode) else str(mode).strip().lower()
+        if self.mode not in COUNT_MODES:
+            raise IkValidateException('Unsupported row count mode: %s. It should be one of %s.' % (mode, ', '.join(COUNT_MODES)))
+        self.cap = DEFAULT_COUNT_CAP if isNullBlank(cap) else int(cap)
+        if self.cap < 1:
+            raise IkValidateException('Row count cap should be greater than 0: %s' % cap)
+
+    def countQuerySet(self, queryset: QuerySet) -> tuple:
+        '''
+            Return (total, isExact).
+        '''
+        if queryset.query.is_sliced:
+            return queryset.count(), True
+        queryset = queryset.order_by()
+        if self.mode == COUNT_MODE_CAPPED:
+            total = queryset[:self.cap + 1].count()
+            return total, total <= self.cap
+        if self.mode == COUNT_MODE_ESTIMATE:
+            conn = connections[queryset.db]
+            if _isPostgreSQL(conn):
+                estimate = None
+                if len(queryset.query.where) == 0 and not queryset.query.distinct and queryset.query.group_by is None:
+                    estimate = self.__getTableEstimate(conn, queryset.model._meta.db_table)
+                if estimate is None:
+                    sql, params = queryset.query.sql_with_params()
+                    estimate = self.__getExplainEstimate(conn, sql, params)
+                if estimate is not None and estimate >= self.cap:
+                    return estimate, False
+        return queryset.count(), True
+
+    def countSql(self, sql: str) -> tuple:
+        '''
+            Return (total, isExact).
+        '''
+        sql = stripSqlOrderBy(sql)
+        if self.mode == COUNT_MODE_CAPPED:
+            total = self.__fetchCount('SELECT COUNT(*) FROM (%s LIMIT %s) ik_count' % (sql, self.cap + 1))
+            return total, total <= self.cap
+        if self.mode == COUNT_MODE_ESTIMATE and _isPostgreSQL(connection):
+            estimate = self.__getExplainEstimate(connection, sql)
+            if estimate is not None and estimate >= self.cap:
+                return estimate, False
+        return self.__fetchCount('SELECT COUNT(*) FROM (%s) ik_count' % sql), True
+
+    def __fetchCount(self, sql: str) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    def __getTableEstimate(self, conn, tableName: str) -> int:
+        '''
+            Return None if the table is not analyzed.
+        '''
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)', [tableName])
+            row = cursor.fetchone()
+        # reltuples is -1 (PostgreSQL 14+) or 0 if the table is never vacuumed or analyzed
+        return None if row is None or row[0] is None or row[0] <= 0 else int(row[0])
+
+    def __getExplainEstimate(self, conn, sql: str, params=None) -> int:
+        try:
+            # a savepoint, the failed EXPLAIN should not break the current transaction
+            with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+                cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+                plan = cursor.fetchone()[0]
+            if type(plan) == str:
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        except Exception as e:
+            logger.warning('Get the row estimate failed, count the rows: %s' % e)
+            return None
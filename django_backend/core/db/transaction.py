@@ -1,3 +1,4 @@
+import functools
 import inspect
 import logging
 import traceback
@@ -8,9 +9,13 @@ from core.core.exception import IkException, IkValidateException
 from core.core.lang import Boolean2
 from django.core.exceptions import ValidationError
 from django.db import (DatabaseError, DataError, IntegrityError, models,
-                       transaction)
+                       router, transaction)
+from django.db.models import Q
+from django.db.models.deletion import Collector
 from django.db.models.query import QuerySet
+from django.db.models.signals import post_save, pre_save
 
+from . import model_version as modelVersion
 from .model import IDModel, Model
 
 logger = logging.getLogger('ikyo')
@@ -31,6 +36,10 @@ class IkTransactionModel():
 
 DEFAULT_FOREIGN_FIELD = 'id'
 
+UNIQUE_CHECK_BATCH_SIZE = 200
+"""Max records in one unique validation query. Reference to IkTransaction.__validateUniqueInBatch.
+"""
+
 
 class IkTransactionForeignKey():
     def __init__(self, modelFieldName, foreignModelRecord, foreignField=DEFAULT_FOREIGN_FIELD) -> None:
@@ -91,10 +100,11 @@ class IkTransaction():
             raise IkException('unsupport data type: %s' % type(modelData))
         return self.add(modelData, updateFields=updateFields, validateExclude=validateExclude, validateUnique=validateUnique)
 
-    def add(self, modelData, updateFields=None, validateExclude=None, validateUnique=True, foreignKeys=None):
+    def add(self, modelData, updateFields=None, validateExclude=None, validateUnique=True, foreignKeys=None, bulkCreate: bool = False):
         '''
             [validateExclude] and [validateUnique] are used for model.full_clean(exclude=None, validate_unique=True)
             foreignKeys (dict/list/IkTransactionForeignKey): {fieldName1: value1, fieldName2: value2 ...} or list [IkTransactionForeignKey1, IkTransactionForeignKey2]
+            bulkCreate (bool): insert the new records of a list by QuerySet.bulk_create. Reference to IkTransaction.__bulkCreate.
         '''
         if modelData is None:
             raise IkValidateException('Parameter [modelData] is mandatory.')
@@ -103,7 +113,7 @@ class IkTransaction():
             modelData = modelDataList
             # raise IkValidateException('Parameter [modelData] cannot be a QuerySet.')
         ikTransactionModel = IkTransactionModel(modelData=modelData, updateFields=updateFields, validateExclude=validateExclude,
-                                                validateUnique=validateUnique, foreignKeys=foreignKeys)
+                                                validateUnique=validateUnique, foreignKeys=foreignKeys, bulkCreate=bulkCreate)
         self.__modelDataList.append(ikTransactionModel)
 
     def getModelData(self) -> list:
@@ -197,6 +207,8 @@ class IkTransaction():
                         if beforeCommit is not None:
                             logger.debug("save models beforeCommit ...")
                             beforeCommit(self, transaction)
+                        # the data cached from the saved models (e.g. combobox options) is out of date after commit
+                        transaction.on_commit(functools.partial(modelVersion.changeModelVersions, self.__getModelClasses()))
                         logger.debug("save models savepoint_commit ...")
                         transaction.savepoint_commit(savePoint)
                         logger.debug("save models savepoint_commit done")
@@ -233,6 +245,15 @@ class IkTransaction():
             return Boolean2(False, 'Save data to database failed. Please ask adinistrator to check.')
         return Boolean2(True, data='Saved.')
 
+    def __getModelClasses(self) -> list:
+        modelClasses = []
+        for ikTransactionModel in self.__modelDataList:
+            data = ikTransactionModel.modelData
+            for r in ([data] if isinstance(data, models.Model) else data):
+                if isinstance(r, models.Model) and r.__class__ not in modelClasses:
+                    modelClasses.append(r.__class__)
+        return modelClasses
+
     def __getValidationError(self, ve) -> str:
         s = ''
         for name, msg in ve.message_dict.items():
@@ -270,8 +291,7 @@ class IkTransaction():
 
         # delete first
         if len(deletedRcs) > 0:
-            for r in deletedRcs:
-                r.delete()
+            self.__bulkDelete(modelClass, deletedRcs)
         if len(updatedRcs) > 0:
             # unique check for update rcs- start
             updateFields = None
@@ -279,7 +299,10 @@ class IkTransaction():
             if len(updatedRcs) > 0:
                 updateFields = self.__getUpdateFieldNames(ikTransactionModel, updatedRcs[0])
                 uniqueCheckedRcs = self.__validateUpdateRecords(deletedRcs, updatedRcs, ikTransactionModel, updateFields)
-                saveUpdateOneByOne = len(uniqueCheckedRcs) > 0
+                saveUpdateOneByOne = len(uniqueCheckedRcs) > 0 or not self.__isBulkUpdateSupported(modelClass, updatedRcs)
+                if not saveUpdateOneByOne:
+                    if self.__bulkUpdate(modelClass, updatedRcs, ikTransactionModel, dataWithoutDeletedRcs, updateFields):
+                        updatedRcs = []
                 for r in updatedRcs:
                     # if the record has run unique sql, then ignore the unique check
                     self.__validateRc(r, ikTransactionModel, dataWithoutDeletedRcs, validateUnique=(not saveUpdateOneByOne))
@@ -297,26 +320,168 @@ class IkTransaction():
                         r.concurrencyCheck(beforeUpdate=False)
 
             # unique check for update rcs- end
-            # if saveUpdateOneByOne:
-            #    for r in updatedRcs:
-            #        r.save()
-            # else:
-            #    modelClass.objects.bulk_update(updatedRcs, updateFields)
         if len(newRcs) > 0:
-            self.__validateNewRecords(newRcs, ikTransactionModel, dataWithoutDeletedRcs)
             if ikTransactionModel.bulkCreate:
-                modelClass.objects.bulk_create(newRcs)
+                self.__bulkCreate(modelClass, newRcs, ikTransactionModel)
             else:
+                self.__validateNewRecords(newRcs, ikTransactionModel, dataWithoutDeletedRcs)
                 for newRc in newRcs:
                     newRc.save()
 
+    def __bulkCreate(self, modelClass, newRcs, ikTransactionModel) -> None:
+        '''
+            Validate and insert the new records with a few queries instead of several queries per record:
+                1. the field values are validated without database queries, the foreign keys are checked by the database.
+                2. one "SELECT ... WHERE ... OR ..." query per unique key for unique validation. The duplicate records in
+                   [newRcs] are checked by the database.
+                3. batched "INSERT" statements (QuerySet.bulk_create).
+
+            The pre_save and post_save signals are sent for each record, the same as Model.save(), e.g. the model history.
+        '''
+        foreignKeyFields = [f for f in modelClass._meta.concrete_fields if f.many_to_one]
+        exclude = set(ikTransactionModel.validateExclude or [])
+        exclude.update(f.name for f in foreignKeyFields)
+        for r in newRcs:
+            for field in foreignKeyFields:
+                if field.is_cached(r):  # e.g. the foreign record is inserted in this transaction, update the model.hdr_id
+                    setattr(r, field.name, getattr(r, field.name))
+            r.full_clean(exclude=exclude, validate_unique=False)
+        self.__validateUniqueInBatch(modelClass, newRcs, ikTransactionModel)
+        using = router.db_for_write(modelClass, instance=newRcs[0])
+        for r in newRcs:
+            pre_save.send(sender=modelClass, instance=r, raw=False, using=using, update_fields=None)
+        modelClass._base_manager.using(using).bulk_create(newRcs)
+        for r in newRcs:
+            post_save.send(sender=modelClass, instance=r, created=True, update_fields=None, raw=False, using=using)
+
+    def __bulkDelete(self, modelClass, deletedRcs) -> None:
+        '''
+            Delete the records with one "DELETE ... WHERE id IN (...)" per model. The delete signals and the cascade deletes
+            are the same as Model.delete().
+        '''
+        if modelClass.delete is not models.Model.delete:
+            # the model has its own delete method
+            for r in deletedRcs:
+                r.delete()
+            return
+        for r in deletedRcs:
+            if r.pk is None:
+                raise ValueError("%s object can't be deleted because its %s attribute is set to None." % (r._meta.object_name, r._meta.pk.attname))
+        collector = Collector(using=router.db_for_write(modelClass, instance=deletedRcs[0]))
+        collector.collect(deletedRcs)
+        collector.delete()
+
+    def __isBulkUpdateSupported(self, modelClass, updatedRcs) -> bool:
+        '''
+            The records are saved one by one if the model has its own save method or the records have deferred fields.
+        '''
+        if modelClass.save is not models.Model.save or modelClass.save_base is not models.Model.save_base:
+            return False
+        for r in updatedRcs:
+            if len(r.get_deferred_fields()) > 0:
+                return False
+        return True
+
+    def __bulkUpdate(self, modelClass, updatedRcs, ikTransactionModel, dataWithoutDeletedRcs, updateFieldNames) -> bool:
+        '''
+            Validate and update the records with a few queries instead of one query per record:
+                1. one "SELECT ... WHERE ... OR ..." query per unique key for unique validation.
+                2. one "SELECT id, version_no ... WHERE id IN (...)" for concurrency check before and after updating.
+                3. batched "UPDATE" statements (QuerySet.bulk_update).
+
+            The pre_save and post_save signals are sent for each record, the same as Model.save().
+
+            Return False if the records are not saved because a record takes a unique value from another record in the batch
+            (e.g. A: x -> z, B: y -> x). The database checks the unique keys row by row, so they should be saved one by one in order.
+        '''
+        for r in updatedRcs:
+            self.__validateRc(r, ikTransactionModel, dataWithoutDeletedRcs, validateUnique=False, concurrencyCheck=False)
+        if self.__validateUniqueInBatch(modelClass, updatedRcs, ikTransactionModel):
+            return False
+        isIDModel = issubclass(modelClass, IDModel)
+        if isIDModel:
+            IDModel.concurrencyCheckInBatch(updatedRcs, beforeUpdate=True)
+
+        using = router.db_for_write(modelClass, instance=updatedRcs[0])
+        updateFields = None if ikTransactionModel.updateFields is None else frozenset(ikTransactionModel.updateFields)
+        modelFields = [modelClass._meta.get_field(name) for name in updateFieldNames]
+        for r in updatedRcs:
+            pre_save.send(sender=modelClass, instance=r, raw=False, using=using, update_fields=updateFields)
+            for modelField in modelFields:
+                modelField.pre_save(r, False)  # E.g. auto_now fields
+        modelClass._base_manager.using(using).bulk_update(updatedRcs, updateFieldNames)
+        for r in updatedRcs:
+            r._state.db = using
+            r._state.adding = False
+            post_save.send(sender=modelClass, instance=r, created=False, update_fields=updateFields, raw=False, using=using)
+
+        if isIDModel:
+            IDModel.concurrencyCheckInBatch(updatedRcs, beforeUpdate=False)
+        return True
+
+    def __validateUniqueInBatch(self, modelClass, rcs, ikTransactionModel) -> bool:
+        '''
+            Check the unique keys of the records with one query per unique key. The records which have the same
+            unique values with the other records in database are validated by model.full_clean() again to get the
+            validation message.
+
+            A unique value in database which is given up by another record in [rcs] is not a conflict. Return True if
+            there is such a value, then the records should be validated and saved one by one.
+        '''
+        exclude = ikTransactionModel.validateExclude
+        uniqueChecks, dateChecks = rcs[0]._get_unique_checks(exclude=exclude)
+        isValueReused = False
+        if not ikTransactionModel.validateUnique and all(r.pk is None for r in rcs):
+            return isValueReused
+        if len(dateChecks) > 0:
+            # unique_for_date, unique_for_month and unique_for_year, validate one by one
+            failedRcs = rcs
+        else:
+            failedRcs = []
+            for uniqueModelClass, uniqueFieldNames in uniqueChecks:
+                uniqueFields = [uniqueModelClass._meta.get_field(name) for name in uniqueFieldNames]
+                if any(f.primary_key for f in uniqueFields):
+                    continue  # no need to check the primary key when updating
+                rcsByValues = {}
+                valuesByPk = {}  # the new unique values of the records in [rcs]
+                for r in rcs:
+                    values = tuple(getattr(r, f.attname) for f in uniqueFields)
+                    if r.pk is not None:
+                        valuesByPk[r.pk] = values
+                    if None not in values:
+                        rcsByValues.setdefault(values, []).append(r)
+                uniqueValues = list(rcsByValues.keys())
+                for i in range(0, len(uniqueValues), UNIQUE_CHECK_BATCH_SIZE):
+                    q = Q()
+                    for values in uniqueValues[i:i + UNIQUE_CHECK_BATCH_SIZE]:
+                        q |= Q(**{f.name: value for f, value in zip(uniqueFields, values)})
+                    for dbRc in uniqueModelClass._default_manager.filter(q).values_list('pk', *[f.attname for f in uniqueFields]):
+                        sameValueRcs = rcsByValues.get(tuple(dbRc[1:]), None)
+                        if sameValueRcs is None:
+                            # the database compares the values in a different way (E.g. data type, collation), validate one by one
+                            failedRcs.extend([r for values in uniqueValues[i:i + UNIQUE_CHECK_BATCH_SIZE] for r in rcsByValues[values]])
+                            break
+                        conflictRcs = [r for r in sameValueRcs if r.pk != dbRc[0]]
+                        if len(conflictRcs) > 0 and dbRc[0] in valuesByPk and valuesByPk[dbRc[0]] != tuple(dbRc[1:]):
+                            isValueReused = True  # the database record gives up the value in this batch
+                        else:
+                            failedRcs.extend(conflictRcs)
+        if isValueReused or not ikTransactionModel.validateUnique:
+            return isValueReused
+        checkedRcs = set()
+        for r in failedRcs:
+            if id(r) not in checkedRcs:
+                checkedRcs.add(id(r))
+                r.full_clean(exclude=exclude, validate_unique=True)
+        return isValueReused
+
     def __getUpdateFieldNames(self, ikTransactionModel, rc) -> list:
         updateFields = ikTransactionModel.updateFields
         if updateFields is None:
             updateFields = self.__getModelFullUpdateFieldNames(rc)
         return updateFields
 
-    def __validateRc(self, rc, ikTransactionModel, rcs, validateUnique=True):
+    def __validateRc(self, rc, ikTransactionModel, rcs, validateUnique=True, concurrencyCheck=True):
         for field in rc._meta.get_fields():
             try:
                 if field.many_to_one and len(field.to_fields) > 0:  # e.g. set model.hdr = model.hdr to update the model.hdr_id
@@ -345,7 +510,7 @@ class IkTransaction():
                     for name, typ, val, err in bad:
                         logger.error(f"model.full_clean error. field={name}, type={typ}, value={val!r}, error={err}")
                 raise
-        if isinstance(rc, IDModel) and rc.ik_is_status_modified():
+        if concurrencyCheck and isinstance(rc, IDModel) and rc.ik_is_status_modified():
             rc.concurrencyCheck(beforeUpdate=True)
 
     def __getModelFullUpdateFieldNames(self, modelRecord) -> list:
@@ -444,6 +609,8 @@ class IkTransaction():
         dbTable = modelClass._meta.db_table
         conn = transaction.get_connection()
         for uniqueFiledNames in uniqueFieldsList:
+            # read the unique values of all the updating records from database
+            dbUniqueValues = self.__getDatabaseUniqueValues(conn, updatedRcs, uniqueFiledNames) if hasIDField and len(updatedRcs) > 1 else {}
             for rcIndex in range(len(updatedRcs)):
                 rc = updatedRcs[rcIndex]
                 uniqueValues = self.__getFieldValues(rc, uniqueFiledNames)
@@ -466,35 +633,12 @@ class IkTransaction():
                 for i in range(rcIndex + 1, len(updatedRcs)):
                     nextRc = updatedRcs[i]
                     if hasIDField:
-                        modelFields = nextRc._meta.fields
-                        sql = 'SELECT '
-                        for j in range(len(uniqueFiledNames)):
-                            if j > 0:
-                                sql += ','
-                            modelField = None
-                            for mf in modelFields:
-                                if mf.is_relation:  # E.g. hdr -> hdr_id, hdr_id -> hdr
-                                    if mf.column == uniqueFiledNames[j] or mf.name == uniqueFiledNames[j]:
-                                        modelField = mf
-                                        break
-                                else:
-                                    if mf.name == uniqueFiledNames[j]:
-                                        modelField = mf
-                                        break
-                            if modelField is None:
-                                raise IkException('Field [%s] does not exist in [%s]. Please check the unique keys: %s' %
-                                                  (uniqueFiledNames[j], nextRc._meta.label, str(uniqueFiledNames)))
-                            sql += modelField.column
-                        sql += ' FROM ' + dbTable + ' WHERE id=' + dbUtils.toSqlField(nextRc.id)
-                        rs = None
-                        with conn.cursor() as cursor:
-                            cursor.execute(sql)
-                            rs = cursor.fetchall()
-                        if not dbUtils.isEmpty(rs):
-                            if self.__isTheSame(modelClass, uniqueFiledNames, uniqueValues, rs[0]):
+                        nextRcDbUniqueValues = dbUniqueValues.get(nextRc.id, None)
+                        if nextRcDbUniqueValues is not None:
+                            if self.__isTheSame(modelClass, uniqueFiledNames, uniqueValues, nextRcDbUniqueValues):
                                 # is this record's unique changed ?
                                 nextRcCurrentUniqueValues = self.__getFieldValues(nextRc, uniqueFiledNames)
-                                if not self.__isTheSame(modelClass, uniqueFiledNames, nextRcCurrentUniqueValues, rs[0]):
+                                if not self.__isTheSame(modelClass, uniqueFiledNames, nextRcCurrentUniqueValues, nextRcDbUniqueValues):
                                     # get foreign keys
                                     foreignKeys = []
                                     uniqueFiledNamesWithoutForeignKeys = []
@@ -516,12 +660,47 @@ class IkTransaction():
                                     logger.debug(sql)
                                     with conn.cursor() as cursor:
                                         cursor.execute(sql)
+                                    nextRcDbUniqueValues = list(nextRcDbUniqueValues)
+                                    for j in range(len(uniqueFiledNamesWithoutForeignKeys)):
+                                        nextRcDbUniqueValues[uniqueFiledNames.index(uniqueFiledNamesWithoutForeignKeys[j])] = tempUniqueValues[j]
+                                    dbUniqueValues[nextRc.id] = nextRcDbUniqueValues
                                     if rc not in uniqueCheckedRcs:
                                         uniqueCheckedRcs.append(rc)
                     else:  # doesn't have 'id' field, then check the unique field directly
                         pass  # TODO:
         return uniqueCheckedRcs
 
+    def __getDatabaseUniqueValues(self, conn, rcs, uniqueFiledNames) -> dict:
+        '''
+            return {id: [value1, value2...]}. The values are in uniqueFiledNames' order.
+        '''
+        modelFields = rcs[0]._meta.fields
+        columns = []
+        for name in uniqueFiledNames:
+            modelField = None
+            for mf in modelFields:
+                if mf.is_relation:  # E.g. hdr -> hdr_id, hdr_id -> hdr
+                    if mf.column == name or mf.name == name:
+                        modelField = mf
+                        break
+                else:
+                    if mf.name == name:
+                        modelField = mf
+                        break
+            if modelField is None:
+                raise IkException('Field [%s] does not exist in [%s]. Please check the unique keys: %s' %
+                                  (name, rcs[0]._meta.label, str(uniqueFiledNames)))
+            columns.append(modelField.column)
+        dbUniqueValues = {}
+        for i in range(0, len(rcs), UNIQUE_CHECK_BATCH_SIZE):
+            ids = [rc.id for rc in rcs[i:i + UNIQUE_CHECK_BATCH_SIZE]]
+            sql = 'SELECT id,' + ','.join(columns) + ' FROM ' + rcs[0]._meta.db_table + ' WHERE id IN (' + ','.join(['%s'] * len(ids)) + ')'
+            with conn.cursor() as cursor:
+                cursor.execute(sql, ids)
+                for r in cursor.fetchall():
+                    dbUniqueValues[r[0]] = r[1:]
+        return dbUniqueValues
+
     def __validateNewRecords(self, newRcs, ikTransactionModel, dataWithoutDeletedRcs):
         '''
             if validate failed, then raise exception
@@ -1,9 +1,15 @@
+import functools
 import logging
 from datetime import datetime
 
+from django.db import DatabaseError, transaction
+from django.db.models import F
+
+import core.db.model_version as modelVersion
 import core.user.user_manager as UserManager
 from core.core.exception import IkValidateException
 from core.core.lang import Boolean2
+from core.db.model import isModelHistoryEnabled
 from core.db.transaction import IkTransaction
 from core.models import IkInbox, IkInboxPrm
 from core.utils.lang_utils import isNullBlank
@@ -45,33 +51,54 @@ def update_status(operator_id: int, inbox_ids: list, status: str) -> Boolean2:
         inbox_ids (list): inbox id list
         status (str): inbox status
 
-        Update inbox messages
+        Update inbox messages by one "UPDATE ... WHERE id IN (...)" statement. The deleted messages are deleted from database.
+        The messages are saved by IkTransaction if the model history is enabled for IkInbox.
         Return True if success.
     '''
     operator = UserManager.getUserName(userID=operator_id)
     if operator is None:
         raise IkValidateException('Operator [%s] does not exist.' % operator_id)
-    inbox_rcs = []
+    inbox_ids = list(dict.fromkeys(int(inbox_id) for inbox_id in inbox_ids))
+    inbox_rcs = {inbox_id: (owner_id, sts) for inbox_id, owner_id, sts in IkInbox.objects.filter(id__in=inbox_ids).values_list('id', 'owner_id', 'sts')}
+    changed_ids = []
     for inbox_id in inbox_ids:
-        inbox_rc = IkInbox.objects.filter(id=inbox_id).first()
+        inbox_rc = inbox_rcs.get(inbox_id, None)
         if inbox_rc is None:
             raise IkValidateException('Message [%s] does not exist.' % inbox_id)
-        elif inbox_rc.owner_id != operator_id:
+        owner_id, sts = inbox_rc
+        if owner_id != operator_id:
             logger.error("[%s] going to change inbox message [%s]'s status from [%s] to [%s]. Permission Deny: Message owner is [%s]." %
-                         (operator, inbox_rc.sts, status, inbox_rc.owner_id))
+                         (operator, inbox_id, sts, status, owner_id))
             raise IkValidateException('Permission deny.')
-        if inbox_rc.sts == status:
-            continue  # no need to change
-        if status == IkInbox.STATUS_DELETED:  # delete database
-            inbox_rc.ik_set_status_delete()
-        else:  # update
-            inbox_rc.sts = status
-            inbox_rc.ik_set_status_modified()
-        inbox_rcs.append(inbox_rc)
+        if sts != status:  # no need to change if it's the same
+            changed_ids.append(inbox_id)
+    if len(changed_ids) == 0:
+        return Boolean2(True, 'No data changed.')
+    if isModelHistoryEnabled(IkInbox):
+        # QuerySet.update() doesn't send the save signals, save by IkTransaction to keep the model history
+        inbox_rcs = list(IkInbox.objects.filter(id__in=changed_ids, owner_id=operator_id))
+        for inbox_rc in inbox_rcs:
+            if status == IkInbox.STATUS_DELETED:  # delete database
+                inbox_rc.ik_set_status_delete()
+            else:  # update
+                inbox_rc.sts = status
+                inbox_rc.ik_set_status_modified()
+        ptrn = IkTransaction(userID=operator_id)
+        ptrn.add(inbox_rcs)
+        return ptrn.save()
     # save to database
-    ptrn = IkTransaction(userID=operator_id)
-    ptrn.add(inbox_rcs)
-    return ptrn.save()
+    try:
+        with transaction.atomic():
+            inbox_qs = IkInbox.objects.filter(id__in=changed_ids, owner_id=operator_id)
+            if status == IkInbox.STATUS_DELETED:  # delete database
+                inbox_qs.delete()
+            else:  # update
+                inbox_qs.update(sts=status, version_no=F('version_no') + 1)
+            transaction.on_commit(functools.partial(modelVersion.changeModelVersions, [IkInbox, IkInboxPrm]))
+    except DatabaseError as e:
+        logger.error(e, exc_info=True)
+        return Boolean2(False, 'Update message status failed.')
+    return Boolean2(True, 'Saved.')
 
 
 def get_link_params(inbox_id: int) -> dict:
@@ -90,9 +117,6 @@ def send(sender_id: int, receiver_ids: int | list, module: str, summary: str, li
     # validation
     if sender_id is None:
         raise IkValidateException('Parameter [senderID] is mandatory!')
-    sender = UserManager.getUserName(userID=sender_id)
-    if sender is None:
-        raise IkValidateException('Sender [%s] does not exist.' % sender_id)
     if isNullBlank(receiver_ids):
         raise IkValidateException('Parameter [receiverIDs] is mandatory!')
     elif type(receiver_ids) == int:
@@ -101,9 +125,12 @@ def send(sender_id: int, receiver_ids: int | list, module: str, summary: str, li
         raise IkValidateException('Parameter [receiverIDs] should be an int or an int list!')
     elif len(receiver_ids) == 0:
         raise IkValidateException('Parameter [receiverIDs] cannot be empty!')
+    # the sender and receivers' names by one query
+    user_names = UserManager.getUserNames([sender_id] + receiver_ids)
+    if int(sender_id) not in user_names:
+        raise IkValidateException('Sender [%s] does not exist.' % sender_id)
     for receiver_id in receiver_ids:
-        receiver = UserManager.getUserName(userID=receiver_id)
-        if receiver is None:
+        if int(receiver_id) not in user_names:
             raise IkValidateException(False, 'Receiver [%s] does not exist.' % receiver_id)
     if isNullBlank(module):
         raise IkValidateException(False, 'Parameter [Module] is mandatory.')
@@ -114,10 +141,11 @@ def send(sender_id: int, receiver_ids: int | list, module: str, summary: str, li
     # prepare model records
     inbox_rcs = []
     inbox_prm_rcs = []
+    send_dt = datetime.now()
     for receiver_id in receiver_ids:
         inbox_rc = IkInbox(owner_id=receiver_id,
                            sender_id=sender_id,
-                           send_dt=datetime.now(),
+                           send_dt=send_dt,
                            sts=IkInbox.STATUS_NEW,
                            summary=summary,
                            module=module)
@@ -125,10 +153,10 @@ def send(sender_id: int, receiver_ids: int | list, module: str, summary: str, li
         if link_params is not None and len(link_params) > 0:
             for name, value in link_params.items():
                 inbox_prm_rcs.append(IkInboxPrm(inbox=inbox_rc, k=name, v=(None if isNullBlank(value) else value)))
-    # save to database
+    # save to database: one bulk_create per model. The parameter names are unique in a new inbox, so no need to check them in database.
     ptrn = IkTransaction(userID=sender_id)
-    ptrn.add(inbox_rcs)
-    ptrn.add(inbox_prm_rcs)
+    ptrn.add(inbox_rcs, bulkCreate=True)
+    ptrn.add(inbox_prm_rcs, validateUnique=False, bulkCreate=True)
     b = ptrn.save()
     if not b.value:
         raise IkValidateException(b.dataStr)
@@ -0,0 +1,366 @@
+'''
+    Request profiler.
+
+    A request is a trace, and the trace has nested spans, e.g.
+        request (AuthAPIView.dispatch)
+            acl
+            screen.build
+            request.parse
+            action
+                sql
+                serialize
+
+    Configure in config.ini [System]:
+        debugRunTime:              true/false. Default to false. If it's false, span() returns a shared empty span, it costs
+                                   about a function call.
+        debugRunTimeSampleRate:    0 - 1. The percent of the requests to profile. Default to 1.
+        debugRunTimeOutputFile:    JSON lines file, one span per line. Default to var/logs/runtime.jsonl.
+        debugRunTimeFlushInterval: seconds. Default to 5.
+
+    The current span is kept in a context variable, so the spans are nested without passing them around. The finished
+    spans are appended to a buffer of the current thread (no lock), and the buffer is written to the output file at the
+    end of a trace if it's full or it's not written in [debugRunTimeFlushInterval] seconds, and when the process exits.
+
+    Usage:
+        from core.log import profiler
+
+        with profiler.trace('job', name='sync'):
+            with profiler.span('load', table='ik_menu'):
+                ...
+
+    Aggregate the output file (p50/p95/p99 in milliseconds):
+        python -m core.log.profiler var/logs/runtime.jsonl [--group-by action] [--json]
+'''
+import argparse
+import atexit
+import contextvars
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import weakref
+from contextlib import ExitStack
+from pathlib import Path
+
+from iktools import IkConfig
+
+logger = logging.getLogger('ikyo')
+
+SQL_MAX_LENGTH = 200
+FLUSH_SIZE = 1000
+
+
+def __getOutputFile(outputFile: str) -> Path:
+    outputFile = outputFile.replace('\\', '/').strip()
+    if not outputFile.startswith('/'):
+        from core.core import fs as ikfs
+        if outputFile.startswith('var/'):
+            outputFile = outputFile[4:]
+        outputFile = ikfs.getVarFolder(outputFile)
+    return Path(outputFile)
+
+
+__enabled = str(IkConfig.get('System', 'debugRunTime', 'false')).strip().lower() == 'true'
+__sampleRate = float(IkConfig.get('System', 'debugRunTimeSampleRate', 1))
+__outputFile = None
+__flushInterval = float(IkConfig.get('System', 'debugRunTimeFlushInterval', 5))
+
+__currentSpan = contextvars.ContextVar('ikProfilerSpan', default=None)
+__threadBuffers = threading.local()
+__allBuffers = []  # [(thread weak reference, buffer)]
+__allBuffersLock = threading.Lock()
+__outputLock = threading.Lock()
+
+
+def configure(enabled: bool = None, sampleRate: float = None, outputFile=None, flushInterval: float = None) -> None:
+    '''
+        Change the configuration at runtime. E.g. in the tests. The pending spans are written first.
+    '''
+    global __enabled, __sampleRate, __outputFile, __flushInterval
+    flush()
+    if enabled is not None:
+        __enabled = enabled
+    if sampleRate is not None:
+        __sampleRate = float(sampleRate)
+    if outputFile is not None:
+        __outputFile = Path(outputFile)
+    if flushInterval is not None:
+        __flushInterval = float(flushInterval)
+
+
+def isEnabled() -> bool:
+    return __enabled
+
+
+def getOutputFile() -> Path:
+    global __outputFile
+    if __outputFile is None:
+        __outputFile = __getOutputFile(IkConfig.get('System', 'debugRunTimeOutputFile', 'var/logs/runtime.jsonl'))
+    return __outputFile
+
+
+class _NullSpan():
+    '''
+        The span used if the profiler is disabled or the trace is not sampled.
+    '''
+    __slots__ = ()
+
+    sampled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb) -> None:
+        pass
+
+    def setAttribute(self, name: str, value) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span():
+    __slots__ = ('traceID', 'spanIDs', 'spanID', 'parentID', 'name', 'attrs', 'sampled', 'startTime', '_token', '_exitStack')
+
+    def __init__(self, name: str, attrs: dict, parent=None, sampled: bool = True) -> None:
+        if parent is None:
+            self.traceID = os.urandom(8).hex()
+            self.spanIDs = itertools.count(1)
+            self.parentID = None
+        else:
+            self.traceID = parent.traceID
+            self.spanIDs = parent.spanIDs
+            self.parentID = parent.spanID
+        self.spanID = next(self.spanIDs)
+        self.name = name
+        self.attrs = attrs
+        self.sampled = sampled
+        self.startTime = None
+        self._token = None
+        self._exitStack = None
+
+    def __enter__(self):
+        self._token = _setCurrentSpan(self)
+        if self.parentID is None and self.sampled:
+            self._exitStack = _watchSql()
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, tb) -> None:
+        endTime = time.perf_counter()
+        if self._exitStack is not None:
+            self._exitStack.close()
+        _resetCurrentSpan(self._token)
+        if not self.sampled:
+            return
+        if excType is not None:
+            self.attrs['error'] = excType.__name__
+        _addRecord({'ts': round(time.time(), 6), 'trace': self.traceID, 'span': self.spanID, 'parent': self.parentID,
+                    'name': self.name, 'ms': round((endTime - self.startTime) * 1000, 3), 'attrs': self.attrs})
+        if self.parentID is None:
+            _flushIfRequired()
+
+    def setAttribute(self, name: str, value) -> None:
+        self.attrs[name] = value
+
+
+def _setCurrentSpan(span) -> contextvars.Token:
+    return __currentSpan.set(span)
+
+
+def _resetCurrentSpan(token) -> None:
+    __currentSpan.reset(token)
+
+
+def trace(name: str, **attrs):
+    '''
+        Start a trace (root span). It's a span if it's called in a trace.
+    '''
+    if not __enabled:
+        return _NULL_SPAN
+    parent = __currentSpan.get()
+    if parent is not None:
+        return _Span(name, attrs, parent=parent) if parent.sampled else _NULL_SPAN
+    return _Span(name, attrs, sampled=__sampleRate >= 1 or random.random() < __sampleRate)
+
+
+def span(name: str, **attrs):
+    '''
+        Start a span in the current trace. Return an empty span if there is no sampled trace.
+    '''
+    if not __enabled:
+        return _NULL_SPAN
+    parent = __currentSpan.get()
+    if parent is None or not parent.sampled:
+        return _NULL_SPAN
+    return _Span(name, attrs, parent=parent)
+
+
+def getCurrentSpan():
+    '''
+        Return the current span, or an empty span if there is no sampled trace. E.g. getCurrentSpan().setAttribute('action', 'save')
+    '''
+    current = __currentSpan.get() if __enabled else None
+    return _NULL_SPAN if current is None or not current.sampled else current
+
+
+def addSpan(name: str, startTime: float, endTime: float = None, **attrs) -> None:
+    '''
+        Add a finished span to the current trace. startTime and endTime are time.perf_counter() values.
+    '''
+    if not __enabled:
+        return
+    parent = __currentSpan.get()
+    if parent is None or not parent.sampled:
+        return
+    rc = _Span(name, attrs, parent=parent)
+    if endTime is None:
+        endTime = time.perf_counter()
+    _addRecord({'ts': round(time.time(), 6), 'trace': rc.traceID, 'span': rc.spanID, 'parent': rc.parentID,
+                'name': name, 'ms': round((endTime - startTime) * 1000, 3), 'attrs': attrs})
+
+
+def __sqlWrapper(execute, sql, params, many, context):
+    with span('sql', db=context['connection'].alias, many=many, sql=str(sql)[:SQL_MAX_LENGTH]):
+        return execute(sql, params, many, context)
+
+
+def _watchSql() -> ExitStack:
+    from django.db import connections
+    exitStack = ExitStack()
+    for conn in connections.all():
+        exitStack.enter_context(conn.execute_wrapper(__sqlWrapper))
+    return exitStack
+
+
+class _SpanBuffer():
+    __slots__ = ('records', 'lastFlushTime')
+
+    def __init__(self) -> None:
+        self.records = []
+        self.lastFlushTime = time.monotonic()
+
+
+def __getThreadBuffer() -> _SpanBuffer:
+    buffer = getattr(__threadBuffers, 'buffer', None)
+    if buffer is None:
+        buffer = _SpanBuffer()
+        __threadBuffers.buffer = buffer
+        with __allBuffersLock:
+            __allBuffers.append((weakref.ref(threading.current_thread()), buffer))
+    return buffer
+
+
+def _addRecord(record: dict) -> None:
+    __getThreadBuffer().records.append(record)
+
+
+def _flushIfRequired() -> None:
+    buffer = __getThreadBuffer()
+    if len(buffer.records) >= FLUSH_SIZE or time.monotonic() - buffer.lastFlushTime >= __flushInterval:
+        __flushBuffer(buffer)
+
+
+def __flushBuffer(buffer: _SpanBuffer) -> int:
+    records = buffer.records
+    buffer.records = []
+    buffer.lastFlushTime = time.monotonic()
+    if len(records) == 0:
+        return 0
+    try:
+        lines = ''.join(json.dumps(rc, ensure_ascii=False, default=str) + '\n' for rc in records)
+        outputFile = getOutputFile()
+        with __outputLock:
+            outputFile.parent.mkdir(parents=True, exist_ok=True)
+            with open(outputFile, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        return len(records)
+    except Exception as e:
+        logger.error('Write the profiler spans failed: %s' % e, exc_info=True)
+        return 0
+
+
+def flush() -> int:
+    '''
+        Write the spans of all the threads. Return the total spans written.
+    '''
+    with __allBuffersLock:
+        buffers = list(__allBuffers)
+        # the finished threads' buffers are written below
+        __allBuffers[:] = [(threadRef, buffer) for threadRef, buffer in buffers if threadRef() is not None]
+    return sum(__flushBuffer(buffer) for _, buffer in buffers)
+
+
+atexit.register(flush)
+
+
+def readSpans(files: list):
+    '''
+        Read the spans from the output files. The bad lines are ignored.
+    '''
+    for file in files:
+        with open(file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def aggregate(spans, groupBy: str = None) -> list:
+    '''
+        Return [{'name', groupBy, 'count', 'p50', 'p95', 'p99', 'max', 'total'}] in milliseconds, order by total desc.
+        groupBy: a span attribute name. E.g. action.
+    '''
+    groups = {}
+    for rc in spans:
+        key = rc['name'] if groupBy is None else (rc['name'], (rc.get('attrs') or {}).get(groupBy, None))
+        groups.setdefault(key, []).append(rc['ms'])
+    results = []
+    for key, durations in groups.items():
+        durations.sort()
+        result = {'name': key} if groupBy is None else {'name': key[0], groupBy: key[1]}
+        result.update({'count': len(durations),
+                       'p50': round(statistics.median(durations), 3),
+                       'p95': percentile(durations, 95),
+                       'p99': percentile(durations, 99),
+                       'max': durations[-1],
+                       'total': round(sum(durations), 3)})
+        results.append(result)
+    results.sort(key=lambda r: r['total'], reverse=True)
+    return results
+
+
+def percentile(sortedValues: list, percent: int) -> float:
+    '''
+        Nearest rank percentile of the sorted values.
+    '''
+    index = max(0, math.ceil(percent / 100 * len(sortedValues)) - 1)
+    return sortedValues[min(index, len(sortedValues) - 1)]
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m core.log.profiler', description='Aggregate the profiler spans.')
+    parser.add_argument('files', nargs='*', help='Default to [System] debugRunTimeOutputFile in config.ini.')
+    parser.add_argument('--group-by', dest='groupBy', default=None, help='Span attribute name. E.g. action, view.')
+    parser.add_argument('--json', dest='isJson', action='store_true', help='Print json.')
+    args = parser.parse_args(argv)
+    results = aggregate(readSpans(args.files if len(args.files) > 0 else [getOutputFile()]), groupBy=args.groupBy)
+    if args.isJson:
+        print(json.dumps(results, indent=2))
+        return
+    print('%-40s %8s %10s %10s %10s %10s %12s' % ('span', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'total ms'))
+    for r in results:
+        name = r['name'] if args.groupBy is None else '%s [%s]' % (r['name'], r[args.groupBy])
+        print('%-40s %8d %10.3f %10.3f %10.3f %10.3f %12.3f' % (name, r['count'], r['p50'], r['p95'], r['p99'], r['max'], r['total']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,9 +1,13 @@
 import logging
+from threading import Lock
 from typing import Dict
 
-from django.db import connection
+from django.db import connection, transaction
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
+import core.db.model_version as modelVersion
 import core.models as ikModels
 import core.utils.db as dbUtils
 from core.core.exception import IkValidateException
@@ -20,6 +24,151 @@ ACL_READ = 'R'
 ACL_WRITE = 'W'
 ACL_DENY = 'D'
 
+'''
+    The menu index is reloaded when the versions of these models are changed (reference to core/db/model_version.py).
+'''
+MENU_INDEX_MODELS = (ikModels.Menu, ikModels.GroupMenu, ikModels.UserGroup)
+
+
+class _MenuIndex():
+    '''
+        Immutable in-memory snapshot of ik_menu, ik_grp_menu and ik_usr_grp. Don't modify it, build a new one instead.
+
+        menus: {menu ID: {'id', 'menu_nm', 'menu_caption', 'screen_nm', 'parent_menu_id', 'enable', 'order_no', 'is_free_access'}}
+    '''
+
+    def __init__(self, generation, menuRcs: list, groupMenuRcs: list, userGroupRcs: list) -> None:
+        self.generation = generation
+        menus = {}
+        menuNameIndex = {}  # {menu name (lower case): menu ID}. Use the last ID if there are duplicates.
+        screenNameIndex = {}  # {screen name (lower case): [menu ID]}. Order by ID desc.
+        childMenuIndex = {}  # {parent menu ID: [menu ID]}
+        for rc in sorted(menuRcs, key=lambda r: r['id']):
+            parentMenuID = rc['parent_menu_id']
+            rc['parent_menu_id'] = None if parentMenuID is None else int(parentMenuID)
+            menus[rc['id']] = rc
+            menuNameIndex[rc['menu_nm'].lower()] = rc['id']
+            if isNotNullBlank(rc['screen_nm']):
+                screenNameIndex.setdefault(rc['screen_nm'].lower(), []).insert(0, rc['id'])
+            if rc['parent_menu_id'] is not None:
+                childMenuIndex.setdefault(rc['parent_menu_id'], []).append(rc['id'])
+        self.menus = menus
+        self.menuNameIndex = menuNameIndex
+        self.screenNameIndex = screenNameIndex
+        self.childMenuIndex = childMenuIndex
+        self.nodeMenuIDs = frozenset(childMenuIndex.keys())
+
+        groupMenuAcls = {}  # {group ID: {menu ID: set(acl)}}
+        for rc in groupMenuRcs:
+            groupMenuAcls.setdefault(rc['grp_id'], {}).setdefault(rc['menu_id'], set()).add(rc['acl'])
+        self.__groupMenuAcls = groupMenuAcls
+        userGroupIDs = {}  # {user ID: [group ID]}
+        for rc in userGroupRcs:
+            userGroupIDs.setdefault(rc['usr_id'], []).append(rc['grp_id'])
+        self.__userGroupIDs = userGroupIDs
+        self.__userAcls = {}  # {user ID: {menu ID: frozenset(acl)}}, built in the first access of the user.
+
+    @staticmethod
+    def load(generation) -> '_MenuIndex':
+        menuRcs = list(ikModels.Menu.objects.values('id', 'menu_nm', 'menu_caption', 'screen_nm', 'parent_menu_id', 'enable', 'order_no',
+                                                    'is_free_access'))
+        groupMenuRcs = list(ikModels.GroupMenu.objects.values('grp_id', 'menu_id', 'acl'))
+        userGroupRcs = list(ikModels.UserGroup.objects.values('usr_id', 'grp_id'))
+        return _MenuIndex(generation, menuRcs, groupMenuRcs, userGroupRcs)
+
+    def getUserAcls(self, usrID) -> dict:
+        '''
+            Return {menu ID: frozenset(acl)}. The acl set is from the user's groups (ik_grp_menu.acl).
+        '''
+        userAcls = self.__userAcls.get(usrID, None)
+        if userAcls is None:
+            menuAcls = {}
+            for grpID in self.__userGroupIDs.get(usrID, []):
+                for menuID, acls in self.__groupMenuAcls.get(grpID, {}).items():
+                    menuAcls.setdefault(menuID, set()).update(acls)
+            userAcls = {menuID: frozenset(acls) for menuID, acls in menuAcls.items()}
+            self.__userAcls[usrID] = userAcls
+        return userAcls
+
+    def getUserMenuAcl(self, usrID, menuID) -> str:
+        menu = self.menus.get(menuID, None)
+        if menu is None:
+            return None
+        if menu['is_free_access']:
+            return ACL_WRITE
+        acls = self.getUserAcls(usrID).get(menuID, ())
+        if ACL_WRITE in acls:
+            return ACL_WRITE
+        if ACL_READ in acls:
+            return ACL_READ
+        return ACL_DENY
+
+    def getUserAclMenuIDs(self, usrID) -> set:
+        '''
+            Return the menu IDs that the user's groups has an acl except ACL_DENY.
+        '''
+        return set(menuID for menuID, acls in self.getUserAcls(usrID).items() if len(acls - {ACL_DENY}) > 0)
+
+    def getMenuIdByName(self, menuName) -> int:
+        return None if menuName is None else self.menuNameIndex.get(menuName.lower(), None)
+
+    def getMenuIdsByScreenName(self, screenName) -> list:
+        return [] if screenName is None else self.screenNameIndex.get(screenName.lower(), [])
+
+
+__menuIndex = None
+__menuIndexLock = Lock()
+
+
+def _getMenuIndexGeneration() -> dict:
+    '''
+        The versions of ik_menu, ik_grp_menu and ik_usr_grp. They are read from the database at most once per
+        [modelVersionCheckInterval] seconds, so a change made by another process is found after that at the latest.
+    '''
+    return modelVersion.getModelVersions(MENU_INDEX_MODELS)
+
+
+def _getMenuIndex() -> _MenuIndex:
+    global __menuIndex
+    generation = _getMenuIndexGeneration()
+    menuIndex = __menuIndex
+    if menuIndex is None or menuIndex.generation != generation:
+        with __menuIndexLock:
+            menuIndex = __menuIndex
+            if menuIndex is None or menuIndex.generation != generation:
+                menuIndex = _MenuIndex.load(generation)
+                __menuIndex = menuIndex
+                logger.debug('Menu index loaded. Generation=%s, menus=%s' % (generation, len(menuIndex.menus)))
+    return menuIndex
+
+
+def invalidateMenuIndex() -> None:
+    '''
+        Drop the menu index and the model versions of this process, they will be reloaded in the next access. It's called
+        when Menu, Group, GroupMenu or UserGroup saved or deleted. Other processes find the change by the model versions, so
+        increase version_no if these tables are updated by QuerySet.update() or SQL, e.g. update(version_no=F('version_no') + 1).
+    '''
+    global __menuIndex
+    __menuIndex = None
+    modelVersion.changeModelVersions(MENU_INDEX_MODELS)
+
+
+@receiver(post_save, sender=ikModels.Menu)
+@receiver(post_save, sender=ikModels.Group)
+@receiver(post_save, sender=ikModels.GroupMenu)
+@receiver(post_save, sender=ikModels.UserGroup)
+@receiver(post_delete, sender=ikModels.Menu)
+@receiver(post_delete, sender=ikModels.Group)
+@receiver(post_delete, sender=ikModels.GroupMenu)
+@receiver(post_delete, sender=ikModels.UserGroup)
+def _onMenuAclChanged(sender, using=None, **kwargs):
+    # The first one makes the current connection reload the uncommitted changes. Other threads may reload the menu index before
+    # the transaction committed, so drop it again after commit.
+    invalidateMenuIndex()
+    dbConnection = transaction.get_connection(using)
+    if dbConnection.in_atomic_block and not any(callback[1] is invalidateMenuIndex for callback in dbConnection.run_on_commit):
+        transaction.on_commit(invalidateMenuIndex, using=using)
+
 
 class _MenuManager():
 
@@ -34,36 +183,30 @@ class _MenuManager():
             else:  # menu Name
                 parentMenuID = self.getMenuId(parentMenu)
 
-        groups_ids = []
-        menu_ids = []
-        if usrID is not None:
-            groups_ids = ikModels.UserGroup.objects.filter(usr_id=usrID).values_list('grp_id', flat=True)
-            menu_ids = ikModels.GroupMenu.objects.filter(grp__in=groups_ids).exclude(acl=ACL_DENY).values_list('menu_id', flat=True)
-
-        NodeMenus = self.getNodeMenus()
-
-        usrAclMenusQs = ikModels.Menu.objects.filter(Q(is_free_access=True) | Q(id__in=menu_ids)
-                                                     | Q(id__in=NodeMenus)).exclude(enable=False).exclude(menu_nm__iexact='Menu').order_by('order_no', 'menu_caption')
-        if parentMenuID is not None:
-            usrAclMenusQs = usrAclMenusQs.filter(parent_menu_id=parentMenuID).order_by('order_no', 'menu_caption')
-        return usrAclMenusQs
+        menuIndex = _getMenuIndex()
+        usrAclMenuIDs = set() if usrID is None else menuIndex.getUserAclMenuIDs(usrID)
+        menuIDs = []
+        for menu in menuIndex.menus.values():
+            if menu['enable'] is False or menu['menu_nm'].lower() == 'menu':
+                continue
+            if parentMenuID is not None and menu['parent_menu_id'] != parentMenuID:
+                continue
+            if menu['is_free_access'] or menu['id'] in usrAclMenuIDs or menu['id'] in menuIndex.nodeMenuIDs:
+                menuIDs.append(menu['id'])
+        return ikModels.Menu.objects.filter(id__in=menuIDs).order_by('order_no', 'menu_caption')
 
     def getUserMenuAcl(self, usrID, menuID) -> str:
-        menuRc = ikModels.Menu.objects.get(id=menuID)
-        if menuRc:
-            if menuRc.is_free_access:
-                return ACL_WRITE
-            groups_ids = ikModels.UserGroup.objects.filter(usr_id=usrID).values_list('grp_id', flat=True)
-            acl_permissions = ikModels.GroupMenu.objects.filter(grp__in=groups_ids, menu=menuRc).values_list('acl', flat=True)
-            if acl_permissions:
-                if ACL_WRITE in acl_permissions:
-                    return ACL_WRITE
-                if ACL_READ in acl_permissions:
-                    return ACL_READ
-            return ACL_DENY
-        else:
+        acl = _getMenuIndex().getUserMenuAcl(usrID, menuID)
+        if acl is None:
             logger.error("Menu ID[%s] does not exist." % menuID)
             return ACL_DENY
+        return acl
+
+    def getUserGroupMenuAcls(self, usrID, menuID) -> frozenset:
+        '''
+            Return all the acl (ik_grp_menu.acl) of the user's groups for the menu. The free access menu is not considered.
+        '''
+        return _getMenuIndex().getUserAcls(usrID).get(menuID, frozenset())
 
     def getMenuInfoByMenuName(self, menuName) -> dict:
         menuRc = ikModels.Menu.objects.filter(menu_nm__iexact=menuName).order_by('-id').first()
@@ -73,103 +216,83 @@ class _MenuManager():
     #     return True  # TODO:
 
     def getMenuId(self, menuName) -> int:
-        menuRc = ikModels.Menu.objects.filter(menu_nm__iexact=menuName).order_by('-id').first()
-        if isNullBlank(menuRc):
+        menuID = _getMenuIndex().getMenuIdByName(menuName)
+        if menuID is None:
             raise IkValidateException('Menu [%s] is not found.' % str(menuName))
-        return menuRc.id
+        return menuID
 
     def getMenuName(self, menuId) -> str:
-        menuRc = ikModels.Menu.objects.filter(id=menuId).first()
-        if isNullBlank(menuRc):
+        menu = _getMenuIndex().menus.get(menuId, None)
+        if menu is None:
             raise IkValidateException('Menu ID [%s] is not found.' % str(menuId))
-        return menuRc.menu_nm
+        return menu['menu_nm']
 
     def getMenuCaption(self, menuId) -> str:
-        menuRc = ikModels.Menu.objects.filter(id=menuId).first()
-        if isNullBlank(menuRc):
+        menu = _getMenuIndex().menus.get(menuId, None)
+        if menu is None:
             raise IkValidateException('Menu ID [%s] is not found.' % str(menuId))
-        return menuRc.menu_caption
+        return menu['menu_caption']
 
     def getParentMenuByMenuNm(self, menuName: str):
-        parentMenuRc = None
-        menuRc = ikModels.Menu.objects.filter(menu_nm__iexact=menuName).order_by('-id').first()
-        if isNotNullBlank(menuRc):
-            parentMenuID = menuRc.parent_menu_id
-            parentMenuRc = ikModels.Menu.objects.filter(id=parentMenuID).first()
-        return parentMenuRc
+        menuIndex = _getMenuIndex()
+        menuID = menuIndex.getMenuIdByName(menuName)
+        return None if menuID is None else self.__getMenuRc(menuIndex.menus[menuID]['parent_menu_id'])
 
     def getParentMenuByMenuId(self, menuID: int):
-        parentMenuRc = None
-        menuRc = ikModels.Menu.objects.filter(id=menuID).first()
-        if isNotNullBlank(menuRc):
-            parentMenuID = menuRc.parent_menu_id
-            parentMenuRc = ikModels.Menu.objects.filter(id=parentMenuID).first()
-        return parentMenuRc
+        menu = _getMenuIndex().menus.get(menuID, None)
+        return None if menu is None else self.__getMenuRc(menu['parent_menu_id'])
+
+    def __getMenuRc(self, menuID: int):
+        return None if menuID is None else ikModels.Menu.objects.filter(id=menuID).first()
 
     def getParentMenuIdByMenuNm(self, menuName: str) -> int:
-        menuRc = ikModels.Menu.objects.filter(menu_nm__iexact=menuName).order_by('-id').first()
-        if isNullBlank(menuRc):
+        menuIndex = _getMenuIndex()
+        menuID = menuIndex.getMenuIdByName(menuName)
+        if menuID is None:
             raise IkValidateException('Menu [%s] is not found.' % str(menuName))
-        return menuRc.parent_menu_id
+        return menuIndex.menus[menuID]['parent_menu_id']
 
     def getParentMenuIdByMenuId(self, menuID: int) -> int:
-        menuRc = ikModels.Menu.objects.filter(id=menuID).first()
-        if isNullBlank(menuRc):
+        menu = _getMenuIndex().menus.get(menuID, None)
+        if menu is None:
             raise IkValidateException('Menu ID[%s] is not found.' % str(menuID))
-        return menuRc.parent_menu_id
+        return menu['parent_menu_id']
 
     # YL.ikyo, 2023-02-10
     # get user all have permission menus (Top & Level1 & Level2 & Level3 menus)
     def getUserAclMenus(self, usrId, parentMenuId=None) -> list:
-        usrAclMenuIDs = []
+        menuIndex = _getMenuIndex()
+        usrAclMenuIDs = set()
         # 1. get all user have permission menus (remove offline menus,  remove parent menus(will add later if sub menus has permission))
-        groups_ids = ikModels.UserGroup.objects.filter(usr_id=usrId).values_list('grp_id', flat=True)
-        menu_ids = ikModels.GroupMenu.objects.filter(grp__in=groups_ids).exclude(acl=ACL_DENY).values_list('menu_id', flat=True)
-        usrAclMenusQs = ikModels.Menu.objects.filter(Q(is_free_access=True) | Q(id__in=menu_ids)).exclude(enable=False).exclude(menu_nm__iexact='Menu').order_by('order_no')
+        groupAclMenuIDs = menuIndex.getUserAclMenuIDs(usrId)
         # If specified Top Menu should just get all Top Menu's sub menu(loop to level3 menus)
-        if parentMenuId is not None:
-            allSubMenuIDs = []
-            sql = "SELECT t.id AS top_menu_id, t.menu_caption AS top_menu_caption,"
-            sql += " l1.id AS l1_menu_id, l1.menu_caption AS l1_menu_caption,"
-            sql += " l2.id AS l2_menu_id, l2.menu_caption AS l2_menu_caption,"
-            sql += " l3.id AS l3_menu_id, l3.menu_caption AS l3_menu_caption"
-            sql += " FROM ik_menu t LEFT JOIN ik_menu l1 ON t.id=l1.parent_menu_id"
-            sql += " LEFT JOIN ik_menu l2 ON l1.id=l2.parent_menu_id LEFT JOIN ik_menu l3 ON l2.id=l3.parent_menu_id"
-            sql += " WHERE t.id=" + str(parentMenuId) + " ORDER BY t.order_no, l1.order_no, l2.order_no, l3.order_no"
-            with connection.cursor() as cursor:
-                cursor.execute(sql)
-                menus = dbUtils.dictfetchall(cursor)
-                for m in menus:
-                    if m['top_menu_id'] is not None:
-                        if (m['top_menu_id'] not in allSubMenuIDs):
-                            allSubMenuIDs.append(m['top_menu_id'])
-                        if (m['l1_menu_id'] not in allSubMenuIDs):
-                            allSubMenuIDs.append(m['l1_menu_id'])
-                        if (m['l2_menu_id'] not in allSubMenuIDs):
-                            allSubMenuIDs.append(m['l2_menu_id'])
-                        if (m['l3_menu_id'] not in allSubMenuIDs):
-                            allSubMenuIDs.append(m['l3_menu_id'])
-            if len(allSubMenuIDs) > 0:
-                usrAclMenusQs = usrAclMenusQs.filter(parent_menu_id__in=allSubMenuIDs).order_by('order_no')
+        allSubMenuIDs = None
+        if parentMenuId is not None and int(parentMenuId) in menuIndex.menus:
+            allSubMenuIDs = set([int(parentMenuId)])
+            levelMenuIDs = [int(parentMenuId)]
+            for _level in range(3):
+                levelMenuIDs = [subMenuID for menuID in levelMenuIDs for subMenuID in menuIndex.childMenuIndex.get(menuID, [])]
+                allSubMenuIDs.update(levelMenuIDs)
         # check user has menu permission
-        for m in usrAclMenusQs:
-            if m.parent_menu_id is not None and int(m.parent_menu_id) not in usrAclMenuIDs:
-                usrAclMenuIDs.append(int(m.parent_menu_id))
-            if m.id is not None and m.id not in usrAclMenuIDs:
-                usrAclMenuIDs.append(m.id)
+        for m in menuIndex.menus.values():
+            if m['enable'] is False or m['menu_nm'].lower() == 'menu':
+                continue
+            if not m['is_free_access'] and m['id'] not in groupAclMenuIDs:
+                continue
+            if allSubMenuIDs is not None and m['parent_menu_id'] not in allSubMenuIDs:
+                continue
+            if m['parent_menu_id'] is not None:
+                usrAclMenuIDs.add(m['parent_menu_id'])
+            usrAclMenuIDs.add(m['id'])
 
         # 2. auto get parent menu by user have permission sub menus(1)
-        dbAllMenusDict = {}
-        for menuDict in ikModels.Menu.objects.exclude(parent_menu_id__isnull=True).values('id', 'parent_menu_id'):
-            dbAllMenusDict[menuDict['id']] = int(menuDict['parent_menu_id'])
-        for menuDict in ikModels.Menu.objects.exclude(parent_menu_id__isnull=True).values('id', 'parent_menu_id'):
-            dbAllMenusDict[menuDict['id']] = int(menuDict['parent_menu_id'])
-        for menuID in [menuID for menuID in usrAclMenuIDs]:
-            parentMenuID = dbAllMenusDict.get(menuID, None)
-            while parentMenuID is not None:
-                if parentMenuID not in usrAclMenuIDs:
-                    usrAclMenuIDs.append(parentMenuID)
-                parentMenuID = dbAllMenusDict.get(parentMenuID, None)
+        for menuID in list(usrAclMenuIDs):
+            menu = menuIndex.menus.get(menuID, None)
+            parentMenuID = None if menu is None else menu['parent_menu_id']
+            while parentMenuID is not None and parentMenuID not in usrAclMenuIDs:
+                usrAclMenuIDs.add(parentMenuID)
+                menu = menuIndex.menus.get(parentMenuID, None)
+                parentMenuID = None if menu is None else menu['parent_menu_id']
 
         usrMenuQs = ikModels.Menu.objects.filter(id__in=usrAclMenuIDs)
         if parentMenuId is None:
@@ -180,29 +303,32 @@ class _MenuManager():
         """Get menu names by screen name.
         """
         import core.menu.menu as coreMenu
-        menuRcs = ikModels.Menu.objects.filter(screen_nm__iexact=screenName).order_by('-id')
-        menuRc = menuRcs.first()
         if coreMenu.MENU_FILTERS:
-            menuRc = coreMenu.MENU_FILTERS.get("menuFilter")(screenName)
-        if isNullBlank(menuRc):
-            logger.error('Screen [%s] is not found in ik_menu table.' % screenName)
-            raise IkValidateException('Screen [%s] is not found.' % screenName)
-        if isNullBlank(coreMenu.MENU_FILTERS) and len(menuRcs) > 1:
-            logger.debug('Too many manus found for screen [%s], please check. System use the first menu(%s) instead.' % (screenName, menuRc.id))
-        return menuRc.menu_nm
+            return self.__getMenuRcByScreenName(screenName).menu_nm
+        return _getMenuIndex().menus[self.__getMenuIdByScreenName(screenName)]['menu_nm']
 
     def getMenuIdByScreenName(self, screenName: str) -> int:
         import core.menu.menu as coreMenu
-        menuRcs = ikModels.Menu.objects.filter(screen_nm__iexact=screenName).order_by('-id')
-        menuRc = menuRcs.first()
         if coreMenu.MENU_FILTERS:
-            menuRc = coreMenu.MENU_FILTERS.get("menuFilter")(screenName)
+            return self.__getMenuRcByScreenName(screenName).id
+        return self.__getMenuIdByScreenName(screenName)
+
+    def __getMenuRcByScreenName(self, screenName: str):
+        import core.menu.menu as coreMenu
+        menuRc = coreMenu.MENU_FILTERS.get("menuFilter")(screenName)
         if isNullBlank(menuRc):
             logger.error('Screen [%s] is not found in ik_menu table.' % screenName)
             raise IkValidateException('Screen [%s] is not found.' % screenName)
-        if isNullBlank(coreMenu.MENU_FILTERS) and len(menuRcs) > 1:
-            logger.debug('Too many manus found for screen [%s], please check. System use the first menu(%s) instead.' % (screenName, menuRc.id))
-        return menuRc.id
+        return menuRc
+
+    def __getMenuIdByScreenName(self, screenName: str) -> int:
+        menuIDs = _getMenuIndex().getMenuIdsByScreenName(screenName)
+        if len(menuIDs) == 0:
+            logger.error('Screen [%s] is not found in ik_menu table.' % screenName)
+            raise IkValidateException('Screen [%s] is not found.' % screenName)
+        if len(menuIDs) > 1:
+            logger.debug('Too many manus found for screen [%s], please check. System use the first menu(%s) instead.' % (screenName, menuIDs[0]))
+        return menuIDs[0]
 
     def __getScreenName(self, classInstance) -> str:
         className = classInstance.__class__.__name__
@@ -217,10 +343,9 @@ class _MenuManager():
             if menuID is None:
                 raise IkValidateException('Screen menu [%s] is not found.' % screenName)
         else:
-            menuInfo = self.getMenuInfoByMenuName(menuName)
-            if menuInfo is None:
+            menuID = _getMenuIndex().getMenuIdByName(menuName)
+            if menuID is None:
                 raise IkValidateException('Menu [%s] is not found.' % menuName)
-            menuID = menuInfo.id
 
         acl = self.getUserMenuAcl(request.user.id, menuID)
 
@@ -256,13 +381,16 @@ class _MenuManager():
 
     def getTopMenu(self, menu: ikModels.Menu):
         if menu is not None:
-            while True:
-                if menu.parent_menu_id is None:
-                    return menu
-                else:
-                    menu = ikModels.Menu.objects.filter(id=menu.parent_menu_id).first()
-                    if menu is None:
-                        break
+            if menu.parent_menu_id is None:
+                return menu
+            menus = _getMenuIndex().menus
+            topMenu = menus.get(int(menu.parent_menu_id), None)
+            visitedMenuIDs = set()
+            while topMenu is not None and topMenu['parent_menu_id'] is not None and topMenu['id'] not in visitedMenuIDs:
+                visitedMenuIDs.add(topMenu['id'])
+                topMenu = menus.get(topMenu['parent_menu_id'], None)
+            if topMenu is not None and topMenu['parent_menu_id'] is None:
+                return self.__getMenuRc(topMenu['id'])
         return None
 
     def isSubMenus(self, menuID1, menuID2, max_loop=10):
@@ -285,8 +413,10 @@ class _MenuManager():
                 raise IkValidateException('Detected circular reference in menu hierarchy. A menu cannot be a sub-menu of its own indirect/direct sub-menus.')
 
     def build_menu_index(self) -> Dict[int, dict]:
-        rows = ikModels.Menu.objects.values('id', 'menu_nm', 'menu_caption', 'parent_menu_id')
-        return {r['id']: r for r in rows}
+        '''
+            Return {menu ID: menu}. It's shared, don't modify it.
+        '''
+        return _getMenuIndex().menus
 
     def get_full_menu_name(self, menu_id: int) -> str:
         menu_index = self.build_menu_index()
@@ -358,15 +488,8 @@ class _MenuManager():
             raise 'No valid menu found for the menu id: %s.' % menuID
 
     def getNodeMenus(self):
-        sql = 'SELECT m1.* FROM ik_menu m1 WHERE EXISTS (SELECT 1 FROM ik_menu m2 WHERE m2.parent_menu_id = m1.id)'
-        rcs = None
-        with connection.cursor() as cursor:
-            cursor.execute(sql)
-            rcs = dbUtils.dictfetchall(cursor)
-        screenIDs = []
-        for r in rcs:
-            screenIDs.append(r['id'])
-        return screenIDs
+        menuIndex = _getMenuIndex()
+        return [menuID for menuID in menuIndex.menus.keys() if menuID in menuIndex.nodeMenuIDs]
 
     def getAllSubMenus(self, parentMenuID):
         childMenus = ikModels.Menu.objects.filter(parent_menu_id=parentMenuID).exclude(enable=False)
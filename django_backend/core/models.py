@@ -478,6 +478,10 @@ class Mail(IDModel):
     send_ts = models.DateTimeField(blank=True, null=True, verbose_name='Send Date')
     duration = models.BigIntegerField(blank=True, null=True, verbose_name='Send Duration')
     error = models.TextField(blank=True, null=True, verbose_name='Error')
+    attempts = models.IntegerField(default=0, verbose_name='Send Failed Times')
+    next_attempt_ts = models.DateTimeField(blank=True, null=True, verbose_name='Next Attempt Date')
+    claimed_by = models.CharField(max_length=100, blank=True, null=True, verbose_name='Claimed By')
+    claim_ts = models.DateTimeField(blank=True, null=True, verbose_name='Claim Date')
 
     class Meta:
         managed = True
@@ -587,6 +591,7 @@ class CronJob(IdDateModel):
     task = models.CharField(max_length=255, blank=True, null=True, verbose_name='Tasks')
     args = models.TextField(blank=True, null=True, verbose_name='Arguments')
     enable = models.BooleanField(blank=True, null=True, verbose_name='Enable')
+    max_instances = models.IntegerField(blank=True, null=True, verbose_name='Max running instances. Empty means 1 (no overlap)')
     dsc = models.CharField(max_length=255, blank=True, null=True, verbose_name='Description')
 
     class Meta:
@@ -594,6 +599,39 @@ class CronJob(IdDateModel):
         verbose_name = "Cron Job"
 
 
+class CronJobRun(IDModel):
+    OUTCOME_SUCCESS = 'success'
+    OUTCOME_ERROR = 'error'
+    OUTCOME_SKIPPED = 'skipped'  # max running instances reached
+    OUTCOME_MISSED = 'missed'  # not run in the misfire grace time, e.g. the scheduler was too busy
+
+    cron_job = models.ForeignKey(CronJob, models.CASCADE, verbose_name='Cron Job')
+    task = models.CharField(max_length=255, blank=True, null=True, verbose_name='Task')
+    scheduled_dt = models.DateTimeField(blank=True, null=True, verbose_name='Scheduled Date')
+    start_dt = models.DateTimeField(blank=True, null=True, verbose_name='Start Date')
+    end_dt = models.DateTimeField(blank=True, null=True, verbose_name='End Date')
+    duration = models.FloatField(blank=True, null=True, verbose_name='Duration (ms)')
+    outcome = models.CharField(max_length=10, verbose_name='Outcome')
+    error = models.TextField(blank=True, null=True, verbose_name='Error')
+    host = models.CharField(max_length=255, blank=True, null=True, verbose_name='Host')
+    pid = models.IntegerField(blank=True, null=True, verbose_name='Process ID')
+
+    class Meta:
+        db_table = '%scron_job_run' % TABLE_NAME_PREFIX
+        verbose_name = "Cron Job Run"
+        indexes = [models.Index(fields=['cron_job', 'scheduled_dt'])]
+
+
+class CronLease(IDModel):
+    lease_nm = models.CharField(max_length=100, unique=True, verbose_name='Lease Name')
+    owner = models.CharField(max_length=255, verbose_name='Owner')
+    expire_dt = models.DateTimeField(verbose_name='Expiry Date')
+
+    class Meta:
+        db_table = '%scron_lease' % TABLE_NAME_PREFIX
+        verbose_name = "Cron Lease"
+
+
 def coreHistoryFilter(sender, instance, **kwargs) -> bool:
     return not isinstance(instance, AccessLog) and not isinstance(instance, UsrToken)
 
@@ -6,6 +6,7 @@ import traceback
 from typing import List
 
 from ..utils.json_prune import prune_non_jsonable
+from .tracker import isWatchedValueChanged, refreshSessionExpiry
 
 logger = logging.getLogger(__name__)
 
@@ -20,10 +21,16 @@ class SessionSanitizerMiddleware:
     Production-ready session sanitizer:
 
     - Response phase (before SessionMiddleware persists the session):
-        * Unconditionally deep-prunes session data to remove/convert any
-          non-JSON-serializable values; logs dropped paths (deduplicated),
-          updates the session, and marks it modified. This catches nested
-          mutations that happen after initial writes.
+        * The values are sanitized when they are written by the session
+          helpers (see core/session/tracker.py), so the session is not
+          traversed here.
+        * Marks the session modified if a mutable value read by the session
+          helpers is changed in place.
+        * Refreshes the session expiry date at most once per
+          [Session] expiryRefreshInterval seconds if the session is not
+          changed, also in the requests which don't use the session.
+          Otherwise the session is not saved (the settings don't set
+          SESSION_SAVE_EVERY_REQUEST).
 
     - Request phase wrapping of session.save():
         * If session.save() raises TypeError (e.g., JSONSerializer choking on
@@ -38,8 +45,8 @@ class SessionSanitizerMiddleware:
       - This acts as a safety net. The correct long-term fix is to avoid
         storing ORM/custom objects in the session. Prefer IDs or small
         JSONable dicts.
-      - Logging levels: pre-scan uses WARNING; retry-scan uses ERROR.
-        Tune via Django LOGGING config as needed.
+      - Logging levels: write-time sanitizing uses WARNING; retry-scan
+        uses ERROR. Tune via Django LOGGING config as needed.
     """
 
     def __init__(self, get_response):
@@ -84,20 +91,12 @@ class SessionSanitizerMiddleware:
         # Call the view
         response = self.get_response(request)
 
-        # --- Response phase: unconditional pre-save prune (does not rely on `modified`)
+        # --- Response phase: save the session only if it's changed, or its expiry date should be refreshed
         sess = getattr(request, "session", None)
-        if sess:
-            raw = self._snapshot_session(sess)
-            cleaned, removed = prune_non_jsonable(raw, path="")
-            if removed:
-                unique_removed = _dedupe_preserve_order(removed)
-                logger.warning(
-                    "[pre-scan] Session pre-save auto-pruned %d entr%s:\n%s",
-                    len(unique_removed),
-                    "y" if len(unique_removed) == 1 else "ies",
-                    "\n".join(f"  - {p}" for p in unique_removed),
-                )
-                self._replace_session(sess, cleaned)
+        if sess is not None:
+            if sess.accessed and not sess.modified and isWatchedValueChanged(sess):
+                sess.modified = True
+            refreshSessionExpiry(sess)
 
         return response
 
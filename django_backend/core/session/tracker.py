@@ -0,0 +1,103 @@
+'''
+    Django session change tracking.
+
+    The session is saved only if it's changed (settings.SESSION_SAVE_EVERY_REQUEST = False):
+        1. The session helpers (reference to core/view/auth_view.py: AuthAPIView.setSessionParameter ...) sanitize the values
+           when they are written, and mark the session modified.
+        2. The mutable values (e.g. dict and list) read by the helpers can be changed in place by the views. The helpers keep
+           their fingerprints, and the fingerprints are checked at the end of the request. Other values are not checked.
+        3. The session expiry date is saved with the session. If the session is not changed, the expiry date is refreshed
+           at most once per [expiryRefreshInterval] seconds (config.ini [Session]), also in the requests which don't use
+           the session.
+
+    Reference to core/session/middleware.py: SessionSanitizerMiddleware.
+'''
+import json
+import logging
+import time
+
+from iktools import IkConfig
+
+from ..utils.json_prune import prune_non_jsonable
+
+logger = logging.getLogger('ikyo')
+
+SESSION_REFRESH_TIMESTAMP_NAME = '$IK_$REFRESH_TS'
+
+EXPIRY_REFRESH_INTERVAL = max(0, int(IkConfig.get('Session', 'expiryRefreshInterval', 60)))
+
+_WATCHED_VALUES_ATTR = '_ik_watched_values'
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def sanitizeSessionValue(value, name: str = None) -> any:
+    '''
+        Convert or delete the values which cannot be saved in the session (JSONSerializer). E.g. a datetime is
+        converted to an ISO 8601 string, and a model instance is deleted.
+    '''
+    if isinstance(value, _SCALAR_TYPES):
+        return value
+    cleaned, removed = prune_non_jsonable(value, path='' if name is None else str(name))
+    if removed:
+        removed = list(dict.fromkeys(removed))
+        logger.warning('Session value [%s] is not JSON serializable, deleted %d entr%s: %s'
+                       % (name, len(removed), 'y' if len(removed) == 1 else 'ies', ', '.join(removed)))
+    elif type(cleaned) == type(value) and cleaned == value:
+        # keep the caller's object, it can be changed in place after it's set (reference to watchSessionValue)
+        return value
+    return cleaned
+
+
+def markSessionModified(session) -> None:
+    session.modified = True
+
+
+def __getFingerprint(value) -> str:
+    try:
+        return json.dumps(value, sort_keys=True, default=repr)
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def watchSessionValue(session, value) -> None:
+    '''
+        Keep the fingerprint of a mutable value read from the session. It's checked by isWatchedValueChanged().
+    '''
+    if isinstance(value, _SCALAR_TYPES):
+        return
+    watchedValues = getattr(session, _WATCHED_VALUES_ATTR, None)
+    if watchedValues is None:
+        watchedValues = {}
+        setattr(session, _WATCHED_VALUES_ATTR, watchedValues)
+    if id(value) not in watchedValues:
+        watchedValues[id(value)] = (value, __getFingerprint(value))
+
+
+def isWatchedValueChanged(session) -> bool:
+    '''
+        Return True if a watched value is changed in place.
+    '''
+    watchedValues = getattr(session, _WATCHED_VALUES_ATTR, None)
+    if not watchedValues:
+        return False
+    return any(__getFingerprint(value) != fingerprint for value, fingerprint in watchedValues.values())
+
+
+def refreshSessionExpiry(session, now: float = None) -> bool:
+    '''
+        Save the session if its expiry date is not refreshed in [EXPIRY_REFRESH_INTERVAL] seconds.
+        Return True if the session will be saved.
+    '''
+    if session.is_empty():
+        return False
+    now = time.time() if now is None else now
+    if session.modified:
+        session[SESSION_REFRESH_TIMESTAMP_NAME] = now  # saved anyway
+        return True
+    lastRefreshTime = session.get(SESSION_REFRESH_TIMESTAMP_NAME, None)
+    if session.is_empty():
+        return False  # it's loaded by get() if the request doesn't use it, e.g. the session has expired
+    if lastRefreshTime is None or now - lastRefreshTime >= EXPIRY_REFRESH_INTERVAL:
+        session[SESSION_REFRESH_TIMESTAMP_NAME] = now
+        return True
+    return False
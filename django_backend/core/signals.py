@@ -2,6 +2,7 @@ from django.db.backends.signals import connection_created
 from django.db.backends.postgresql.base import DatabaseWrapper
 from django.dispatch import receiver
 from core.utils.run_once import run_once
+import core.menu.menu_manager  # noqa: F401 register the menu index signal handlers
 
 
 KEY = f"{__name__}.init_on_first_db_connection"
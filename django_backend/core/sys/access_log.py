@@ -7,15 +7,31 @@ from django.db.models import Q
 import core.utils.db as dbUtils
 from core.auth.index import getRequestToken, getSessionID, getUser
 from core.core.http import get_ip, is_support_session
-from core.db.transaction import IkTransaction
+from core.db.bulk_writer import BulkWriter
 from core.models import AccessLog, Menu
+from iktools import IkConfig
 
 logger = logging.getLogger('ikyo')
 
+ACCESS_LOG_BUFFER_SIZE = int(IkConfig.get('System', 'accessLogBufferSize', 10000))
+"""Max access logs in memory. The new access logs are dropped if the buffer is full.
+"""
+ACCESS_LOG_BATCH_SIZE = int(IkConfig.get('System', 'accessLogBatchSize', 200))
+ACCESS_LOG_FLUSH_INTERVAL = float(IkConfig.get('System', 'accessLogFlushInterval', 0.5))
+"""Seconds.
+"""
+
+__accessLogWriter = BulkWriter('Access Log Writer', AccessLog, batchSize=ACCESS_LOG_BATCH_SIZE,
+                               flushInterval=ACCESS_LOG_FLUSH_INTERVAL, maxPendingSize=ACCESS_LOG_BUFFER_SIZE)
+
 
 def addAccessLog(request, menuID, pageName, actionName=None, remarks=None):
     '''
         add access log (ik_access_log)
+
+        The access log is added to a buffer and inserted by a background thread every [accessLogBatchSize] logs or every
+        [accessLogFlushInterval] seconds, and when the process exits. If the buffer is full ([accessLogBufferSize]),
+        the access log is dropped. Reference to getAccessLogCounters().
     '''
     try:
         urlReferer = request.META.get('HTTP_REFERER', '')  # urlReferer = request.META['HTTP_REFERER']
@@ -48,15 +64,29 @@ def addAccessLog(request, menuID, pageName, actionName=None, remarks=None):
         rc.action_nm = actionName
         rc.rmk = remarks
 
-        ptrn = IkTransaction()
-        ptrn.add(rc)
-        b = ptrn.save()
-        if not b.value:
-            logger.error('Save access log failed: url=%s, userID=%s, error=%s' % (url, userID, b.dataStr))
+        if not __accessLogWriter.add(rc):
+            droppedCount = __accessLogWriter.droppedCount
+            if droppedCount == 1 or droppedCount % 1000 == 0:
+                logger.warning('Access log buffer is full (%s). Total dropped access logs: %s. The last one: url=%s, userID=%s'
+                               % (ACCESS_LOG_BUFFER_SIZE, droppedCount, url, userID))
     except Exception as e:
         logger.error(e, exc_info=True)
 
 
+def flushAccessLog() -> int:
+    '''
+        Insert the buffered access logs now. Return the total inserted logs.
+    '''
+    return __accessLogWriter.flush()
+
+
+def getAccessLogCounters() -> dict:
+    '''
+        return {'pending': buffered logs, 'flushed': inserted logs, 'failed': insert failed logs, 'dropped': dropped logs because the buffer is full}
+    '''
+    return __accessLogWriter.getCounters()
+
+
 def getAccessLog(userID):
     sql = "SELECT a.menu_id, a.menu_caption, a.screen_nm FROM ("
     sql += " SELECT l.menu_id, m.menu_caption, m.screen_nm, max(l.id) AS id FROM ik_access_log l LEFT JOIN ik_menu m ON m.id=l.menu_id WHERE usr_id=%s" % dbUtils.toSqlField(
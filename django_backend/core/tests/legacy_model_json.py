@@ -0,0 +1,44 @@
+'''
+    The model to json implementation before core.core.json_serializer (IkJsonResponse converted each model instance and read
+    the foreign key values by getattr). The serializer tests compare the results with it, and core/benchmark/model_json.py
+    compares the performance.
+'''
+from django.db import models
+
+import core.db.model as ikDbModels
+import core.utils.model_utils as model_utils
+from core.core.json_serializer import object2Str
+
+
+def legacyModel2Json(r, modelAdditionalFields: list = None) -> dict:
+    '''
+        The model to json before core.core.json_serializer. It's used to compare the results and the performance.
+    '''
+    for field in r._meta.get_fields():
+        try:
+            if isinstance(field, models.Field) and not isinstance(field, models.ForeignKey):
+                r.__dict__[field.name] = object2Str(r.__dict__[field.name])
+        except Exception:
+            pass
+    d = r.toJson()
+    for prpKey, prpValue in model_utils.getModelPropertyValues(r).items():
+        d[prpKey] = object2Str(prpValue)
+    if r._meta.pk is not None and r._meta.pk.name is not None:
+        d['__PK_'] = r._meta.pk.name
+    for name in modelAdditionalFields or []:
+        if name not in d.keys():
+            if ikDbModels.FOREIGN_KEY_VALUE_FLAG in name:
+                value = r
+                for attr in name.split('.'):
+                    if value:
+                        try:
+                            value = getattr(value, attr)
+                        except Exception:
+                            value = None
+                    else:
+                        value = None
+                        break
+                d[name] = object2Str(value)
+            elif name.startswith(ikDbModels.MODEL_PROPERTY_ATTRIBUTE_NAME_PREFIX):
+                d[name] = object2Str(getattr(r, name, None))
+    return d
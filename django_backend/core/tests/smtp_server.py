@@ -0,0 +1,167 @@
+'''
+    In-process SMTP debugging server for the mail tests.
+
+    It accepts all mails and keeps them in memory. AUTH PLAIN / LOGIN accept any account.
+
+    Usage:
+        server = DebuggingSmtpServer()
+        server.start()
+        ... send mails to ('127.0.0.1', server.port)
+        server.stop()
+'''
+import base64
+import socketserver
+import threading
+import time
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        server = self.server.smtpServer
+        server._onConnect(self)
+        try:
+            self.__reply('220 localhost ikyo debugging SMTP server')
+            mailFrom, rcptTos = None, []
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace').strip()
+                verb = command.split(' ', 1)[0].upper()
+                if verb == 'EHLO':
+                    self.__reply('250-localhost', '250-AUTH PLAIN LOGIN', '250-8BITMIME', '250 SIZE 0')
+                elif verb == 'HELO':
+                    self.__reply('250 localhost')
+                elif verb == 'AUTH':
+                    self.__auth(command)
+                elif verb == 'MAIL':
+                    mailFrom, rcptTos = command[10:].strip(), []
+                    self.__reply('250 OK')
+                elif verb == 'RCPT':
+                    rcptTos.append(command[8:].strip())
+                    self.__reply('250 OK')
+                elif verb == 'DATA':
+                    self.__reply('354 End data with <CR><LF>.<CR><LF>')
+                    size, message = self.__readData(server)
+                    if server.delay > 0:
+                        time.sleep(server.delay)
+                    server._onMessage(mailFrom, rcptTos, size, message)
+                    if server.dropAfterData:
+                        break  # the mail is received, but the connection is closed before the reply
+                    self.__reply('250 OK')
+                elif verb == 'RSET':
+                    mailFrom, rcptTos = None, []
+                    self.__reply('250 OK')
+                elif verb == 'NOOP':
+                    server._count('noops')
+                    self.__reply('250 OK')
+                elif verb == 'QUIT':
+                    server._count('quits')
+                    self.__reply('221 Bye')
+                    break
+                else:
+                    self.__reply('502 Command not implemented')
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            server._onDisconnect(self)
+
+    def __auth(self, command: str) -> None:
+        args = command.split(' ')
+        if args[1].upper() == 'LOGIN':
+            self.__reply('334 VXNlcm5hbWU6')
+            self.rfile.readline()
+            self.__reply('334 UGFzc3dvcmQ6')
+            self.rfile.readline()
+        elif len(args) < 3:
+            self.__reply('334 ')
+            base64.b64decode(self.rfile.readline().strip())
+        self.server.smtpServer._count('logins')
+        self.__reply('235 Authentication successful')
+
+    def __readData(self, server) -> tuple:
+        '''
+            Read the message until <CR><LF>.<CR><LF>. Return (message size, message bytes). The message is None if server.keepMessages is False.
+        '''
+        size = 0
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b'.\r\n':
+                break
+            size += len(line)
+            if server.keepMessages:
+                lines.append(line[1:] if line.startswith(b'..') else line)
+        return size, (b''.join(lines) if server.keepMessages else None)
+
+    def __reply(self, *lines: str) -> None:
+        self.wfile.write(('\r\n'.join(lines) + '\r\n').encode('utf-8'))
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class DebuggingSmtpServer():
+    def __init__(self, delay: float = 0, keepMessages: bool = True) -> None:
+        '''
+            delay (float): seconds to wait before reply the DATA command, e.g. a slow SMTP server.
+            keepMessages (bool): keep the message content in [messages].
+        '''
+        self.delay = delay
+        self.keepMessages = keepMessages
+        self.dropAfterData = False  # close the connection after a message is received, the DATA command is not replied
+        self.messages = []  # [(mail from, [rcpt to], size, message bytes)]
+        self.counters = {'connections': 0, 'logins': 0, 'noops': 0, 'quits': 0}
+        self.maxConcurrentConnections = 0
+        self.__handlers = set()
+        self.__lock = threading.Lock()
+        self.__server = _ThreadingTCPServer(('127.0.0.1', 0), _SmtpHandler)
+        self.__server.smtpServer = self
+        self.port = self.__server.server_address[1]
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.dropConnections()
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def dropConnections(self) -> None:
+        '''
+            Close all client connections, e.g. the server closes the idle connections.
+        '''
+        with self.__lock:
+            handlers = list(self.__handlers)
+        for handler in handlers:
+            try:
+                handler.connection.shutdown(2)
+            except OSError:
+                pass
+        # wait for the handlers exit
+        for _i in range(100):
+            with self.__lock:
+                if len(self.__handlers) == 0:
+                    break
+            time.sleep(0.01)
+
+    def _count(self, name: str) -> None:
+        with self.__lock:
+            self.counters[name] += 1
+
+    def _onConnect(self, handler) -> None:
+        with self.__lock:
+            self.__handlers.add(handler)
+            self.counters['connections'] += 1
+            self.maxConcurrentConnections = max(self.maxConcurrentConnections, len(self.__handlers))
+
+    def _onDisconnect(self, handler) -> None:
+        with self.__lock:
+            self.__handlers.discard(handler)
+
+    def _onMessage(self, mailFrom: str, rcptTos: list, size: int, message: bytes) -> None:
+        with self.__lock:
+            self.messages.append((mailFrom, rcptTos, size, message))
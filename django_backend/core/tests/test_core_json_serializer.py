@@ -0,0 +1,66 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import TestCase
+
+from core.core.http import IkSccJsonResponse
+from core.core.json_serializer import getModelJsonSerializer
+from core.models import Company, Currency, Group, Office, User, UserGroup
+from core.tests.legacy_model_json import legacyModel2Json
+
+COMPANY_FIELDS = ['location.name', 'location.ccy.code', 'cre_usr.usr_nm', 'ctg']
+
+
+class ModelJsonSerializerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(usr_nm='json_user', psw='-')
+        User.objects.create(usr_nm='json_user2', psw='-')
+        groups = [Group.objects.create(grp_nm='JsonGroup%s' % i) for i in range(3)]
+        for group in groups:
+            UserGroup.objects.create(usr=cls.user, grp=group)
+        ccy = Currency.objects.create(seq=1.5, code='HKD', name='Hong Kong Dollar')
+        office = Office.objects.create(name='Head Office', code='HK', addr='-', city='HK', country='China', ccy=ccy)
+        Company.objects.create(sn='C1', full_nm='Company 1', short_nm='C1', location=office, ctg='A', cre_usr=cls.user)
+        Company.objects.create(sn='C2', full_nm='Company 2', short_nm='C2', location=office, ctg='B')  # cre_usr is null
+
+    def _dumps(self, data) -> str:
+        return json.dumps(data, cls=DjangoJSONEncoder)
+
+    def _legacyJson(self, queryset, additionalFields: list = None) -> str:
+        return self._dumps([legacyModel2Json(r, additionalFields) for r in queryset.all()])
+
+    def test_queryset_values(self):
+        queryset = Company.objects.order_by('id')
+        self.assertTrue(getModelJsonSerializer(Company, COMPANY_FIELDS).isValuesSupported(queryset))
+        expected = self._legacyJson(queryset, COMPANY_FIELDS)
+        with self.assertNumQueries(1):
+            data = getModelJsonSerializer(Company, COMPANY_FIELDS).serializeQuerySet(queryset)
+        self.assertEqual(expected, self._dumps(data))
+        self.assertIsNone(data[1]['cre_usr.usr_nm'])
+        self.assertEqual(expected, self._dumps(IkSccJsonResponse(data=queryset).getJsonData(COMPANY_FIELDS)))
+
+    def test_queryset_instances(self):
+        # User has properties, so the records are converted by the model instances
+        queryset = User.objects.filter(usr_nm__startswith='json_user').order_by('id')
+        self.assertFalse(getModelJsonSerializer(User).isValuesSupported(queryset))
+        self.assertEqual(self._legacyJson(queryset), self._dumps(IkSccJsonResponse(data=queryset).getJsonData()))
+
+        queryset = Company.objects.order_by('id').defer('dsc')
+        expected = self._legacyJson(queryset, COMPANY_FIELDS)
+        with self.assertNumQueries(1):  # the foreign keys are selected together. The deferred fields are not in the json
+            data = getModelJsonSerializer(Company, COMPANY_FIELDS).serializeQuerySet(queryset)
+        self.assertEqual(expected, self._dumps(data))
+
+    def test_model_list(self):
+        expectedRcs = list(UserGroup.objects.order_by('id'))
+        expectedRcs[1].ik_set_cursor()
+        expected = [legacyModel2Json(r, ['usr.usr_nm', 'grp.grp_nm']) for r in expectedRcs]
+        rcs = list(UserGroup.objects.order_by('id'))
+        rcs[1].ik_set_cursor()
+        with self.assertNumQueries(2):  # users and groups
+            data = getModelJsonSerializer(UserGroup, ['usr.usr_nm', 'grp.grp_nm']).serializeModels(rcs)
+        self.assertEqual(self._dumps(expected), self._dumps(data))
+        self.assertEqual(self._dumps(expected), self._dumps(IkSccJsonResponse(data={'rcs': rcs}).getJsonData(['usr.usr_nm', 'grp.grp_nm'])['rcs']))
+        self.assertEqual(self._dumps(legacyModel2Json(UserGroup.objects.get(id=rcs[0].id))),
+                         self._dumps(IkSccJsonResponse(data=UserGroup.objects.get(id=rcs[0].id)).getJsonData()))
@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from django.db import connection
+from django.test import TransactionTestCase
+
+# The sender processes import this module before django.setup(), so the models and mailer are imported in the functions.
+
+ACCOUNT = 'sender@ikyo.test'
+SENDER_PROCESSES = 3
+TOTAL_QUEUE_MAILS = 30
+
+
+def _sendQueueMails(databaseName: str, queue) -> None:
+    '''
+        Sender process: send the queue mails until the queue is empty. Put the number of the sent mails to the queue.
+    '''
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_backend.settings')
+    django.setup()
+    from django.db import connections
+    connections['default'].settings_dict['NAME'] = databaseName
+    import core.core.mailer as ikMailer
+    try:
+        mailManager = getattr(ikMailer, '__MailManager')(startSender=False)
+        total = 0
+        while True:
+            count = mailManager.sendQueueMails(limit=2)
+            if count == 0:
+                break
+            total += count
+        queue.put(total)
+    except Exception as e:
+        queue.put(e)
+    finally:
+        connections.close_all()
+
+
+class MailQueueTestCase(TransactionTestCase):
+    def test_multiple_processes(self):
+        from core.models import Mail, MailAddr, Setting
+        from core.sys.system_setting import DEFAULT_SETTING_CODE
+        from core.tests.smtp_server import DebuggingSmtpServer
+        server = DebuggingSmtpServer()
+        server.start()
+        try:
+            for key, value in (('SMTP Host', '127.0.0.1'), ('SMTP Port', str(server.port)), ('SMTP With SSL', 'no'),
+                               ('SMTP Account', ACCOUNT), ('SMTP Password', 'password'), ('SMTP Sender Address', ACCOUNT)):
+                Setting.objects.create(cd=DEFAULT_SETTING_CODE, key=key, value=value)
+            for i in range(TOTAL_QUEUE_MAILS):
+                mail = Mail.objects.create(sender='test', subject='Queue mail %s' % i, content='-', sts=Mail.STATUS_PENDING)
+                MailAddr.objects.create(mail=mail, type=MailAddr.TYPE_TO, name='Receiver', address='receiver@ikyo.test', seq=1)
+            with tempfile.TemporaryDirectory() as folder:
+                if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+                    # the sender processes cannot open the in-memory test database, copy it to a file
+                    databaseName = str(Path(folder, 'test_mail_queue.sqlite3'))
+                    connection.ensure_connection()
+                    target = sqlite3.connect(databaseName)
+                    connection.connection.backup(target)
+                    target.close()
+                else:
+                    databaseName = connection.settings_dict['NAME']
+
+                context = multiprocessing.get_context('spawn')
+                queue = context.Queue()
+                processes = [context.Process(target=_sendQueueMails, args=(databaseName, queue)) for _ in range(SENDER_PROCESSES)]
+                for p in processes:
+                    p.start()
+                results = [queue.get(timeout=120) for _ in processes]
+                for p in processes:
+                    p.join()
+                for r in results:
+                    if isinstance(r, Exception):
+                        raise r
+                if databaseName != connection.settings_dict['NAME']:
+                    source = sqlite3.connect(databaseName)
+                    source.backup(connection.connection)
+                    source.close()
+        finally:
+            server.stop()
+
+        # each mail is sent once
+        self.assertEqual(TOTAL_QUEUE_MAILS, sum(results))
+        subjects = [message.split(b'\r\n\r\n')[0] for _, _, _, message in server.messages]
+        self.assertEqual(TOTAL_QUEUE_MAILS, len(subjects))
+        self.assertEqual(TOTAL_QUEUE_MAILS, len(set(subjects)))
+        self.assertEqual(TOTAL_QUEUE_MAILS, Mail.objects.filter(sts=Mail.STATUS_COMPLETE, claimed_by__isnull=True).count())
@@ -0,0 +1,339 @@
+import email
+import os
+import smtplib
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from pathlib import Path
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+import core.core.mailer as ikMailer
+from core.core.smtp_pool import SmtpConnectionPool
+from core.models import Mail, MailAddr, MailAttch, Setting
+from core.sys.system_setting import DEFAULT_SETTING_CODE
+from core.tests.smtp_server import DebuggingSmtpServer
+
+ACCOUNT = 'sender@ikyo.test'
+LARGE_ATTACHMENT_SIZE = 200 * 1024 * 1024
+
+
+def _message(i: int) -> str:
+    msg = MIMEText('Mail content %s' % i, 'plain', 'utf-8')
+    msg['Subject'] = 'Mail %s' % i
+    return msg.as_string()
+
+
+class SmtpConnectionPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.server = DebuggingSmtpServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _send(self, pool: SmtpConnectionPool, i: int, timing: dict = None) -> None:
+        pool.sendmail('127.0.0.1', self.server.port, False, ACCOUNT, 'password', ACCOUNT, ['to%s@ikyo.test' % i], _message(i), timing=timing)
+
+    def test_reuse_connection(self):
+        pool = SmtpConnectionPool()
+        timings = [{} for _i in range(5)]
+        for i in range(5):
+            self._send(pool, i, timings[i])
+        self.assertEqual(5, len(self.server.messages))
+        self.assertEqual(1, self.server.counters['connections'])
+        self.assertEqual(1, self.server.counters['logins'])
+        self.assertEqual([False, True, True, True, True], [timing['reused'] for timing in timings])
+        self.assertEqual(0, timings[1]['connect'])
+        self.assertTrue(all(timing['total'] >= timing['send'] > 0 for timing in timings))
+        counters = pool.getCounters()
+        self.assertEqual((1, 4, 5, 1, 1), (counters['created'], counters['reused'], counters['sent'], counters['open'], counters['idle']))
+
+        self.assertEqual(1, pool.closeIdleConnections(closeAll=True))
+        self.assertEqual(0, pool.getCounters()['open'])
+
+    def test_idle_timeout(self):
+        pool = SmtpConnectionPool(idleTimeout=0.05)
+        self._send(pool, 1)
+        time.sleep(0.1)
+        self.assertEqual(1, pool.closeIdleConnections())
+        self._send(pool, 2)
+        self.assertEqual(2, self.server.counters['connections'])
+        self.assertEqual(1, self.server.counters['quits'])
+
+    def test_health_check(self):
+        pool = SmtpConnectionPool(checkInterval=0)
+        self._send(pool, 1)
+        self._send(pool, 2)
+        self.assertEqual(1, self.server.counters['noops'])
+        # the server closed the idle connection, NOOP fails and a new connection is opened
+        self.server.dropConnections()
+        timing = {}
+        self._send(pool, 3, timing)
+        self.assertFalse(timing['reused'])
+        self.assertEqual(3, len(self.server.messages))
+        self.assertEqual(2, self.server.counters['connections'])
+        self.assertEqual(1, pool.getCounters()['broken'])
+
+    def test_resend_if_reused_connection_closed(self):
+        pool = SmtpConnectionPool(checkInterval=60)
+        self._send(pool, 1)
+        self.server.dropConnections()
+        self._send(pool, 2)
+        self.assertEqual(2, len(self.server.messages))
+        self.assertEqual(2, self.server.counters['connections'])
+
+    def test_no_resend_after_data_accepted(self):
+        pool = SmtpConnectionPool(checkInterval=60)
+        self._send(pool, 1)
+        # the server received the mail, and closed the connection before the reply
+        self.server.dropAfterData = True
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            self._send(pool, 2)
+        self.assertEqual(2, len(self.server.messages))
+        self.assertEqual(1, self.server.counters['connections'])
+        self.assertEqual(1, pool.getCounters()['failed'])
+
+    def test_pool_key_without_password(self):
+        pool = SmtpConnectionPool()
+        self._send(pool, 1)
+        pool.sendmail('127.0.0.1', self.server.port, False, ACCOUNT, 'new password', ACCOUNT, ['to@ikyo.test'], _message(2))
+        # a connection logged in by another password is not reused
+        self.assertEqual(2, self.server.counters['logins'])
+        keys = list(pool._SmtpConnectionPool__openCounts.keys())
+        self.assertEqual(2, len(keys))
+        self.assertFalse(any(value in ('password', 'new password') for key in keys for value in key))
+        pool.closeIdleConnections(closeAll=True)
+
+    def test_max_size(self):
+        self.server.delay = 0.05
+        pool = SmtpConnectionPool(maxSize=2)
+        threads = [threading.Thread(target=self._send, args=(pool, i)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(6, len(self.server.messages))
+        self.assertEqual(2, self.server.maxConcurrentConnections)
+        self.assertEqual(2, pool.getCounters()['created'])
+
+
+class MailMessageTestCase(SimpleTestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_stream_message(self):
+        server = DebuggingSmtpServer()
+        server.start()
+        try:
+            pool = SmtpConnectionPool()
+            # a list can be iterated again if the mail is sent again by a new connection
+            chunks = [b'Subject: Stream\r\n\r\n', b'.leading dot\nline 2\n', b'last line']
+            pool.sendmail('127.0.0.1', server.port, False, ACCOUNT, 'password', ACCOUNT, ['to@ikyo.test'], chunks)
+            self.assertEqual(b'Subject: Stream\r\n\r\n.leading dot\r\nline 2\r\nlast line\r\n', server.messages[0][3])
+            pool.closeIdleConnections(closeAll=True)
+        finally:
+            server.stop()
+
+    def test_attachments(self):
+        files = []
+        for name, data in (('a.txt', b'attachment a'), ('empty.txt', b''), ('b.bin', bytes(range(256)) * 1000)):
+            files.append((str(Path(self.folder.name, name)), data))
+            with open(files[-1][0], 'wb') as f:
+                f.write(data)
+        msg = MIMEMultipart()
+        msg['Subject'] = 'Attachments'
+        msg.attach(MIMEText('Content', 'plain', 'utf-8'))
+        message = ikMailer._MailMessage(msg)
+        for filePath, _ in files:
+            message.attachFile(filePath)
+        parsed = email.message_from_string(message.as_string())
+        self.assertEqual(message.as_string(), message.as_string())
+        parts = [part for part in parsed.walk() if part.get_filename() is not None]
+        self.assertEqual([(os.path.basename(filePath), data) for filePath, data in files], [(part.get_filename(), part.get_payload(decode=True)) for part in parts])
+        self.assertEqual('Content', [part for part in parsed.walk() if part.get_content_type() == 'text/plain'][0].get_payload(decode=True).decode())
+
+    def test_large_attachment(self):
+        # 200 MB, it's not loaded into memory
+        filePath = str(Path(self.folder.name, 'large.pdf'))
+        with open(filePath, 'wb') as f:
+            f.truncate(LARGE_ATTACHMENT_SIZE)
+        msg = MIMEMultipart()
+        msg['Subject'] = 'Large attachment'
+        msg.attach(MIMEText('Content', 'plain', 'utf-8'))
+        message = ikMailer._MailMessage(msg)
+        message.attachFile(filePath)
+        server = DebuggingSmtpServer(keepMessages=False)
+        server.start()
+        pool = SmtpConnectionPool()
+        tracemalloc.start()
+        try:
+            pool.sendmail('127.0.0.1', server.port, False, ACCOUNT, 'password', ACCOUNT, ['to@ikyo.test'], message)
+            peakBytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            pool.closeIdleConnections(closeAll=True)
+            server.stop()
+        self.assertEqual(1, len(server.messages))
+        self.assertGreater(server.messages[0][2], LARGE_ATTACHMENT_SIZE * 4 / 3)
+        self.assertLess(peakBytes, 16 * 1024 * 1024)
+
+
+class MailSenderTestCase(TestCase):
+    def setUp(self):
+        self.server = DebuggingSmtpServer()
+        self.server.start()
+        for key, value in (('SMTP Host', '127.0.0.1'), ('SMTP Port', str(self.server.port)), ('SMTP With SSL', 'no'),
+                           ('SMTP Account', ACCOUNT), ('SMTP Password', 'password'), ('SMTP Sender Address', ACCOUNT),
+                           ('SMTP Sender Name', 'Sender')):
+            Setting.objects.create(cd=DEFAULT_SETTING_CODE, key=key, value=value)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_send_queue_mails(self):
+        mailIDs = []
+        for i in range(3):
+            mail = Mail.objects.create(sender='test', subject='Queue mail %s' % i, content='Content %s' % i, sts=Mail.STATUS_PENDING)
+            MailAddr.objects.create(mail=mail, type=MailAddr.TYPE_TO, name='Receiver', address='receiver@ikyo.test', seq=1)
+            mailIDs.append(mail.id)
+        noReceiverMail = Mail.objects.create(sender='test', subject='No receiver', content='-', sts=Mail.STATUS_PENDING)
+
+        mailManager = getattr(ikMailer, '__MailManager')(startSender=False)
+        pool = SmtpConnectionPool()
+        with mock.patch('core.core.mailer.SMTP_POOL', pool):
+            self.assertEqual(4, mailManager.sendQueueMails())
+            self.assertEqual(0, mailManager.sendQueueMails())
+        self.assertEqual(3, len(self.server.messages))
+        self.assertEqual(1, self.server.counters['logins'])
+        self.assertTrue(all(mail.sts == Mail.STATUS_COMPLETE and mail.duration is not None and mail.claimed_by is None
+                            for mail in Mail.objects.filter(id__in=mailIDs)))
+        self.assertEqual(Mail.STATUS_ERROR, Mail.objects.get(id=noReceiverMail.id).sts)
+        pool.closeIdleConnections(closeAll=True)
+
+    def test_wake_sender_for_queued_mails(self):
+        mailManager = getattr(ikMailer, '__MailManager')(startSender=False)
+        with mock.patch.object(mailManager, '_MailManager__wakeSender') as wakeSender:
+            # sent and saved as complete, not queued
+            with mock.patch.object(mailManager, '_MailManager__sendEmail', return_value=(True, None)), \
+                    self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(mailManager.send_with_account(ACCOUNT, 'password', None, 'test', 'Sent', 'receiver@ikyo.test', content='-').value)
+            self.assertEqual(0, wakeSender.call_count)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(mailManager.send('test', 'Queued', 'receiver@ikyo.test', content='-').value)
+            self.assertEqual(1, wakeSender.call_count)
+        self.assertEqual([Mail.STATUS_COMPLETE, Mail.STATUS_PENDING], [mail.sts for mail in Mail.objects.order_by('id')])
+
+    def test_claim_mails(self):
+        for i in range(10):
+            mail = Mail.objects.create(sender='test', subject='Queue mail %s' % i, content='-', sts=Mail.STATUS_PENDING)
+            MailAddr.objects.bulk_create([MailAddr(mail=mail, type=tp, name='Receiver', address='%s@ikyo.test' % tp, seq=1)
+                                          for tp in (MailAddr.TYPE_TO, MailAddr.TYPE_CC, MailAddr.TYPE_BCC)])
+            MailAttch.objects.create(mail=mail, file='attachment%s.txt' % i, size=1, seq=1)
+        Mail.objects.create(sender='test', subject='Sent', content='-', sts=Mail.STATUS_COMPLETE)
+        Mail.objects.create(sender='test', subject='Retry later', content='-', sts=Mail.STATUS_PENDING,
+                            next_attempt_ts=timezone.now() + timedelta(minutes=1))
+        mailManager = getattr(ikMailer, '__MailManager')(startSender=False)
+
+        # the claim and the receivers / attachments of the batch are loaded by a fixed number of queries
+        with CaptureQueriesContext(connection) as queries:
+            claimedMails = mailManager._MailManager__claimMails(8)
+        self.assertEqual(4, len([q for q in queries if 'SAVEPOINT' not in q['sql']]))
+        self.assertEqual(8, len(claimedMails))
+        claimID, mail, toAddresses, ccAddresses, bccAddresses, attachments = claimedMails[0]
+        self.assertEqual(['to@ikyo.test', 'cc@ikyo.test', 'bcc@ikyo.test'], [addresses[0].email for addresses in (toAddresses, ccAddresses, bccAddresses)])
+        self.assertEqual(['attachment0.txt'], [attachment.file for attachment in attachments])
+        self.assertEqual(8, Mail.objects.filter(sts=Mail.STATUS_IN_PROGRESS, claimed_by=claimID).count())
+
+        self.assertEqual(2, len(mailManager._MailManager__claimMails(8)))
+        self.assertEqual([], mailManager._MailManager__claimMails(8))
+        # the mails claimed by a dead sender are claimed again after the claim timeout
+        Mail.objects.filter(claimed_by=claimID).update(claim_ts=timezone.now() - timedelta(seconds=mailManager.CLAIM_TIMEOUT + 1))
+        self.assertEqual(8, len(mailManager._MailManager__claimMails(10)))
+
+    def test_retry(self):
+        mail = Mail.objects.create(sender='test', subject='Retry mail', content='-', sts=Mail.STATUS_PENDING)
+        MailAddr.objects.create(mail=mail, type=MailAddr.TYPE_TO, name='Receiver', address='receiver@ikyo.test', seq=1)
+        mailManager = getattr(ikMailer, '__MailManager')(startSender=False)
+        pool = SmtpConnectionPool()
+        with mock.patch('core.core.mailer.SMTP_POOL', pool), mock.patch.object(pool, 'sendmail', side_effect=ConnectionError('Server down')):
+            nextAttemptTimes = []
+            for attempts in range(1, mailManager.SEND_FAILED_RETRY_TIMES + 1):
+                self.assertEqual(1, mailManager.sendQueueMails())
+                self.assertEqual(0, mailManager.sendQueueMails())  # wait for the next attempt
+                mail.refresh_from_db()
+                self.assertEqual(attempts, mail.attempts)
+                self.assertEqual('Server down', mail.error)
+                if mail.sts == Mail.STATUS_PENDING:
+                    nextAttemptTimes.append((mail.next_attempt_ts - timezone.now()).total_seconds())
+                    Mail.objects.filter(id=mail.id).update(next_attempt_ts=timezone.now())
+        self.assertEqual(Mail.STATUS_ERROR, mail.sts)
+        self.assertEqual(mailManager.SEND_FAILED_RETRY_TIMES - 1, len(nextAttemptTimes))
+        # the retry interval is doubled for each attempt
+        for i, seconds in enumerate(nextAttemptTimes):
+            interval = min(mailManager.RETRY_INTERVAL * 2 ** i, mailManager.MAX_RETRY_INTERVAL)
+            self.assertTrue(interval - 5 < seconds <= interval, '%s: %s' % (i, seconds))
+
+        # sent successfully
+        Mail.objects.filter(id=mail.id).update(sts=Mail.STATUS_PENDING, attempts=1)
+        with mock.patch('core.core.mailer.SMTP_POOL', pool):
+            self.assertEqual(1, mailManager.sendQueueMails())
+        mail.refresh_from_db()
+        self.assertEqual((Mail.STATUS_COMPLETE, None, None), (mail.sts, mail.error, mail.next_attempt_ts))
+        pool.closeIdleConnections(closeAll=True)
+
+    def test_attachment_size_limit(self):
+        limit = Setting.objects.create(cd=DEFAULT_SETTING_CODE, key='EMAIL_ATTACH_TOTAL_SIZE_LIMIT', value='1')
+        with tempfile.TemporaryDirectory() as folder:
+            filePath = str(Path(folder, 'expense.pdf'))
+            with open(filePath, 'wb') as f:
+                f.truncate(2 * 1024 * 1024)
+            mail = Mail.objects.create(sender='test', subject='Large attachment', content='-', sts=Mail.STATUS_PENDING)
+            MailAddr.objects.create(mail=mail, type=MailAddr.TYPE_TO, name='Receiver', address='receiver@ikyo.test', seq=1)
+            MailAttch.objects.create(mail=mail, file=filePath, size=2 * 1024 * 1024, seq=1)
+            mailManager = getattr(ikMailer, '__MailManager')(startSender=False)
+            pool = SmtpConnectionPool()
+            with mock.patch('core.core.mailer.SMTP_POOL', pool):
+                self.assertEqual(1, mailManager.sendQueueMails())
+                # don't retry
+                mail.refresh_from_db()
+                self.assertEqual((Mail.STATUS_ERROR, 0), (mail.sts, mail.attempts))
+                self.assertEqual('The total attachment size can only be less than 1 MB, total has 2.00 MB.', mail.error)
+                self.assertEqual((False, mail.error), ikMailer._Mailer()._send('Large attachment', '-', [ikMailer.EmailAddress('receiver@ikyo.test')], [],
+                                                                              attachments=[MailAttch(file=filePath)]))
+            self.assertEqual(0, len(self.server.messages))
+
+            # sent
+            limit.value = '3'
+            limit.save()
+            Mail.objects.filter(id=mail.id).update(sts=Mail.STATUS_PENDING)
+            with mock.patch('core.core.mailer.SMTP_POOL', pool):
+                self.assertEqual(1, mailManager.sendQueueMails())
+            self.assertEqual(Mail.STATUS_COMPLETE, Mail.objects.get(id=mail.id).sts)
+            attachments = [part for part in email.message_from_bytes(self.server.messages[0][3]).walk() if part.get_filename() == 'expense.pdf']
+            self.assertEqual(bytes(2 * 1024 * 1024), attachments[0].get_payload(decode=True))
+            pool.closeIdleConnections(closeAll=True)
+
+    def test_missing_attachment(self):
+        mail = Mail.objects.create(sender='test', subject='Missing attachment', content='-', sts=Mail.STATUS_PENDING)
+        MailAddr.objects.create(mail=mail, type=MailAddr.TYPE_TO, name='Receiver', address='receiver@ikyo.test', seq=1)
+        MailAttch.objects.create(mail=mail, file='/not/exists/expense.pdf', size=1, seq=1)
+        mailManager = getattr(ikMailer, '__MailManager')(startSender=False)
+        pool = SmtpConnectionPool()
+        with mock.patch('core.core.mailer.SMTP_POOL', pool), mock.patch.object(pool, 'sendmail') as sendmail:
+            self.assertEqual(1, mailManager.sendQueueMails())
+        # failed before the SMTP transaction, don't retry
+        self.assertEqual(0, sendmail.call_count)
+        mail.refresh_from_db()
+        self.assertEqual((Mail.STATUS_ERROR, 0, 'Attachment [/not/exists/expense.pdf] does not exist.'), (mail.sts, mail.attempts, mail.error))
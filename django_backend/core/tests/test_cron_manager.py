@@ -0,0 +1,180 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+# The scheduler processes import this module before django.setup(), so the models and cron_manager are imported in the functions.
+
+REFRESH_INTERVAL = 0.2
+LEASE_TIMEOUT = 2
+
+
+def recordCronRun(outputFile: str) -> None:
+    '''
+        Cron job: append "pid, time" to the output file.
+    '''
+    with open(outputFile, 'a') as f:
+        f.write('%s %s\n' % (os.getpid(), time.time()))
+
+
+def sleepCronJob(seconds: str) -> None:
+    '''
+        Cron job: it runs longer than the fire interval, so the next fire is skipped.
+    '''
+    time.sleep(float(seconds))
+
+
+def _runScheduler(databaseName: str, seconds: float) -> None:
+    '''
+        Scheduler process: start the cron manager for [seconds] seconds.
+    '''
+    import logging
+
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_backend.settings')
+    django.setup()
+    from django.db import connections
+    connections['default'].settings_dict['NAME'] = databaseName
+    logging.getLogger('apscheduler').setLevel(logging.WARNING)
+    from core.cron.cron_manager import get_manager
+    manager = get_manager()
+    manager.set_refresh_job_interval(REFRESH_INTERVAL)
+    manager.set_lease_timeout(LEASE_TIMEOUT)
+    manager.start()
+    time.sleep(seconds)
+    manager.stop()
+    connections.close_all()
+
+
+def _readRuns(outputFile: Path) -> list:
+    if not outputFile.is_file():
+        return []
+    with open(outputFile, 'r') as f:
+        return [(int(pid), float(t)) for pid, t in (line.split() for line in f if line.strip() != '')]
+
+
+class CronLeaseTestCase(TestCase):
+    def test_lease(self):
+        from core.cron.cron_manager import acquire_lease, release_lease
+        self.assertTrue(acquire_lease('test', 'a', 10))
+        self.assertFalse(acquire_lease('test', 'b', 10))
+        self.assertTrue(acquire_lease('test', 'a', 10))  # renew
+        self.assertFalse(release_lease('test', 'b'))
+        self.assertTrue(release_lease('test', 'a'))
+        self.assertTrue(acquire_lease('test', 'b', -1))  # expired
+        self.assertTrue(acquire_lease('test', 'c', 10))
+        self.assertTrue(acquire_lease('other', 'a', 10))
+
+    def test_jobs_version(self):
+        from core.cron.cron_manager import get_jobs_version
+        from core.models import CronJob
+        with self.assertNumQueries(1):
+            version0 = get_jobs_version()
+        job = CronJob.objects.create(second='*', task='core.cron.examples.JobExample02', enable=True)
+        version1 = get_jobs_version()
+        self.assertNotEqual(version0, version1)
+        job.version_no += 1
+        job.enable = False
+        job.save()
+        self.assertNotEqual(version1, get_jobs_version())
+        job.delete()
+        self.assertEqual(version0[:3], get_jobs_version()[:3])
+
+
+class CronRunHistoryTestCase(TestCase):
+    def setUp(self):
+        from core.models import CronJob
+        self.job1 = CronJob.objects.create(second='*', task='core.tests.test_cron_manager.recordCronRun', enable=True)
+        self.job2 = CronJob.objects.create(second='0', task='core.tests.test_cron_manager.sleepCronJob', enable=True)
+
+    def test_run_stats(self):
+        from core.cron.cron_manager import add_run_history, flush_run_history, get_run_stats
+        from core.models import CronJobRun
+        add_run_history(self.job2.id, self.job2.task, CronJobRun.OUTCOME_ERROR, duration=5.0, error='ValueError')
+        add_run_history(self.job2.id, self.job2.task, CronJobRun.OUTCOME_SKIPPED, scheduled_dt=datetime.now(timezone.utc))
+        self.assertEqual(2, flush_run_history())
+        self.assertEqual([(os.getpid(), 'ValueError'), (os.getpid(), None)], list(CronJobRun.objects.order_by('id').values_list('pid', 'error')))
+        CronJobRun.objects.bulk_create([CronJobRun(cron_job=self.job1, task=self.job1.task, outcome=CronJobRun.OUTCOME_SUCCESS, duration=float(i))
+                                        for i in range(100, 0, -1)] + [CronJobRun(cron_job=self.job1, task=self.job1.task, outcome=CronJobRun.OUTCOME_MISSED)])
+
+        with self.assertNumQueries(1):
+            stats = get_run_stats()
+        self.assertEqual([{'cron_job_id': self.job1.id, 'task': self.job1.task, 'count': 101, 'success': 100, 'error': 0,
+                           'skipped': 0, 'missed': 1, 'p50': 50.0, 'p95': 95.0, 'max': 100.0},
+                          {'cron_job_id': self.job2.id, 'task': self.job2.task, 'count': 2, 'success': 0, 'error': 1,
+                           'skipped': 1, 'missed': 0, 'p50': 5.0, 'p95': 5.0, 'max': 5.0}], stats)
+        self.assertEqual([self.job2.id], [r['cron_job_id'] for r in get_run_stats(cron_job_id=self.job2.id)])
+
+    def test_retention(self):
+        from core.cron.cron_manager import _now, clean_run_history
+        from core.models import CronJobRun
+        now = _now()
+        CronJobRun.objects.bulk_create([CronJobRun(cron_job=self.job1, outcome=CronJobRun.OUTCOME_SUCCESS, scheduled_dt=now - timedelta(days=i))
+                                        for i in range(9, -1, -1)]
+                                       + [CronJobRun(cron_job=self.job2, outcome=CronJobRun.OUTCOME_SUCCESS, scheduled_dt=now) for _ in range(2)])
+        self.assertEqual(5 + 2, clean_run_history(days=4.5, max_rows=3))
+        self.assertEqual([now - timedelta(days=i) for i in range(2, -1, -1)],
+                         list(CronJobRun.objects.filter(cron_job=self.job1).order_by('id').values_list('scheduled_dt', flat=True)))
+        self.assertEqual(2, CronJobRun.objects.filter(cron_job=self.job2).count())
+
+
+class CronSchedulerTestCase(TransactionTestCase):
+    def test_multiple_processes(self):
+        from core.cron.cron_manager import get_run_stats
+        from core.models import CronJob, CronJobRun
+        with tempfile.TemporaryDirectory() as folder:
+            outputFile = Path(folder, 'runs.txt')
+            recordJob = CronJob.objects.create(second='*', task='core.tests.test_cron_manager.recordCronRun', args='"%s"' % outputFile, enable=True)
+            sleepJob = CronJob.objects.create(second='*', task='core.tests.test_cron_manager.sleepCronJob', args='1.5', enable=True, max_instances=1)
+            if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+                # the scheduler processes cannot open the in-memory test database, copy it to a file
+                databaseName = str(Path(folder, 'test_cron_manager.sqlite3'))
+                connection.ensure_connection()
+                target = sqlite3.connect(databaseName)
+                connection.connection.backup(target)
+                target.close()
+            else:
+                databaseName = connection.settings_dict['NAME']
+
+            context = multiprocessing.get_context('spawn')
+            # the first process holds the lease, and the others take it over when it stops
+            first = context.Process(target=_runScheduler, args=(databaseName, 4))
+            first.start()
+            startTime = time.time()
+            while len(_readRuns(outputFile)) == 0 and time.time() - startTime < 60:
+                time.sleep(0.1)
+            others = [context.Process(target=_runScheduler, args=(databaseName, 6)) for _ in range(2)]
+            for p in others:
+                p.start()
+            for p in [first] + others:
+                p.join()
+            if databaseName != connection.settings_dict['NAME']:
+                # copy the run history back
+                source = sqlite3.connect(databaseName)
+                source.backup(connection.connection)
+                source.close()
+
+            runs = _readRuns(outputFile)
+            self.assertGreater(len(runs), 0)
+            self.assertEqual(first.pid, runs[0][0])
+            pids = [pid for pid, _ in runs]
+            self.assertEqual(1, len(set(pid for pid in pids if pid != first.pid)))  # one new lease holder
+            self.assertGreaterEqual(len(runs), 5)
+
+            # run history
+            history = list(CronJobRun.objects.filter(cron_job=recordJob).order_by('scheduled_dt').values_list('pid', 'outcome', 'duration', 'scheduled_dt'))
+            self.assertEqual([(pid, CronJobRun.OUTCOME_SUCCESS) for pid in pids], [(pid, outcome) for pid, outcome, _, _ in history])
+            self.assertTrue(all(duration >= 0 for _, _, duration, _ in history))
+            # each fire time runs once
+            scheduledTimes = [scheduledDt for _, _, _, scheduledDt in history]
+            self.assertEqual(len(scheduledTimes), len(set(scheduledTimes)))
+            outcomes = list(CronJobRun.objects.filter(cron_job=sleepJob).values_list('outcome', flat=True))
+            self.assertIn(CronJobRun.OUTCOME_SUCCESS, outcomes)
+            self.assertIn(CronJobRun.OUTCOME_SKIPPED, outcomes)
+            self.assertEqual(1, len(get_run_stats(cron_job_id=sleepJob.id)))
@@ -0,0 +1,59 @@
+import time
+
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.db.bulk_writer import BulkWriter
+from core.models import AccessLog
+
+
+class BulkWriterTestCase(TransactionTestCase):
+    def _newWriter(self, **kwargs) -> BulkWriter:
+        writer = BulkWriter('Test Writer', AccessLog, **kwargs)
+        self.addCleanup(writer.stop)
+        return writer
+
+    def test_batch_flush(self):
+        writer = self._newWriter(batchSize=10, flushInterval=3600)
+        writer.addAll([AccessLog(page_nm='P%s' % i) for i in range(25)])
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(25, writer.flush())
+        self.assertEqual(3, len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]))
+        self.assertEqual({'pending': 0, 'flushed': 25, 'failed': 0, 'dropped': 0}, writer.getCounters())
+        self.assertEqual(25, AccessLog.objects.count())
+
+    def test_overflow_drops_new_records(self):
+        writer = self._newWriter(batchSize=100, flushInterval=3600, maxPendingSize=5)
+        self.assertEqual(3, writer.addAll([AccessLog(page_nm='P%s' % i) for i in range(3)]))
+        self.assertEqual(2, writer.addAll([AccessLog(page_nm='Q%s' % i) for i in range(4)]))
+        self.assertFalse(writer.add(AccessLog(page_nm='R')))
+        self.assertEqual(5, writer.pendingCount)
+        self.assertEqual(3, writer.droppedCount)
+        writer.flush()
+        self.assertEqual(['P0', 'P1', 'P2', 'Q0', 'Q1'], list(AccessLog.objects.order_by('id').values_list('page_nm', flat=True)))
+
+    def test_failed_batch_writes_one_by_one(self):
+        writer = self._newWriter(batchSize=10, flushInterval=3600)
+        badRc = AccessLog(page_nm='bad')
+        badRc.id = 'not a number'
+        writer.addAll([AccessLog(page_nm='P0'), badRc, AccessLog(page_nm='P1')])
+        self.assertEqual(2, writer.flush())
+        self.assertEqual(1, writer.failedCount)
+        self.assertEqual(['P0', 'P1'], list(AccessLog.objects.order_by('id').values_list('page_nm', flat=True)))
+
+    def test_background_flush(self):
+        writer = self._newWriter(batchSize=1000, flushInterval=0.05)
+        writer.add(AccessLog(page_nm='P0'))
+        for _i in range(100):
+            if writer.flushedCount == 1:
+                break
+            time.sleep(0.05)
+        self.assertEqual(1, writer.flushedCount)
+        self.assertEqual(1, AccessLog.objects.count())
+
+    def test_stop_flushes_pending_records(self):
+        writer = self._newWriter(batchSize=1000, flushInterval=3600)
+        writer.addAll([AccessLog(page_nm='P%s' % i) for i in range(3)])
+        writer.stop()
+        self.assertEqual(3, AccessLog.objects.count())
@@ -0,0 +1,95 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+import core.ui.ui as ikui
+from core.db.keyset_paginator import KeysetPaginator, parseSortKeys, splitSqlOrderBy
+from core.models import Group, Menu
+from core.view.screen_view import ScreenAPIView
+
+SCREEN_NAME = 'KeysetPaginatorTest'
+
+
+class KeysetPaginatorTest(ScreenAPIView):
+    pass
+
+
+GROUP_SQL = "SELECT id, grp_nm, rmk FROM ik_grp WHERE grp_nm LIKE 'G%' ORDER BY rmk DESC"
+
+
+class KeysetPaginatorTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # rmk has duplicates, so "id" is required to make the order unique
+        Group.objects.bulk_create([Group(grp_nm='G%02d' % i, rmk='R%s' % (i % 4)) for i in range(25)])
+        Group.objects.create(grp_nm='Other', rmk='R9')
+        cls.expectedIDs = list(Group.objects.filter(grp_nm__startswith='G').order_by('-rmk', 'id').values_list('id', flat=True))
+
+    def _getPages(self, getPage, pageNums: list) -> tuple:
+        pages, cursor = [], None
+        with CaptureQueriesContext(connection) as queries:
+            for pageNum in pageNums:
+                rcs, cursor = getPage(pageNum, cursor)
+                pages.append([rc['id'] if type(rc) == dict else rc.id for rc in rcs])
+        return pages, [q['sql'] for q in queries.captured_queries]
+
+    def _getExpectedPage(self, pageNum: int) -> list:
+        return self.expectedIDs[(pageNum - 1) * 10:pageNum * 10]
+
+    def test_parse_sort_keys(self):
+        self.assertEqual([('claim_dt', True), ('id', False)], parseSortKeys('-claim_dt'))
+        self.assertEqual([('claim_dt', True), ('sn', False), ('id', False)], parseSortKeys('t.claim_dt DESC, sn'))
+        self.assertEqual([('id', True)], parseSortKeys(['-id']))
+        self.assertEqual(("SELECT a FROM t WHERE b = 1", 'a DESC'), splitSqlOrderBy('SELECT a FROM t WHERE b = 1 ORDER BY a DESC'))
+
+    def test_queryset_pages(self):
+        paginator = KeysetPaginator(10)
+        queryset = Group.objects.filter(grp_nm__startswith='G').order_by('-rmk')
+        pages, sqls = self._getPages(lambda pageNum, cursor: paginator.getQuerySetPage(queryset, pageNum, cursor), [1, 2, 3, 2, 1])
+        self.assertEqual([self._getExpectedPage(n) for n in [1, 2, 3, 2, 1]], pages)
+        self.assertFalse(any('OFFSET' in sql for sql in sqls))
+
+    def test_sql_pages(self):
+        paginator = KeysetPaginator(10)
+        pages, sqls = self._getPages(lambda pageNum, cursor: paginator.getSqlPage(GROUP_SQL, pageNum, cursor), [1, 2, 3, 3, 2, 1])
+        self.assertEqual([self._getExpectedPage(n) for n in [1, 2, 3, 3, 2, 1]], pages)
+        self.assertFalse(any('OFFSET 10' in sql or 'OFFSET 20' in sql for sql in sqls))
+
+    def test_jump_and_invalid_cursor_use_offset(self):
+        paginator = KeysetPaginator(10, '-rmk')
+        queryset = Group.objects.filter(grp_nm__startswith='G')
+        rcs, cursor = paginator.getQuerySetPage(queryset, 3, None)
+        self.assertEqual(self._getExpectedPage(3), [rc.id for rc in rcs])
+        rcs, _cursor = paginator.getQuerySetPage(queryset, 2, cursor)
+        self.assertEqual(self._getExpectedPage(2), [rc.id for rc in rcs])
+        rows, _cursor = paginator.getSqlPage(GROUP_SQL, 2, cursor + 'x')
+        self.assertEqual(self._getExpectedPage(2), [r['id'] for r in rows])
+        # a cursor of another page size is ignored
+        rows, _cursor = KeysetPaginator(5, '-rmk').getSqlPage(GROUP_SQL, 4, cursor)
+        self.assertEqual(self.expectedIDs[15:20], [r['id'] for r in rows])
+
+    def test_paging_response(self):
+        cache.set('fgTypes', list(ikui.SCREEN_FIELD_NORMAL_GROUP_TYPES))
+        cache.set('fieldWidgets', list(ikui.SCREEN_FIELD_NORMAL_WIDGETS))
+        dfn = {'templateVersion': 1, 'viewID': SCREEN_NAME, 'viewTitle': SCREEN_NAME, 'viewDesc': None, 'layoutType': None,
+               'layoutParams': None, 'appName': 'core', 'viewName': SCREEN_NAME, 'editable': True,
+               'recordsetTable': [('grpRcs', '*', 'core.models.Group', None, 'id', None, None)],
+               'fieldGroupTable': [('grpFg', ikui.SCREEN_FIELD_TYPE_RESULT_TABLE, None, 'grpRcs', None, None, None, None, None, None,
+                                    ikui.SCREEN_FIELD_GROUP_PAGE_TYPE_SERVER, 10, None, None, None, None, 'pageMode: keyset\npageSortKey: -rmk', None)],
+               'fieldTable': [('grpFg', 'grp_nm', 'Group Name', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_LABEL, None, 'grp_nm', None, None, None)],
+               'subScreenTable': [], 'fieldGroupLinkTable': [], 'headerFooterTable': []}
+        Menu.objects.create(menu_nm=SCREEN_NAME, menu_caption=SCREEN_NAME, screen_nm=SCREEN_NAME)
+        view = KeysetPaginatorTest()
+        view._screen = ikui.IkUI._compileScreen(SCREEN_NAME, dfn)
+        queryset = Group.objects.filter(grp_nm__startswith='G').values('id', 'grp_nm', 'rmk')
+        cursor = None
+        for pageNum in (1, 2):
+            requestData = {'PAGEABLE_grpFg_pageNum': pageNum, 'PAGEABLE_grpFg_cursor': cursor}
+            with mock.patch.object(view, 'getRequestData', return_value=requestData):
+                data = view.getPagingResponse('grpFg', table_data=queryset).getJsonData()
+            self.assertEqual(25, data['paginatorDataAmount'])
+            self.assertEqual(self._getExpectedPage(pageNum), [r['id'] for r in data['data']])
+            cursor = data['paginatorCursor']
@@ -0,0 +1,86 @@
+import json
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+import core.db.model as ikDbModel
+from core.db.bulk_writer import BulkWriter
+from core.db.model import ModelHistory
+from core.db.model_version import changeModelVersions
+from core.db.transaction import IkTransaction
+from core.menu.menu_manager import invalidateMenuIndex
+from core.models import Group
+
+
+class ModelHistoryTestCase(TestCase):
+    def setUp(self):
+        self.writer = BulkWriter('Test Model History Writer', ModelHistory, batchSize=2, flushInterval=3600)
+        # no background thread, the records are written by flushModelHistory() in the tests
+        for patcher in (mock.patch('core.db.bulk_writer.Thread'),
+                        mock.patch.object(ikDbModel, 'ENABLE_MODEL_HISTORY', True),
+                        mock.patch.object(ikDbModel, '_isModelHistoryEnabled', return_value=True),
+                        mock.patch.object(ikDbModel, '_modelHistoryWriter', self.writer)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.writer.stop)
+        ContentType.objects.get_for_model(Group)
+
+    def _updateGroups(self, total: int = 3) -> list:
+        Group.objects.bulk_create([Group(grp_nm='G%s' % i) for i in range(total)])
+        groups = list(Group.objects.order_by('id'))
+        for grp in groups:
+            grp.rmk = 'changed'
+            grp.ik_set_status_modified()
+        trn = IkTransaction(userID=-1)
+        trn.add(groups)
+        b = trn.save()
+        self.assertTrue(b.value, b.data)
+        return groups
+
+    def test_deferred(self):
+        with mock.patch.object(ikDbModel, 'MODEL_HISTORY_MODE', ikDbModel.MODEL_HISTORY_MODE_DEFERRED):
+            with self.captureOnCommitCallbacks(execute=True):
+                groups = self._updateGroups()
+                self.assertEqual(0, self.writer.pendingCount)
+            self.assertEqual(3, self.writer.pendingCount)
+            self.assertEqual(0, ModelHistory.objects.count())
+            with self.assertNumQueries(2):  # batch size is 2
+                self.assertEqual(3, ikDbModel.flushModelHistory())
+        self.assertEqual(3, self.writer.flushedCount)
+        hist = ModelHistory.objects.get(object_id=groups[0].id)
+        self.assertEqual(ModelHistory.UPDATE_FLAG, hist.action)
+        self.assertEqual('core.models.Group', hist.model_name)
+        self.assertEqual({'rmk': {'old': None, 'new': 'changed'}}, json.loads(hist.diff))
+        self.assertEqual({'rmk': None, 'version_no': 0}, json.loads(hist.old_data)[0]['fields'])
+        self.assertEqual({'rmk': 'changed', 'version_no': 1}, json.loads(hist.new_data)[0]['fields'])
+
+    def test_deferred_rollback(self):
+        with mock.patch.object(ikDbModel, 'MODEL_HISTORY_MODE', ikDbModel.MODEL_HISTORY_MODE_DEFERRED):
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                self._updateGroups()
+        self.assertEqual(3, len([callback for callback in callbacks if callback is not invalidateMenuIndex
+                                 and getattr(callback, 'func', None) is not changeModelVersions]))
+        self.assertEqual(0, self.writer.pendingCount)
+
+    def test_sync(self):
+        with mock.patch.object(ikDbModel, 'MODEL_HISTORY_MODE', ikDbModel.MODEL_HISTORY_MODE_SYNC):
+            grp = Group(grp_nm='new')
+            grp.save()
+            grp.rmk = 'a'
+            grp.save()
+            grp.delete()
+        self.assertEqual(0, self.writer.pendingCount)
+        hists = list(ModelHistory.objects.order_by('id'))
+        self.assertEqual([ModelHistory.INSERT_FLAG, ModelHistory.UPDATE_FLAG, ModelHistory.DELETE_FLAG], [h.action for h in hists])
+        self.assertEqual('new', json.loads(hists[0].new_data)[0]['fields']['grp_nm'])
+        self.assertEqual({'rmk': {'old': None, 'new': 'a'}}, json.loads(hists[1].diff))
+        self.assertEqual('a', json.loads(hists[2].old_data)[0]['fields']['rmk'])
+
+    def test_no_old_record_query(self):
+        Group.objects.create(grp_nm='G')
+        grp = Group.objects.get(grp_nm='G')
+        grp.rmk = 'changed'
+        with mock.patch.object(ikDbModel, 'MODEL_HISTORY_MODE', ikDbModel.MODEL_HISTORY_MODE_DEFERRED):
+            with self.assertNumQueries(1):
+                grp.save()
@@ -0,0 +1,100 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+import core.db.row_counter as rowCounter
+import core.ui.ui as ikui
+from core.core.exception import IkValidateException
+from core.db.row_counter import RowCounter, stripSqlOrderBy
+from core.models import Group, Menu
+from core.view.screen_view import ScreenAPIView
+
+SCREEN_NAME = 'RowCounterTest'
+GROUP_SQL = "SELECT id, grp_nm, rmk FROM ik_grp WHERE grp_nm LIKE 'G%' ORDER BY rmk DESC, id"
+
+
+class RowCounterTest(ScreenAPIView):
+    pass
+
+
+class RowCounterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Group.objects.bulk_create([Group(grp_nm='G%02d' % i, rmk='R%s' % (i % 4)) for i in range(25)])
+        Group.objects.create(grp_nm='Other', rmk='R9')
+        Menu.objects.create(menu_nm=SCREEN_NAME, menu_caption=SCREEN_NAME, screen_nm=SCREEN_NAME)
+
+    def test_strip_order_by(self):
+        self.assertEqual("SELECT id, grp_nm, rmk FROM ik_grp WHERE grp_nm LIKE 'G%'", stripSqlOrderBy(GROUP_SQL))
+        self.assertEqual("SELECT a FROM t", stripSqlOrderBy('SELECT a FROM t ORDER BY a LIMIT 10;'))
+        with self.assertRaises(IkValidateException):
+            RowCounter('fast')
+
+    def test_count_modes(self):
+        queryset = Group.objects.filter(grp_nm__startswith='G').order_by('-rmk')
+        for mode in ('exact', 'estimate', None):  # sqlite: estimate -> exact
+            with self.assertNumQueries(2):
+                self.assertEqual((25, True), RowCounter(mode).countQuerySet(queryset))
+                self.assertEqual((25, True), RowCounter(mode).countSql(GROUP_SQL))
+        self.assertEqual((25, True), RowCounter('capped', 25).countQuerySet(queryset))
+        self.assertEqual((11, False), RowCounter('capped', 10).countQuerySet(queryset))
+        self.assertEqual((25, True), RowCounter('capped', 25).countSql(GROUP_SQL))
+        self.assertEqual((11, False), RowCounter('Capped', 10).countSql(GROUP_SQL))
+
+    def test_postgresql_estimate(self):
+        counter = RowCounter('estimate', 1000)
+        with mock.patch.object(rowCounter, '_isPostgreSQL', return_value=True), \
+                mock.patch.object(counter, '_RowCounter__getTableEstimate', return_value=50000) as tableEstimate, \
+                mock.patch.object(counter, '_RowCounter__getExplainEstimate', side_effect=[2000, 10]) as explainEstimate:
+            with self.assertNumQueries(0):
+                self.assertEqual((50000, False), counter.countQuerySet(Group.objects.all()))
+                self.assertEqual((2000, False), counter.countQuerySet(Group.objects.filter(grp_nm__startswith='G')))
+            # the estimate is less than the cap, count the rows
+            self.assertEqual((25, True), counter.countSql(GROUP_SQL))
+        self.assertEqual(1, tableEstimate.call_count)
+        self.assertEqual(2, explainEstimate.call_count)
+
+    def _getView(self, additionalProps: str) -> RowCounterTest:
+        cache.set('fgTypes', list(ikui.SCREEN_FIELD_NORMAL_GROUP_TYPES))
+        cache.set('fieldWidgets', list(ikui.SCREEN_FIELD_NORMAL_WIDGETS))
+        dfn = {'templateVersion': 1, 'viewID': SCREEN_NAME, 'viewTitle': SCREEN_NAME, 'viewDesc': None, 'layoutType': None,
+               'layoutParams': None, 'appName': 'core', 'viewName': SCREEN_NAME, 'editable': True,
+               'recordsetTable': [('grpRcs', '*', 'core.models.Group', None, 'id', None, None)],
+               'fieldGroupTable': [('grpFg', ikui.SCREEN_FIELD_TYPE_RESULT_TABLE, None, 'grpRcs', None, None, None, None, None, None,
+                                    ikui.SCREEN_FIELD_GROUP_PAGE_TYPE_SERVER, 10, None, None, None, None, additionalProps, None)],
+               'fieldTable': [('grpFg', 'grp_nm', 'Group Name', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_LABEL, None, 'grp_nm', None, None, None)],
+               'subScreenTable': [], 'fieldGroupLinkTable': [], 'headerFooterTable': []}
+        view = RowCounterTest()
+        view._screen = ikui.IkUI._compileScreen(SCREEN_NAME, dfn)
+        return view
+
+    def _getPage(self, view, pageNum: int, **kwargs) -> dict:
+        with mock.patch.object(view, 'getRequestData', return_value={'PAGEABLE_grpFg_pageNum': pageNum}):
+            return view.getPagingResponse('grpFg', **kwargs).getJsonData()
+
+    def test_paging_response(self):
+        queryset = Group.objects.filter(grp_nm__startswith='G').order_by('id').values('id', 'grp_nm')
+        ids = list(queryset.values_list('id', flat=True))
+
+        view = self._getView('pageCountMode: capped\npageCountCap: 15')
+        with self.assertNumQueries(2):  # count and page
+            data = self._getPage(view, 3, table_data=queryset)
+        self.assertEqual((16, False), (data['paginatorDataAmount'], data['paginatorDataAmountExact']))
+        self.assertEqual(ids[20:], [r['id'] for r in data['data']])
+        data = self._getPage(view, -1, table_data=queryset)  # page number is less than 1, use the first page
+        self.assertEqual(ids[:10], [r['id'] for r in data['data']])
+        data = self._getPage(view, 1, table_sql=GROUP_SQL)
+        self.assertEqual((16, False), (data['paginatorDataAmount'], data['paginatorDataAmountExact']))
+        self.assertEqual(10, len(data['data']))
+
+        view = self._getView('pageCountMode: exact')
+        with self.assertNumQueries(2):
+            data = self._getPage(view, 3, table_data=queryset)
+        self.assertEqual((25, True), (data['paginatorDataAmount'], data['paginatorDataAmountExact']))
+        self.assertEqual(ids[20:], [r['id'] for r in data['data']])
+
+        # count mode is not set
+        data = self._getPage(self._getView(None), 1, table_sql=GROUP_SQL)
+        self.assertEqual(25, data['paginatorDataAmount'])
+        self.assertNotIn('paginatorDataAmountExact', data)
@@ -0,0 +1,143 @@
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from core.db.model import ModelRecordStatus
+from core.db.transaction import IkTransaction
+from core.models import Group, Menu, GroupMenu
+
+
+class _GroupTestMixin:
+    def _createGroups(self, total: int, prefix: str = 'G') -> list:
+        Group.objects.bulk_create([Group(grp_nm='%s%s' % (prefix, i)) for i in range(total)])
+        return list(Group.objects.filter(grp_nm__startswith=prefix).order_by('id'))
+
+    def _save(self, rcs: list):
+        trn = IkTransaction(userID=-1)
+        trn.add(rcs)
+        return trn.save()
+
+
+class IkTransactionBulkSaveTestCase(_GroupTestMixin, TestCase):
+    def _getUpdateQueryCount(self, total: int, prefix: str) -> int:
+        groups = self._createGroups(total, prefix)
+        for grp in groups:
+            grp.rmk = 'changed'
+            grp.ik_set_status_modified()
+        with CaptureQueriesContext(connection) as ctx:
+            b = self._save(groups)
+        self.assertTrue(b.value, b.data)
+        return len(ctx.captured_queries)
+
+    def test_update_query_count_is_constant(self):
+        self.assertEqual(self._getUpdateQueryCount(5, 'A'), self._getUpdateQueryCount(50, 'B'))
+
+    def test_delete_query_count_is_constant(self):
+        def getDeleteQueryCount(total: int, prefix: str) -> int:
+            groups = self._createGroups(total, prefix)
+            menu = Menu.objects.create(menu_nm=prefix, menu_caption=prefix)
+            GroupMenu.objects.bulk_create([GroupMenu(grp=grp, menu=menu) for grp in groups])
+            for grp in groups:
+                grp.ik_set_status_delete()
+            with CaptureQueriesContext(connection) as ctx:
+                b = self._save(groups)
+            self.assertTrue(b.value, b.data)
+            self.assertFalse(Group.objects.filter(grp_nm__startswith=prefix).exists())
+            self.assertFalse(GroupMenu.objects.filter(menu=menu).exists())
+            return len(ctx.captured_queries)
+
+        self.assertEqual(getDeleteQueryCount(5, 'A'), getDeleteQueryCount(50, 'B'))
+
+    def test_update_result(self):
+        groups = self._createGroups(3)
+        groups[0].rmk = 'changed'
+        groups[0].ik_set_status_modified()
+        groups[1].ik_set_status_delete()
+        newGroup = Group(grp_nm='new')
+        b = self._save(groups + [newGroup])
+        self.assertTrue(b.value, b.data)
+        self.assertEqual(ModelRecordStatus.MODIFIED, groups[0].ik_get_status())
+        self.assertEqual(ModelRecordStatus.RETRIEVE, groups[2].ik_get_status())
+        self.assertEqual([('G0', 'changed', 1), ('G2', None, 0), ('new', None, 0)],
+                         list(Group.objects.order_by('id').values_list('grp_nm', 'rmk', 'version_no')))
+
+
+
+class IkTransactionBulkSaveValidationTestCase(_GroupTestMixin, TransactionTestCase):
+    '''
+        IkTransaction rolls back its own savepoint if saving failed, so run the failed cases out of the test case transaction.
+    '''
+
+    def test_concurrency_check(self):
+        groups = self._createGroups(3)
+        Group.objects.filter(id=groups[1].id).update(version_no=F('version_no') + 1)
+        for grp in groups:
+            grp.rmk = 'changed'
+            grp.ik_set_status_modified()
+        b = self._save(groups)
+        self.assertFalse(b.value)
+        self.assertIn('Record [%s] has been updated by others' % groups[1], b.data)
+        self.assertFalse(Group.objects.filter(rmk='changed').exists())
+
+    def test_concurrency_check_deleted_record(self):
+        groups = self._createGroups(3)
+        Group.objects.filter(id=groups[2].id).delete()
+        for grp in groups:
+            grp.rmk = 'changed'
+            grp.ik_set_status_modified()
+        b = self._save(groups)
+        self.assertFalse(b.value)
+        self.assertIn('Record [%s] has been deleted' % groups[2], b.data)
+
+    def test_unique_validation(self):
+        groups = self._createGroups(3)
+        Group.objects.create(grp_nm='other')
+        groups[1].grp_nm = 'other'
+        groups[1].ik_set_status_modified()
+        b = self._save(groups)
+        self.assertFalse(b.value)
+        self.assertIn('already exists', str(b.data))
+        self.assertEqual(1, Group.objects.filter(grp_nm='other').count())
+
+    def test_reuse_unique_value(self):
+        # A: x -> z, B: y -> x. B takes the value which A gives up in the same save.
+        groups = self._createGroups(3)
+        groups[0].grp_nm = 'z'
+        groups[1].grp_nm = 'G0'
+        for grp in groups[:2]:
+            grp.ik_set_status_modified()
+        b = self._save(groups)
+        self.assertTrue(b.value, b.data)
+        self.assertEqual(['z', 'G0', 'G2'], [Group.objects.get(id=grp.id).grp_nm for grp in groups])
+
+        # a value which is not given up is still a conflict
+        groups = list(Group.objects.filter(id__in=[grp.id for grp in groups]).order_by('id'))
+        groups[0].grp_nm = 'x'
+        groups[1].grp_nm = 'G2'
+        for grp in groups[:2]:
+            grp.ik_set_status_modified()
+        b = self._save(groups)
+        self.assertFalse(b.value)
+        self.assertIn('already exists', str(b.data))
+
+    def test_bulk_create(self):
+        def getCreateQueryCount(total: int, prefix: str) -> int:
+            trn = IkTransaction(userID=-1)
+            trn.add([Group(grp_nm='%s%s' % (prefix, i)) for i in range(total)], bulkCreate=True)
+            with CaptureQueriesContext(connection) as ctx:
+                b = trn.save()
+            self.assertTrue(b.value, b.data)
+            self.assertEqual(total, Group.objects.filter(grp_nm__startswith=prefix).count())
+            return len(ctx.captured_queries)
+
+        self.assertEqual(getCreateQueryCount(5, 'A'), getCreateQueryCount(50, 'B'))
+
+        # unique and field validation
+        for grpNm, message in (('A1', 'already exists'), ('X' * 100, 'at most 50 characters')):
+            trn = IkTransaction(userID=-1)
+            trn.add([Group(grp_nm='C1'), Group(grp_nm=grpNm)], bulkCreate=True)
+            b = trn.save()
+            self.assertFalse(b.value)
+            self.assertIn(message, str(b.data))
+            self.assertFalse(Group.objects.filter(grp_nm='C1').exists())
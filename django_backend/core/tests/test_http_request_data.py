@@ -0,0 +1,85 @@
+import json
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.test import TestCase
+
+import core.core.http as ikhttp
+import core.db.model as ikDbModels
+import core.ui.ui as ikui
+from core.core.exception import IkValidateException
+from core.models import Group
+
+SCREEN_NAME = 'HttpRequestDataTest'
+
+
+def getGroupScreen() -> ikui.Screen:
+    dfn = {'templateVersion': 1, 'viewID': SCREEN_NAME, 'viewTitle': SCREEN_NAME, 'viewDesc': None, 'layoutType': None,
+           'layoutParams': None, 'appName': 'core', 'viewName': SCREEN_NAME, 'editable': True,
+           'recordsetTable': [('grpRcs', '*', 'core.models.Group', None, 'id', None, None)],
+           'fieldGroupTable': [('grpFg', ikui.SCREEN_FIELD_TYPE_TABLE, None, 'grpRcs', True, True, True, None, None, None,
+                                None, None, None, None, None, None, None, None)],
+           'fieldTable': [('grpFg', 'grp_nm', 'Group Name', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_TEXT_BOX, None, 'grp_nm', None, None, None),
+                          ('grpFg', 'rmk', 'Remarks', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_TEXT_BOX, None, 'rmk', None, None, None)],
+           'subScreenTable': [], 'fieldGroupLinkTable': [], 'headerFooterTable': []}
+    return ikui.IkUI._compileScreen(SCREEN_NAME, dfn)
+
+
+class GetRequestDataTestCase(TestCase):
+    def setUp(self):
+        cache.set('fgTypes', list(ikui.SCREEN_FIELD_NORMAL_GROUP_TYPES))
+        cache.set('fieldWidgets', list(ikui.SCREEN_FIELD_NORMAL_WIDGETS))
+        self.screen = getGroupScreen()
+
+    def _getRequestData(self, rows: list) -> ikhttp.IkRequestData:
+        body = {'grpFg': {'attr': ['__STT_', '__KEY_', 'grp_nm', 'rmk'], 'data': rows}}
+        request = SimpleNamespace(query_params={}, body=json.dumps(body).encode(), data={})
+        return ikhttp.GetRequestData(request, {'grpFg': 'core.models.Group'}, self.screen)
+
+    def _createGroups(self, total: int) -> list:
+        Group.objects.bulk_create([Group(grp_nm='G%s' % i) for i in range(total)])
+        return list(Group.objects.order_by('id'))
+
+    def _getRows(self, groups: list) -> list:
+        rows = []
+        for i, grp in enumerate(groups):
+            if i % 3 == 0:
+                rows.append(['~', str(grp.id), grp.grp_nm, 'changed'])
+            elif i % 3 == 1:
+                rows.append(['-', str(grp.id), grp.grp_nm, None])
+            else:
+                rows.append(['', str(grp.id), grp.grp_nm, None])
+        rows.append(['+', '', 'new group', None])
+        return rows
+
+    def test_query_count_is_constant(self):
+        groups = self._createGroups(20)
+        with self.assertNumQueries(1):
+            data = self._getRequestData(self._getRows(groups[:3]))
+        self.assertEqual(4, len(data['grpFg']))
+        with self.assertNumQueries(1):
+            data = self._getRequestData(self._getRows(groups))
+        self.assertEqual(21, len(data['grpFg']))
+
+    def test_query_chunk(self):
+        groups = self._createGroups(ikhttp.PREFETCH_CHUNK_SIZE + 10)
+        with self.assertNumQueries(2):
+            data = self._getRequestData(self._getRows(groups))
+        self.assertEqual(len(groups) + 1, len(data['grpFg']))
+
+    def test_record_status(self):
+        groups = self._createGroups(3)
+        rcs = self._getRequestData(self._getRows(groups))['grpFg']
+        self.assertEqual([groups[0].id, groups[1].id, groups[2].id, None], [rc.id for rc in rcs])
+        self.assertEqual('changed', rcs[0].rmk)
+        self.assertEqual(ikDbModels.ModelRecordStatus.MODIFIED, rcs[0].ik_get_status())
+        self.assertEqual(ikDbModels.ModelRecordStatus.DELETE, rcs[1].ik_get_status())
+        self.assertEqual(ikDbModels.ModelRecordStatus.RETRIEVE, rcs[2].ik_get_status())
+        self.assertEqual(ikDbModels.ModelRecordStatus.NEW, rcs[3].ik_get_status())
+        self.assertEqual('new group', rcs[3].grp_nm)
+
+    def test_deleted_record(self):
+        groups = self._createGroups(2)
+        Group.objects.filter(id=groups[1].id).delete()
+        with self.assertRaises(IkValidateException):
+            self._getRequestData([['~', str(groups[0].id), 'G0', 'a'], ['-', str(groups[1].id), 'G1', None]])
@@ -0,0 +1,90 @@
+import json
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+import core.db.model as ikDbModel
+from core.core.exception import IkValidateException
+from core.db.model import ModelHistory
+from core.inbox import inbox_manager
+from core.models import IkInbox, IkInboxPrm, User
+
+RECEIVERS = 1000
+
+
+class InboxManagerTestCase(TestCase):
+    def setUp(self):
+        User.objects.bulk_create([User(usr_nm='InboxUser%s' % i, psw='-') for i in range(RECEIVERS + 1)])
+        userIDs = list(User.objects.filter(usr_nm__startswith='InboxUser').order_by('id').values_list('id', flat=True))
+        self.senderID = userIDs[0]
+        self.receiverIDs = userIDs[1:]
+
+    def _send(self, receiverIDs: list) -> tuple:
+        '''
+            Return (inbox IDs, queries).
+        '''
+        with CaptureQueriesContext(connection) as queries:
+            inboxIDs = inbox_manager.send(self.senderID, receiverIDs, 'Test', 'Summary', link_params={'id': 1, inbox_manager.ACTION_COMMAND: 'open'})
+        return inboxIDs, [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+
+    def test_send(self):
+        inboxIDs, queries = self._send(self.receiverIDs)
+        self.assertEqual(RECEIVERS, len(set(inboxIDs)))
+        # 1 query for the user names, and the batched inserts (the batch size depends on the database)
+        self.assertTrue(queries[0].startswith('SELECT') and 'ik_usr' in queries[0])
+        self.assertTrue(all(sql.startswith('INSERT') for sql in queries[1:]))
+        self.assertLess(len(queries), RECEIVERS / 50)
+        self.assertEqual(sorted(self.receiverIDs), sorted(IkInbox.objects.filter(id__in=inboxIDs).values_list('owner_id', flat=True)))
+        self.assertEqual({'id': '1', inbox_manager.ACTION_COMMAND: 'open'}, inbox_manager.get_link_params(inboxIDs[-1]))
+        self.assertEqual(2 * RECEIVERS, IkInboxPrm.objects.filter(inbox_id__in=inboxIDs).count())
+
+        with self.assertRaises(IkValidateException):
+            inbox_manager.send(self.senderID, self.receiverIDs[:2] + [-999], 'Test', 'Summary')
+        with self.assertRaises(IkValidateException):
+            inbox_manager.send(-999, self.receiverIDs[:2], 'Test', 'Summary')
+
+    def test_update_status(self):
+        inboxIDs = [inbox_manager.send(self.senderID, self.receiverIDs[0], 'Test', 'Summary %s' % i)[0] for i in range(RECEIVERS)]
+        ownerID = self.receiverIDs[0]
+        with CaptureQueriesContext(connection) as queries:
+            b = inbox_manager.mark_read(ownerID, inboxIDs)
+        self.assertTrue(b.value, b.data)
+        # user name, select and update
+        self.assertEqual(3, len([q for q in queries if 'SAVEPOINT' not in q['sql']]))
+        self.assertEqual(RECEIVERS, IkInbox.objects.filter(id__in=inboxIDs, sts=IkInbox.STATUS_READ, version_no=1).count())
+        self.assertEqual('No data changed.', inbox_manager.mark_read(ownerID, inboxIDs[:10]).data)
+
+        # permission
+        otherID = inbox_manager.send(self.senderID, self.receiverIDs[1], 'Test', 'Other')[0]
+        with self.assertRaises(IkValidateException):
+            inbox_manager.mark_completed(ownerID, inboxIDs[:10] + [otherID])
+        with self.assertRaises(IkValidateException):
+            inbox_manager.mark_completed(ownerID, [-1])
+        self.assertEqual(0, IkInbox.objects.filter(sts=IkInbox.STATUS_COMPLETED).count())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(inbox_manager.mark_deleted(ownerID, inboxIDs).value)
+        # user name, select, and the batched selects and deletes of the inboxes and parameters
+        self.assertLess(len([q for q in queries if 'SAVEPOINT' not in q['sql']]), RECEIVERS / 50)
+        self.assertFalse(IkInbox.objects.filter(id__in=inboxIDs).exists())
+        self.assertTrue(IkInbox.objects.filter(id=otherID).exists())
+
+    def test_model_history(self):
+        with mock.patch.object(ikDbModel, '_isModelHistoryEnabled', return_value=True), \
+                mock.patch.object(ikDbModel, 'MODEL_HISTORY_MODE', ikDbModel.MODEL_HISTORY_MODE_SYNC):
+            inboxIDs = inbox_manager.send(self.senderID, self.receiverIDs[:3], 'Test', 'Summary', link_params={'id': 1})
+            ownerID = self.receiverIDs[0]
+            self.assertTrue(inbox_manager.mark_read(ownerID, inboxIDs[:1]).value)
+            self.assertTrue(inbox_manager.mark_deleted(ownerID, inboxIDs[:1]).value)
+
+        def histories(action, modelClass) -> list:
+            return list(ModelHistory.objects.filter(action=action, db_table=modelClass._meta.db_table).order_by('id'))
+        self.assertEqual(sorted(inboxIDs), sorted(int(h.object_id) for h in histories(ModelHistory.INSERT_FLAG, IkInbox)))
+        self.assertEqual(3, len(histories(ModelHistory.INSERT_FLAG, IkInboxPrm)))
+        updateHistories = histories(ModelHistory.UPDATE_FLAG, IkInbox)
+        self.assertEqual([inboxIDs[0]], [int(h.object_id) for h in updateHistories])
+        self.assertEqual({'sts': {'old': IkInbox.STATUS_NEW, 'new': IkInbox.STATUS_READ}}, json.loads(updateHistories[0].diff))
+        self.assertEqual([inboxIDs[0]], [int(h.object_id) for h in histories(ModelHistory.DELETE_FLAG, IkInbox)])
+        self.assertEqual(1, len(histories(ModelHistory.DELETE_FLAG, IkInboxPrm)))
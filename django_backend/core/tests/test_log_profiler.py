@@ -0,0 +1,114 @@
+import io
+import json
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.core.http import IkSccJsonResponse
+from core.log import profiler
+from core.models import Group, User
+from core.view.auth_view import AuthAPIView
+
+
+class ProfilerTest(AuthAPIView):
+    permission_classes = []
+
+    def get(self, request, *args, **kwargs):
+        with profiler.span('action', action='getGroups'):
+            return IkSccJsonResponse(data=list(Group.objects.values_list('grp_nm', flat=True)))
+
+
+class ProfilerTestCase(TestCase):
+    def setUp(self):
+        self.outputFolder = tempfile.TemporaryDirectory()
+        self.outputFile = Path(self.outputFolder.name, 'runtime.jsonl')
+        profiler.configure(enabled=True, sampleRate=1, outputFile=self.outputFile, flushInterval=3600)
+
+    def tearDown(self):
+        profiler.configure(enabled=False)
+        self.outputFolder.cleanup()
+
+    def _readSpans(self) -> list:
+        profiler.flush()
+        return list(profiler.readSpans([self.outputFile])) if self.outputFile.is_file() else []
+
+    def test_disabled(self):
+        profiler.configure(enabled=False)
+        with profiler.trace('request') as rootSpan:
+            with profiler.span('action') as span:
+                span.setAttribute('a', 1)
+        self.assertIs(rootSpan, span)
+        self.assertEqual([], self._readSpans())
+
+    def test_nested_spans(self):
+        with profiler.trace('request', path='/api/test'):
+            with profiler.span('action', action='save'):
+                with profiler.span('serialize'):
+                    pass
+                profiler.getCurrentSpan().setAttribute('rows', 3)
+            with self.assertRaises(ValueError):
+                with profiler.span('action', action='delete'):
+                    raise ValueError()
+        spans = {rc['span']: rc for rc in self._readSpans()}
+        self.assertEqual(['serialize', 'action', 'action', 'request'], [rc['name'] for rc in spans.values()])
+        self.assertEqual(1, len(set(rc['trace'] for rc in spans.values())))
+        root = [rc for rc in spans.values() if rc['parent'] is None][0]
+        self.assertEqual({'path': '/api/test'}, root['attrs'])
+        self.assertEqual('action', spans[[rc for rc in spans.values() if rc['name'] == 'serialize'][0]['parent']]['name'])
+        self.assertEqual([{'action': 'save', 'rows': 3}, {'action': 'delete', 'error': 'ValueError'}],
+                         [rc['attrs'] for rc in spans.values() if rc['name'] == 'action'])
+
+        # no trace
+        with profiler.span('action'):
+            pass
+        self.assertEqual(4, len(self._readSpans()))
+
+    def test_sampling(self):
+        profiler.configure(sampleRate=0)
+        with profiler.trace('request'):
+            with profiler.span('action'):
+                pass
+        self.assertEqual([], self._readSpans())
+
+    def test_thread_buffers(self):
+        def request(i):
+            with profiler.trace('request', index=i):
+                with profiler.span('action'):
+                    pass
+        threads = [threading.Thread(target=request, args=(i, )) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        spans = self._readSpans()
+        self.assertEqual(8, len(spans))
+        self.assertEqual(4, len(set(rc['trace'] for rc in spans)))
+
+    def test_view(self):
+        Group.objects.create(grp_nm='ProfilerGroup')
+        request = APIRequestFactory().get('/api/ProfilerTest')
+        force_authenticate(request, user=User.objects.create(usr_nm='ProfilerUser', psw='-'))
+        ProfilerTest.as_view()(request)
+        spans = self._readSpans()
+        self.assertEqual(['acl', 'sql', 'serialize', 'action', 'request'], [rc['name'] for rc in spans])
+        self.assertIn('ik_grp', spans[1]['attrs']['sql'])
+        self.assertEqual({'view': 'ProfilerTest', 'method': 'GET', 'path': '/api/ProfilerTest'}, spans[-1]['attrs'])
+
+    def test_aggregate(self):
+        spans = [{'name': 'sql', 'ms': float(i), 'attrs': {}} for i in range(1, 101)] \
+            + [{'name': 'action', 'ms': 5.0, 'attrs': {'action': 'save'}}, {'name': 'action', 'ms': 1.0, 'attrs': {'action': 'delete'}}]
+        results = profiler.aggregate(spans)
+        self.assertEqual({'name': 'sql', 'count': 100, 'p50': 50.5, 'p95': 95.0, 'p99': 99.0, 'max': 100.0, 'total': 5050.0}, results[0])
+        self.assertEqual([('action', 'save', 5.0), ('action', 'delete', 1.0)],
+                         [(r['name'], r['action'], r['p95']) for r in profiler.aggregate(spans, groupBy='action')][1:])
+
+        with profiler.trace('request'):
+            pass
+        profiler.flush()
+        with redirect_stdout(io.StringIO()) as output:
+            profiler.main([str(self.outputFile), '--json'])
+        self.assertEqual(['request'], [r['name'] for r in json.loads(output.getvalue())])
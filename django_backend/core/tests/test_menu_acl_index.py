@@ -0,0 +1,86 @@
+from unittest import mock
+
+from django.db.models import F
+from django.test import TestCase
+
+import core.db.model_version as modelVersion
+import core.menu.menu_manager as ikMenuManager
+from core.core.exception import IkValidateException
+from core.menu.menu_manager import ACL_DENY, ACL_READ, ACL_WRITE, MenuManager
+from core.models import Group, GroupMenu, Menu, User, UserGroup
+
+
+class MenuAclIndexTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(usr_nm='index_test_user', psw='-')
+        cls.readGroup = Group.objects.create(grp_nm='Index Test Read')
+        cls.writeGroup = Group.objects.create(grp_nm='Index Test Write')
+        cls.topMenu = Menu.objects.create(menu_nm='IndexTop', menu_caption='Top', enable=True, order_no=1)
+        cls.subMenu = Menu.objects.create(menu_nm='IndexSub', menu_caption='Sub', parent_menu_id=cls.topMenu.id, enable=True, order_no=1)
+        cls.readMenu = Menu.objects.create(menu_nm='IndexRead', menu_caption='Read', screen_nm='IndexReadScreen', parent_menu_id=cls.subMenu.id,
+                                           enable=True, order_no=1)
+        cls.writeMenu = Menu.objects.create(menu_nm='IndexWrite', menu_caption='Write', screen_nm='IndexWriteScreen', parent_menu_id=cls.subMenu.id,
+                                            enable=True, order_no=2)
+        cls.freeMenu = Menu.objects.create(menu_nm='IndexFree', menu_caption='Free', parent_menu_id=cls.subMenu.id, enable=True, order_no=3,
+                                           is_free_access=True)
+        UserGroup.objects.create(usr=cls.user, grp=cls.readGroup)
+        GroupMenu.objects.create(grp=cls.readGroup, menu=cls.readMenu, acl=ACL_READ)
+        GroupMenu.objects.create(grp=cls.readGroup, menu=cls.writeMenu, acl=ACL_READ)
+        GroupMenu.objects.create(grp=cls.writeGroup, menu=cls.writeMenu, acl=ACL_WRITE)
+
+    def setUp(self):
+        ikMenuManager.invalidateMenuIndex()
+
+    def test_acl_lookup_without_queries_in_steady_state(self):
+        MenuManager.getUserMenuAcl(self.user.id, self.readMenu.id)  # load the index
+        with self.assertNumQueries(0):
+            self.assertEqual(ACL_READ, MenuManager.getUserMenuAcl(self.user.id, self.readMenu.id))
+            self.assertEqual(ACL_READ, MenuManager.getUserMenuAcl(self.user.id, self.writeMenu.id))
+            self.assertEqual(ACL_WRITE, MenuManager.getUserMenuAcl(self.user.id, self.freeMenu.id))
+            self.assertEqual(ACL_DENY, MenuManager.getUserMenuAcl(self.user.id, self.topMenu.id))
+            self.assertEqual(ACL_DENY, MenuManager.getUserMenuAcl(self.user.id, -1))
+            self.assertEqual(self.readMenu.id, MenuManager.getMenuId('indexread'))
+            self.assertEqual('IndexWrite', MenuManager.getMenuName(self.writeMenu.id))
+            self.assertEqual('Read', MenuManager.getMenuCaption(self.readMenu.id))
+            self.assertEqual(self.subMenu.id, MenuManager.getParentMenuIdByMenuNm('IndexRead'))
+            self.assertEqual(self.writeMenu.id, MenuManager.getMenuIdByScreenName('IndexWriteScreen'))
+            self.assertEqual('IndexRead', MenuManager.getMenuNameByScreenName('IndexReadScreen'))
+            self.assertIn(self.subMenu.id, MenuManager.getNodeMenus())
+            self.assertEqual('Top -> Sub -> IndexRead - Read', MenuManager.get_full_menu_name(self.readMenu.id))
+            self.assertEqual(frozenset([ACL_READ]), MenuManager.getUserGroupMenuAcls(self.user.id, self.writeMenu.id))
+        self.assertRaises(IkValidateException, MenuManager.getMenuId, 'IndexNotExists')
+
+    def test_group_menu_change_reloads_index(self):
+        self.assertEqual(ACL_READ, MenuManager.getUserMenuAcl(self.user.id, self.writeMenu.id))
+        UserGroup.objects.create(usr=self.user, grp=self.writeGroup)
+        self.assertEqual(ACL_WRITE, MenuManager.getUserMenuAcl(self.user.id, self.writeMenu.id))
+
+        GroupMenu.objects.filter(grp=self.readGroup, menu=self.readMenu).delete()
+        self.assertEqual(ACL_DENY, MenuManager.getUserMenuAcl(self.user.id, self.readMenu.id))
+
+        self.writeMenu.menu_nm = 'IndexWrite2'
+        self.writeMenu.save()
+        self.assertEqual(self.writeMenu.id, MenuManager.getMenuId('IndexWrite2'))
+
+    def test_generation_changed_by_other_process(self):
+        MenuManager.getUserMenuAcl(self.user.id, self.readMenu.id)
+        # QuerySet.update() doesn't send signals, e.g. another process changed the database. The generation is read from the database.
+        GroupMenu.objects.filter(grp=self.readGroup, menu=self.readMenu).update(acl=ACL_WRITE, version_no=F('version_no') + 1)
+        self.assertEqual(ACL_READ, MenuManager.getUserMenuAcl(self.user.id, self.readMenu.id))  # in the check interval
+        with mock.patch.object(modelVersion, 'CHECK_INTERVAL', 0):  # the interval passed
+            self.assertEqual(ACL_WRITE, MenuManager.getUserMenuAcl(self.user.id, self.readMenu.id))
+
+        # not found by other processes without version_no, drop the index of this process
+        GroupMenu.objects.filter(grp=self.readGroup, menu=self.readMenu).update(acl=ACL_READ)
+        self.assertEqual(ACL_WRITE, MenuManager.getUserMenuAcl(self.user.id, self.readMenu.id))
+        ikMenuManager.invalidateMenuIndex()
+        self.assertEqual(ACL_READ, MenuManager.getUserMenuAcl(self.user.id, self.readMenu.id))
+
+    def test_user_acl_menus(self):
+        self.assertEqual([self.topMenu.id], [m.id for m in MenuManager.getUserAclMenus(self.user.id)])
+        self.assertEqual([self.topMenu.id, self.subMenu.id, self.readMenu.id, self.writeMenu.id, self.freeMenu.id],
+                         sorted(m.id for m in MenuManager.getUserAclMenus(self.user.id, self.topMenu.id)))
+        self.assertEqual([self.readMenu.id, self.writeMenu.id, self.freeMenu.id], [m.id for m in MenuManager.getUserMenus(self.user.id, self.subMenu.id)])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.topMenu.id, MenuManager.getTopMenu(self.readMenu).id)
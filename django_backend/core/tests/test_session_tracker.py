@@ -0,0 +1,137 @@
+import datetime
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+import core.session.tracker as sessionTracker
+from core.session.middleware import SessionSanitizerMiddleware
+from core.session.tracker import SESSION_REFRESH_TIMESTAMP_NAME, refreshSessionExpiry
+from core.view.auth_view import AuthAPIView
+
+
+class SessionTrackerTest(AuthAPIView):
+    pass
+
+
+class SessionTrackerTestCase(TestCase):
+    def setUp(self):
+        self.sessionKey = None
+
+    def _request(self, callback) -> int:
+        '''
+            Call [callback(view)] in a request, return the number of the session writes.
+        '''
+        def getResponse(request):
+            view = SessionTrackerTest()
+            view.request = request
+            callback(view)
+            return HttpResponse()
+
+        request = RequestFactory().get('/api/SessionTrackerTest/init')
+        if self.sessionKey is not None:
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = self.sessionKey
+        middleware = SessionMiddleware(SessionSanitizerMiddleware(getResponse))
+        with CaptureQueriesContext(connection) as queries:
+            response = middleware(request)
+        if settings.SESSION_COOKIE_NAME in response.cookies:
+            self.sessionKey = response.cookies[settings.SESSION_COOKIE_NAME].value
+        return len([q for q in queries.captured_queries
+                    if 'django_session' in q['sql'] and q['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE'))])
+
+    def _readOnly(self, view) -> None:
+        view.getSessionParameter('filter')
+        view.getSessionParameters()
+        view.getSessionParameter('user', isGlobal=True)
+
+    def test_read_only_requests(self):
+        self.assertEqual(0, self._request(self._readOnly))  # the session is not created
+        self.assertIsNone(self.sessionKey)
+
+        self.assertEqual(1, self._request(lambda view: view.setSessionParameter('filter', {'name': 'a'})))
+        self.assertIsNotNone(self.sessionKey)
+        for _ in range(5):
+            self.assertEqual(0, self._request(self._readOnly))
+
+        # save every request: 1 write for each request
+        with override_settings(SESSION_SAVE_EVERY_REQUEST=True):
+            for _ in range(5):
+                self.assertEqual(1, self._request(self._readOnly))
+
+    def test_changes(self):
+        self._request(lambda view: view.setSessionParameter('filter', {'name': 'a', 'ids': [1]}))
+        self.assertEqual(0, self._request(lambda view: view.getSessionParameter('filter')['ids'].sort()))
+
+        # changed in place
+        self.assertEqual(1, self._request(lambda view: view.getSessionParameter('filter')['ids'].append(2)))
+        self.assertEqual(1, self._request(lambda view: view.getSessionParameters()['filter'].update(name='b')))
+        self.assertEqual({'name': 'b', 'ids': [1, 2]}, self._getParameter('filter'))
+
+        self.assertEqual(0, self._request(lambda view: view.deleteSessionParameters('unknown')))
+        self.assertEqual(0, self._request(lambda view: view.getSessionParameter('unknown', delete=True)))
+        self.assertEqual(1, self._request(lambda view: view.getSessionParameter('filter', delete=True)))
+        self.assertIsNone(self._getParameter('filter'))
+
+    def _getParameter(self, name) -> any:
+        values = []
+        self._request(lambda view: values.append(view.getSessionParameter(name)))
+        return values[0]
+
+    def test_sanitize_at_write_time(self):
+        value = {'date': datetime.date(2024, 1, 2), 'view': object(), 'ids': [1, 2]}
+        with self.assertLogs('ikyo', level='WARNING') as logs:
+            self.assertEqual(1, self._request(lambda view: view.setSessionParameter('data', value)))
+        self.assertIn('data.view', logs.output[0])
+        self.assertEqual({'date': '2024-01-02', 'ids': [1, 2]}, self._getParameter('data'))
+
+        # the JSON serializable value is not copied
+        value = {'ids': [1, 2]}
+        values = []
+
+        def setAndGet(view):
+            view.setSessionParameter('data', value)
+            values.append(view.getSessionParameter('data'))
+        self._request(setAndGet)
+        self.assertIs(value, values[0])
+
+    def test_expiry_refresh(self):
+        self._request(lambda view: view.setSessionParameter('filter', 'a'))
+        self.assertEqual(0, self._request(self._readOnly))
+        with mock.patch.object(sessionTracker, 'EXPIRY_REFRESH_INTERVAL', 0):
+            self.assertEqual(1, self._request(self._readOnly))
+
+        # the request doesn't use the session, e.g. a static file
+        self.assertEqual(0, self._request(lambda view: None))
+        with mock.patch.object(sessionTracker, 'EXPIRY_REFRESH_INTERVAL', 0):
+            self.assertEqual(1, self._request(lambda view: None))
+            self.sessionKey = 'expired-session-key'
+            self.assertEqual(0, self._request(lambda view: None))  # no new session
+        self.assertEqual('', self.sessionKey)  # the cookie is deleted
+
+        session = {}
+        self.assertFalse(refreshSessionExpiry(_Session(session), now=1000))  # empty session
+        session['a'] = 1
+        self.assertTrue(refreshSessionExpiry(_Session(session), now=1000))
+        self.assertFalse(refreshSessionExpiry(_Session(session), now=1000 + sessionTracker.EXPIRY_REFRESH_INTERVAL - 1))
+        self.assertTrue(refreshSessionExpiry(_Session(session), now=1000 + sessionTracker.EXPIRY_REFRESH_INTERVAL))
+        self.assertEqual(1000 + sessionTracker.EXPIRY_REFRESH_INTERVAL, session[SESSION_REFRESH_TIMESTAMP_NAME])
+
+
+class _Session():
+    def __init__(self, data: dict) -> None:
+        self.data = data
+        self.modified = False
+
+    def is_empty(self) -> bool:
+        return len(self.data) == 0
+
+    def get(self, key, default=None) -> any:
+        return self.data.get(key, default)
+
+    def __setitem__(self, key, value) -> None:
+        self.data[key] = value
+        self.modified = True
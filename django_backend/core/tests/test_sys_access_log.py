@@ -0,0 +1,37 @@
+from unittest import mock
+
+from django.test import RequestFactory, TestCase
+
+import core.sys.access_log as ikAccessLog
+from core.db.bulk_writer import BulkWriter
+from core.models import AccessLog
+
+
+class AccessLogTestCase(TestCase):
+    def setUp(self):
+        self.writer = BulkWriter('Test Access Log Writer', AccessLog, batchSize=100, flushInterval=3600, maxPendingSize=3)
+        patcher = mock.patch.object(ikAccessLog, '__accessLogWriter', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.writer.stop)
+
+    def _addAccessLog(self, pageName: str) -> None:
+        request = RequestFactory().get('/api/menu/%s' % pageName, HTTP_HOST='testserver')
+        request.user = None
+        ikAccessLog.addAccessLog(request, 1, pageName, 'getScreen', 'GET')
+
+    def test_add_access_log_is_buffered(self):
+        with self.assertNumQueries(0):
+            self._addAccessLog('Page1')
+            self._addAccessLog('Page2')
+        self.assertEqual(0, AccessLog.objects.count())
+        self.assertEqual(2, ikAccessLog.flushAccessLog())
+        rc = AccessLog.objects.order_by('id').first()
+        self.assertEqual(('http://testserver/api/menu/Page1', 1, 'Page1', 'getScreen', 'GET'),
+                         (rc.request_url, rc.menu_id, rc.page_nm, rc.action_nm, rc.rmk))
+
+    def test_counters(self):
+        for i in range(5):
+            self._addAccessLog('Page%s' % i)
+        ikAccessLog.flushAccessLog()
+        self.assertEqual({'pending': 0, 'flushed': 3, 'failed': 0, 'dropped': 2}, ikAccessLog.getAccessLogCounters())
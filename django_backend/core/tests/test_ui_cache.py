@@ -0,0 +1,82 @@
+import copy
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+import core.ui.ui as ikui
+import core.ui.ui_cache as ikuiCache
+from core.benchmark.screen_dfn import buildScreenDefinition, primeScreenCache
+
+
+class ScreenCacheTestCase(TestCase):
+    def setUp(self):
+        self.dfn = buildScreenDefinition(totalFieldGroups=2, totalFields=3)
+        self.screenName = self.dfn['viewID']
+        primeScreenCache(self.dfn)
+        ikuiCache.resetCacheCounters()
+
+    def tearDown(self):
+        ikuiCache.deletePageDefinitionFromCache(self.screenName)
+
+    def _setByAnotherWorker(self, screenSN: str, dfn: dict) -> None:
+        # another worker changes the shared cache only
+        rev = 'another-worker-rev'
+        cache.set_many({ikuiCache.SCREEN_CACHE_KEY_PREFIX + 'dfn.' + screenSN: (rev, dfn), ikuiCache.SCREEN_CACHE_KEY_PREFIX + 'rev.' + screenSN: rev})
+
+    def test_tiers(self):
+        ikuiCache.getPageDefinitionFromCache(self.screenName)
+        ikuiCache.getPageDefinitionFromCache(self.screenName)
+        counters = ikuiCache.getCacheCounters()
+        self.assertEqual({'hits': 2, 'misses': 0}, counters['local'])
+        self.assertEqual({'hits': 0, 'misses': 0}, counters['shared'])
+
+        getattr(ikuiCache, '__localScreens').clear()  # e.g. a new worker
+        self.assertEqual('Benchmark Large Screen', ikuiCache.getPageDefinitionFromCache(self.screenName)['viewTitle'])
+        self.assertEqual('Benchmark Large Screen', ikuiCache.getPageDefinitionFromCache(self.screenName)['viewTitle'])
+        counters = ikuiCache.getCacheCounters()
+        self.assertEqual({'hits': 3, 'misses': 1}, counters['local'])
+        self.assertEqual({'hits': 1, 'misses': 0}, counters['shared'])
+
+        self.assertIsNone(ikuiCache.getPageDefinitionFromCache('NotCachedScreen'))
+        self.assertEqual(1, ikuiCache.getCacheCounters()['shared']['misses'])
+
+    def test_change_by_another_worker(self):
+        ikui.IkUI.getScreen(self.screenName)
+        ikui.IkUI.getScreen(self.screenName)
+        self.assertEqual({'hits': 1, 'misses': 1}, ikuiCache.getCacheCounters()['compiled'])
+
+        dfn = copy.deepcopy(self.dfn)
+        dfn['viewTitle'] = 'Changed by Another Worker'
+        self._setByAnotherWorker(self.screenName, dfn)
+        self.assertEqual('Changed by Another Worker', ikui.IkUI.getScreen(self.screenName).title)
+        counters = ikuiCache.getCacheCounters()
+        self.assertEqual({'hits': 1, 'misses': 2}, counters['compiled'])
+        self.assertEqual(1, counters['shared']['hits'])
+
+        # another worker deletes the definition
+        ikuiCache.deletePageDefinitionFromCache(self.screenName)
+        self.assertIsNone(ikuiCache.getCompiledScreen(self.screenName, ikui.MAIN_SCREEN_NAME))
+
+    def test_targeted_invalidation(self):
+        cache.set('ikyo.test.value', 1)
+        ikui.IkUI.getScreen(self.screenName)
+        ikuiCache.deletePageDefinitionFromCache(self.screenName)
+        self.assertIsNone(ikuiCache.getPageDefinitionFromCache(self.screenName))
+        self.assertEqual(1, cache.get('ikyo.test.value'))
+
+        primeScreenCache(self.dfn)
+        ikuiCache.clearAllCache()
+        self.assertIsNone(ikuiCache.getPageDefinitionFromCache(self.screenName))
+        self.assertIsNone(cache.get('fgTypes'))
+        self.assertEqual(1, cache.get('ikyo.test.value'))
+
+    def test_local_cache_size(self):
+        with mock.patch.object(ikuiCache, 'LOCAL_CACHE_SIZE', 2):
+            for i in range(3):
+                ikuiCache.setPageDefinitionCache('LruScreen%s' % i, self.dfn)
+            self.assertEqual(2, ikuiCache.getCacheCounters()['localSize'])
+            self.assertEqual(['LruScreen1', 'LruScreen2'], list(getattr(ikuiCache, '__localScreens').keys()))
+            # the evicted screen is still in the shared cache
+            self.assertEqual(self.dfn, ikuiCache.getPageDefinitionFromCache('LruScreen0'))
+        ikuiCache.deletePageDefinitionsFromCache(['LruScreen%s' % i for i in range(3)])
@@ -0,0 +1,127 @@
+import json
+from unittest import mock
+
+from django.db.models import F
+from django.test import TestCase
+
+import core.core.http as ikhttp
+import core.db.model_version as modelVersion
+import core.ui.ui as ikui
+import core.ui.ui_cache as ikuiCache
+from core.benchmark.screen_dfn import buildScreenDefinition, primeScreenCache
+from core.db.transaction import IkTransaction
+from core.models import Group, Menu
+
+
+def initComboboxData(fieldGroup, field, recordsetName, getDataFunctionName) -> tuple:
+    '''
+        Get the combobox data from the recordset as ScreenAPIView.initScreenData does, ignore the field group data.
+    '''
+    if field is None:
+        return True, None
+    return True, ikhttp.IkSccJsonResponse(data=ikui.IkUI._getRecordSetData(fieldGroup, field, recordsetName)).getJsonData()
+
+
+class ComboboxCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Menu.objects.bulk_create([Menu(menu_nm='ComboMenu%s' % i, menu_caption='Menu %s' % i, enable=i != 1) for i in range(3)])
+
+    def setUp(self):
+        self.dfn = buildScreenDefinition(totalFieldGroups=3, totalFields=5)
+        self.dfn['recordsetTable'][1] = ('rcs1', '*', 'core.models.Menu', 'enable = true', 'id', None, None)
+        self.dfn['fieldTable'].append(('fg0', 'cmbStatic', 'Static', None, True, True, None, None, ikui.SCREEN_FIELD_WIDGET_COMBO_BOX,
+                                       "data: [{'value': 'Y', 'display': 'Yes'}, {'value': 'N', 'display': 'No'}]", 'field9', None, None, None))
+        self.screenName = self.dfn['viewID']
+        primeScreenCache(self.dfn)
+        ikuiCache.deleteModelRecordsCache()
+        modelVersion.changeModelVersions([Menu, Group])
+        ikuiCache.resetCacheCounters()
+
+    def tearDown(self):
+        ikuiCache.deletePageDefinitionFromCache(self.screenName)
+        ikuiCache.deleteModelRecordsCache()
+
+    def _render(self) -> ikui.Screen:
+        screen = ikui.IkUI.getScreen(self.screenName)
+        ikui.IkUI.initScreenData(screen, initDataCallBack=initComboboxData)
+        return screen
+
+    def _options(self, screen, fgName) -> list:
+        return [r['display'] for r in screen.getField(fgName, 'cmb0').widgetParameter['data']]
+
+    def test_steady_state_no_query(self):
+        screen = self._render()
+        self.assertEqual(['ComboMenu0', 'ComboMenu1', 'ComboMenu2'], self._options(screen, 'fg0'))
+        self.assertEqual(['ComboMenu0', 'ComboMenu2'], self._options(screen, 'fg1'))  # keyed by the filter
+        self.assertEqual({'hits': 4, 'misses': 2}, ikuiCache.getCacheCounters()['combobox'])
+
+        with self.assertNumQueries(0):
+            screen = self._render()
+        self.assertEqual(['ComboMenu0', 'ComboMenu1', 'ComboMenu2'], self._options(screen, 'fg2'))
+        self.assertEqual({'hits': 10, 'misses': 2}, ikuiCache.getCacheCounters()['combobox'])
+
+    def test_transaction_invalidation(self):
+        self._render()
+        menu = Menu.objects.get(menu_nm='ComboMenu1')
+        menu.menu_nm = 'ComboMenu1b'
+        menu.enable = True
+        trn = IkTransaction(userID=-1)
+        trn.modify(menu)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(trn.save().value)
+
+        with self.assertNumQueries(3):  # the menu model's version, and reload the 2 filters of the menu model
+            screen = self._render()
+        self.assertEqual(['ComboMenu0', 'ComboMenu1b', 'ComboMenu2'], self._options(screen, 'fg0'))
+        self.assertEqual(['ComboMenu0', 'ComboMenu1b', 'ComboMenu2'], self._options(screen, 'fg1'))
+
+        # the versions are not changed if the transaction is rolled back
+        menu.menu_caption = None
+        trn = IkTransaction(userID=-1)
+        trn.modify(menu)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertFalse(trn.save().value)
+        self.assertEqual([], callbacks)
+
+    def test_change_by_another_process(self):
+        self._render()
+        # changed by another process: no IkTransaction in this process, the version is read from the database
+        Menu.objects.filter(menu_nm='ComboMenu1').update(menu_nm='ComboMenu1b', version_no=F('version_no') + 1)
+        with self.assertNumQueries(0):  # the versions are reused in the check interval (default)
+            self.assertEqual(['ComboMenu0', 'ComboMenu1', 'ComboMenu2'], self._options(self._render(), 'fg0'))
+        with mock.patch.object(modelVersion, 'CHECK_INTERVAL', 0):  # the interval passed
+            self.assertEqual(['ComboMenu0', 'ComboMenu1b', 'ComboMenu2'], self._options(self._render(), 'fg0'))
+
+        Menu.objects.get(menu_nm='ComboMenu2').delete()
+        with mock.patch.object(modelVersion, 'CHECK_INTERVAL', 0):
+            self.assertEqual(['ComboMenu0', 'ComboMenu1b'], self._options(self._render(), 'fg0'))
+
+    def test_dependent_model(self):
+        queryKey = (False, None, "id IN (SELECT id FROM %s WHERE grp_nm = 'a')" % Group._meta.db_table.upper(), 'id', None)
+        self.assertEqual([Menu, Group], getattr(ikuiCache, '__getDependentModels')(Menu, queryKey))
+        self.assertEqual([Menu], getattr(ikuiCache, '__getDependentModels')(Menu, (False, None, 'enable = true', 'id', None)))
+
+    def test_cached_records_are_copies(self):
+        screen = self._render()
+        fg0 = screen.getFieldGroup('fg0')
+        rcs = ikui.IkUI._getRecordSetData(fg0, screen.getField('fg0', 'cmb0'), 'rcs0')
+        rcs[0].menu_nm = 'Changed'
+        rcs[0].ik_set_cursor(isCursor=True)
+        rcs = ikui.IkUI._getRecordSetData(fg0, screen.getField('fg0', 'cmb0'), 'rcs0')
+        self.assertEqual('ComboMenu0', rcs[0].menu_nm)
+        self.assertFalse(rcs[0].ik_is_cursor())
+        self.assertTrue(rcs[0].ik_is_status_retrieve())
+
+    def test_parsed_combobox_parameters(self):
+        self._render()
+        with mock.patch.object(ikui, 'json', wraps=json) as jsonModule:
+            screen = self._render()
+            self.assertEqual(0, jsonModule.loads.call_count)
+            self.assertEqual('{"value": "id", "display": "menu_nm"}', screen.getField('fg0', 'cmb0').widgetParameter['values'])
+
+            # changed in the request, e.g. beforeInitScreenData
+            screen = ikui.IkUI.getScreen(self.screenName)
+            screen.getField('fg0', 'cmbStatic').widgetParameter['data'] = '[1, 2'
+            with self.assertRaises(ValueError):
+                ikui.IkUI.initScreenData(screen, initDataCallBack=initComboboxData)
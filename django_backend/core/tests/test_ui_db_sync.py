@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+
+import core.ui.ui_db as ikuidb
+import core.utils.spreadsheet as ikSpreadsheet
+from core.benchmark.screen_sync import createScreenFiles, createScreenTypes, syncEnvironment, updateScreenFileRevision
+from core.models import Screen
+
+APP_NAME = 'screensynctest'
+
+
+class ScreenSyncTestCase(TestCase):
+    def setUp(self):
+        self.workFolder = tempfile.mkdtemp(prefix='ikyo-screen-sync-test-')
+        self.files = createScreenFiles(os.path.join(self.workFolder, APP_NAME), 3, screenNamePrefix='SyncTest')
+        self.cwd = os.getcwd()
+        os.chdir(self.workFolder)
+        self.patches = syncEnvironment(self.workFolder, [APP_NAME])
+        for p in self.patches:
+            p.start()
+        createScreenTypes()
+        ikuidb.syncScreenDefinitions()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workFolder, ignore_errors=True)
+
+    def _sync(self) -> tuple:
+        '''
+            Return (parsed files, exported screens).
+        '''
+        with mock.patch.object(ikSpreadsheet, 'SpreadsheetParser', wraps=ikSpreadsheet.SpreadsheetParser) as parser, \
+                mock.patch.object(ikuidb, 'screenDbWriteToExcel', wraps=ikuidb.screenDbWriteToExcel) as writer:
+            ikuidb.syncScreenDefinitions()
+        return parser.call_count, writer.call_count
+
+    def test_first_sync(self):
+        self.assertEqual(['SyncTest000', 'SyncTest001', 'SyncTest002'], list(Screen.objects.order_by('screen_sn').values_list('screen_sn', flat=True)))
+        with open(ikuidb._getSyncManifestFile(), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.assertEqual(3, len(manifest['files']))
+        self.assertEqual({'synctest000': 0, 'synctest001': 0, 'synctest002': 0}, manifest['screens'])
+        self.assertTrue(all(os.path.isfile(os.path.join(APP_NAME, 'resources', 'screen', 'csv', 'SyncTest00%s.csv' % i)) for i in range(3)))
+
+    def test_unchanged(self):
+        with self.assertNumQueries(1):  # the latest screen revisions
+            self.assertEqual((0, 0), self._sync())
+
+    def test_changed_file(self):
+        updateScreenFileRevision(self.files[1], 2)
+        self.assertEqual((1, 1), self._sync())
+        self.assertEqual(1, Screen.objects.filter(screen_sn='SyncTest001').order_by('-rev').first().rev)
+        self.assertEqual((0, 0), self._sync())
+
+    def test_database_changed(self):
+        # the screen is deleted from database, e.g. a new database
+        Screen.objects.filter(screen_sn='SyncTest002').delete()
+        self.assertEqual((1, 1), self._sync())
+        self.assertTrue(Screen.objects.filter(screen_sn='SyncTest002').exists())
+
+        # the exported csv file is deleted
+        os.remove(os.path.join(APP_NAME, 'resources', 'screen', 'csv', 'SyncTest000.csv'))
+        self.assertEqual((0, 0), self._sync())
+        self.assertTrue(os.path.isfile(os.path.join(APP_NAME, 'resources', 'screen', 'csv', 'SyncTest000.csv')))
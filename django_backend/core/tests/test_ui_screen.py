@@ -0,0 +1,50 @@
+from django.test import TestCase
+
+import core.ui.ui as ikui
+import core.ui.ui_cache as ikuiCache
+from core.benchmark.screen_dfn import buildScreenDefinition, primeScreenCache
+
+
+class ScreenOverlayTestCase(TestCase):
+    def setUp(self):
+        self.dfn = buildScreenDefinition(totalFieldGroups=4, totalFields=5)
+        self.screenName = self.dfn['viewID']
+        primeScreenCache(self.dfn)
+
+    def tearDown(self):
+        ikuiCache.deletePageDefinitionFromCache(self.screenName)
+
+    def test_get_screen_matches_fresh_compile(self):
+        screen = ikui.IkUI.getScreen(self.screenName)
+        expected = ikui.IkUI._compileScreen(self.screenName, self.dfn)
+        self.assertEqual(expected.toJson(), screen.toJson())
+
+    def test_overlay_isolation(self):
+        screen1 = ikui.IkUI.getScreen(self.screenName)
+        screen1.editable = False
+        screen1.getFieldGroup('fg0').visible = False
+        screen1.getField('fg1', 'field1').caption = 'changed'
+        screen1.getField('fg1', 'cmb0').widgetParameter['data'] = [{'id': 1}]
+        screen1.getRecordSet('rcs1').modelNames = 'changed'
+        screen1.addStaticFile('test.js')
+
+        screen2 = ikui.IkUI.getScreen(self.screenName)
+        self.assertTrue(screen2.editable)
+        self.assertTrue(screen2.getFieldGroup('fg0').visible)
+        self.assertEqual('Field 1', screen2.getField('fg1', 'field1').caption)
+        self.assertNotIn('data', screen2.getField('fg1', 'cmb0').widgetParameter)
+        self.assertEqual('core.models.Menu', screen2.getRecordSet('rcs1').modelNames)
+        self.assertEqual([], screen2.getStaticFiles())
+        self.assertIs(screen2, screen2.getFieldGroup('fg2').parent)
+        self.assertIs(screen2.getFieldGroup('fg1'), screen2.getFieldGroupLink('fg2').parentFieldGroup)
+
+    def test_warm_get_screen_no_query(self):
+        ikui.IkUI.getScreen(self.screenName)
+        with self.assertNumQueries(0):
+            ikui.IkUI.getScreen(self.screenName)
+
+    def test_definition_change_invalidates_compiled_screen(self):
+        ikui.IkUI.getScreen(self.screenName)
+        self.dfn['viewTitle'] = 'New Title'
+        ikuiCache.setPageDefinitionCache(self.screenName, self.dfn)
+        self.assertEqual('New Title', ikui.IkUI.getScreen(self.screenName).title)
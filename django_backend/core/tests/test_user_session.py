@@ -0,0 +1,102 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.models import User, UsrSessionPrm, UsrToken
+from core.user.session import TokenSessionStore, dumps, isSessionPrmNameMatched
+from core.view.auth_view import AuthAPIView
+
+
+class TokenSessionTest(AuthAPIView):
+    permission_classes = []
+
+    def get(self, request, *args, **kwargs):
+        for i in range(10):
+            self.getSessionParameter('filter%s' % i)
+            self.setSessionParameter('filter%s' % i, {'page': i})
+        self.deleteSessionParameters('old*')
+        self.getSessionParameterInt('page', delete=True)
+        return Response({'filter3': self.getSessionParameter('filter3')})
+
+
+class TokenSessionStoreTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(usr_nm='SessionUser', psw='-')
+        cls.token = UsrToken.objects.create(usr=cls.user, token='SessionUserToken')
+        UsrSessionPrm.objects.bulk_create([UsrSessionPrm(token=cls.token, key=key, value=dumps(value))
+                                           for key, value in (('a', 1), ('b', {'x': [1, 2]}), ('oldA', 'a'), ('oldB', 'b'))])
+
+    def _getPrms(self) -> dict:
+        return {rc.key: rc.value for rc in UsrSessionPrm.objects.filter(token=self.token)}
+
+    def _getWrites(self, queries) -> list:
+        return [q['sql'].split()[0].upper() for q in queries.captured_queries
+                if UsrSessionPrm._meta.db_table in q['sql'] and not q['sql'].lstrip().upper().startswith('SELECT')]
+
+    def test_name_filters(self):
+        self.assertTrue(isSessionPrmNameMatched('dog', 'dog'))
+        self.assertTrue(isSessionPrmNameMatched('dogs', 'dog*'))
+        self.assertTrue(isSessionPrmNameMatched('hotdog', '*dog'))
+        self.assertTrue(isSessionPrmNameMatched('hotdogs', '*dog*'))
+        self.assertFalse(isSessionPrmNameMatched('hotdogs', '*dog'))
+        self.assertFalse(isSessionPrmNameMatched('dog', '*'))
+
+    def test_single_load_and_flush(self):
+        store = TokenSessionStore(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(1, store.getPrms('a'))
+            self.assertEqual('none', store.getPrms('c', defaultValue='none'))
+            self.assertEqual({'a': 1, 'b': {'x': [1, 2]}, 'oldA': 'a', 'oldB': 'b'}, store.getPrms2())
+            store.updatePrms('a', 2)
+            store.updatePrms('c', [3])
+            self.assertEqual('b', store.getPrmAndDelete('oldB'))
+            store.deletePrms(['old*', 'unknown'])
+            self.assertEqual({'a': 2, 'b': {'x': [1, 2]}, 'c': [3]}, store.getPrms2())
+
+        with CaptureQueriesContext(connection) as queries:
+            store.flush()
+        self.assertEqual(['DELETE', 'INSERT'], self._getWrites(queries))
+        self.assertEqual({'a': '2', 'b': '{"x": [1, 2]}', 'c': '[3]'}, self._getPrms())
+        with self.assertNumQueries(0):
+            store.flush()
+
+    def test_last_writer_wins(self):
+        store1, store2 = TokenSessionStore(self.user), TokenSessionStore(self.user)
+        store1.getPrms2()
+        store2.getPrms2()
+        store1.updatePrms('a', 'store1')
+        store1.updatePrms('c', 'store1')
+        store2.updatePrms('c', 'store2')
+        store2.deletePrms('oldA')
+        store1.flush()
+        store2.flush()
+        self.assertEqual({'a': '"store1"', 'b': '{"x": [1, 2]}', 'c': '"store2"', 'oldB': '"b"'}, self._getPrms())
+
+    def test_no_token(self):
+        user = User.objects.create(usr_nm='NoTokenUser', psw='-')
+        store = TokenSessionStore(user)
+        store.updatePrms('a', 1)
+        self.assertIsNone(store.getPrms('a'))
+        self.assertIsNone(store.getPrms2())
+        with self.assertNumQueries(0):  # loaded
+            store.flush()
+            store.getPrms('b')
+
+    def test_view(self):
+        UsrSessionPrm.objects.bulk_create([UsrSessionPrm(token=self.token, key='TokenSessionTest_%s' % key, value=dumps(value))
+                                           for key, value in (('old1', 1), ('old2', 2), ('page', 5))])
+        request = APIRequestFactory().get('/api/TokenSessionTest', HTTP_ORIGIN='http://localhost:3000')
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = TokenSessionTest.as_view()(request)
+        self.assertEqual({'filter3': {'page': 3}}, response.data)
+        self.assertEqual(1, len([q for q in queries.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')
+                                 and UsrSessionPrm._meta.db_table in q['sql']]))
+        self.assertEqual(['DELETE', 'INSERT'], self._getWrites(queries))
+        prms = self._getPrms()
+        self.assertEqual(14, len(prms))
+        self.assertNotIn('TokenSessionTest_page', prms)
+        self.assertEqual('{"page": 9}', prms['TokenSessionTest_filter9'])
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+from django.test import TestCase
+
+import core.utils.model_utils as model_utils
+from core.benchmark.query_model import MODEL_NAME, createTeams, legacyQueryModel, modelValues
+from core.core.exception import IkValidateException
+from core.models import Mail
+
+
+class QueryModelTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        createTeams(5)
+        Mail.objects.create(sender='test', subject='Mail 1', content='-', send_ts=datetime(2025, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc), duration=10)
+        Mail.objects.create(sender='test', subject='Mail 2', content='-', queue=False)
+
+    def assertSameAsLegacy(self, modelNames, **kwargs) -> list:
+        expected = [modelValues(r) for r in legacyQueryModel(modelNames, **kwargs)]
+        with self.assertNumQueries(1):
+            rcs = model_utils.queryModel(modelNames, **kwargs)
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(expected, [modelValues(r) for r in rcs])
+        self.assertTrue(all(r.ik_is_status_retrieve() for r in rcs))
+        return rcs
+
+    def test_all_fields(self):
+        rcs = self.assertSameAsLegacy(MODEL_NAME, orderBy='id')
+        self.assertEqual('1.2500', rcs[1].seq)
+        self.assertIsInstance(rcs[0].cre_dt, str)
+        self.assertIsNone(rcs[0].dsc)
+        rcs = self.assertSameAsLegacy('core.models.Mail', orderBy='id')
+        self.assertFalse(rcs[1].queue)
+
+    def test_query_fields(self):
+        rcs = self.assertSameAsLegacy(MODEL_NAME, queryFields='nm, seq, enable', orderBy='nm DESC')
+        self.assertIsNone(rcs[0].id)
+        self.assertIsNone(rcs[0].cre_dt)
+        rcs = self.assertSameAsLegacy(MODEL_NAME, queryFields='id, nm, company_id', queryWhere="nm <> 'BenchmarkTeam1'", orderBy='id', limit=3)
+        self.assertIsNotNone(rcs[0].company_id)
+        self.assertTrue(rcs[0].enable)  # default value
+        self.assertSameAsLegacy(MODEL_NAME, queryFields='enable', distinct=True, orderBy='enable')
+        self.assertSameAsLegacy('core.models.Mail', queryFields='id, subject, send_ts', orderBy='id')
+        with self.assertRaisesMessage(IkValidateException, 'Raw query must include the primary key'):
+            model_utils.queryModel(MODEL_NAME, queryFields='nm, company_id')
+
+    def test_iterate_chunks(self):
+        chunks = list(model_utils.iterateModel(MODEL_NAME, orderBy='id', chunkSize=2))
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual([modelValues(r) for r in legacyQueryModel(MODEL_NAME, orderBy='id')], [modelValues(r) for chunk in chunks for r in chunk])
+        self.assertEqual([], list(model_utils.iterateModel(MODEL_NAME, queryWhere='1 = 0')))
@@ -1,4 +1,3 @@
-import copy
 import json
 import os
 import re
@@ -132,6 +131,15 @@ def getResultTableEditButonDefaultEventName(fieldName) -> str:
     return '%s_Click' % fieldName
 
 
+def _shallowCopy(obj) -> object:
+    '''
+        Copy an object's attributes without calling its __init__ method. The attribute values are shared.
+    '''
+    obj2 = object.__new__(obj.__class__)
+    obj2.__dict__.update(obj.__dict__)
+    return obj2
+
+
 def _getSceenFieldName(fieldName: str, actionName: str, parentFieldGroupName: str) -> str:
     if isNotNullBlank(fieldName):
         return fieldName
@@ -162,6 +170,9 @@ class ScreenRecordSet:
         # self.readOnly = False
         # YL.ikyo, 2023-04-20 - end
 
+    def _overlay(self) -> 'ScreenRecordSet':
+        return _shallowCopy(self)
+
     # def getData(self) -> dict:
     #    pass
 
@@ -178,6 +189,7 @@ class ScreenField:
         self.tooltip = None
         self.widget = None
         self.widgetParameter = None
+        self.comboxJsonPrms = None  # {parameter name: (parameter value, json value)}, parsed at compile time, don't change it
         self.editable = True
         self.visible = True
         self.required = False
@@ -195,6 +207,18 @@ class ScreenField:
     def getEventHandlerName(self) -> str:
         return None if self.eventHandler is None else self.eventHandler.split('/')[-1]
 
+    def _overlay(self, parent) -> 'ScreenField':
+        '''
+            Per-request copy of a compiled field. The widget parameters and style are changed in requests, so copy them.
+        '''
+        field = _shallowCopy(self)
+        field.parent = parent
+        if self.widgetParameter is not None:
+            field.widgetParameter = dict(self.widgetParameter)
+        if self.style is not None:
+            field.style = dict(self.style)
+        return field
+
     def _initData(self, fieldIndexInFieldGroup, getFieldWidgetDataFn=None) -> None:
         if getFieldWidgetDataFn is not None:
             getFieldWidgetDataFn(self, fieldIndexInFieldGroup)
@@ -339,6 +363,18 @@ class ScreenFieldGroup:
     def getFieldNames(self) -> list:
         return [f.name for f in self.fields]
 
+    def _overlay(self, parent) -> 'ScreenFieldGroup':
+        '''
+            Per-request copy of a compiled field group. The field group link is updated in Screen._overlay().
+        '''
+        fg = _shallowCopy(self)
+        fg.parent = parent
+        fg.fields = [field._overlay(fg) for field in self.fields]
+        fg.style = list(self.style) if self.style is not None else None
+        if self.additionalProps is not None:
+            fg.additionalProps = dict(self.additionalProps)
+        return fg
+
     def getResultTableEditColumnField(self) -> ScreenField:
         if self.groupType == SCREEN_FIELD_TYPE_RESULT_TABLE:
             defaultName = getResultTableEditButonDefaultEventName(getResultTableEditFieldName(self.name))
@@ -542,6 +578,28 @@ class Screen:
         self.__staticFiles = []  # static files. E.g. js, css, images
         self.__helpUrl = None
 
+    def _overlay(self) -> 'Screen':
+        '''
+            Return a thin per-request copy of a compiled screen.
+
+            The compiled screen is shared by all requests and should not be changed. The copy shares all the parsed
+            definition values with the compiled screen, only the objects and containers a request can change
+            (screen, recordsets, field groups, fields, widget parameters, styles, links and static files) are copied.
+        '''
+        screen = _shallowCopy(self)
+        screen.recordsets = [rs._overlay() for rs in self.recordsets]
+        screen.fieldGroups = [fg._overlay(screen) for fg in self.fieldGroups]
+        screen.fieldGroupLinks = {}
+        for fg in screen.fieldGroups:
+            fgl = fg.fieldGroupLink
+            if fgl is not None:
+                fgl = FieldGroupLink(screen.getFieldGroup(fgl.parentFieldGroup.name), fgl.parentKey, fgl.localKey)
+                fg.fieldGroupLink = fgl
+                screen.fieldGroupLinks[fg.name] = fgl
+        screen.tableHeaderFooters = dict(self.tableHeaderFooters)
+        screen.__staticFiles = list(self.__staticFiles)
+        return screen
+
     def addStaticFile(self, staticFile) -> None:
         '''
             static files in templates/static/ folder
@@ -1002,9 +1060,8 @@ class __ScreenManager:
             self.__screenDefinitions.clear()
             screenFiles = {}
 
-            # Restart Server Run
+            # Restart Server Run. The changed screens are invalidated by syncScreenDefinitions, other cached screens are still valid.
             ikuidb.syncScreenDefinitions()
-            ikuiCache.clearAllCache()
 
             ikuiCache.setFieldGroupTypeCache()
             ikuiCache.setFieldWidgetCache()
@@ -1082,22 +1139,44 @@ class __ScreenManager:
 
         return dfn
 
-    def getScreen(self, screenName: str, subScreenNm=None, globalRequestUrlParameters: dict = None) -> Screen:
-        '''
-            screenName (str): screen's name
-            globalRequestUrlParameters (dict, optional):  add parameters to all request urls (e.g. get data request, button action ...)
-        '''
-        global DNF_Summary
+    def _getScreenDefinition(self, screenName: str) -> dict:
         screenDfn = ikuiCache.getPageDefinitionFromCache(screenName)
         if isNullBlank(screenDfn):
             screenDfn = self._getScreenDefinitionFromDB(screenName)  # YL.ikyo, 2023-04-18 get screen from database
             ikuiCache.setPageDefinitionCache(screenName, screenDfn)
-        dfn = copy.deepcopy(screenDfn)
-
-        if dfn is None:
+        if screenDfn is None:
             logger.error('getScreenDefinition(%s).data=None' % screenName)
-            return None
+        return screenDfn
 
+    def getScreen(self, screenName: str, subScreenNm=None, globalRequestUrlParameters: dict = None) -> Screen:
+        '''
+            screenName (str): screen's name
+            globalRequestUrlParameters (dict, optional):  add parameters to all request urls (e.g. get data request, button action ...)
+
+            The screen definition is compiled once per (screen, sub screen) and shared by all requests. Each call
+            returns a thin copy of the compiled screen, so the changes (e.g. visible, editable, combobox data) only
+            apply to the current request.
+        '''
+        if subScreenNm is None:
+            subScreenNm = MAIN_SCREEN_NAME
+        if isNotNullBlank(globalRequestUrlParameters):
+            # the event handler urls are request specific, don't share it.
+            dfn = self._getScreenDefinition(screenName)
+            return None if dfn is None else self._compileScreen(screenName, dfn, subScreenNm, globalRequestUrlParameters)
+        compiledScreen = ikuiCache.getCompiledScreen(screenName, subScreenNm)
+        if compiledScreen is None:
+            dfn = self._getScreenDefinition(screenName)
+            if dfn is None:
+                return None
+            compiledScreen = self._compileScreen(screenName, dfn, subScreenNm)
+            ikuiCache.setCompiledScreen(screenName, subScreenNm, compiledScreen)
+        return compiledScreen._overlay()
+
+    def _compileScreen(self, screenName: str, dfn: dict, subScreenNm=None, globalRequestUrlParameters: dict = None) -> Screen:
+        '''
+            Build the screen from the screen definition. The screen definition (dfn) will not be changed.
+        '''
+        global DNF_Summary
         screen = Screen(screenDefinition=dfn)
         # 1. screen information
         screen.templateVersion = dfn['templateVersion']
@@ -1225,6 +1304,7 @@ class __ScreenManager:
             # field is an input parameter, then put this line at the end.
             # TODO:....
             field.widgetParameter = self.__getWidgetPramsOnly(widgetPrms)
+            field.comboxJsonPrms = self.__parseComboxJsonPrms(field.widgetParameter)
 
             DNF_Summary.addFieldWidget(screenName, field.widget)
             DNF_Summary.addFieldWidgetParameters(screenName + ' -> ' + str(widget), widgetPrms)
@@ -1600,6 +1680,35 @@ class __ScreenManager:
         if (widget in SCREEN_FIELD_SELECT_WIDGETS or widget == SCREEN_FIELD_WIDGET_LABEL) and parameters is not None and len(parameters) > 0:  # TODO: lower() for old to json method
             self.__updateComboxPrms(field, initDataCallBack, globalRequestUrlParameters)
 
+    def __parseComboxJsonPrms(self, widgetPrms: dict) -> dict:
+        '''
+            Parse the combobox json parameters [data] and [values] once when the screen is compiled.
+            The invalid values are ignored here, they are parsed (and reported) when the combobox data is initialized.
+        '''
+        jsonPrms = None
+        for name in ('data', 'values'):
+            value = widgetPrms.get(name, None)
+            if type(value) == str and not isNullBlank(value):
+                try:
+                    if jsonPrms is None:
+                        jsonPrms = {}
+                    jsonPrms[name] = (value, json.loads(value.replace("'", '"')))
+                except ValueError:
+                    pass
+        return jsonPrms
+
+    def __getComboxJsonPrm(self, field, name):
+        '''
+            Return the parsed combobox json parameter. It's parsed again if it's changed in the request.
+        '''
+        value = field.widgetParameter.get(name, None)
+        if type(value) != str:
+            return value
+        parsedValue = None if field.comboxJsonPrms is None else field.comboxJsonPrms.get(name, None)
+        if parsedValue is not None and parsedValue[0] == value:
+            return parsedValue[1]
+        return json.loads(value.replace("'", '"'))
+
     def __updateComboxPrms(self, field, initDataCallBack=None, globalRequestUrlParameters: dict = None) -> None:
         '''
             comboxPrms: 
@@ -1625,8 +1734,7 @@ class __ScreenManager:
         screenID = field.parent.parent.id
         comboxData = comboxPrms.get('data', None)
         if comboxData is not None:
-            if type(comboxData) == str:
-                comboxData = json.loads(comboxData.replace("'", '"'))
+            comboxData = self.__getComboxJsonPrm(field, 'data')
         else:
             dataUrl = comboxPrms.get('dataUrl', None)
             recordSetName = comboxPrms.get('recordset', None)
@@ -1634,8 +1742,7 @@ class __ScreenManager:
                 raise IkValidateException(
                     'Parameter [recordset] and [dataUrl] cannot be defined for a combox at the same time. Please check the screen [%s].' % screenID)
             fieldDefine = comboxPrms.get('values', None)  # {'value': 'dbField1', 'display': 'dbField2'}
-            fieldDefine = None if isNullBlank(fieldDefine) else (json.loads(fieldDefine.replace("'", '"'))
-                                                                 if type(fieldDefine) == str else fieldDefine)
+            fieldDefine = None if isNullBlank(fieldDefine) else self.__getComboxJsonPrm(field, 'values')
 
             getDataFunctionName = None
             if not isNullBlank(recordSetName):
@@ -1787,10 +1894,20 @@ class __ScreenManager:
         # pageSize = None if pageType != SCREEN_FIELD_GROUP_PAGE_TYPE_SERVER else fieldGroup.pageSize
         # if not pageSize:
         #     pageSize = recordset.queryPageSize
+        queryFields = None if (isNullBlank(recordset.queryFields) or recordset.queryFields == '*') else recordset.queryFields
+        if field is not None:
+            # combobox options, e.g. currencies. Reference to ui_cache.getModelRecordsFromCache
+            modelClass = model_utils.getModelClass(recordset.modelNames)
+            queryKey = (recordset.distinct, queryFields, recordset.queryWhere, recordset.queryOrder, recordset.queryLimit)
+            rcs, versions = ikuiCache.getModelRecordsFromCache(modelClass, queryKey)
+            if rcs is None:
+                rcs = model_utils.queryModel(modelNames=recordset.modelNames, distinct=recordset.distinct, queryFields=queryFields,
+                                             queryWhere=recordset.queryWhere, orderBy=recordset.queryOrder, limit=recordset.queryLimit, page=None)
+                ikuiCache.setModelRecordsCache(modelClass, queryKey, rcs, versions)
+            return rcs
         return model_utils.queryModel(modelNames=recordset.modelNames,
                                      distinct=recordset.distinct,
-                                     queryFields=None if (isNullBlank(recordset.queryFields)
-                                                          or recordset.queryFields == '*') else recordset.queryFields,
+                                     queryFields=queryFields,
                                      queryWhere=recordset.queryWhere,
                                      orderBy=recordset.queryOrder,
                                      limit=recordset.queryLimit,
@@ -1,31 +1,290 @@
+'''
+    Screen definition cache.
+
+    The screen definitions are cached in two tiers:
+        1. The shared cache (django.core.cache). It's shared by all workers if the cache backend is shared (e.g. redis, memcached).
+           Each screen has a revision stamp. The revision is changed when the screen definition is set or deleted.
+        2. A per-process LRU cache of [screenLocalCacheSize] screens (config.ini [System]). It keeps the screen definitions and
+           the compiled screens (reference to core/ui/ui.py: __ScreenManager.getScreen) with the revision they were read.
+           A local entry is used only if its revision is the same as the shared revision, so a worker checks it's up to date
+           by one cache read, and a screen changed by a worker is reloaded by the other workers.
+
+    Only the changed screens are invalidated. Other values in the shared cache are not touched.
+
+    Combobox options.
+
+    The model records of the combobox recordsets (e.g. currencies, offices, status codes) are kept in a per-process LRU cache
+    of [comboboxCacheSize] queries (config.ini [System]), keyed by the model and the recordset filter. An entry is used only if
+    the versions of its models are the same as the versions in the database (reference to core/db/model_version.py), so a
+    combobox is reloaded after its model is changed by any worker. The models used in the query where/fields (e.g. a sub query)
+    are dependent models too. The records are not cached if a model doesn't have a version.
+'''
+import copy
+import re
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+from django.apps import apps
 from django.core.cache import cache
 
+import core.db.model_version as modelVersion
+
 from core.core.exception import IkValidateException
-from core.models import ScreenFgType, ScreenFieldWidget
+from core.models import Screen, ScreenFgType, ScreenFieldWidget
 from core.utils.lang_utils import isNullBlank
+from iktools import IkConfig
+
+# Change the version if the cached screen definition format is changed, then the definitions cached by the old version are ignored.
+SCREEN_CACHE_KEY_PREFIX = 'ikui.screen.v1.'
+
+LOCAL_CACHE_SIZE = max(1, int(IkConfig.getSystem('screenLocalCacheSize', 256)))
+# 0 means the combobox options are not cached.
+COMBOBOX_CACHE_SIZE = max(0, int(IkConfig.getSystem('comboboxCacheSize', 256)))
+
+
+class _LocalScreenEntry():
+    def __init__(self, rev: str, screenDfn: dict) -> None:
+        self.rev = rev
+        self.screenDfn = screenDfn
+        self.compiledScreens = {}  # {sub screen name (lower case): core.ui.ui.Screen}
+
+
+class _LocalModelRecordsEntry():
+    def __init__(self, versions: dict, records: list) -> None:
+        self.versions = versions  # {model label: version}, the model and the dependent models
+        self.records = records
+
+
+__localScreens = OrderedDict()  # {screen SN: _LocalScreenEntry}, the last one is the latest used screen
+__localScreensLock = Lock()
+__localModelRecords = OrderedDict()  # {(model label, query key): _LocalModelRecordsEntry}, the last one is the latest used
+__counters = {'local': {'hits': 0, 'misses': 0}, 'shared': {'hits': 0, 'misses': 0}, 'compiled': {'hits': 0, 'misses': 0},
+              'combobox': {'hits': 0, 'misses': 0}}
+__tableModels = None  # {db table name (lower case): model class}
+
+
+def __getRevisionKey(screenSN) -> str:
+    return SCREEN_CACHE_KEY_PREFIX + 'rev.' + screenSN
+
+
+def __getDefinitionKey(screenSN) -> str:
+    return SCREEN_CACHE_KEY_PREFIX + 'dfn.' + screenSN
+
+
+def __count(tier: str, isHit: bool) -> None:
+    with __localScreensLock:
+        __counters[tier]['hits' if isHit else 'misses'] += 1
+
+
+def __getLocalScreen(screenSN, rev: str) -> _LocalScreenEntry:
+    '''
+        Return the local entry if it's the same as the shared revision [rev]. The out of date entry is deleted.
+    '''
+    with __localScreensLock:
+        entry = __localScreens.get(screenSN, None)
+        if entry is not None:
+            if rev is not None and entry.rev == rev:
+                __localScreens.move_to_end(screenSN)
+                return entry
+            del __localScreens[screenSN]
+        return None
+
+
+def __setLocalScreen(screenSN, rev: str, screenDfn: dict) -> _LocalScreenEntry:
+    entry = _LocalScreenEntry(rev, screenDfn)
+    with __localScreensLock:
+        __localScreens[screenSN] = entry
+        __localScreens.move_to_end(screenSN)
+        while len(__localScreens) > LOCAL_CACHE_SIZE:
+            __localScreens.popitem(last=False)
+    return entry
 
 
 def clearAllCache():
-    cache.clear()
+    '''
+        Invalidate all screen definitions and the field group type / widget caches. Other values in the cache are not deleted.
+    '''
+    screenSNs = set(Screen.objects.values_list('screen_sn', flat=True).distinct())
+    with __localScreensLock:
+        screenSNs.update(__localScreens.keys())
+    deletePageDefinitionsFromCache(screenSNs)
+    cache.delete_many(['fgTypes', 'fieldWidgets'])
+    deleteModelRecordsCache()
 
 
 def setPageDefinitionCache(screenSN, screenDfn):
     if isNullBlank(screenSN) or isNullBlank(screenDfn):
         return None
-    cache.set(screenSN, screenDfn)
+    rev = uuid.uuid4().hex
+    cache.set_many({__getDefinitionKey(screenSN): (rev, screenDfn), __getRevisionKey(screenSN): rev})
+    # the caller can change [screenDfn] later, so keep a copy as the shared cache does
+    __setLocalScreen(screenSN, rev, copy.deepcopy(screenDfn))
 
 
 def getPageDefinitionFromCache(screenSN):
+    '''
+        Return the screen definition. It's shared by the requests in this process, so don't change it.
+    '''
     if isNullBlank(screenSN):
         return None
-    screenDfn = cache.get(screenSN)
-    return screenDfn
+    rev = cache.get(__getRevisionKey(screenSN))
+    entry = __getLocalScreen(screenSN, rev)
+    __count('local', entry is not None)
+    if entry is not None:
+        return entry.screenDfn
+    if rev is None:
+        __count('shared', False)
+        return None
+    value = cache.get(__getDefinitionKey(screenSN))
+    if value is None or value[0] != rev:
+        # the definition is not cached, or it's changed by another worker at the same time
+        __count('shared', False)
+        return None
+    __count('shared', True)
+    return __setLocalScreen(screenSN, rev, value[1]).screenDfn
 
 
 def deletePageDefinitionFromCache(screenSN):
     if isNullBlank(screenSN):
         return None
-    cache.delete(screenSN)
+    deletePageDefinitionsFromCache([screenSN])
+
+
+def deletePageDefinitionsFromCache(screenSNs: list) -> None:
+    '''
+        Invalidate the screen definitions of [screenSNs]. The revisions are changed, so the other workers reload them.
+    '''
+    screenSNs = [screenSN for screenSN in screenSNs if not isNullBlank(screenSN)]
+    if len(screenSNs) == 0:
+        return
+    cache.set_many({__getRevisionKey(screenSN): uuid.uuid4().hex for screenSN in screenSNs})
+    cache.delete_many([__getDefinitionKey(screenSN) for screenSN in screenSNs])
+    with __localScreensLock:
+        for screenSN in screenSNs:
+            __localScreens.pop(screenSN, None)
+
+
+def getCompiledScreen(screenSN, subScreenName):
+    '''
+        Return the compiled screen if it's compiled from the latest screen definition.
+    '''
+    entry = __getLocalScreen(screenSN, cache.get(__getRevisionKey(screenSN)))
+    screen = None if entry is None else entry.compiledScreens.get(subScreenName.lower(), None)
+    __count('compiled', screen is not None)
+    return screen
+
+
+def setCompiledScreen(screenSN, subScreenName, screen):
+    '''
+        Keep the compiled screen with the local screen definition. The screen is not kept if the definition is not in the local cache.
+    '''
+    if isNullBlank(screenSN) or screen is None:
+        return
+    with __localScreensLock:
+        entry = __localScreens.get(screenSN, None)
+        if entry is not None:
+            entry.compiledScreens[subScreenName.lower()] = screen
+
+
+def deleteCompiledScreens(screenSN=None):
+    '''
+        Delete the compiled screens of [screenSN]. Delete all compiled screens if [screenSN] is None.
+    '''
+    with __localScreensLock:
+        for sn, entry in __localScreens.items():
+            if screenSN is None or sn == screenSN:
+                entry.compiledScreens.clear()
+
+
+def __getDependentModels(modelClass, queryKey: tuple) -> list:
+    '''
+        Return the model and the models which tables are used in the query, e.g. "id IN (SELECT ccy_id FROM ik_office)".
+    '''
+    global __tableModels
+    if __tableModels is None:
+        __tableModels = {m._meta.db_table.lower(): m for m in apps.get_models()}
+    modelClasses = [modelClass]
+    for s in queryKey:
+        if type(s) == str:
+            for name in re.findall(r'\w+', s.lower()):
+                m = __tableModels.get(name, None)
+                if m is not None and m not in modelClasses:
+                    modelClasses.append(m)
+    return modelClasses
+
+
+def getModelRecordsFromCache(modelClass, queryKey: tuple) -> tuple:
+    '''
+        queryKey (tuple): the query parameters. E.g. (distinct, queryFields, queryWhere, orderBy, limit).
+
+        Return (records, versions). [records] is a copy of the cached model records, it's None if the records are not cached
+        or they are out of date. [versions] is used to cache the records: setModelRecordsCache(modelClass, queryKey, records, versions).
+    '''
+    if COMBOBOX_CACHE_SIZE == 0:
+        return None, None
+    key = (modelVersion.getModelLabel(modelClass), queryKey)
+    with __localScreensLock:
+        entry = __localModelRecords.get(key, None)
+    # read the versions before the query, then the records saved by other workers during the query are reloaded next time
+    versions = modelVersion.getModelVersions(__getDependentModels(modelClass, queryKey))
+    if None in versions.values():
+        versions = None
+    records = None
+    with __localScreensLock:
+        if entry is not None and versions is not None and entry.versions == versions:
+            __localModelRecords.move_to_end(key)
+            records = entry.records
+        __counters['combobox']['hits' if records is not None else 'misses'] += 1
+    return (None if records is None else [copy.copy(r) for r in records]), versions
+
+
+def setModelRecordsCache(modelClass, queryKey: tuple, records: list, versions: dict) -> None:
+    '''
+        Keep a copy of the model records. The requests can change the records returned, e.g. set the cursor.
+    '''
+    if COMBOBOX_CACHE_SIZE == 0 or versions is None or records is None:
+        return
+    entry = _LocalModelRecordsEntry(versions, [copy.copy(r) for r in records])
+    key = (modelVersion.getModelLabel(modelClass), queryKey)
+    with __localScreensLock:
+        __localModelRecords[key] = entry
+        __localModelRecords.move_to_end(key)
+        while len(__localModelRecords) > COMBOBOX_CACHE_SIZE:
+            __localModelRecords.popitem(last=False)
+
+
+def deleteModelRecordsCache(modelClasses: list = None) -> None:
+    '''
+        Delete the local model records of [modelClasses] and the records depend on them. Delete all if [modelClasses] is None.
+        The changed records are found by the model versions, so this is for the changes without version_no in this process, e.g. QuerySet.update().
+    '''
+    with __localScreensLock:
+        if modelClasses is None:
+            __localModelRecords.clear()
+            return
+        labels = set(modelVersion.getModelLabel(modelClass) for modelClass in modelClasses)
+        for key in [key for key, entry in __localModelRecords.items() if len(labels.intersection(entry.versions.keys())) > 0]:
+            del __localModelRecords[key]
+
+
+def getCacheCounters() -> dict:
+    '''
+        Return the hit and miss counters of each tier: {"local": {"hits", "misses"}, "shared": {...}, "compiled": {...}, "combobox": {...},
+        "localSize", "comboboxSize"}.
+    '''
+    with __localScreensLock:
+        counters = {tier: dict(values) for tier, values in __counters.items()}
+        counters['localSize'] = len(__localScreens)
+        counters['comboboxSize'] = len(__localModelRecords)
+    return counters
+
+
+def resetCacheCounters() -> None:
+    with __localScreensLock:
+        for values in __counters.values():
+            values['hits'] = 0
+            values['misses'] = 0
 
 
 def setFieldGroupTypeCache():
@@ -1,4 +1,5 @@
 import hashlib
+import json
 import os
 import re
 import threading
@@ -21,15 +22,35 @@ from core.utils.lang_utils import isNotNullBlank, isNullBlank
 from iktools import IkConfig, getAppNames
 
 from . import ui as ikui
+from . import ui_cache as ikuiCache
+
+
+# The spreadsheet files and the screens processed by syncScreenDefinitions. The unchanged files and screens are skipped in the next sync.
+SCREEN_SYNC_MANIFEST_VERSION = 1
+
+
+def _getSyncManifestFile() -> Path:
+    return ikfs.getVarFolder(os.path.join('sys', 'screen-sync-manifest.json'))
 
 
 def syncScreenDefinitions(userID: int = None):
+    '''
+        Import the changed screen spreadsheet files to database, and then export the changed screens to spreadsheet and csv files.
+
+        The manifest file (_getSyncManifestFile) keeps the MD5 and the revision of the synced spreadsheet files, and the revision
+        of the exported screens. A spreadsheet file is not parsed if its MD5 is not changed and its revision is in database.
+        A screen is not exported if its revision is not changed and the exported files exist.
+    '''
     if IkConfig.getSystem('supportSpreadsheetScreenDefinition', 'true').lower() == 'false':
         return
 
     # excel to database
     template_file = ikfs.getLastRevisionFile(ikui.getScreenFileTemplateFolder(), 'template.xlsx')
     template_rev = _extract_version_from_path(template_file)
+    manifest = __loadSyncManifest(template_rev)
+    synced_files = {}  # {file: file state}, the files are up to date in database
+    changed_screen_sns = set()
+    latest_screens = __getLatestScreens()
 
     def get_app_screen_files(fp, app_name) -> dict:
         screen_files = {}
@@ -44,6 +65,15 @@ def syncScreenDefinitions(userID: int = None):
                 continue
 
             path = Path(os.path.join(fp, f2))
+            file_key = __getSyncFileKey(path)
+            last_file_state = manifest['files'].get(file_key, None)
+            file_state = __getSyncFileState(path, last_file_state)
+            if last_file_state is not None and file_state['md5'] == last_file_state['md5']:
+                latest_screen = latest_screens.get(last_file_state['screenSN'].lower(), None)
+                if latest_screen is not None and isNotNullBlank(latest_screen['spreadsheetRev']) and latest_screen['spreadsheetRev'] >= last_file_state['rev']:
+                    synced_files[file_key] = last_file_state
+                    continue
+
             spData = ikSpreadsheet.SpreadsheetParser(path).data
             screenSN = __strip(spData['viewID'])
             if 'templateVersion' not in spData.keys():
@@ -54,8 +84,8 @@ def syncScreenDefinitions(userID: int = None):
                     app_name, screenSN, spData['templateVersion'], template_rev))
                 continue
             if screenSN not in excelRevs:
-                latestScreen = Screen.objects.filter(screen_sn__iexact=screenSN).order_by('-rev').first()
-                dbRev = latestScreen.spreadsheet_rev if isNotNullBlank(latestScreen) and isNotNullBlank(latestScreen.spreadsheet_rev) else -1
+                latestScreen = latest_screens.get(screenSN.lower(), None)
+                dbRev = latestScreen['spreadsheetRev'] if isNotNullBlank(latestScreen) and isNotNullBlank(latestScreen['spreadsheetRev']) else -1
                 excelRevs[screenSN] = dbRev
             if screenSN not in screen_files:
                 screen_files[screenSN] = []
@@ -68,9 +98,14 @@ def syncScreenDefinitions(userID: int = None):
                     excelRev = int(spData['rev'])
             except Exception:
                 logger.error('Excel "Reversion" field must be an integer. Invalid file: %s' % path)
+                continue
+            file_state['screenSN'] = screenSN
+            file_state['rev'] = excelRev
             if isNotNullBlank(excelRev) and excelRev > excelRevs[screenSN]:
                 screenDefinition = ikui.ScreenDefinition(name=screenSN, fullName=app_name + '.' + screenSN, filePath=path, definition=spData)
-                screen_files[screenSN].append([path, excelRev, screenDefinition])
+                screen_files[screenSN].append([path, excelRev, screenDefinition, file_key, file_state])
+            else:
+                synced_files[file_key] = file_state
         return screen_files
 
     def process_app_screen_files(app_name):
@@ -80,33 +115,127 @@ def syncScreenDefinitions(userID: int = None):
             for screenSN, screenDefinitions in screen_files.items():
                 if len(screenDefinitions) > 0:
                     screenDefinitions = sorted(screenDefinitions, key=lambda x: x[1])
-                    for file_path, file_rev, screenDefinition in screenDefinitions:
+                    for file_path, file_rev, screenDefinition, file_key, file_state in screenDefinitions:
                         b = _updateDatabaseWithExcelFiles(screenDefinition, userID)
                         if not b.value:
                             logger.error("Process screen [%s], Path=%s, Rev=%s, failed: %s" % (screenSN, str(file_path), file_rev, b.dataStr))
+                        else:
+                            synced_files[file_key] = file_state
+                            changed_screen_sns.add(screenSN.lower())
 
     app_names = getAppNames()
     for app_name in app_names:
         process_app_screen_files(app_name)
 
     # database to excel: Screen Dfn
-    screenSNs = Screen.objects.values('screen_sn').distinct().order_by('screen_sn')
-    for screenSN in screenSNs:
-        b1 = __createExcelWithDatabase(screenSN, userID)
-        if not b1.value:
-            return b1
+    if len(changed_screen_sns) > 0:
+        latest_screens = __getLatestScreens()
+    exported_screens = {}  # {screen SN (lower case): revision}
+    csv_screen_sns = []
+    is_production = IkConfig.get("production", False)
+    try:
+        for screen_key, latest_screen in sorted(latest_screens.items()):
+            screenSN = latest_screen['screenSN']
+            if screen_key not in changed_screen_sns and manifest['screens'].get(screen_key, None) == latest_screen['rev'] \
+                    and __isScreenFilesExist(latest_screen, is_production):
+                exported_screens[screen_key] = latest_screen['rev']
+                continue
+            b1 = __createExcelWithDatabase({'screen_sn': screenSN}, userID)
+            if not b1.value:
+                return b1
+            exported_screens[screen_key] = latest_screen['rev']
+            csv_screen_sns.append(screenSN)
+    finally:
+        # the spreadsheet files maybe updated or deleted by the export
+        manifest_files = {}
+        for file_key, file_state in synced_files.items():
+            if os.path.isfile(file_key):
+                manifest_files[file_key] = __getSyncFileState(Path(file_key), file_state)
+                manifest_files[file_key]['screenSN'] = file_state['screenSN']
+                manifest_files[file_key]['rev'] = file_state['rev']
+        __saveSyncManifest(template_rev, manifest_files, exported_screens)
 
     # database to excel: Screen Dfn CSV
-    if not IkConfig.get("production", False):
-        thread = threading.Thread(target=createCSVFileWithDatabase)
+    if not is_production and len(csv_screen_sns) > 0:
+        thread = threading.Thread(target=createCSVFileWithDatabase, kwargs={'screen_sns': csv_screen_sns})
         thread.start()
+    logger.info('Sync screen definitions: %s screens imported, %s screens exported.' % (len(changed_screen_sns), len(csv_screen_sns)))
     return Boolean2(True, "Reloaded")
 
 
-def createCSVFileWithDatabase(select_screen_sn: str = None):
+def __getLatestScreens() -> dict:
+    '''
+        Return the latest revision of the screens: {screen SN (lower case): {"screenSN", "rev", "spreadsheetRev", "appNm"}}.
+    '''
+    latest_screens = {}
+    for screen_sn, rev, spreadsheet_rev, app_nm in Screen.objects.order_by('screen_sn', 'rev').values_list('screen_sn', 'rev', 'spreadsheet_rev', 'app_nm'):
+        screen_key = screen_sn.lower()
+        latest_screen = latest_screens.get(screen_key, None)
+        if latest_screen is None or rev >= latest_screen['rev']:
+            latest_screens[screen_key] = {'screenSN': screen_sn, 'rev': rev, 'spreadsheetRev': spreadsheet_rev, 'appNm': app_nm}
+    return latest_screens
+
+
+def __isScreenFilesExist(latest_screen: dict, is_production: bool) -> bool:
+    if latest_screen['appNm'] not in getAppNames():
+        return True  # the screen files are not exported. Reference to __databaseHasModify
+    screen_folder = os.path.join(latest_screen['appNm'], ikui.SCREEN_RESOURCE_FOLDER_PATH)
+    if not os.path.isfile(os.path.join(screen_folder, '%s.xlsx' % latest_screen['screenSN'])):
+        return False
+    return is_production or os.path.isfile(os.path.join(screen_folder, 'csv', '%s.csv' % latest_screen['screenSN']))
+
+
+def __getSyncFileKey(path: Path) -> str:
+    return str(path).replace('\\', '/')
+
+
+def __getSyncFileState(path: Path, last_file_state: dict = None) -> dict:
+    '''
+        Return the file size, the modify time and the MD5 of [path]. The MD5 is not calculated if the size and the modify time are not changed.
+    '''
+    stat = os.stat(path)
+    if last_file_state is not None and last_file_state.get('size', None) == stat.st_size and last_file_state.get('mtime', None) == stat.st_mtime_ns:
+        return dict(last_file_state)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'md5': _getExcelMD5(path)}
+
+
+def __loadSyncManifest(template_rev) -> dict:
+    manifest = None
+    manifest_file = _getSyncManifestFile()
+    if os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except Exception as e:
+            logger.warning('Read screen sync manifest file [%s] failed, sync all screens: %s' % (manifest_file, e))
+            manifest = None
+    if manifest is None or manifest.get('version', None) != SCREEN_SYNC_MANIFEST_VERSION or manifest.get('templateRev', None) != template_rev:
+        manifest = {'files': {}, 'screens': {}}
+    return manifest
+
+
+def __saveSyncManifest(template_rev, files: dict, screens: dict) -> None:
+    manifest_file = _getSyncManifestFile()
+    try:
+        ikfs.mkParentDirs(manifest_file)
+        temp_file = '%s.%s.tmp' % (manifest_file, os.getpid())
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': SCREEN_SYNC_MANIFEST_VERSION, 'templateRev': template_rev, 'files': files, 'screens': screens}, f, indent=1, sort_keys=True)
+        os.replace(temp_file, manifest_file)
+    except Exception as e:
+        logger.error('Save screen sync manifest file [%s] failed: %s' % (manifest_file, e))
+
+
+def createCSVFileWithDatabase(select_screen_sn: str = None, screen_sns: list = None):
+    '''
+        Export [select_screen_sn], or the screens in [screen_sns], or all screens to csv files.
+    '''
     try:
         if isNotNullBlank(select_screen_sn):
             screen_sns = [{'screen_sn': select_screen_sn}]
+        elif screen_sns is not None:
+            logger.info('Export %s screen definitions to csv file start ...' % len(screen_sns))
+            screen_sns = [{'screen_sn': screen_sn} for screen_sn in screen_sns]
         else:
             screen_sns = Screen.objects.values('screen_sn').distinct().order_by('screen_sn')
             logger.info('Export all screen definition to csv file start ...')
@@ -686,3 +815,4 @@ def __updateScreenDatabase(dfn, userID):
     b = ptrn.save()
     if not b.value:
         raise IkValidateException(b.dataStr)
+    ikuiCache.deletePageDefinitionFromCache(screenRc.screen_sn)
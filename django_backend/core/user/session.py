@@ -1,5 +1,5 @@
 """
-    The methods in __SessionManager are used for developing in port 3000.
+    The methods in __SessionManager and TokenSessionStore are used for developing in port 3000.
 """
 import inspect
 import json
@@ -9,6 +9,7 @@ from core.core.exception import IkException
 from core.db.transaction import IkTransaction
 from core.models import UsrSessionPrm, UsrToken
 from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection, transaction
 from django.core.handlers.wsgi import WSGIHandler
 from rest_framework.views import APIView
 
@@ -128,3 +129,132 @@ class __SessionManager:
 
 
 SessionManager = __SessionManager()
+
+
+def isSessionPrmNameMatched(name: str, nameFilter: str) -> bool:
+    '''
+        nameFilter: "dog" / "dog*" / "*dog" / "*dog*". Same as __SessionManager.deletePrms.
+    '''
+    if '*' in nameFilter:
+        if len(nameFilter) > 2 and nameFilter[0] == '*' and nameFilter[-1] == '*':
+            return nameFilter[1:-1] in name
+        elif nameFilter[0] != '*' and nameFilter[-1] == '*':
+            return name.startswith(nameFilter[0:-1])
+        elif nameFilter[-1] != '*' and nameFilter[0] == '*':
+            return name.endswith(nameFilter[1:])
+    return name == nameFilter
+
+
+class TokenSessionStore():
+    '''
+        Request scoped session parameters (UsrSessionPrm) of a user's token.
+
+        All the parameters are loaded by one query when a parameter is used at the first time. The changes are kept in
+        memory, and flush() writes them in one transaction: one DELETE for the deleted parameters, and one
+        INSERT ... ON CONFLICT DO UPDATE for the changed parameters. Only the changed parameters are written, so the
+        concurrent requests of the same token don't overwrite each other's parameters, and the last flush wins if they
+        change the same parameter.
+
+        The model history signals are not sent for the session parameters.
+
+        Usage (reference to core/view/auth_view.py: AuthAPIView):
+            store = TokenSessionStore(user)
+            store.updatePrms('name', value)
+            value = store.getPrms('name')
+            store.flush()  # at the end of the request
+    '''
+    __DELETED = object()
+
+    def __init__(self, user) -> None:
+        self.userID = None if user is None else user.id
+        self.__isLoaded = False
+        self.__tokenID = None
+        self.__prms = {}  # {key: json string}
+        self.__changes = {}  # {key: json string or __DELETED}
+
+    @property
+    def isChanged(self) -> bool:
+        return len(self.__changes) > 0
+
+    def __load(self) -> None:
+        if self.__isLoaded:
+            return
+        self.__isLoaded = True
+        if self.userID is None:
+            return
+        # a user has one token at most, reference to core/auth/index.py
+        rows = UsrToken.objects.filter(usr_id=self.userID).order_by('id').values_list('id', 'usrsessionprm__key', 'usrsessionprm__value')
+        for tokenID, key, value in rows:
+            if self.__tokenID is None:
+                self.__tokenID = tokenID
+            elif tokenID != self.__tokenID:
+                break
+            if key is not None:
+                self.__prms[key] = value
+
+    def getPrms(self, name, defaultValue=None):
+        '''
+            return object
+        '''
+        self.__load()
+        if self.__tokenID is None:
+            return None
+        v = self.__prms.get(name, None)
+        return defaultValue if v is None else loads(v)
+
+    def getPrms2(self) -> dict:
+        ''' Get all parameters.
+        '''
+        self.__load()
+        if self.__tokenID is None:
+            return None
+        return {key: loads(self.__prms[key]) if self.__prms[key] else None for key in sorted(self.__prms.keys())}
+
+    def updatePrms(self, name, value) -> None:
+        self.__load()
+        if self.__tokenID is None:
+            return
+        if isinstance(value, Path):
+            value = str(value)
+        value = None if value is None else dumps(value)
+        self.__prms[name] = value
+        self.__changes[name] = value
+
+    def deletePrms(self, nameFilters) -> bool:
+        '''
+            nameFilter: str: "dog" / "*dog" / "*dog*" / "*dog" or a list
+        '''
+        if nameFilters is None or type(nameFilters) == list and len(nameFilters) == 0:
+            return True
+        if type(nameFilters) == str:
+            nameFilters = [nameFilters]
+        self.__load()
+        for name in [name for name in self.__prms.keys() if any(isSessionPrmNameMatched(name, nameFilter) for nameFilter in nameFilters)]:
+            del self.__prms[name]
+            self.__changes[name] = self.__DELETED
+        return True
+
+    def getPrmAndDelete(self, name, defaultValue=None):
+        v = self.getPrms(name, defaultValue)
+        self.deletePrms(name)
+        return v
+
+    def flush(self) -> None:
+        '''
+            Write the changes in one transaction.
+        '''
+        if not self.isChanged:
+            return
+        deletedKeys = sorted(key for key, value in self.__changes.items() if value is self.__DELETED)
+        changedRcs = [UsrSessionPrm(token_id=self.__tokenID, key=key, value=value)
+                      for key, value in sorted(self.__changes.items()) if value is not self.__DELETED]
+        with transaction.atomic():
+            if len(deletedKeys) > 0:
+                qn = connection.ops.quote_name
+                with connection.cursor() as cursor:
+                    cursor.execute('DELETE FROM %s WHERE %s = %%s AND %s IN (%s)' % (qn(UsrSessionPrm._meta.db_table), qn('token_id'), qn('key'),
+                                                                                  ','.join(['%s'] * len(deletedKeys))),
+                                   [self.__tokenID] + deletedKeys)
+            if len(changedRcs) > 0:
+                UsrSessionPrm.objects.bulk_create(changedRcs, update_conflicts=True, unique_fields=['token', 'key'], update_fields=['value'])
+        self.__changes = {}
@@ -40,6 +40,13 @@ def getUserName(userID) -> str:
     return None if dbUtils.isEmpty(rs) else rs[0]['usr_nm']
 
 
+def getUserNames(userIDs: list) -> dict:
+    '''
+        Return {user ID: user name} of the existing users by one query.
+    '''
+    return dict(User.objects.filter(id__in=userIDs).values_list('id', 'usr_nm'))
+
+
 def getUserID(userNm) -> int:
     rs = None
     with connection.cursor() as cursor:
@@ -1,9 +1,12 @@
+import functools
 import json
 import logging
 from importlib import import_module
+from types import SimpleNamespace
 
-from django.core import serializers
-from django.db.models import QuerySet
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.utils.encoding import is_protected_type
 
 from core.core.exception import IkValidateException
 from core.db.model import DummyModel, Model
@@ -13,6 +16,10 @@ from .lang_utils import isNullBlank
 
 logger = logging.getLogger(__name__)
 
+QUERY_MODEL_CHUNK_SIZE = 2000
+__JSON_VALUE_TYPES = (str, int, float, bool)
+__JSON_ENCODER = DjangoJSONEncoder()
+
 
 def model2Fields(modelRc):
     if type(modelRc) == list:
@@ -188,12 +195,31 @@ def is_model_class_exists(app_name: str, screen_sn: str, class_nm: str) -> bool:
 
 
 def queryModel(modelNames, queryFields=None, distinct=False, queryWhere=None, orderBy=None,
-               limit=None, pageSize=None, page=None) -> QuerySet:
+               limit=None, pageSize=None, page=None) -> list:
+    '''
+        Query the model records by sql. Return a list of model instances, the record status is retrieve.
+
+        The field values are the same as django json serializer (serializers.serialize('json', ...)), e.g. the datetime fields are iso format strings.
+        The fields not in the query result have the default values.
+    '''
+    rcs = []
+    for chunk in iterateModel(modelNames, queryFields=queryFields, distinct=distinct, queryWhere=queryWhere, orderBy=orderBy,
+                              limit=limit, pageSize=pageSize, page=page):
+        rcs.extend(chunk)
+    return rcs
+
+
+def iterateModel(modelNames, queryFields=None, distinct=False, queryWhere=None, orderBy=None,
+                 limit=None, pageSize=None, page=None, chunkSize=QUERY_MODEL_CHUNK_SIZE):
+    '''
+        Same as queryModel, but yield the records in lists of [chunkSize] records. The rows are fetched from the database cursor
+        chunk by chunk, so a large query doesn't need to keep all records in memory.
+    '''
     if ',' in modelNames:
         raise IkValidateException('Screen recordset supports one model only at the moment: %s' % modelNames)
     modelClass = getModelClass(modelNames)
     if modelClass == DummyModel:
-        return None
+        return
     meta = modelClass._meta
 
     sql = 'SELECT '
@@ -220,26 +246,105 @@ def queryModel(modelNames, queryFields=None, distinct=False, queryWhere=None, or
         engine = IkConfig.get('Database', 'engine')
         if 'postgresql' not in engine:
             raise IkValidateException('Query Pageable only supports PostgreSQL.')
-        sql += 'LIIT %s OFFSET %s ' % (pageSize, pageSize * (page - 1))
+        sql += 'LIMIT %s OFFSET %s ' % (pageSize, pageSize * (page - 1))
     logger.debug(sql)
-    ds = modelClass.objects.raw(sql)  # -> django.db.models.query.RawQuerySet
-    dataStr = serializers.serialize('json', ds, fields=queryFields)
-    rcs = []
-    for j in json.loads(dataStr):
-        r = modelClass()
-        if 'pk' in j and hasattr(r, 'id'):
-            id = j['pk']
-            if id:
-                setattr(r, 'id', id)
-        fields = j['fields']
-        for fieldName, fieldValue in fields.items():
-            try:
-                setattr(r, fieldName, fieldValue)
-            except Exception as e:
-                setattr(r, fieldName + "_id", fieldValue)  # TODO: foreign key ? seee masterDetailDemo.py: "author" -> "author_id"
+    connection = connections[modelClass.objects.db]
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, ())  # the same as modelClass.objects.raw(sql)
+        rows = cursor.fetchmany(chunkSize)  # a server side cursor has the description after fetch
+        rowReader = _ModelRowReader(modelClass, [column[0] for column in cursor.description], queryFields, connection)
+        while rows:
+            yield [rowReader.toModel(row) for row in rows]
+            rows = cursor.fetchmany(chunkSize)
+
+
+class _ModelRowReader():
+    '''
+        Convert the query result rows to model instances. The columns are mapped to the model fields once per query.
+
+        The values are converted as the old implementation: modelClass.objects.raw(sql) -> serializers.serialize('json', fields=queryFields)
+        -> json.loads -> setattr:
+            1. The primary key is set if it's not empty.
+            2. A field is set if it's in the query result and its name is in [queryFields] (or [queryFields] is empty).
+               The value is converted to json type, e.g. datetime, date, time and decimal to string.
+            3. The other fields have the default values.
+    '''
+
+    def __init__(self, modelClass, columns: list, queryFields: str, connection) -> None:
+        self.modelClass = modelClass
+        meta = modelClass._meta
+        columnConverter = connection.introspection.identifier_converter
+        columnIndexes = {}
+        for i, column in enumerate(columns):
+            columnIndexes.setdefault(columnConverter(column), i)
+        if columnConverter(meta.pk.column) not in columnIndexes:
+            raise IkValidateException('Raw query must include the primary key')
+
+        self.setID = meta.pk.attname == 'id'
+        selectedFields = set()
+        for field in meta.concrete_model._meta.local_fields:
+            if field.serialize:
+                attname = field.attname if field.remote_field is None else field.attname[:-3]
+                if isNullBlank(queryFields) or attname in queryFields:
+                    selectedFields.add(field)
+        # [(row index, value converter)] or [(None, default value or default value function)]
+        self.fields = []
+        for field in meta.concrete_fields:
+            index = columnIndexes.get(columnConverter(field.column), None)
+            if field.primary_key:
+                self.fields.append((index, self.__getConverter(field, connection, isPrimaryKey=True)))
+            elif index is not None and field in selectedFields:
+                self.fields.append((index, self.__getConverter(field, connection)))
+            elif field.has_default() and callable(field.default):
+                self.fields.append((None, field.get_default))
+            else:
+                self.fields.append((None, field.get_default()))
+
+    def toModel(self, row):
+        values = []
+        for index, converter in self.fields:
+            if index is not None:
+                values.append(converter(row[index]))
+            elif callable(converter):
+                values.append(converter())
+            else:
+                values.append(converter)
+        r = self.modelClass(*values)
         r.ik_set_status_retrieve()
-        rcs.append(r)
-    return rcs
+        return r
+
+    def __getConverter(self, field, connection, isPrimaryKey: bool = False):
+        col = field.get_col(field.model._meta.db_table)
+        dbConverters = connection.ops.get_db_converters(col) + col.get_db_converters(connection)
+        defaultValue = field.get_default() if isPrimaryKey else None
+
+        def convert(value):
+            for dbConverter in dbConverters:
+                value = dbConverter(value, col, connection)
+            value = _toJsonValue(field, value)
+            if isPrimaryKey and (not self.setID or not value):
+                return defaultValue
+            return value
+        return functools.partial(_toJsonValue, field) if len(dbConverters) == 0 and not isPrimaryKey else convert
+
+
+def _toJsonValue(field, value):
+    '''
+        Convert the field value to json type as serializers.serialize('json', ...) and json.loads.
+    '''
+    if value is None or type(value) in __JSON_VALUE_TYPES:
+        return value
+    if not is_protected_type(value):
+        value = field.value_to_string(SimpleNamespace(**{field.attname: value}))
+        if value is None or type(value) in __JSON_VALUE_TYPES:
+            return value
+    try:
+        value = __JSON_ENCODER.default(value)  # e.g. datetime, date, time, decimal, uuid
+        if type(value) in __JSON_VALUE_TYPES:
+            return value
+    except TypeError:
+        pass
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
 
 
 def locateToFirst(recordset, fieldName, fieldValue) -> Model:
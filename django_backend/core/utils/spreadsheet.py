@@ -100,7 +100,7 @@ class SpreadsheetParser:
                 if len(d.columns) > 0 and d.columns[0] is not None \
                         and type(d.columns[0]) == str \
                         and d.columns[0].lower() == 'do not modify this column':
-                    d = d.where(d.notnull(), None)
+                    d = d.astype(object).where(d.notnull(), None)  # pandas 3 keeps NaN in the string columns
                     d = d.to_numpy()
                     sheetData.append(d)
             # 2 .read user's input data
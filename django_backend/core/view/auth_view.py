@@ -1,20 +1,17 @@
-import csv
-import logging
 import inspect
 import logging
+import time
 from datetime import datetime
 from pathlib import Path
-from threading import Lock
 
 from django.core.handlers.wsgi import WSGIHandler
-from iktools import IkConfig
 
-from ..core import fs as ikfs
-from ..utils import date_utils as date_utils
 from ..auth.index import Authentication, UserPermission
 from ..core.http import is_support_session
+from ..log import profiler
 from ..models import User
-from ..user.session import SessionManager
+from ..session.tracker import markSessionModified, sanitizeSessionValue, watchSessionValue
+from ..user.session import TokenSessionStore
 from .base_view import BaseAPIView
 
 logger = logging.getLogger(__name__)
@@ -24,9 +21,6 @@ SESSION_DATA_NAME = '$IK_$G'
 SESSION_VIEW_DATA_NAME = '$IK_$S'
 SESSION_DATA_TIMESTAMP_SUFFIX = '_$TIMESTAMP'
 
-_RuntimeOutputLock = Lock()
-_RuntimeOutputHasAddHeader = False
-
 
 class AuthAPIView(BaseAPIView):
     authentication_classes = [Authentication, ]
@@ -36,9 +30,19 @@ class AuthAPIView(BaseAPIView):
         super().__init__(**kwargs)
         self._SUUID = None  # client request ID. E.g. SUUID, each screen instance has its own suuid
         self.__instanceID = int(datetime.now().timestamp() * 1e6)
+        self.__tokenSessionStore = None
+
+    def dispatch(self, request, *args, **kwargs):
+        with profiler.trace('request', view=self.__class__.__name__, method=request.method, path=request.path):
+            return super().dispatch(request, *args, **kwargs)
 
     def initial(self, request, *args, **kwargs):
-        super().initial(request, *args, **kwargs)
+        with profiler.span('acl'):
+            super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        self.__flushTokenSessionStore()
+        return super().finalize_response(request, response, *args, **kwargs)
 
     def _getInstanceID(self) -> int:
         return self.__instanceID
@@ -60,6 +64,21 @@ class AuthAPIView(BaseAPIView):
     def __isUseSession(self) -> bool:
         return is_support_session(self.request)
 
+    def __getTokenSessionStore(self) -> TokenSessionStore:
+        '''
+            The session parameters for developing in port 3000. They are loaded once and saved at the end of the request.
+        '''
+        if self.__tokenSessionStore is None:
+            self.__tokenSessionStore = TokenSessionStore(self.getCurrentUser())
+        return self.__tokenSessionStore
+
+    def __flushTokenSessionStore(self) -> None:
+        if self.__tokenSessionStore is not None:
+            try:
+                self.__tokenSessionStore.flush()
+            except Exception as e:
+                logger.error('Save the session parameters failed: %s' % e, exc_info=True)
+
     def __getSessionParameterName(self, name, isGlobal: bool = False) -> str:
         if self.__isUseSession():
             return name
@@ -82,13 +101,19 @@ class AuthAPIView(BaseAPIView):
     def __getSessionParameterTimestampName(self, name) -> str:
         return '%s%s' % (name, SESSION_DATA_TIMESTAMP_SUFFIX)
 
-    def __getSessionData(self, isGlobal=False, isDelete=False) -> dict:
+    def __getSessionData(self, isGlobal=False, isDelete=False, isCreate=True) -> dict:
+        '''
+            isCreate: False means read only, the data is not added to the session if it's not exists.
+
+            The nested data is changed in place, so call markSessionModified() when it's changed. Reference to core/session/tracker.py
+        '''
         name = SESSION_DATA_NAME if isGlobal else SESSION_VIEW_DATA_NAME
         data = self.request.session.get(name, None)
         if data is None and not isDelete:
             data = {}
-            self.request.session[name] = data
-            self.request.session[self.__getSessionParameterTimestampName(name)] = datetime.now().timestamp()
+            if isCreate:
+                self.request.session[name] = data
+                self.request.session[self.__getSessionParameterTimestampName(name)] = datetime.now().timestamp()
         elif isGlobal and isDelete:
             del self.request.session[self.__getSessionParameterTimestampName(name)]
             del self.request.session[name]
@@ -99,15 +124,20 @@ class AuthAPIView(BaseAPIView):
             screenData = data.get(dataSetName, None)
             if screenData is None and not isDelete:
                 screenData = {}
-                data[dataSetName] = screenData
-                data[self.__getSessionParameterTimestampName(dataSetName)] = datetime.now().timestamp()
+                if isCreate:
+                    data[dataSetName] = screenData
+                    data[self.__getSessionParameterTimestampName(dataSetName)] = datetime.now().timestamp()
+                    markSessionModified(self.request.session)
             elif isDelete:
                 del data[self.__getSessionParameterTimestampName(dataSetName)]
                 del data[dataSetName]
+                markSessionModified(self.request.session)
             data = screenData
         return data
 
     def ____popSessionData(self, data, name, default=None) -> any:
+        if name in data:
+            markSessionModified(self.request.session)
         data.pop(self.__getSessionParameterTimestampName(name), None)
         return data.pop(name, default)
 
@@ -116,14 +146,15 @@ class AuthAPIView(BaseAPIView):
             return object
         '''
         if self.__isUseSession():
-            sd = self.__getSessionData()
+            sd = self.__getSessionData(isCreate=False)
             if sd:
                 prms = {}
                 for name, value in sd.items():
+                    watchSessionValue(self.request.session, value)
                     prms[self.__getSessionParameterOritinalName(name, isGlobal)] = value
                 return prms
         else:
-            sp = SessionManager.getPrms2(self.getCurrentUser())
+            sp = self.__getTokenSessionStore().getPrms2()
             if sp:
                 prms = {}
                 for name, value in sp.items():
@@ -137,16 +168,19 @@ class AuthAPIView(BaseAPIView):
         '''
         name2 = self.__getSessionParameterName(name, isGlobal)
         if self.__isUseSession():
-            data = self.__getSessionData(isGlobal)
+            data = self.__getSessionData(isGlobal, isCreate=False)
             if delete:
                 return self.____popSessionData(data, name2, default)
             else:
-                return data.get(name2, default)
+                value = data.get(name2, default)
+                if name2 in data:
+                    watchSessionValue(self.request.session, value)  # it can be changed in place
+                return value
         else:
             if delete:
-                return SessionManager.getPrmAndDelete(self.getCurrentUser(), name2, defaultValue=default)
+                return self.__getTokenSessionStore().getPrmAndDelete(name2, defaultValue=default)
             else:
-                return SessionManager.getPrms(self.getCurrentUser(), name2, defaultValue=default)
+                return self.__getTokenSessionStore().getPrms(name2, defaultValue=default)
 
     def getSessionParameterInt(self, name, delete=False, default=None, isGlobal=False) -> int:
         if self.__isUseSession():
@@ -155,10 +189,10 @@ class AuthAPIView(BaseAPIView):
         else:
             name2 = self.__getSessionParameterName(name, isGlobal)
             if delete:
-                value = SessionManager.getPrmAndDelete(self.getCurrentUser(), name2, defaultValue=default)
+                value = self.__getTokenSessionStore().getPrmAndDelete(name2, defaultValue=default)
                 return None if value is None else int(value)
             else:
-                value = SessionManager.getPrms(self.getCurrentUser(), name2, defaultValue=default)
+                value = self.__getTokenSessionStore().getPrms(name2, defaultValue=default)
                 return None if value is None or value == '' else int(value)
 
     def getSessionParameterBool(self, name, delete=False, default=None, isGlobal=False) -> bool:
@@ -171,10 +205,10 @@ class AuthAPIView(BaseAPIView):
         else:
             name2 = self.__getSessionParameterName(name, isGlobal)
             if delete:
-                value = SessionManager.getPrmAndDelete(self.getCurrentUser(), name2, defaultValue=default)
+                value = self.__getTokenSessionStore().getPrmAndDelete(name2, defaultValue=default)
                 return None if value is None else bool(value)
             else:
-                value = SessionManager.getPrms(self.getCurrentUser(), name2, defaultValue=default)
+                value = self.__getTokenSessionStore().getPrms(name2, defaultValue=default)
                 return None if value is None or value == '' else bool(value)
 
     def setSessionParameters(self, parameters: dict, isGlobal: bool = False) -> None:
@@ -188,11 +222,12 @@ class AuthAPIView(BaseAPIView):
         if self.__isUseSession():
             data = self.__getSessionData(isGlobal)
             name2 = self.__getSessionParameterName(name, isGlobal)
-            data[name2] = value
+            data[name2] = sanitizeSessionValue(value, name2)
             data[self.__getSessionParameterTimestampName(name2)] = datetime.now().timestamp()
+            markSessionModified(self.request.session)
         else:
             name2 = self.__getSessionParameterName(name, isGlobal)
-            SessionManager.updatePrms(self.getCurrentUser(), name2, value)
+            self.__getTokenSessionStore().updatePrms(name2, value)
 
     def cleanSessionParameters(self, isGlobal=False) -> None:
         if self.__isUseSession():
@@ -214,7 +249,7 @@ class AuthAPIView(BaseAPIView):
                 name2 = nameFilters
             else:
                 name2 = [nameFilters]
-            data = self.__getSessionData(isGlobal)
+            data = self.__getSessionData(isGlobal, isCreate=False)
             keys = list(data.keys())
             namePrefix = self.__getSessionParameterName('', isGlobal)
             namePrefixLen = len(namePrefix)
@@ -252,87 +287,18 @@ class AuthAPIView(BaseAPIView):
                     name2.append(self.__getSessionParameterName(name, isGlobal))
             else:
                 name2 = self.__getSessionParameterName(nameFilters, isGlobal)
-            return SessionManager.deletePrms(self.getCurrentUser(), name2)
+            return self.__getTokenSessionStore().deletePrms(name2)
 
     def _logDuration(self, startTime: datetime, endTime: datetime = None, actionName: str = None, description: str = None) -> None:
-        global _RuntimeOutputLock, _RuntimeOutputHasAddHeader
-
-        try:
-            if startTime is None:
-                return
-            if str(IkConfig.get('System', 'debugRunTime', 'false')).strip().lower() != 'true':
-                return  # ignore
-            outputFile = IkConfig.get('System', 'debugRunTimeOutputFile', 'var/logs/runtime.csv').replace('\\', '/').strip()
-            if not outputFile.startswith('/'):
-                if outputFile.startswith('var/'):
-                    outputFile = outputFile[4:]
-                outputFile = ikfs.getVarFolder(outputFile)
-            outputFile = Path(outputFile)
-
-            methodName = ''
-            frame = inspect.currentframe().f_back
-            callerModule = inspect.getmodule(frame).__name__
-            callerClass = frame.f_locals.get('self', None).__class__.__name__
-            callerMethod = frame.f_code.co_name
-            try:
-                v = getCurrentView()
-                if v is not None:
-                    callerModule = v.__module__
-            except:
-                pass
-            if endTime is None:
-                endTime = datetime.now()
-            seconds = (endTime - startTime).total_seconds()
-            csvContent = []
-            csvContent.append([datetime.strftime(endTime, '%Y-%m-%d %H:%M:%S.%f'),
-                               self.__instanceID,
-                               callerModule,
-                               callerClass,
-                               callerMethod,
-                               actionName,
-                               self.request.method,
-                               self.request.build_absolute_uri(),
-                               self.request.path,
-                               datetime.strftime(startTime, '%Y-%m-%d %H:%M:%S.%f'),
-                               datetime.strftime(endTime, '%Y-%m-%d %H:%M:%S.%f'),
-                               seconds,
-                               date_utils.getDurationStr(startTime, endTime),
-                               description
-                               ])
-
-            _RuntimeOutputLock.acquire()
-            try:
-                if not _RuntimeOutputHasAddHeader:
-                    isNewFile = not outputFile.is_file()
-                    if isNewFile:
-                        csvContent.insert(0, ['date',
-                                              'request id',
-                                              'module',
-                                              'class',
-                                              'caller',
-                                              'api action',
-                                              'http method',
-                                              'http url',
-                                              'http path',
-                                              'start time',
-                                              'end time',
-                                              'duration in seconds',
-                                              'duration time',
-                                              'description'
-                                              ])
-                        ikfs.mkParentDirs(outputFile)
-                    _RuntimeOutputHasAddHeader = True
-                with open(outputFile, 'a', newline='') as file:
-                    writer = csv.writer(file)
-                    writer.writerows(csvContent)
-            finally:
-                _RuntimeOutputLock.release()
-
-            methodName = "%s.%s:%s" % (callerModule, callerClass, callerMethod)
-            logger.info('Duration %s (%s) = %s, %s' % (methodName, '-' if actionName is None else actionName,
-                        date_utils.getDurationStr(startTime), description))
-        except Exception as e:
-            logger.error(e, exc_info=True)
+        '''
+            Add a profiler span from [startTime] to [endTime] (default to now). Please use core.log.profiler.span() instead.
+        '''
+        if startTime is None or not profiler.isEnabled():
+            return
+        if endTime is None:
+            endTime = datetime.now()
+        profiler.addSpan('duration', time.perf_counter() - (endTime - startTime).total_seconds(),
+                         action=actionName, description=description)
 
 
 def getCurrentView() -> AuthAPIView:
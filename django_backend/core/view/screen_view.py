@@ -11,7 +11,6 @@ import traceback
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
-import sqlparse
 from django.core.handlers.wsgi import WSGIHandler
 from django.core.paginator import Paginator
 from django.db import connection
@@ -25,7 +24,6 @@ from django.http.response import HttpResponseBase, StreamingHttpResponse
 import core.core.fs as ikfs
 import core.core.http as ikhttp
 import core.db.model as ikDbModels
-import core.models as ikModels
 import core.ui.ui as ikui
 import core.utils.db as dbUtils
 import core.utils.model_utils as model_utils
@@ -34,8 +32,11 @@ from core.core.code import MessageType
 from core.core.exception import (IkException, IkMessageException,
                                  IkValidateException)
 from core.core.lang import Boolean2
+from core.db.keyset_paginator import PAGE_MODE_KEYSET, KeysetPaginator
 from core.db.model import DummyModel, Model
+from core.db.row_counter import RowCounter
 from core.db.transaction import IkTransaction, IkTransactionForeignKey
+from core.log import profiler
 from core.menu.menu_manager import MenuManager
 from core.sys.access_log import addAccessLog
 from core.utils import template_utils
@@ -158,6 +159,15 @@ class ScreenAPIView(AuthAPIView):
         '''
 
         self._staticResources = []
+
+        self._paginatorCursors = {}
+        '''
+            keyset pagination cursors in this request. {table name: cursor}
+        '''
+        self._paginatorDataAmountExacts = {}
+        '''
+            the paging tables' totals are exact or not in this request. {table name: True/False}
+        '''
         '''
             static resource files. Reference to django_backend/core/core/http.py.IkResponseStaticResource
         '''
@@ -376,11 +386,7 @@ class ScreenAPIView(AuthAPIView):
         menuID = MenuManager.getMenuId(menuName)
         if isNullBlank(menuID):
             return False
-        groupsIDs = ikModels.UserGroup.objects.filter(usr_id=userID).values_list('grp_id', flat=True)
-        if len(groupsIDs) == 0:
-            return False
-        aclPermissions = ikModels.GroupMenu.objects.filter(grp__in=groupsIDs, menu__id=menuID).values_list('acl', flat=True)
-        return False if aclPermissions is None else 'W' in aclPermissions
+        return 'W' in MenuManager.getUserGroupMenuAcls(userID, menuID)
 
     def isACLReadOnly(self) -> bool:
         userID = self.getCurrentUserId()
@@ -392,11 +398,7 @@ class ScreenAPIView(AuthAPIView):
         menuID = MenuManager.getMenuId(menuName)
         if isNullBlank(menuID):
             return False
-        groupsIDs = ikModels.UserGroup.objects.filter(usr_id=userID).values_list('grp_id', flat=True)
-        if len(groupsIDs) == 0:
-            return False
-        aclPermissions = ikModels.GroupMenu.objects.filter(grp__in=groupsIDs, menu__id=menuID).values_list('acl', flat=True)
-        return False if aclPermissions is None else 'R' in aclPermissions
+        return 'R' in MenuManager.getUserGroupMenuAcls(userID, menuID)
 
     def isACLDeny(self) -> bool:
         """User doesn't have write and read rights.
@@ -433,36 +435,34 @@ class ScreenAPIView(AuthAPIView):
         pass
 
     def _getScreenResponse(self) -> ikhttp.IkSccJsonResponse:
-        _startTime = datetime.datetime.now()
         screen = self._screen
-        try:
-            self.beforeInitScreenData(screen)
-            ikui.IkUI.initScreenData(screen, initDataCallBack=self.initScreenData)
-            if self.beforeDisplayAdapter:
-                if screen.subScreenName != ikui.MAIN_SCREEN_NAME:  # clear screen layout when show dialog
-                    screen.layoutParams = ''
-                self.beforeDisplayAdapter(screen)
-            self.beforeDisplayScreen(screen=screen)
-            screenJson = ikui.IkUI.screen2Json(screen)
-            if self.beforeDisplayResponseAdapter:
-                self.beforeDisplayResponseAdapter(screenJson)
-            logger.debug(screenJson)
-            return ikhttp.IkSccJsonResponse(data=screenJson)
-        except Exception as e:
-            screenClassName = '%s.%s.py:%s' % (self.__class__.__module__, self.__class__.__qualname__, self.__class__.__name__) if screen else None
-            logger.error('_getScreenResponse error. Screen=%s, menuID=%s, error=%s' % (screenClassName, self._menuID, str(e)))
-            logger.error(e, exc_info=True)
-            return ikhttp.IkErrJsonResponse(message='System error: %s' % str(e))
-        finally:
-            self._logDuration(_startTime, description='_getScreenResponse')
+        with profiler.span('screen.response', screen=None if screen is None else screen.id):
+            try:
+                self.beforeInitScreenData(screen)
+                ikui.IkUI.initScreenData(screen, initDataCallBack=self.initScreenData)
+                if self.beforeDisplayAdapter:
+                    if screen.subScreenName != ikui.MAIN_SCREEN_NAME:  # clear screen layout when show dialog
+                        screen.layoutParams = ''
+                    self.beforeDisplayAdapter(screen)
+                self.beforeDisplayScreen(screen=screen)
+                screenJson = ikui.IkUI.screen2Json(screen)
+                if self.beforeDisplayResponseAdapter:
+                    self.beforeDisplayResponseAdapter(screenJson)
+                logger.debug(screenJson)
+                return ikhttp.IkSccJsonResponse(data=screenJson)
+            except Exception as e:
+                screenClassName = '%s.%s.py:%s' % (self.__class__.__module__, self.__class__.__qualname__, self.__class__.__name__) if screen else None
+                logger.error('_getScreenResponse error. Screen=%s, menuID=%s, error=%s' % (screenClassName, self._menuID, str(e)))
+                logger.error(e, exc_info=True)
+                return ikhttp.IkErrJsonResponse(message='System error: %s' % str(e))
 
     def initScreenData(self, fieldGroup, field, recordsetName, getDataMethodName) -> tuple:
         '''
             return (getDataDone, returnData)
         '''
         snake_get_data_method_name = camel_to_snake(getDataMethodName) if isNotNullBlank(getDataMethodName) else getDataMethodName
-        _startTime = datetime.datetime.now()
-        try:
+        with profiler.span('screen.data', fieldGroup=None if fieldGroup is None else fieldGroup.name,
+                           field=None if field is None else field.name, recordset=recordsetName, method=getDataMethodName):
             r = None
             getDataDone = False
             if fieldGroup.visible:
@@ -511,11 +511,6 @@ class ScreenAPIView(AuthAPIView):
             if recordsetName is not None:
                 self.setSessionParameter(recordsetName, data)
             return getDataDone, data
-        finally:
-            self._logDuration(_startTime, description='FieldGroup=%s, field=%s, recordsetName=%s, getDataMethodName=%s'
-                              % ('' if fieldGroup is None else fieldGroup.name,
-                                 '' if field is None else field.name,
-                                 recordsetName, getDataMethodName))
 
     def _getTableCurrentRecordInfo(self) -> TableCursorInfo:
         '''
@@ -769,7 +764,6 @@ class ScreenAPIView(AuthAPIView):
         return self.__proecessRequest('put', *args, **kwargs)
 
     def __proecessRequest(self, httpMethod, *args, **kwargs):
-        _startTime = datetime.datetime.now()
         r = None
         self.__isCallViewAPI = False
         try:
@@ -833,36 +827,32 @@ class ScreenAPIView(AuthAPIView):
                 except Exception as e:
                     className = '%s.%s.py:%s' % (self.__class__.__module__, self.__class__.__qualname__, self.__class__.__name__)
                     logger.debug('%s Object [%s] cannot convert to json string.' % (className, self.getRequestData()))
-            self._logDuration(_startTime)
         return r
 
     def __proecessRequest__(self, httpMethod, *args, **kwargs):
         '''
             call get action
         '''
-        _startTime = datetime.datetime.now()
-        _loggerDesc = None
+        requestSpan = profiler.getCurrentSpan()
 
         self._httpMethod = httpMethod
         className = self.__class__.__name__
         try:
-            if not self.__permissionCheck():
-                _loggerDesc = 'Permission Deny'
+            with profiler.span('acl'):
+                isPermitted = self.__permissionCheck()
+            if not isPermitted:
+                requestSpan.setAttribute('action', 'Permission Deny')
                 return ikhttp.IkErrJsonResponse(message='Permission Deny')
 
             if self._screen is None:
-                _getScreenStartTime = datetime.datetime.now()
-
                 parsedUrl = urlparse(self.request.get_full_path())
                 queryParams = parse_qs(parsedUrl.query)
                 subScreenNm = queryParams.get(PARAMETER_KEY_NAME_SUB_SCREEN_NAME, [None])[0]
 
-                self._screen = MenuManager.getScreen2(self.request, self, menuName=self._menuName, subScreenNm=subScreenNm)
-                self._logDuration(_getScreenStartTime, description='MenuManager.getScreen2, menuName=%s, screen=%s'
-                                  % (self._menuName, None if self._screen is None else self._screen.id))
-            #  getRequestDataStartTime = datetime.datetime.now()
-            self._requestData = self._getRequestData()
-            self._logDuration(_getScreenStartTime, description='_getRequestData, screen=%s' % (None if self._screen is None else self._screen.id))
+                with profiler.span('screen.build', menu=self._menuName):
+                    self._screen = MenuManager.getScreen2(self.request, self, menuName=self._menuName, subScreenNm=subScreenNm)
+            with profiler.span('request.parse', screen=None if self._screen is None else self._screen.id):
+                self._requestData = self._getRequestData()
             self._lastRequestData = self.getSessionParameter(PARAMETER_KEY_NAME_LAST_REQUEST_DATA, default=None)
             action = self.getRequestAction(**kwargs)
             if httpMethod == 'post' and action not in [REQUEST_SYSTEM_ACTION_UNLOADED_SCREEN, REQUEST_SYSTEM_ACTION_LOAD_SCREEN_COMPLETED]:
@@ -873,7 +863,7 @@ class ScreenAPIView(AuthAPIView):
             if isNotNullBlank(action) and ikui.RESULT_TABLE_EDIT_COLUMN_PARAMETER_NAME in self.getRequestData().keys():
                 self.setSessionParameter(ikui.RESULT_TABLE_EDIT_COLUMN_PARAMETER_NAME, self.getRequestData().get(ikui.RESULT_TABLE_EDIT_COLUMN_PARAMETER_NAME, None))
 
-            _loggerDesc = action
+            requestSpan.setAttribute('action', action)
             self._requestAction = action
             if not isNullBlank(action):
                 getDataFlag = kwargs.get(ikui.GET_DATA_URL_FLAG_PARAMETER_NAME, None)  # TODO: error, need to check and test
@@ -919,11 +909,8 @@ class ScreenAPIView(AuthAPIView):
                 if isNullBlank(subScreenNm) or subScreenNm == ikui.MAIN_SCREEN_NAME:
                     # delete the old session parameters
                     self.cleanSessionParameters()
-                _initScreenStartTime = datetime.datetime.now()
-                try:
+                with profiler.span('screen.init', screen=None if self._screen is None else self._screen.id):
                     return self._initScreen()
-                finally:
-                    self._logDuration(_initScreenStartTime, description='_initScreen screen=%s' % (None if self._screen is None else self._screen.id))
             elif httpMethod == 'get' and action == REQUEST_SYSTEM_ACTION_GET_SCREEN:
                 return self._getScreenResponse()
             elif httpMethod == 'post' and action == REQUEST_SYSTEM_ACTION_UNLOADED_SCREEN:
@@ -969,11 +956,8 @@ class ScreenAPIView(AuthAPIView):
                     if actionFn is None and isResultTableClickColumnDefaultEvent:
                         # this method is optional for user's controller
                         return ikhttp.IkSccJsonResponse()
-                    _callActionFnStartTime = datetime.datetime.now()
-                    try:
+                    with profiler.span('action', action=actionFnName, screen=None if self._screen is None else self._screen.id):
                         return actionFn()
-                    finally:
-                        self._logDuration(_callActionFnStartTime, actionName=actionFnName, description='Screen=%s' % (None if self._screen is None else self._screen.id))
         except DatabaseError as e:
             logger.error(e, exc_info=True)
             msg = str(e)
@@ -995,8 +979,6 @@ class ScreenAPIView(AuthAPIView):
         except Exception as e:
             logger.error(e, exc_info=True)
             return ikhttp.IkErrJsonResponse(message='System error. Please ask administrator to check.')
-        finally:
-            self._logDuration(_startTime, description=_loggerDesc)
 
     def isGetDataRequest(self, action, recordsetName) -> bool:
         ''' 
@@ -1615,46 +1597,78 @@ class ScreenAPIView(AuthAPIView):
             return 0
         return int(pageNumStr)
 
-    def _getPaginatorTableDataAmount(self, sql: str) -> int:
+    def _isPaginatorKeysetMode(self, tableName: str) -> bool:
+        '''
+            Keyset pagination is enabled by field group's additional properties. E.g.
+                pageMode: keyset
+                pageSortKey: -claim_dt     (optional. Default to the queryset's order by or the sql's ORDER BY. "id" is always added)
+        '''
+        fg = self._screen.getFieldGroup(tableName) if self._screen is not None else None
+        if fg is None or fg.additionalProps is None:
+            return False
+        pageMode = fg.additionalProps.get('pageMode', None)
+        return isNotNullBlank(pageMode) and str(pageMode).strip().lower() == PAGE_MODE_KEYSET
+
+    def _getKeysetPaginator(self, tableName: str) -> KeysetPaginator:
+        return KeysetPaginator(self._getPaginatorPageSize(tableName), self._screen.getFieldGroup(tableName).additionalProps.get('pageSortKey', None))
+
+    def _getPaginatorRequestCursor(self, tableName: str) -> str:
+        return self.getRequestData().get("PAGEABLE_%s_cursor" % tableName)
+
+    def _getPaginatorCursor(self, tableName: str) -> str:
+        '''
+            Return the keyset pagination cursor of the table's current page. Send it to client by getSccJsonResponse(paginatorCursor=...).
+        '''
+        return self._paginatorCursors.get(tableName, None)
+
+    def _getPaginatorRowCounter(self, tableName: str) -> RowCounter:
+        '''
+            The row count mode is set by field group's additional properties. E.g.
+                pageCountMode: capped      (exact, capped or estimate. Default to exact. Reference to core/db/row_counter.py)
+                pageCountCap: 10000        (optional. Default to 10000)
+            Return None if the count mode is not set.
+        '''
+        fg = self._screen.getFieldGroup(tableName) if self._screen is not None and isNotNullBlank(tableName) else None
+        if fg is None or fg.additionalProps is None or isNullBlank(fg.additionalProps.get('pageCountMode', None)):
+            return None
+        return RowCounter(fg.additionalProps.get('pageCountMode'), fg.additionalProps.get('pageCountCap', None))
+
+    def _isPaginatorDataAmountExact(self, tableName: str) -> bool:
+        '''
+            Return the table's total is exact or not. None if the table's count mode is not set (exact).
+        '''
+        return self._paginatorDataAmountExacts.get(tableName, None)
+
+    def _getPaginatorTableDataAmount(self, sql: str, tableName: str = None) -> int:
+        '''
+            tableName: use the table's count mode if it's set. E.g. the total can be an estimate.
+        '''
         amount = 0
         try:
             if isNullBlank(sql):
                 return amount
-            # delete order by part
-            # Parse the query statement
-            parsed = sqlparse.parse(sql)
-            # Iterate through each statement in the parsed results
-            for statement in parsed:
-                # Locate the ORDER BY clause
-                order_by_clause = None
-                for token in statement.tokens:
-                    if isinstance(token, sqlparse.sql.Token) and token.value.upper() == "ORDER BY":
-                        order_by_clause = token
-                        break
-                if order_by_clause:
-                    # Remove the ORDER BY clause and everything that follows it from the statement
-                    index = statement.tokens.index(order_by_clause)
-                    del statement.tokens[index:]
-            # Reconstruct the query statement
-            parsedSql = str(parsed[0])
-            fromIndex = parsedSql.upper().index("FROM")
-            tmpSql = parsedSql[fromIndex:]
-            parsedSql = "SELECT COUNT(*) %s" % tmpSql
-            with connection.cursor() as cursor:
-                cursor.execute(parsedSql)
-                data = dbUtils.dictfetchall(cursor)
-                if not dbUtils.isEmpty(data):
-                    amount = data[0]['count']
+            counter = self._getPaginatorRowCounter(tableName)
+            amount, isExact = (RowCounter() if counter is None else counter).countSql(sql)
+            if counter is not None:
+                self._paginatorDataAmountExacts[tableName] = isExact
             return amount
+        except IkValidateException:
+            raise
         except Exception as e:
             logger.error(e, exc_info=True)
             traceback.print_exc()
             raise IkException("Get sql amount failed.")
 
-    def _getPaginatorTableData(self, sql: str, pageNum=None, pageSize=None) -> list:
+    def _getPaginatorTableData(self, sql: str, pageNum=None, pageSize=None, tableName: str = None) -> list:
+        '''
+            tableName: use keyset pagination if it's enabled in the table.
+        '''
         data = None
         if isNullBlank(sql):
             return data
+        if isNotNullBlank(tableName) and isNotNullBlank(pageNum) and pageNum != 0 and self._isPaginatorKeysetMode(tableName):
+            data, self._paginatorCursors[tableName] = self._getKeysetPaginator(tableName).getSqlPage(sql, pageNum, self._getPaginatorRequestCursor(tableName))
+            return data
         if isNotNullBlank(pageNum) and pageNum != 0:
             sql += " LIMIT %s" % pageSize
             if isNotNullBlank(pageSize):
@@ -1670,13 +1684,27 @@ class ScreenAPIView(AuthAPIView):
         """
         rcs = None
         pageNum = self._getPaginatorPageNumber(fieldGroupName)
-        total = queryFilter.count()
+        counter = self._getPaginatorRowCounter(fieldGroupName)
+        if counter is None:
+            total, isExact = queryFilter.count(), True
+        else:
+            total, isExact = counter.countQuerySet(queryFilter)
+            self._paginatorDataAmountExacts[fieldGroupName] = isExact
         if pageNum == 0:
             rcs = queryFilter
-        else:
+        elif self._isPaginatorKeysetMode(fieldGroupName):
+            rcs, self._paginatorCursors[fieldGroupName] = self._getKeysetPaginator(fieldGroupName).getQuerySetPage(
+                queryFilter, pageNum, self._getPaginatorRequestCursor(fieldGroupName))
+        elif isExact:
             pageSize = self._getPaginatorPageSize(fieldGroupName)
             paginator = Paginator(queryFilter, pageSize)
+            paginator.count = total  # don't count again
             rcs = paginator.get_page(pageNum)
+        else:
+            # the total is not exact, so the last page is unknown. Don't move the page number to the "last page".
+            pageSize = self._getPaginatorPageSize(fieldGroupName)
+            pageNum = max(pageNum, 1)
+            rcs = queryFilter[(pageNum - 1) * pageSize:pageNum * pageSize]
         rcs = [r for r in rcs]
         return rcs, total
 
@@ -1748,7 +1776,10 @@ class ScreenAPIView(AuthAPIView):
         page_num = self._getPaginatorPageNumber(table_name)
         total_len = 0
         results, css_style = [], []
-        if isNotNullBlank(table_data):
+        if isinstance(table_data, QuerySet) and isNotNullBlank(page_size) and page_num != 0 \
+                and (self._isPaginatorKeysetMode(table_name) or self._getPaginatorRowCounter(table_name) is not None):
+            results, total_len = self._getPaginattorRecords(table_name, table_data)
+        elif isNotNullBlank(table_data):
             total_len = len(table_data)
             if isNullBlank(page_size) or page_num == 0:
                 results = table_data
@@ -1756,8 +1787,8 @@ class ScreenAPIView(AuthAPIView):
                 paginator = Paginator(table_data, page_size)
                 results = paginator.get_page(page_num).object_list
         elif isNotNullBlank(table_sql):
-            total_len = self._getPaginatorTableDataAmount(table_sql)
-            results = self._getPaginatorTableData(table_sql, pageNum=page_num, pageSize=page_size)
+            total_len = self._getPaginatorTableDataAmount(table_sql, tableName=table_name)
+            results = self._getPaginatorTableData(table_sql, pageNum=page_num, pageSize=page_size, tableName=table_name)
 
         tableModelAdditionalFields = []
         fields = self._screen.getFieldGroup(table_name).fields
@@ -1773,10 +1804,22 @@ class ScreenAPIView(AuthAPIView):
         if isNotNullBlank(get_style_func):
             css_style = get_style_func(results)
 
-        return self.getSccJsonResponse(data=results, cssStyle=css_style, paginatorDataAmount=total_len, message=message)
+        return self.getSccJsonResponse(data=results, cssStyle=css_style, paginatorDataAmount=total_len, message=message,
+                                       paginatorCursor=self._getPaginatorCursor(table_name),
+                                       paginatorDataAmountExact=self._isPaginatorDataAmountExact(table_name))
 
-    def getSccJsonResponse(self, data: any = None, cssStyle: list[dict] = None, paginatorDataAmount: int = None, message: str = None) -> ikhttp.IkSccJsonResponse:
-        return ikhttp.IkSccJsonResponse(data={"data": data, "cssStyle": cssStyle, "paginatorDataAmount": paginatorDataAmount}, message=message)
+    def getSccJsonResponse(self, data: any = None, cssStyle: list[dict] = None, paginatorDataAmount: int = None, message: str = None,
+                           paginatorCursor: str = None, paginatorDataAmountExact: bool = None) -> ikhttp.IkSccJsonResponse:
+        '''
+            paginatorCursor: keyset pagination cursor. The client sends it back with the next page number.
+            paginatorDataAmountExact: the [paginatorDataAmount] is exact or not (e.g. an estimate). Send it if the table's count mode is set.
+        '''
+        data = {"data": data, "cssStyle": cssStyle, "paginatorDataAmount": paginatorDataAmount}
+        if paginatorCursor is not None:
+            data["paginatorCursor"] = paginatorCursor
+        if paginatorDataAmountExact is not None:
+            data["paginatorDataAmountExact"] = paginatorDataAmountExact
+        return ikhttp.IkSccJsonResponse(data=data, message=message)
 
 
 def getCurrentView() -> ScreenAPIView:
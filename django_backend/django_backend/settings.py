@@ -193,7 +193,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Reference to https://docs.djangoproject.com/en/4.2/topics/http/sessions/
 SESSION_COOKIE_AGE = int(IkConfig.get('Session', 'timeout'))  # in seconds
-SESSION_SAVE_EVERY_REQUEST = True
+# The session is saved only if it's changed, and its expiry date is refreshed at most once per [Session] expiryRefreshInterval
+# seconds. Reference to core/session/tracker.py and core/session/middleware.py
+SESSION_SAVE_EVERY_REQUEST = False
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
 # rest_framework.authentication.TokenAuthentication
@@ -214,6 +214,8 @@ const TableFg = forwardRef(<CellType extends Types.CellBase>(props: Props<CellTy
   const [pageNation, setPageNation] = React.useState(1) // Actual page number
   const [pageSelect, setPageSelect] = React.useState(1) // Selected page number
   const [totalPageNm, setTotalPageNm] = React.useState(1) // Total page numbers
+  const [pageCursor, setPageCursor] = React.useState(null) // Server-side keyset paging cursor of the current page
+  const [totalPageExact, setTotalPageExact] = React.useState(true) // Server-side paging total is exact or not (e.g. an estimate)
   const [messageFlag, setMessageFlag] = React.useState(true) // Server-side paging flags whether the current page has been modified or not
   const [preShowRange, setPreShowRange] = React.useState([]) // When filtering data in the paging case, the showRange before filtering is saved, which is used to exit filtering and fallback when filtering is initialized.
   const [filterRow, setFilterRow] = React.useState(false) // Whether to display the filterRow
@@ -611,6 +613,9 @@ const TableFg = forwardRef(<CellType extends Types.CellBase>(props: Props<CellTy
     const key = "PAGEABLE_" + name + "_pageNum"
     let data = {}
     data[key] = pageNum
+    if (pageCursor) {
+      data["PAGEABLE_" + name + "_cursor"] = pageCursor
+    }
 
     if (!tableParams.dataUrl) {
       showErrorMessage("DataUrl not found when fetching paging data on server side, please check.")
@@ -654,7 +659,15 @@ const TableFg = forwardRef(<CellType extends Types.CellBase>(props: Props<CellTy
               } else {
                 setShowRange(range(serverPageData.length, 0))
               }
-              setTotalPageNm(Math.ceil(data["paginatorDataAmount"] / pageSize))
+              if (data["paginatorDataAmountExact"] === false) {
+                // the total is capped or estimated, the last page is unknown
+                setTotalPageNm(Math.max(Math.ceil(data["paginatorDataAmount"] / pageSize), pageNum !== undefined ? Number(pageNum) : 1))
+                setTotalPageExact(false)
+              } else {
+                setTotalPageNm(Math.ceil(data["paginatorDataAmount"] / pageSize))
+                setTotalPageExact(true)
+              }
+              setPageCursor(data["paginatorCursor"] ? data["paginatorCursor"] : null)
               if (pageNum !== undefined) {
                 setPageSelect(pageNum)
                 setPageNation(pageNum)
@@ -1414,10 +1427,10 @@ const TableFg = forwardRef(<CellType extends Types.CellBase>(props: Props<CellTy
         <div className="PageSelectDiv" style={{ display: "flex", alignItems: "flex-end", paddingLeft: "3px" }}>
           {pageNation === 1 || pageNation === 0 ? null : <img src={img_firstButton} alt="got to first page" onClick={getTheFirstPage}></img>}
           {pageNation === 1 || pageNation === 0 ? null : <img src={img_previousButton} alt="go to previous page" onClick={getPreviousPage}></img>}
-          {pageNation === totalPageNm || pageNation === 0 || totalPageNm === 0 ? null : (
+          {(pageNation === totalPageNm && totalPageExact) || pageNation === 0 || totalPageNm === 0 ? null : (
             <img src={img_nextButton} alt="Go to the next page" onClick={getNextPage}></img>
           )}
-          {pageNation === totalPageNm || pageNation === 0 || totalPageNm === 0 ? null : (
+          {pageNation === totalPageNm || pageNation === 0 || totalPageNm === 0 || !totalPageExact ? null : (
             <img src={img_lastButton} alt="Go to the last page" onClick={getTheLastPage}></img>
           )}
           &nbsp;
@@ -1435,7 +1448,7 @@ const TableFg = forwardRef(<CellType extends Types.CellBase>(props: Props<CellTy
         </div>
       )
     }
-  }, [pageNation, pageSelect, pageSize, totalPageNm, messageFlag, state.data, state.showRange, filterRow])
+  }, [pageNation, pageSelect, pageSize, totalPageNm, totalPageExact, messageFlag, state.data, state.showRange, filterRow])
 
   const topIconNode = React.useMemo(() => {
     let headerHeight = 0